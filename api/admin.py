@@ -1,18 +1,43 @@
-﻿from fastapi import APIRouter, Form
+﻿from fastapi import APIRouter, Form, Request, Depends, UploadFile, File
 from fastapi.responses import JSONResponse
 from app.db import db_connect # <-- CORRECCIÓN: Importación relativa
 import psycopg2
 from psycopg2.extras import RealDictCursor
 import decimal # Importamos decimal para manejar dinero
+import ipaddress
+import asyncio
 from datetime import datetime, date
-from app.utils import serialize_data
-from passlib.context import CryptContext
-
-# Configura el contexto de hasheo (mismo que auth.py)
-pwd_context = CryptContext(schemes=["argon2"], deprecated="auto")
-
-
-router = APIRouter(prefix="/api/admin", tags=["Admin"])
+from app.utils import serialize_data, etag_response, client_ip
+from app.services.game_catalog import catalog as game_catalog
+from app.services.bet_limits import bet_limits, ensure_limits_table
+from app.services.user_locks import user_ops
+from app.services.jackpot import jackpot
+from app.services.password_hasher import password_hasher, PasswordHasherBusyError
+from app.services.session_tokens import sessions
+from app.services.role_cache import role_cache
+from app.services.rate_limiter import auth_limiter
+from app.services.registration import registrar_usuario, importar_usuarios, IMPORT_COLUMNS
+from app.services.admin_stats import admin_stats, ensure_admin_stats_counters
+from app.services.agent_stats import agent_stats
+from app.services.user_purge import user_purger, ensure_purge_table
+from app.services.bonus_engine import bonus_engine
+from app.services.wagering import wagering
+from app.services.maintenance import maintenance, ensure_maintenance_indexes
+from app.services.event_hub import event_hub
+from app.services.live_chat import live_chat
+from app.services.ticket_assigner import ticket_assigner
+from app.services.ip_filter import ip_filter, ensure_allowlist_table, normalizar_red, formato_red, PERMITIDA
+from app.services.user_directory import buscar_usuarios, ensure_directory_indexes, CursorInvalidoError, DIRECTORY_PAGE_SIZE
+from app.middleware.auth_roles import requiere_rol, ROL_ADMINISTRADOR
+
+
+# Todas las rutas del panel exigen sesión con rol 'Administrador'
+router = APIRouter(prefix="/api/admin", tags=["Admin"], dependencies=[Depends(requiere_rol(ROL_ADMINISTRADOR))])
+
+ensure_admin_stats_counters()
+ensure_directory_indexes()
+ensure_purge_table()
+ensure_maintenance_indexes()
 
 # ==========================================================
 #  ESTADÍSTICAS (Ya existente)
@@ -24,81 +49,160 @@ async def api_get_admin_stats():
     Llamada por: admin-info-general.html
     """
     print("🔹 API Admin: Pidiendo estadísticas generales")
-    conn = None
     try:
-        conn = db_connect.get_connection()
-        if conn is None:
-            return JSONResponse({"error": "Error de conexión"}, status_code=500)
-        
-        cursor = conn.cursor(cursor_factory=RealDictCursor)
-        
-        # 1. Total de usuarios (solo jugadores)
-        cursor.execute("SELECT COUNT(*) as total FROM Usuario WHERE id_rol = 1")
-        total_users = cursor.fetchone()['total']
-        
-        # 2. Usuarios Activos (jugadores activos)
-        cursor.execute("SELECT COUNT(*) as active FROM Usuario WHERE id_rol = 1 AND activo = true")
-        active_users = cursor.fetchone()['active']
-        
-        # 3. Depósitos Totales (Histórico)
-        cursor.execute(
-            "SELECT COALESCE(SUM(monto), 0) as total FROM Transaccion WHERE tipo_transaccion = 'Depósito' AND estado = 'Completada'"
-        )
-        total_deposits = cursor.fetchone()['total']
-
-        # 4. Retiros Totales (Histórico)
-        cursor.execute(
-            "SELECT COALESCE(SUM(monto), 0) as total FROM Transaccion WHERE tipo_transaccion = 'Retiro' AND estado = 'Completada'"
-        )
-        total_withdrawals = cursor.fetchone()['total']
-        
-        cursor.close()
-        
-        return JSONResponse({
-            "total_users": total_users,
-            "active_users": active_users,
-            "total_deposits": float(total_deposits),
-            "total_withdrawals": float(total_withdrawals)
-        })
+        # Contadores mantenidos por triggers, cacheados unos segundos.
+        # 'actualizado' indica de cuándo es el snapshot.
+        return JSONResponse(admin_stats.get())
 
     except Exception as e:
         print(f"🚨 API ERROR (Admin Stats): {e}")
         return JSONResponse({"error": f"Error interno: {e}"}, status_code=500)
-    finally:
-        if conn: conn.close()
+
+@router.post("/stats/recalcular")
+async def api_rebuild_admin_stats():
+    """
+    Resincroniza los contadores del dashboard con un agregado completo (mantenimiento).
+    """
+    print("🔹 API Admin: Recalculando contadores de estadísticas")
+    try:
+        admin_stats.rebuild()
+        return JSONResponse({"success": True, **admin_stats.get()})
+    except Exception as e:
+        print(f"🚨 API ERROR (Admin Stats Rebuild): {e}")
+        return JSONResponse({"error": f"Error interno: {e}"}, status_code=500)
+
+@router.post("/stats/agentes/recalcular")
+async def api_rebuild_agent_stats():
+    """
+    Resincroniza los contadores del dashboard de agentes con el estado actual de Soporte.
+    """
+    print("🔹 API Admin: Recalculando contadores de agentes")
+    try:
+        agent_stats.rebuild()
+        return JSONResponse({"success": True, **agent_stats.get()})
+    except Exception as e:
+        print(f"🚨 API ERROR (Agent Stats Rebuild): {e}")
+        return JSONResponse({"error": f"Error interno: {e}"}, status_code=500)
+
+@router.get("/metrics/user-locks")
+async def api_get_user_lock_metrics():
+    """
+    Métricas de contención de los locks por usuario (saldo / juegos) de este worker.
+    """
+    return JSONResponse(user_ops.stats())
+
+@router.get("/metrics/jackpot")
+async def api_get_jackpot_metrics():
+    """
+    Contribuciones, volcados y premios del jackpot en este worker.
+    """
+    return JSONResponse(jackpot.stats())
+
+@router.get("/metrics/password-hasher")
+async def api_get_password_hasher_metrics():
+    """
+    Cola, espera y tiempo de ejecución del pool de hashing Argon2 de este worker.
+    """
+    return JSONResponse(password_hasher.stats())
+
+@router.get("/metrics/role-cache")
+async def api_get_role_cache_metrics():
+    """
+    Aciertos y usuarios en la cache de roles (rutas protegidas por rol) de este worker.
+    """
+    return JSONResponse(role_cache.stats())
+
+@router.get("/metrics/user-purge")
+async def api_get_user_purge_metrics():
+    """
+    Lotes, filas borradas y trabajos terminados del borrado de usuarios en este worker.
+    """
+    return JSONResponse(user_purger.stats())
+
+@router.get("/metrics/maintenance")
+async def api_get_maintenance_metrics():
+    """
+    Corridas recientes del barrido de mantenimiento (bonos vencidos, retiros y tickets
+    olvidados) y filas procesadas por tarea en este worker.
+    """
+    return JSONResponse(maintenance.stats())
+
+@router.get("/metrics/events")
+async def api_get_event_hub_metrics():
+    """
+    Conexiones SSE abiertas, eventos recibidos por LISTEN y entregados en este worker.
+    """
+    return JSONResponse(event_hub.stats())
+
+@router.get("/metrics/chat")
+async def api_get_live_chat_metrics():
+    """
+    Salas y sockets de chat abiertos, mensajes pendientes de guardar y lotes escritos en este worker.
+    """
+    return JSONResponse(live_chat.stats())
+
+@router.get("/metrics/assignment")
+async def api_get_ticket_assignment_metrics():
+    """
+    Tickets repartidos automáticamente, latencia creación -> asignación y equidad del reparto en este worker.
+    """
+    return JSONResponse(ticket_assigner.stats())
+
+@router.get("/metrics/bonus-engine")
+async def api_get_bonus_engine_metrics():
+    """
+    Catálogo de bonos, perfiles cacheados y reglas evaluadas por el motor de elegibilidad de este worker.
+    """
+    return JSONResponse(bonus_engine.stats())
+
+@router.get("/metrics/wagering")
+async def api_get_wagering_metrics():
+    """
+    Apuestas acumuladas, volcados y bonos completados por el rollover de este worker.
+    """
+    return JSONResponse(wagering.stats())
+
+@router.get("/metrics/ip-filter")
+async def api_get_ip_filter_metrics():
+    """
+    Reglas cargadas, consultas, bloqueos y última recarga del filtro de IPs de este worker.
+    """
+    return JSONResponse(ip_filter.stats())
+
+@router.get("/metrics/rate-limit")
+async def api_get_rate_limit_metrics():
+    """
+    Intentos permitidos/bloqueados del login, registro y reseteo, con las claves
+    (IP o correo) más bloqueadas en este worker.
+    """
+    return JSONResponse(auth_limiter.stats())
 
 # ==========================================================
 #  NUEVO: LISTAR USUARIOS Y ADMINS
 # ==========================================================
 @router.get("/usuarios")
-async def api_get_all_users():
+async def api_get_all_users(q: str = None, limit: int = DIRECTORY_PAGE_SIZE, cursor: str = None):
     """
-    Obtiene la lista de todos los usuarios con rol 'Jugador'.
+    Obtiene una página de usuarios con rol 'Jugador', ordenada por nombre.
+    q busca por nombre, apellido o email; cursor es el 'next_cursor' de la página anterior.
     Llamada por: admin-usuarios.html
     """
-    print(f"🔹 API Admin: Pidiendo lista de Jugadores")
+    print(f"🔹 API Admin: Pidiendo lista de Jugadores (q={q!r})")
     conn = None
     try:
         conn = db_connect.get_connection()
         if conn is None: return JSONResponse({"error": "Error de conexión"}, status_code=500)
         
-        cursor = conn.cursor(cursor_factory=RealDictCursor)
+        db_cursor = conn.cursor(cursor_factory=RealDictCursor)
         
         # Buscamos solo Jugadores (id_rol = 1)
-        cursor.execute(
-            """
-            SELECT u.id_usuario, u.nombre, u.apellido, u.email, u.activo, r.nombre as rol
-            FROM Usuario u
-            JOIN Rol r ON u.id_rol = r.id_rol
-            WHERE u.id_rol = 1
-            ORDER BY u.nombre
-            """
-        )
-        usuarios = cursor.fetchall()
-        cursor.close()
+        pagina = buscar_usuarios(db_cursor, (1,), q=q, limit=limit, after=cursor)
+        db_cursor.close()
         
-        return JSONResponse({"users": usuarios})
+        return JSONResponse({"users": pagina["items"], "next_cursor": pagina["next_cursor"]})
 
+    except CursorInvalidoError as e:
+        return JSONResponse({"error": str(e)}, status_code=400)
     except Exception as e:
         print(f"🚨 API ERROR (Admin Get Jugadores): {e}")
         return JSONResponse({"error": f"Error interno: {e}"}, status_code=500)
@@ -106,34 +210,28 @@ async def api_get_all_users():
         if conn: conn.close()
 
 @router.get("/administradores")
-async def api_get_all_admins():
+async def api_get_all_admins(q: str = None, limit: int = DIRECTORY_PAGE_SIZE, cursor: str = None):
     """
-    Obtiene la lista de todos los usuarios con rol 'Administrador' o 'Auditor'.
+    Obtiene una página de usuarios con rol 'Administrador' o 'Auditor', ordenada por nombre.
+    Mismos parámetros de búsqueda y paginación que /usuarios.
     Llamada por: admin-administradores.html
     """
-    print(f"🔹 API Admin: Pidiendo lista de Admins/Auditores")
+    print(f"🔹 API Admin: Pidiendo lista de Admins/Auditores (q={q!r})")
     conn = None
     try:
         conn = db_connect.get_connection()
         if conn is None: return JSONResponse({"error": "Error de conexión"}, status_code=500)
         
-        cursor = conn.cursor(cursor_factory=RealDictCursor)
+        db_cursor = conn.cursor(cursor_factory=RealDictCursor)
         
         # Buscamos Admins (id_rol = 2) y Auditores (id_rol = 3)
-        cursor.execute(
-            """
-            SELECT u.id_usuario, u.nombre, u.apellido, u.email, r.nombre as rol, u.activo
-            FROM Usuario u
-            JOIN Rol r ON u.id_rol = r.id_rol
-            WHERE u.id_rol IN (2, 3)
-            ORDER BY u.nombre
-            """
-        )
-        admins = cursor.fetchall()
-        cursor.close()
+        pagina = buscar_usuarios(db_cursor, (2, 3), q=q, limit=limit, after=cursor)
+        db_cursor.close()
         
-        return JSONResponse({"admins": admins})
+        return JSONResponse({"admins": pagina["items"], "next_cursor": pagina["next_cursor"]})
 
+    except CursorInvalidoError as e:
+        return JSONResponse({"error": str(e)}, status_code=400)
     except Exception as e:
         print(f"🚨 API ERROR (Admin Get Admins): {e}")
         return JSONResponse({"error": f"Error interno: {e}"}, status_code=500)
@@ -168,24 +266,11 @@ async def api_create_admin(
         id_rol = rol_res[0]
 
         # 2. Hashear password
-        hashed_password = pwd_context.hash(password)
+        hashed_password = await password_hasher.hash(password)
 
-        # 3. Insertar Usuario
-        cursor.execute(
-            """
-            INSERT INTO Usuario (nombre, apellido, email, password_hash, id_rol, fecha_registro, activo)
-            VALUES (%s, %s, %s, %s, %s, %s, true)
-            RETURNING id_usuario
-            """,
-            (nombre, apellido, email, hashed_password, id_rol, datetime.now())
-        )
-        new_id = cursor.fetchone()[0]
-
-        # 4. Insertar Saldo inicial (aunque sea admin, por integridad)
-        cursor.execute(
-            "INSERT INTO Saldo (id_usuario, saldo_actual, ultima_actualizacion) VALUES (%s, 0.00, %s)",
-            (new_id, datetime.now())
-        )
+        # 3. Insertar Usuario y su Saldo inicial (aunque sea admin, por integridad)
+        # en un solo statement. Los administradores no tienen CURP.
+        registrar_usuario(cursor, nombre, apellido, "", email, hashed_password, id_rol)
 
         conn.commit()
         cursor.close()
@@ -195,6 +280,9 @@ async def api_create_admin(
     except psycopg2.errors.UniqueViolation:
         if conn: conn.rollback()
         return JSONResponse({"error": "El correo ya está registrado."}, status_code=409)
+    except PasswordHasherBusyError as e:
+        print("⚠️ API Admin (Create Admin): cola de hashing llena")
+        return JSONResponse({"error": e.detail}, status_code=e.status_code)
     except Exception as e:
         if conn: conn.rollback()
         print(f"🚨 API ERROR (Create Admin): {e}")
@@ -202,6 +290,27 @@ async def api_create_admin(
     finally:
         if conn: conn.close()
 
+@router.post("/usuarios/importar")
+async def api_import_users(archivo: UploadFile = File(...)):
+    """
+    Alta masiva de jugadores migrados desde otra plataforma (CSV con encabezado).
+    Columnas: nombre, apellido, curp, email, password_hash (Argon2), saldo.
+    """
+    print(f"🔹 API Admin: Importando usuarios desde {archivo.filename}")
+    try:
+        # El COPY puede tardar con archivos grandes: en un hilo, sin frenar el event loop
+        resultado = await asyncio.to_thread(importar_usuarios, archivo.file)
+        print(f"✅ API Admin: Importación terminada: {resultado}")
+        return JSONResponse({"success": True, **resultado})
+    except psycopg2.DataError as e:
+        print(f"❌ API Admin: CSV inválido: {e}")
+        return JSONResponse(
+            {"error": f"CSV inválido. Columnas esperadas: {', '.join(IMPORT_COLUMNS)}"}, status_code=400
+        )
+    except Exception as e:
+        print(f"🚨 API ERROR (Import Users): {e}")
+        return JSONResponse({"error": f"Error interno: {e}"}, status_code=500)
+
 # ==========================================================
 #  GESTIÓN DE PERFIL DE USUARIO (Ya existente)
 # ==========================================================
@@ -277,14 +386,24 @@ async def api_update_user_profile(
         if not rol_result:
             return JSONResponse({" error": "Rol inválido"}, status_code=400)
         id_rol = rol_result[0]
+        nuevo_activo = activo.lower() == 'true'
+
+        # Rol y estado actuales, para saber si hay que cerrar sus sesiones
+        cursor.execute("SELECT id_rol, activo FROM Usuario WHERE id_usuario = %s FOR UPDATE", (id_usuario,))
+        anterior = cursor.fetchone()
         
         # Ahora actualizamos con id_rol
         cursor.execute(
             "UPDATE Usuario SET nombre = %s, apellido = %s, email = %s, id_rol = %s, activo = %s WHERE id_usuario = %s",
-            (nombre, apellido, email, id_rol, activo.lower() == 'true', id_usuario)
+            (nombre, apellido, email, id_rol, nuevo_activo, id_usuario)
         )
         conn.commit()
         cursor.close()
+        role_cache.invalidate(id_usuario)
+
+        # Los tokens llevan el rol: si cambió el rol o se desactivó la cuenta, se revocan
+        if anterior and (anterior[0] != id_rol or (anterior[1] and not nuevo_activo)):
+            sessions.revoke_user(id_usuario)
         return JSONResponse({"success": True, "message": "Perfil actualizado con éxito."})
 
     except Exception as e:
@@ -307,7 +426,7 @@ async def api_admin_reset_password(id_usuario: int, new_password: str = Form()):
         if conn is None: return JSONResponse({"error": "Error de conexión"}, status_code=500)
         
         # Hashear la nueva contraseña
-        hashed_password = pwd_context.hash(new_password)
+        hashed_password = await password_hasher.hash(new_password)
         
         cursor = conn.cursor()
         cursor.execute(
@@ -319,6 +438,9 @@ async def api_admin_reset_password(id_usuario: int, new_password: str = Form()):
         
         return JSONResponse({"success": True, "message": "Contraseña actualizada."})
 
+    except PasswordHasherBusyError as e:
+        print("⚠️ API Admin (Reset Pwd): cola de hashing llena")
+        return JSONResponse({"error": e.detail}, status_code=e.status_code)
     except Exception as e:
         if conn: conn.rollback()
         print(f"🚨 API ERROR (Admin Reset Pwd): {e}")
@@ -327,94 +449,66 @@ async def api_admin_reset_password(id_usuario: int, new_password: str = Form()):
         if conn: conn.close()
 
 @router.delete("/user-profile/{id_usuario}")
-async def api_delete_user(id_usuario: int):
+async def api_delete_user(id_usuario: int, request: Request):
     """
-    Elimina un usuario y TODOS sus datos relacionados (Manual CASCADE).
+    Elimina un usuario y TODOS sus datos relacionados.
+    El usuario se desactiva de inmediato; sus datos se borran por lotes en segundo
+    plano (app/services/user_purge.py). El avance se consulta en GET .../borrado.
     Llamada por: admin-usuario-perfil.html
     """
-    print(f"🔹 API Admin: Eliminando usuario {id_usuario} y datos relacionados...")
-    conn = None
+    print(f"🔹 API Admin: Solicitando borrado del usuario {id_usuario}...")
     try:
-        conn = db_connect.get_connection()
-        if conn is None: return JSONResponse({"error": "Error de conexión"}, status_code=500)
-        
-        cursor = conn.cursor()
-        
-        # 1. Eliminar dependencias con RESTRICT en el esquema
-        
-        # Auditoria (fk: id_usuario)
-        cursor.execute("DELETE FROM Auditoria WHERE id_usuario = %s", (id_usuario,))
-        
-        # RespuestaTicket (fk: id_usuario - quien responde)
-        cursor.execute("DELETE FROM RespuestaTicket WHERE id_usuario = %s", (id_usuario,))
-        
-        # Soporte (fk: id_jugador y id_agente)
-        # Primero eliminamos las respuestas de los tickets donde el usuario es el jugador
-        cursor.execute("DELETE FROM RespuestaTicket WHERE id_ticket IN (SELECT id_ticket FROM Soporte WHERE id_jugador = %s)", (id_usuario,))
-        cursor.execute("DELETE FROM Soporte WHERE id_jugador = %s OR id_agente = %s", (id_usuario, id_usuario))
-        
-        # Transaccion (fk: id_usuario)
-        cursor.execute("DELETE FROM Transaccion WHERE id_usuario = %s", (id_usuario,))
-        
-        # Apuesta (via Sesion_Juego -> CASCADE en esquema? No, Apuesta reference Sesion ON DELETE CASCADE)
-        # Sesion_Juego (fk: id_usuario -> RESTRICT)
-        # Al borrar Sesion_Juego, las Apuestas se borran por CASCADE del esquema
-        cursor.execute("DELETE FROM Sesion_Juego WHERE id_usuario = %s", (id_usuario,))
-        
-        # Usuario_Metodo_Pago (fk: id_usuario -> CASCADE en esquema, pero safe to delete)
-        cursor.execute("DELETE FROM Usuario_Metodo_Pago WHERE id_usuario = %s", (id_usuario,))
-        
-        # Saldo (fk: id_usuario -> CASCADE en esquema)
-        cursor.execute("DELETE FROM Saldo WHERE id_usuario = %s", (id_usuario,))
-        
-        # Usuario_Bono (fk: id_usuario -> CASCADE en esquema)
-        cursor.execute("DELETE FROM Usuario_Bono WHERE id_usuario = %s", (id_usuario,))
+        job = user_purger.request(id_usuario, solicitado_por=sessions.user_id(request))
+        if job is None:
+            return JSONResponse({"error": "Usuario no encontrado"}, status_code=404)
 
-        # Chat & Mensaje_Chat (fk: id_jugador, id_agente, id_usuario)
-        cursor.execute("DELETE FROM Mensaje_Chat WHERE id_usuario = %s", (id_usuario,))
-        cursor.execute("DELETE FROM Chat WHERE id_jugador = %s OR id_agente = %s", (id_usuario, id_usuario))
-        
-        # 2. Finalmente eliminar Usuario
-        cursor.execute("DELETE FROM Usuario WHERE id_usuario = %s", (id_usuario,))
-        
-        conn.commit()
-        cursor.close()
-        
-        print(f"✅ API Admin: Usuario {id_usuario} eliminado totalmente.")
-        return JSONResponse({"success": True, "message": "Usuario y todos sus datos eliminados."})
+        # Fuera de inmediato, aunque el borrado tarde
+        role_cache.invalidate(id_usuario)
+        sessions.revoke_user(id_usuario)
+
+        print(f"✅ API Admin: Usuario {id_usuario} desactivado, borrado en segundo plano ({job['estado']}).")
+        return JSONResponse(
+            {"success": True, "message": "Usuario desactivado. Sus datos se están eliminando.", "job": serialize_data(job)},
+            status_code=202
+        )
 
     except Exception as e:
-        if conn: conn.rollback()
         print(f"🚨 API ERROR (Admin Delete User): {e}")
         return JSONResponse({"error": f"Error interno al eliminar: {e}"}, status_code=500)
-    finally:
-        if conn: conn.close()
+
+@router.get("/user-profile/{id_usuario}/borrado")
+async def api_get_user_delete_status(id_usuario: int):
+    """
+    Estado y avance del borrado de un usuario (paso actual, filas borradas por tabla).
+    Llamada por: admin-usuario-perfil.html
+    """
+    try:
+        job = user_purger.status(id_usuario)
+        if job is None:
+            return JSONResponse({"error": "No hay borrado solicitado para este usuario"}, status_code=404)
+        return JSONResponse({"job": serialize_data(job)})
+
+    except Exception as e:
+        print(f"🚨 API ERROR (Admin Delete Status): {e}")
+        return JSONResponse({"error": f"Error interno: {e}"}, status_code=500)
 
 # ==========================================================
 #  GESTIÓN DE JUEGOS (Ya existente)
 # ==========================================================
 @router.get("/games")
-async def api_get_all_games():
+async def api_get_all_games(request: Request):
     """
     Obtiene la lista de todos los juegos para el admin.
+    Se sirve desde el catálogo en memoria con soporte ETag/304.
     Llamada por: admin-juegos.html
     """
-    conn = None
     try:
-        conn = db_connect.get_connection()
-        if conn is None: return JSONResponse({"error": "Error de conexión"}, status_code=500)
-        
-        cursor = conn.cursor(cursor_factory=RealDictCursor)
-        cursor.execute("SELECT * FROM Juego ORDER BY nombre")
-        juegos = cursor.fetchall()
-        cursor.close()
-        return JSONResponse({"games": serialize_data(juegos)})
+        juegos, etag = game_catalog.get_games()
+        return etag_response(request, {"games": juegos}, etag)
 
     except Exception as e:
         print(f"🚨 API ERROR (Admin Get Games): {e}")
         return JSONResponse({"error": f"Error interno: {e}"}, status_code=500)
-    finally:
-        if conn: conn.close()
 
 @router.post("/games")
 async def api_create_game(
@@ -441,6 +535,7 @@ async def api_create_game(
         )
         conn.commit()
         cursor.close()
+        game_catalog.invalidate()
         return JSONResponse({"success": True, "message": "Juego creado con éxito."})
 
     except Exception as e:
@@ -464,6 +559,7 @@ async def api_toggle_game_status(id_juego: int, activo: bool = Form()):
         cursor.execute("UPDATE Juego SET activo = %s WHERE id_juego = %s", (activo, id_juego))
         conn.commit()
         cursor.close()
+        game_catalog.invalidate()
         return JSONResponse({"success": True})
     except Exception as e:
         if conn: conn.rollback()
@@ -471,6 +567,129 @@ async def api_toggle_game_status(id_juego: int, activo: bool = Form()):
     finally:
         if conn: conn.close()
 
+@router.put("/games/{id_juego}/limits")
+async def api_update_game_limits(id_juego: int, min_apuesta: float = Form(), max_apuesta: float = Form()):
+    """
+    Cambia la apuesta mínima/máxima de un juego. Los límites se recargan en caliente.
+    """
+    if min_apuesta <= 0 or max_apuesta < min_apuesta:
+        return JSONResponse({"error": "Límites inválidos."}, status_code=400)
+    conn = None
+    try:
+        conn = db_connect.get_connection()
+        if conn is None: return JSONResponse({"error": "Error de conexión"}, status_code=500)
+
+        cursor = conn.cursor()
+        cursor.execute(
+            "UPDATE Juego SET min_apuesta = %s, max_apuesta = %s WHERE id_juego = %s",
+            (min_apuesta, max_apuesta, id_juego)
+        )
+        conn.commit()
+        cursor.close()
+        game_catalog.invalidate()
+        return JSONResponse({"success": True})
+    except Exception as e:
+        if conn: conn.rollback()
+        print(f"🚨 API ERROR (Admin Game Limits): {e}")
+        return JSONResponse({"error": f"Error interno: {e}"}, status_code=500)
+    finally:
+        if conn: conn.close()
+
+# ==========================================================
+#  LÍMITES DE APUESTA POR USUARIO (VIP / Juego responsable)
+# ==========================================================
+ensure_limits_table()
+
+@router.get("/user-limits/{id_usuario}")
+async def api_get_user_limits(id_usuario: int):
+    conn = None
+    try:
+        conn = db_connect.get_connection()
+        if conn is None: return JSONResponse({"error": "Error de conexión"}, status_code=500)
+
+        cursor = conn.cursor(cursor_factory=RealDictCursor)
+        cursor.execute(
+            """
+            SELECT l.id_limite, l.id_juego, j.nombre as juego, l.min_apuesta, l.max_apuesta, l.motivo, l.fecha_actualizacion
+            FROM Limite_Apuesta_Usuario l
+            LEFT JOIN Juego j ON l.id_juego = j.id_juego
+            WHERE l.id_usuario = %s
+            ORDER BY l.id_juego NULLS FIRST
+            """,
+            (id_usuario,)
+        )
+        limites = cursor.fetchall()
+        cursor.close()
+        return JSONResponse({"limits": serialize_data(limites)})
+    except Exception as e:
+        print(f"🚨 API ERROR (Admin Get User Limits): {e}")
+        return JSONResponse({"error": f"Error interno: {e}"}, status_code=500)
+    finally:
+        if conn: conn.close()
+
+@router.put("/user-limits/{id_usuario}")
+async def api_set_user_limit(
+    id_usuario: int,
+    id_juego: int = Form(None), # Vacío = aplica a todos los juegos
+    min_apuesta: float = Form(None),
+    max_apuesta: float = Form(None),
+    motivo: str = Form("")
+):
+    """
+    Crea o reemplaza el límite de un usuario (p.ej. VIP o tope de juego responsable).
+    """
+    if min_apuesta is None and max_apuesta is None:
+        return JSONResponse({"error": "Debe indicar un mínimo o un máximo."}, status_code=400)
+    conn = None
+    try:
+        conn = db_connect.get_connection()
+        if conn is None: return JSONResponse({"error": "Error de conexión"}, status_code=500)
+
+        cursor = conn.cursor()
+        cursor.execute(
+            """
+            INSERT INTO Limite_Apuesta_Usuario (id_usuario, id_juego, min_apuesta, max_apuesta, motivo)
+            VALUES (%s, %s, %s, %s, %s)
+            ON CONFLICT (id_usuario, COALESCE(id_juego, 0)) DO UPDATE
+            SET min_apuesta = EXCLUDED.min_apuesta, max_apuesta = EXCLUDED.max_apuesta,
+                motivo = EXCLUDED.motivo, fecha_actualizacion = NOW()
+            """,
+            (id_usuario, id_juego, min_apuesta, max_apuesta, motivo)
+        )
+        conn.commit()
+        cursor.close()
+        bet_limits.invalidate()
+        return JSONResponse({"success": True, "message": "Límite guardado."})
+    except Exception as e:
+        if conn: conn.rollback()
+        print(f"🚨 API ERROR (Admin Set User Limit): {e}")
+        return JSONResponse({"error": f"Error interno: {e}"}, status_code=500)
+    finally:
+        if conn: conn.close()
+
+@router.delete("/user-limits/{id_usuario}/{id_limite}")
+async def api_delete_user_limit(id_usuario: int, id_limite: int):
+    conn = None
+    try:
+        conn = db_connect.get_connection()
+        if conn is None: return JSONResponse({"error": "Error de conexión"}, status_code=500)
+
+        cursor = conn.cursor()
+        cursor.execute(
+            "DELETE FROM Limite_Apuesta_Usuario WHERE id_limite = %s AND id_usuario = %s",
+            (id_limite, id_usuario)
+        )
+        conn.commit()
+        cursor.close()
+        bet_limits.invalidate()
+        return JSONResponse({"success": True})
+    except Exception as e:
+        if conn: conn.rollback()
+        print(f"🚨 API ERROR (Admin Delete User Limit): {e}")
+        return JSONResponse({"error": f"Error interno: {e}"}, status_code=500)
+    finally:
+        if conn: conn.close()
+
 # ==========================================================
 #  GESTIÓN DE PROMOCIONES (Ya existente)
 # ==========================================================
@@ -505,7 +724,11 @@ async def api_create_bono(
     valor: float = Form(),
     requisito_apuesta: float = Form(),
     fecha_expiracion: str = Form(None), # Puede ser opcional
-    activo: bool = Form()
+    activo: bool = Form(),
+    # Segmentación (opcional): solo jugadores nuevos, con depósito mínimo o de un juego
+    solo_nuevos_dias: int = Form(None),
+    deposito_minimo: float = Form(None),
+    id_juego: int = Form(None)
 ):
     """
     Crea un nuevo bono/promoción.
@@ -521,11 +744,17 @@ async def api_create_bono(
 
         cursor = conn.cursor()
         cursor.execute(
-            "INSERT INTO Bono (nombre_bono, tipo, descripcion, fecha_expiracion, activo) VALUES (%s, %s, %s, %s, %s)",
-            (nombre_bono, tipo, descripcion, fecha_exp, activo)
+            """
+            INSERT INTO Bono (nombre_bono, tipo, descripcion, fecha_expiracion, activo, valor, requisito_apuesta,
+                              solo_nuevos_dias, deposito_minimo, id_juego)
+            VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+            """,
+            (nombre_bono, tipo, descripcion, fecha_exp, activo, valor, requisito_apuesta,
+             solo_nuevos_dias, deposito_minimo, id_juego)
         )
         conn.commit()
         cursor.close()
+        bonus_engine.invalidate_catalog()
         return JSONResponse({"success": True, "message": "Bono creado con éxito."})
 
     except Exception as e:
@@ -549,6 +778,7 @@ async def api_delete_bono(id_bono: int):
         cursor.execute("DELETE FROM Bono WHERE id_bono = %s", (id_bono,))
         conn.commit()
         cursor.close()
+        bonus_engine.invalidate_catalog()
         
         return JSONResponse({"success": True, "message": "Bono eliminado."})
 
@@ -586,6 +816,7 @@ def ensure_ip_table():
 
 # Llamamos a esto al iniciar (o al primer request, simplicidad aquí)
 ensure_ip_table()
+ensure_allowlist_table()
 
 @router.get("/config/ip-block")
 async def api_get_blocked_ips():
@@ -603,17 +834,32 @@ async def api_get_blocked_ips():
         if conn: conn.close()
 
 @router.post("/config/ip-block")
-async def api_block_ip(ip_address: str = Form(), razon: str = Form("")):
+async def api_block_ip(request: Request, ip_address: str = Form(), razon: str = Form("")):
+    """Bloquea una IP o un rango CIDR (IPv4/IPv6). Llamada por: admin-configuracion-bloquear-ip.html"""
+    try:
+        red = normalizar_red(ip_address)
+    except ValueError:
+        return JSONResponse({"error": "Dirección IP o rango CIDR inválido."}, status_code=400)
+
+    # Que el admin no se deje fuera a sí mismo (salvo que su IP esté en la lista blanca)
+    propia = client_ip(request)
+    try:
+        if ipaddress.ip_address(propia) in red and ip_filter.verdict(propia) != PERMITIDA:
+            return JSONResponse({"error": f"El rango incluye tu propia IP ({propia}). Agrégala primero a la lista blanca."}, status_code=409)
+    except ValueError:
+        pass
+
     conn = None
     try:
         conn = db_connect.get_connection()
         cursor = conn.cursor()
         cursor.execute(
             "INSERT INTO BloqueoIP (ip_address, razon) VALUES (%s, %s)",
-            (ip_address, razon)
+            (formato_red(red), razon)
         )
         conn.commit()
         cursor.close()
+        ip_filter.invalidate()
         return JSONResponse({"success": True})
     except psycopg2.errors.UniqueViolation:
         if conn: conn.rollback()
@@ -633,6 +879,72 @@ async def api_unblock_ip(id_bloqueo: int):
         cursor.execute("DELETE FROM BloqueoIP WHERE id_bloqueo = %s", (id_bloqueo,))
         conn.commit()
         cursor.close()
+        ip_filter.invalidate()
+        return JSONResponse({"success": True})
+    except Exception as e:
+        if conn: conn.rollback()
+        return JSONResponse({"error": str(e)}, status_code=500)
+    finally:
+        if conn: conn.close()
+
+# ==========================================================
+#  CONFIGURACIÓN (Lista Blanca IP)
+#  Las IPs/rangos de aquí nunca se bloquean, aunque estén en BloqueoIP.
+# ==========================================================
+@router.get("/config/ip-allow")
+async def api_get_allowed_ips():
+    conn = None
+    try:
+        conn = db_connect.get_connection()
+        cursor = conn.cursor(cursor_factory=RealDictCursor)
+        cursor.execute("SELECT * FROM ListaBlancaIP ORDER BY fecha_alta DESC")
+        ips = cursor.fetchall()
+        cursor.close()
+        return JSONResponse({"ips": serialize_data(ips)})
+    except Exception as e:
+        return JSONResponse({"error": str(e)}, status_code=500)
+    finally:
+        if conn: conn.close()
+
+@router.post("/config/ip-allow")
+async def api_allow_ip(ip_address: str = Form(), descripcion: str = Form("")):
+    """Agrega una IP o rango CIDR a la lista blanca. Llamada por: admin-configuracion-lista-blanca.html"""
+    try:
+        red = normalizar_red(ip_address)
+    except ValueError:
+        return JSONResponse({"error": "Dirección IP o rango CIDR inválido."}, status_code=400)
+
+    conn = None
+    try:
+        conn = db_connect.get_connection()
+        cursor = conn.cursor()
+        cursor.execute(
+            "INSERT INTO ListaBlancaIP (ip_address, descripcion) VALUES (%s, %s)",
+            (formato_red(red), descripcion)
+        )
+        conn.commit()
+        cursor.close()
+        ip_filter.invalidate()
+        return JSONResponse({"success": True})
+    except psycopg2.errors.UniqueViolation:
+        if conn: conn.rollback()
+        return JSONResponse({"error": "La IP ya está en la lista blanca."}, status_code=409)
+    except Exception as e:
+        if conn: conn.rollback()
+        return JSONResponse({"error": str(e)}, status_code=500)
+    finally:
+        if conn: conn.close()
+
+@router.delete("/config/ip-allow/{id_lista}")
+async def api_disallow_ip(id_lista: int):
+    conn = None
+    try:
+        conn = db_connect.get_connection()
+        cursor = conn.cursor()
+        cursor.execute("DELETE FROM ListaBlancaIP WHERE id_lista = %s", (id_lista,))
+        conn.commit()
+        cursor.close()
+        ip_filter.invalidate()
         return JSONResponse({"success": True})
     except Exception as e:
         if conn: conn.rollback()
@@ -1,4 +1,4 @@
-﻿from fastapi import APIRouter, Form
+﻿from fastapi import APIRouter, Form, Depends
 from fastapi.responses import JSONResponse
 from app.db import db_connect
 import psycopg2
@@ -7,8 +7,23 @@ from datetime import datetime
 from app.utils import serialize_data
 from typing import Optional
 import decimal
+from app.middleware.auth_agente import verificar_rol_agente
+from app.services.ticket_queue import buscar_tickets, ensure_ticket_queue_columns, TICKET_PAGE_SIZE
+from app.services.user_directory import CursorInvalidoError
+from app.services.live_chat import tomar_chat, cerrar_chat
+from app.services.agent_stats import agent_stats, ensure_agent_stats_counters
+from app.services.ticket_assigner import ensure_assignment_table
+from app.services.ticket_search import (
+    buscar_texto_tickets, ensure_ticket_search_columns, BusquedaInvalidaError, SEARCH_PAGE_SIZE
+)
 
-router = APIRouter(prefix="/api/agente", tags=["Agente Soporte"])
+# Todas las rutas del agente exigen sesión con rol 'Agente de Soporte'
+router = APIRouter(prefix="/api/agente", tags=["Agente Soporte"], dependencies=[Depends(verificar_rol_agente)])
+
+ensure_ticket_queue_columns()
+ensure_agent_stats_counters()
+ensure_assignment_table()
+ensure_ticket_search_columns()
 
 # ==========================================================
 #  DASHBOARD DEL AGENTE - ESTADÍSTICAS
@@ -17,56 +32,16 @@ router = APIRouter(prefix="/api/agente", tags=["Agente Soporte"])
 async def api_get_agent_dashboard(id_agente: int):
     """
     Obtiene estadísticas del dashboard para el agente de soporte
-    Usando solo la tabla Soporte
+    De los contadores por agente que mantiene el trigger de Soporte (snapshot
+    compartido por todos los agentes, cacheado unos segundos)
     """
     print(f"🔹 API Agente: Dashboard para agente {id_agente}")
-    conn = None
     try:
-        conn = db_connect.get_connection()
-        if conn is None:
-            return JSONResponse({"error": "Error de conexión"}, status_code=500)
-        
-        cursor = conn.cursor(cursor_factory=RealDictCursor)
-        
-        # 1. Tickets pendientes (Abiertos, sin asignar a ningún agente)
-        cursor.execute("""
-            SELECT COUNT(*) as total
-            FROM Soporte
-            WHERE estado = 'Abierto' AND id_agente IS NULL
-        """)
-        tickets_pendientes = cursor.fetchone()['total']
-        
-        # 2. Tickets asignados al agente (activos - no cerrados)
-        cursor.execute("""
-            SELECT COUNT(*) as total
-            FROM Soporte
-            WHERE id_agente = %s AND estado != 'Cerrado'
-        """, (id_agente,))
-        mis_tickets = cursor.fetchone()['total']
-        
-        # 3. Tickets cerrados hoy por el agente
-        cursor.execute("""
-            SELECT COUNT(*) as total
-            FROM Soporte
-            WHERE id_agente = %s 
-            AND estado = 'Cerrado'
-            AND DATE(fecha_cierre) = CURRENT_DATE
-        """, (id_agente,))
-        cerrados_hoy = cursor.fetchone()['total']
-        
-        cursor.close()
-        
-        return JSONResponse({
-            "tickets_pendientes": tickets_pendientes,
-            "mis_tickets": mis_tickets,
-            "cerrados_hoy": cerrados_hoy
-        })
+        return JSONResponse(agent_stats.dashboard(id_agente))
 
     except Exception as e:
         print(f"🚨 API ERROR (Agent Dashboard): {e}")
         return JSONResponse({"error": f"Error interno: {e}"}, status_code=500)
-    finally:
-        if conn: conn.close()
 
 
 # ==========================================================
@@ -79,11 +54,13 @@ async def api_get_agent_dashboard(id_agente: int):
 @router.get("/tickets/all")
 async def api_get_all_tickets(
     estado: Optional[str] = None,
-    asignado: Optional[str] = None
+    asignado: Optional[str] = None,
+    limit: int = TICKET_PAGE_SIZE,
+    cursor: Optional[str] = None
 ):
     """
-    Obtiene todos los tickets para que el agente pueda verlos
-    Soporta filtros por estado y asignación
+    Obtiene la cola de tickets para que el agente pueda verlos
+    Soporta filtros por estado y asignación, paginado por cursor (next_cursor)
     """
     print(f"🔹 API Agente: Listando tickets (estado={estado}, asignado={asignado})")
     conn = None
@@ -92,52 +69,14 @@ async def api_get_all_tickets(
         if conn is None:
             return JSONResponse({"error": "Error de conexión"}, status_code=500)
         
-        cursor = conn.cursor(cursor_factory=RealDictCursor)
+        db_cursor = conn.cursor(cursor_factory=RealDictCursor)
+        pagina = buscar_tickets(db_cursor, (estado or "").strip() or None, asignado, limit, cursor)
+        db_cursor.close()
         
-        # Construcción dinámica de la query
-        query = """
-            SELECT 
-                s.id_ticket,
-                s.id_jugador,
-                u.nombre as nombre_jugador,
-                u.apellido as apellido_jugador,
-                s.asunto,
-                s.estado,
-                s.mensaje,
-                s.fecha_creacion,
-                s.id_agente,
-                CASE WHEN s.id_agente IS NOT NULL THEN 'Asignado' ELSE 'Sin asignar' END as estado_asignacion,
-                (SELECT nombre || ' ' || apellido FROM Usuario WHERE id_usuario = s.id_agente) as nombre_agente
-            FROM Soporte s
-            JOIN Usuario u ON s.id_jugador = u.id_usuario
-            WHERE 1=1
-        """
-        params = []
-
-        if estado and estado.strip():
-            query += " AND s.estado = %s"
-            params.append(estado)
-        
-        if asignado:
-            if asignado == 'si':
-                query += " AND s.id_agente IS NOT NULL"
-            elif asignado == 'no':
-                query += " AND s.id_agente IS NULL"
-
-        query += """
-            ORDER BY 
-                CASE WHEN s.estado = 'Abierto' THEN 1
-                     WHEN s.estado = 'En Proceso' THEN 2
-                     ELSE 3 END,
-                s.fecha_creacion DESC
-        """
-        
-        cursor.execute(query, tuple(params))
-        tickets = cursor.fetchall()
-        cursor.close()
-        
-        return JSONResponse({"tickets": serialize_data(tickets)})
+        return JSONResponse({"tickets": serialize_data(pagina["items"]), "next_cursor": pagina["next_cursor"]})
 
+    except CursorInvalidoError as e:
+        return JSONResponse({"error": str(e)}, status_code=400)
     except Exception as e:
         print(f"🚨 API ERROR (Listar Tickets): {e}")
         return JSONResponse({"error": f"Error interno: {e}"}, status_code=500)
@@ -145,6 +84,44 @@ async def api_get_all_tickets(
         if conn: conn.close()
 
 
+# ==========================================================
+#  BUSCAR TICKETS (TEXTO COMPLETO)
+# ==========================================================
+@router.get("/tickets/buscar")
+async def api_search_tickets(
+    q: str,
+    idioma: Optional[str] = None,
+    estado: Optional[str] = None,
+    limit: int = SEARCH_PAGE_SIZE,
+    cursor: Optional[str] = None
+):
+    """
+    Busca en el asunto, el mensaje y las respuestas de los tickets (índices GIN,
+    español e inglés). Resultados por relevancia con el fragmento que coincide
+    resaltado, paginados por cursor (next_cursor)
+    """
+    print(f"🔹 API Agente: Buscando tickets (q={q!r}, idioma={idioma}, estado={estado})")
+    conn = None
+    try:
+        conn = db_connect.get_connection()
+        if conn is None:
+            return JSONResponse({"error": "Error de conexión"}, status_code=500)
+
+        db_cursor = conn.cursor(cursor_factory=RealDictCursor)
+        pagina = buscar_texto_tickets(db_cursor, q, idioma, (estado or "").strip() or None, limit, cursor)
+        db_cursor.close()
+
+        return JSONResponse({"resultados": serialize_data(pagina["items"]), "next_cursor": pagina["next_cursor"]})
+
+    except (BusquedaInvalidaError, CursorInvalidoError) as e:
+        return JSONResponse({"error": str(e)}, status_code=400)
+    except Exception as e:
+        print(f"🚨 API ERROR (Buscar Tickets): {e}")
+        return JSONResponse({"error": f"Error interno: {e}"}, status_code=500)
+    finally:
+        if conn: conn.close()
+
+
 # ==========================================================
 #  LISTAR MIS TICKETS (ASIGNADOS AL AGENTE)
 # ==========================================================
@@ -219,6 +196,7 @@ async def api_assign_ticket(
         """, (id_agente, id_ticket))
         
         conn.commit()
+        agent_stats.invalidate() # Que el dashboard de este worker refleje el cambio ya
         
         print(f"✅ Ticket {id_ticket} asignado al agente {id_agente}")
         return JSONResponse({"success": True, "message": "Ticket asignado correctamente"})
@@ -343,6 +321,7 @@ async def api_respond_ticket(
         """, (id_ticket,))
         
         conn.commit()
+        agent_stats.invalidate()
         
         print(f"✅ Respuesta enviada al ticket {id_ticket}")
         return JSONResponse({"success": True, "message": "Respuesta enviada correctamente"})
@@ -382,6 +361,7 @@ async def api_close_ticket(id_ticket: int = Form()):
         """, (datetime.now(), id_ticket))
         
         conn.commit()
+        agent_stats.invalidate()
         
         print(f"✅ Ticket {id_ticket} cerrado")
         return JSONResponse({"success": True, "message": "Ticket cerrado correctamente"})
@@ -421,6 +401,7 @@ async def api_reopen_ticket(id_ticket: int = Form()):
         """, (id_ticket,))
         
         conn.commit()
+        agent_stats.invalidate()
         
         print(f"✅ Ticket {id_ticket} reabierto")
         return JSONResponse({"success": True, "message": "Ticket reabierto correctamente"})
@@ -434,19 +415,140 @@ async def api_reopen_ticket(id_ticket: int = Form()):
         if conn: conn.close()
 
 # ==========================================================
-#  CHATS EN ESPERA (STUB / PLACEHOLDER)
+#  CHATS EN ESPERA
+#  (Los mensajes van por WebSocket: ver api/chat.py)
 # ==========================================================
 @router.get("/chats-esperando")
 async def api_get_waiting_chats():
     """
-    Retorna lista vacía para prevenir errores en frontend ya que no hay tabla de Chats.
+    Chats que ningún agente ha tomado, los más antiguos primero
     """
-    print("🔹 API Agente: Solicitud de chats en espera (Funcionalidad desactivada)")
-    return JSONResponse({"chats": []})
+    print("🔹 API Agente: Chats en espera")
+    conn = None
+    try:
+        conn = db_connect.get_connection()
+        if conn is None:
+            return JSONResponse({"error": "Error de conexión"}, status_code=500)
+        
+        cursor = conn.cursor(cursor_factory=RealDictCursor)
+        
+        # Usa el índice parcial idx_chat_esperando
+        cursor.execute("""
+            SELECT c.id_chat, c.fecha_inicio, u.nombre || ' ' || u.apellido AS nombre_usuario
+            FROM Chat c
+            JOIN Usuario u ON c.id_jugador = u.id_usuario
+            WHERE c.estado = 'Esperando'
+            ORDER BY c.fecha_inicio
+            LIMIT 100
+        """)
+        chats = cursor.fetchall()
+        cursor.close()
+        
+        return JSONResponse({"chats": serialize_data(chats)})
+
+    except Exception as e:
+        print(f"🚨 API ERROR (Chats en Espera): {e}")
+        return JSONResponse({"error": f"Error interno: {e}"}, status_code=500)
+    finally:
+        if conn: conn.close()
+
 
 @router.post("/tomar-chat")
-async def api_take_chat(id_chat: int = Form(), id_agente: int = Form()):
+async def api_take_chat(id_chat: int = Form(), id_agente: int = Depends(verificar_rol_agente)):
+    """
+    Asigna un chat en espera al agente de la sesión. Si otro agente lo tomó primero retorna 409
+    """
+    print(f"🔹 API Agente: Agente {id_agente} tomando chat {id_chat}")
+    conn = None
+    try:
+        conn = db_connect.get_connection()
+        if conn is None:
+            return JSONResponse({"error": "Error de conexión"}, status_code=500)
+        
+        cursor = conn.cursor()
+        tomado = tomar_chat(cursor, id_chat, id_agente)
+        conn.commit()
+        cursor.close()
+        
+        if not tomado:
+            return JSONResponse({"success": False, "error": "Otro agente ya tomó este chat"}, status_code=409)
+        
+        print(f"✅ Chat {id_chat} asignado al agente {id_agente}")
+        return JSONResponse({"success": True, "message": "Chat asignado correctamente"})
+
+    except Exception as e:
+        if conn: conn.rollback()
+        print(f"🚨 API ERROR (Tomar Chat): {e}")
+        return JSONResponse({"error": f"Error interno: {e}"}, status_code=500)
+    finally:
+        if conn: conn.close()
+
+
+# ==========================================================
+#  MIS CHATS (ACTIVOS DEL AGENTE)
+# ==========================================================
+@router.get("/mis-chats")
+async def api_get_my_chats(id_agente: int = Depends(verificar_rol_agente)):
+    """
+    Chats activos que atiende el agente de la sesión
+    """
+    print(f"🔹 API Agente: Chats del agente {id_agente}")
+    conn = None
+    try:
+        conn = db_connect.get_connection()
+        if conn is None:
+            return JSONResponse({"error": "Error de conexión"}, status_code=500)
+        
+        cursor = conn.cursor(cursor_factory=RealDictCursor)
+        cursor.execute("""
+            SELECT c.id_chat, c.fecha_inicio, c.fecha_asignacion, u.nombre || ' ' || u.apellido AS nombre_usuario
+            FROM Chat c
+            JOIN Usuario u ON c.id_jugador = u.id_usuario
+            WHERE c.id_agente = %s AND c.estado = 'Activo'
+            ORDER BY c.fecha_asignacion DESC
+        """, (id_agente,))
+        chats = cursor.fetchall()
+        cursor.close()
+        
+        return JSONResponse({"chats": serialize_data(chats)})
+
+    except Exception as e:
+        print(f"🚨 API ERROR (Mis Chats): {e}")
+        return JSONResponse({"error": f"Error interno: {e}"}, status_code=500)
+    finally:
+        if conn: conn.close()
+
+
+# ==========================================================
+#  CERRAR CHAT
+# ==========================================================
+@router.post("/cerrar-chat")
+async def api_close_chat(id_chat: int = Form(), id_agente: int = Depends(verificar_rol_agente)):
     """
-    Stub para tomar chat.
+    Cierra un chat que atiende el agente de la sesión; el trigger evento_chat avisa
+    a los sockets abiertos de la sala
     """
-    return JSONResponse({"success": False, "error": "Chat en vivo no disponible temporalmente"})
+    print(f"🔹 API Agente: Agente {id_agente} cerrando chat {id_chat}")
+    conn = None
+    try:
+        conn = db_connect.get_connection()
+        if conn is None:
+            return JSONResponse({"error": "Error de conexión"}, status_code=500)
+        
+        cursor = conn.cursor()
+        cerrado = cerrar_chat(cursor, id_chat, id_agente)
+        conn.commit()
+        cursor.close()
+        
+        if not cerrado:
+            return JSONResponse({"success": False, "error": "El chat no existe, no lo atiendes o ya estaba cerrado"}, status_code=404)
+        
+        print(f"✅ Chat {id_chat} cerrado")
+        return JSONResponse({"success": True, "message": "Chat cerrado correctamente"})
+
+    except Exception as e:
+        if conn: conn.rollback()
+        print(f"🚨 API ERROR (Cerrar Chat): {e}")
+        return JSONResponse({"error": f"Error interno: {e}"}, status_code=500)
+    finally:
+        if conn: conn.close()
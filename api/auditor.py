@@ -9,13 +9,11 @@ from reportlab.pdfgen import canvas
 from reportlab.lib.units import inch
 from reportlab.lib.colors import HexColor
 import os
+from app.middleware.auth_roles import resolver_usuario, ROL_AUDITOR
 
-# Simple auth dependency using cookies
+# Auth dependency: signed session + cached role check (Auditor)
 async def get_current_user_from_cookie(request: Request):
-    user_id = request.cookies.get("userId")
-    if not user_id:
-        raise HTTPException(status_code=401, detail="No autenticado")
-    return {"id_usuario": int(user_id)}
+    return resolver_usuario(request, ROL_AUDITOR)
 
 router = APIRouter(prefix="/api", tags=["Auditor"])
 
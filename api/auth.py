@@ -1,18 +1,37 @@
-from fastapi import APIRouter
+from fastapi import APIRouter, Request
 from fastapi.responses import JSONResponse
 from pydantic import BaseModel, EmailStr, constr
 from app.db import db_connect  # <-- ¡CORRECCIÓN CLAVE!
 import psycopg2
 from psycopg2.extras import RealDictCursor
-from passlib.context import CryptContext
 from datetime import datetime # Para la fecha de registro
-
-# Configura el contexto de hasheo
-# Usamos Argon2 porque bcrypt estaba dando problemas en Render
-pwd_context = CryptContext(schemes=["argon2"], deprecated="auto")
+# Argon2 corre en un pool de procesos para no bloquear el event loop
+from app.services.password_hasher import password_hasher, PasswordHasherBusyError
+from app.services.session_tokens import sessions, ensure_session_tables
+from app.services.rate_limiter import auth_limiter, RateLimitedError, ensure_rate_limit_table, RATE_LIMIT_BACKEND
+from app.utils import client_ip
+from app.services.registration import registrar_usuario, campo_duplicado, ensure_registration_indexes
 
 router = APIRouter(prefix="/api/auth", tags=["Authentication"])
 
+ensure_session_tables()
+ensure_registration_indexes()
+if RATE_LIMIT_BACKEND == "postgres":
+    ensure_rate_limit_table()
+
+
+def rate_limited(action: str, request: Request, correo: str = None):
+    """
+    Cuenta el intento por IP y correo. Retorna la respuesta 429 si se superó el
+    límite, o None para continuar. Va antes de cualquier hash o consulta.
+    """
+    try:
+        auth_limiter.check(action, client_ip(request), correo)
+    except RateLimitedError as e:
+        print(f"⛔ API: Rate limit en {action} (ip={client_ip(request)}, correo={correo})")
+        return JSONResponse({"error": e.detail}, status_code=e.status_code, headers=e.headers)
+    return None
+
 # Modelo Pydantic para validar los datos de entrada del login
 class UserLogin(BaseModel):
     correo: EmailStr
@@ -37,7 +56,7 @@ class ResetPasswordRequest(BaseModel):
 
 
 @router.post("/login")
-async def api_login(user_data: UserLogin):
+async def api_login(user_data: UserLogin, request: Request):
     """
     Ruta de Login que valida los datos con Pydantic.
     """
@@ -45,6 +64,9 @@ async def api_login(user_data: UserLogin):
     # Marca de versión única para este archivo.
     print("✅✅✅ Ejecutando desde 'api/auth.py' - ¡ESTA ES LA VERSIÓN CORRECTA! ✅✅✅")
     print(f"🔹 API: Intento de login para: {user_data.correo}")
+    limited = rate_limited("login", request, user_data.correo)
+    if limited:
+        return limited
     conn = None
     cursor = None
     try:
@@ -71,7 +93,10 @@ async def api_login(user_data: UserLogin):
         usuario = cursor.fetchone()
         
         # 2. Verificar si el usuario existe y la contraseña es correcta
-        if not usuario or not pwd_context.verify(user_data.contrasena, usuario[3]): # Índice 3 para password_hash
+        valida, nuevo_hash = (False, None)
+        if usuario:
+            valida, nuevo_hash = await password_hasher.verify_and_update(user_data.contrasena, usuario[3]) # Índice 3 para password_hash
+        if not valida:
             print("❌ API: Credenciales incorrectas (email no encontrado o contraseña no coincide)")
             return JSONResponse({"error": "Correo o contraseña incorrectos"}, status_code=401)
         
@@ -80,6 +105,20 @@ async def api_login(user_data: UserLogin):
             print("❌ API: Cuenta inactiva")
             return JSONResponse({"error": "Esta cuenta ha sido desactivada"}, status_code=403)
 
+        # 3b. Rehash transparente si el hash se generó con parámetros de Argon2 viejos.
+        # Solo se reemplaza si nadie cambió la contraseña mientras tanto.
+        if nuevo_hash:
+            try:
+                cursor.execute(
+                    "UPDATE Usuario SET password_hash = %s WHERE id_usuario = %s AND password_hash = %s",
+                    (nuevo_hash, usuario[0], usuario[3])
+                )
+                conn.commit()
+                print(f"🔄 API: Hash de contraseña actualizado a los parámetros actuales para {usuario[0]}")
+            except Exception as e:
+                conn.rollback()
+                print(f"⚠️ API (Login): no se pudo rehashear la contraseña de {usuario[0]}: {e}")
+
         # 4. ¡Éxito!
         # 4. ¡Éxito!
         print(f"✅ API: Login exitoso para {usuario[0]} con rol {usuario[2]}")
@@ -88,10 +127,13 @@ async def api_login(user_data: UserLogin):
             "id_rol": usuario[1],       # Índice 1 para id_rol
             "rol": usuario[2]           # Índice 2 para rol_nombre
         })
-        # Set cookie for middleware
-        response.set_cookie(key="userId", value=str(usuario[0]), httponly=False) # httponly=False so frontend can read if needed, though middleware reads it from request
+        # Sesión firmada (id, rol y expiración) que el backend verifica sin ir a la BD
+        sessions.set_cookie(response, sessions.issue(usuario[0], usuario[1]))
         return response
 
+    except PasswordHasherBusyError as e:
+        print("⚠️ API (Login): cola de hashing llena")
+        return JSONResponse({"error": e.detail}, status_code=e.status_code)
     except Exception as e:
         print(f"🚨 API ERROR (Login): {e}")
         return JSONResponse({"error": "Error interno del servidor"}, status_code=500)
@@ -100,21 +142,42 @@ async def api_login(user_data: UserLogin):
         if conn: conn.close()
 
 
+@router.post("/logout")
+async def api_logout(request: Request):
+    """
+    Cierra la sesión: revoca el token actual y borra la cookie.
+    """
+    session = sessions.from_request(request)
+    response = JSONResponse({"success": True})
+    sessions.clear_cookie(response)
+    if session:
+        try:
+            sessions.revoke(session)
+            print(f"✅ API: Logout de usuario {session['id_usuario']}")
+        except Exception as e:
+            # La cookie se borra igual; el token expira por sí solo
+            print(f"🚨 API ERROR (Logout): {e}")
+    return response
+
+
 # ==========================================================
 #  RUTA PARA REGISTRO (Corregida para tu Esquema)
 # ==========================================================
 @router.post("/register")
-async def api_register(user_data: UserRegister):
+async def api_register(user_data: UserRegister, request: Request):
     """
     Ruta de Registro que valida los datos con Pydantic.
     """
     print(f"🔹 API: Intento de registro para: {user_data.correo}")
+    limited = rate_limited("register", request, user_data.correo)
+    if limited:
+        return limited
     conn = None
     cursor = None
     
     try:
         # 1. Hashear la contraseña
-        hashed_password = pwd_context.hash(user_data.contrasena)
+        hashed_password = await password_hasher.hash(user_data.contrasena)
         
         # 2. Conectarse a la BD
         conn = db_connect.get_connection()
@@ -123,29 +186,13 @@ async def api_register(user_data: UserRegister):
         
         cursor = conn.cursor()
         
-        # 3. PASO 1: Insertar en la tabla 'Usuario' con id_rol = 1 (Jugador)
-        cursor.execute(
-            """
-            INSERT INTO Usuario (nombre, apellido, curp, email, password_hash, id_rol, fecha_registro, activo)
-            VALUES (%s, %s, %s, %s, %s, 1, %s, true)
-            RETURNING id_usuario
-            """,
-            (user_data.nombre, user_data.apellido, user_data.curp, user_data.correo, hashed_password, datetime.now())
+        # 3. Insertar 'Usuario' (id_rol = 1, Jugador) y su 'Saldo' en un solo statement.
+        # Si el email o la CURP ya existen, lo detecta el índice único.
+        new_user_id = registrar_usuario(
+            cursor, user_data.nombre, user_data.apellido, user_data.curp, user_data.correo, hashed_password
         )
         
-        # Obtenemos el ID del usuario que acabamos de crear
-        new_user_id = cursor.fetchone()[0]
-        
-        # 4. PASO 2: Insertar en la tabla 'Saldo'
-        cursor.execute(
-            """
-            INSERT INTO Saldo (id_usuario, saldo_actual, ultima_actualizacion)
-            VALUES (%s, 0.00, %s)
-            """,
-            (new_user_id, datetime.now())
-        )
-        
-        # 5. Confirmar la transacción (ambos inserts)
+        # 4. Confirmar la transacción (ambos inserts)
         conn.commit()
         
         print(f"✅ API: Registro exitoso para {user_data.correo}, ID: {new_user_id}")
@@ -153,8 +200,17 @@ async def api_register(user_data: UserRegister):
 
     except psycopg2.errors.UniqueViolation as e:
         if conn: conn.rollback()
-        print(f"❌ API: Conflicto de datos (email o curp ya existen): {e}")
+        campo = campo_duplicado(e)
+        print(f"❌ API: Conflicto de datos ({campo} ya existe): {e}")
+        if campo == "curp":
+            return JSONResponse({"error": "La CURP ya está registrada."}, status_code=409)
+        if campo == "email":
+            return JSONResponse({"error": "El correo electrónico ya está registrado."}, status_code=409)
         return JSONResponse({"error": "El correo electrónico o la CURP ya están registrados."}, status_code=409)
+
+    except PasswordHasherBusyError as e:
+        print("⚠️ API (Register): cola de hashing llena")
+        return JSONResponse({"error": e.detail}, status_code=e.status_code)
         
     except Exception as e:
         if conn: conn.rollback()
@@ -170,12 +226,15 @@ async def api_register(user_data: UserRegister):
 #  RUTA: RECUPERAR CONTRASEÑA (SIMULACIÓN)
 # ==========================================================
 @router.post("/forgot-password")
-async def api_forgot_password(request_data: ForgotPasswordRequest):
+async def api_forgot_password(request_data: ForgotPasswordRequest, request: Request):
     """
     Ruta para manejar la solicitud de "Olvidé mi contraseña".
     Valida los datos con Pydantic.
     """
     print(f"🔹 API: Solicitud de recuperación de contraseña para: {request_data.correo}")
+    limited = rate_limited("forgot-password", request, request_data.correo)
+    if limited:
+        return limited
     
     conn = None
     cursor = None
@@ -219,12 +278,15 @@ async def api_forgot_password(request_data: ForgotPasswordRequest):
 #  RUTA: CAMBIO DE CONTRASEÑA DIRECTO (SIN EMAIL)
 # ==========================================================
 @router.post("/reset-password")
-async def api_reset_password(request_data: ResetPasswordRequest):
+async def api_reset_password(request_data: ResetPasswordRequest, request: Request):
     """
     Ruta para cambiar la contraseña directamente dado un correo.
     ADVERTENCIA: Esto permite cambiar la contraseña de cualquiera si se conoce el correo.
     """
     print(f"🔹 API: Solicitud de cambio de contraseña directo para: {request_data.correo}")
+    limited = rate_limited("reset-password", request, request_data.correo)
+    if limited:
+        return limited
     
     conn = None
     cursor = None
@@ -245,7 +307,7 @@ async def api_reset_password(request_data: ResetPasswordRequest):
             return JSONResponse({"error": "Usuario no encontrado o inactivo."}, status_code=404)
         
         # 2. Hashear la nueva contraseña
-        hashed_password = pwd_context.hash(request_data.nueva_contrasena)
+        hashed_password = await password_hasher.hash(request_data.nueva_contrasena)
         
         # 3. Actualizar la contraseña en la base de datos
         cursor.execute(
@@ -257,6 +319,9 @@ async def api_reset_password(request_data: ResetPasswordRequest):
         print(f"✅ API: Contraseña actualizada exitosamente para {request_data.correo}")
         return JSONResponse({"success": True, "message": "Contraseña actualizada correctamente."})
 
+    except PasswordHasherBusyError as e:
+        print("⚠️ API (Reset Password): cola de hashing llena")
+        return JSONResponse({"error": e.detail}, status_code=e.status_code)
     except Exception as e:
         if conn: conn.rollback()
         print(f"🚨 API ERROR (Reset Password): {e}")
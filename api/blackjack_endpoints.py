@@ -2,6 +2,11 @@ from fastapi import APIRouter, HTTPException, Request
 from fastapi.responses import JSONResponse
 from pydantic import BaseModel
 from app.db import db_connect
+from app.services.bet_limits import bet_limits
+from app.services.user_locks import user_ops
+from app.services.leaderboard import leaderboard
+from app.services.wagering import wagering
+from app.services.session_tokens import sessions
 import psycopg2
 from psycopg2.extras import RealDictCursor
 import random
@@ -86,25 +91,54 @@ def get_game_state(user_id: int):
     return game_states[user_id]
 
 def save_game_state(user_id: int, g: dict):
-    """Guarda el estado del juego y sincroniza con PostgreSQL"""
+    """Guarda el estado del juego (en memoria; el saldo solo cambia con _cobrar/_pagar)"""
     game_states[user_id] = g
-    # Sincronizar saldo con PostgreSQL
-    conn = None
+
+def _mover_saldo(user_id: int, delta: float, minimo: float = None):
+    """
+    Suma `delta` al saldo con un UPDATE relativo (como /spin); nunca escribe un saldo
+    absoluto calculado en memoria. Con `minimo`, solo si el saldo alcanza. Retorna el
+    saldo nuevo o None si no alcanzó.
+    """
+    conn = db_connect.get_connection()
+    if conn is None:
+        raise HTTPException(status_code=500, detail="Error de conexión")
     try:
-        conn = db_connect.get_connection()
         cur = conn.cursor()
         cur.execute(
-            "UPDATE Saldo SET saldo_actual = %s, ultima_actualizacion = NOW() WHERE id_usuario = %s",
-            (decimal.Decimal(str(g["bank"])), user_id)
+            """
+            UPDATE Saldo SET saldo_actual = saldo_actual + %s, ultima_actualizacion = NOW()
+            WHERE id_usuario = %s AND saldo_actual >= %s
+            RETURNING saldo_actual
+            """,
+            (decimal.Decimal(str(delta)), user_id, decimal.Decimal(str(minimo or 0)))
         )
+        res = cur.fetchone()
         conn.commit()
         cur.close()
-    except Exception as e:
-        print(f"Error guardando saldo: {e}")
-        if conn:
-            conn.rollback()
+        return float(res[0]) if res else None
+    except Exception:
+        conn.rollback()
+        raise
     finally:
-        if conn: conn.close()
+        conn.close()
+
+def _cobrar(g, user_id: int, monto: float) -> bool:
+    """Descuenta la apuesta del saldo al repartir (o al doblar). False si no alcanza."""
+    saldo = _mover_saldo(user_id, -monto, minimo=monto)
+    if saldo is None:
+        return False
+    g["bank"] = saldo
+    return True
+
+def _pagar(g, user_id: int, pago: float):
+    """Acredita el pago de la mano (apuesta devuelta + ganancia) y cierra la ronda."""
+    if pago > 0:
+        saldo = _mover_saldo(user_id, pago)
+        if saldo is not None:
+            g["bank"] = saldo
+    g["payout"] = pago
+    g["phase"] = "END"
 
 def draw_card(g, who):
     if not g["deck"]:
@@ -119,7 +153,8 @@ def allowed_actions(g):
         actions = ["bet", "clear_bet", "deal"]
     elif phase == "PLAYER":
         actions = ["hit", "stand"]
-        if len(g["player"]) == 2 and g["bet"] * 2 <= g["bank"]:
+        # La apuesta ya se descontó al repartir: doblar cobra otra igual
+        if len(g["player"]) == 2 and g["bet"] <= g["bank"]:
             actions.append("double")
     elif phase == "END":
         actions = ["new_round"]
@@ -139,31 +174,62 @@ def serialize_state(g):
         "dealer_hidden": g["phase"] == "PLAYER" and len(g["dealer"]) >= 2
     }
 
-def resolve_blackjack(g):
+def resolve_blackjack(g, user_id: int):
     p = is_blackjack(g["player"])
     d = is_blackjack(g["dealer"])
     if p and d:
         g["message"] = "EMPATE"
+        pago = g["bet"]
     elif p:
         win = int(g["bet"] * 1.5)
-        g["bank"] += win
         g["message"] = f"¡BLACKJACK! +${win}"
+        pago = g["bet"] + win
     else:
-        g["bank"] -= g["bet"]
         g["message"] = "BLACKJACK DEL DEALER"
-    g["phase"] = "END"
+        pago = 0
+    _pagar(g, user_id, pago)
+
+def settle(g, user_id: int):
+    """Turno del dealer y pago contra la mano del jugador (stand y doble)."""
+    while hand_value(g["dealer"]) < 17:
+        draw_card(g, "dealer")
+
+    pv = hand_value(g["player"])
+    dv = hand_value(g["dealer"])
+
+    if dv > 21:
+        g["message"] = "DEALER SE PASÓ • GANASTE"
+        pago = g["bet"] * 2
+    elif pv > dv:
+        g["message"] = "GANASTE"
+        pago = g["bet"] * 2
+    elif pv < dv:
+        g["message"] = "PERDISTE"
+        pago = 0
+    else:
+        g["message"] = "EMPATE"
+        pago = g["bet"]
+    _pagar(g, user_id, pago)
+
+def record_round(user_id: int, g):
+    """
+    Si la ronda terminó: suma la apuesta al rollover de bonos y, si hubo ganancia,
+    la registra en el leaderboard.
+    """
+    if g["phase"] != "END":
+        return
+    wagering.record_bet(user_id, "blackjack", g["bet"])
+    if g.get("payout", 0) > g["bet"]:
+        leaderboard.record_win(user_id, "blackjack", g["payout"] - g["bet"])
 
 # ========== HELPER PARA OBTENER USER_ID DE COOKIES ==========
 
 def get_user_id_from_cookie(request: Request):
-    """Obtiene el user_id desde la cookie userId"""
-    user_id = request.cookies.get("userId")
+    """Obtiene el user_id desde la cookie de sesión firmada"""
+    user_id = sessions.user_id(request)
     if not user_id:
         raise HTTPException(status_code=401, detail="No autenticado")
-    try:
-        return int(user_id)
-    except ValueError:
-        raise HTTPException(status_code=401, detail="Cookie inválida")
+    return user_id
 
 # ========== ENDPOINTS DEL JUEGO BLACKJACK ==========
 
@@ -171,182 +237,183 @@ def get_user_id_from_cookie(request: Request):
 async def api_state(request: Request):
     """Obtener estado actual del juego"""
     user_id = get_user_id_from_cookie(request)
-    g = get_game_state(user_id)
-    save_game_state(user_id, g)
-    return serialize_state(g)
+    async with user_ops.hold(user_id):
+        g = get_game_state(user_id)
+        save_game_state(user_id, g)
+        return serialize_state(g)
 
 @router.post("/bet")
 async def api_bet(bet_req: BetRequest, request: Request):
     """Hacer una apuesta"""
     user_id = get_user_id_from_cookie(request)
-    g = get_game_state(user_id)
+    async with user_ops.hold(user_id):
+        g = get_game_state(user_id)
     
-    if g["phase"] != "BETTING":
-        return serialize_state(g)
+        if g["phase"] != "BETTING":
+            return serialize_state(g)
     
-    amount = bet_req.amount
-    if amount > 0 and g["bet"] + amount <= g["bank"]:
-        g["bet"] += amount
-        g["message"] = f"APUESTA: ${g['bet']}"
-    else:
-        g["message"] = "FONDOS INSUFICIENTES"
+        amount = bet_req.amount
+        limit_error = bet_limits.check(user_id, "blackjack", g["bet"] + amount, check_min=False)
+        if limit_error:
+            g["message"] = limit_error.upper()
+        elif amount > 0 and g["bet"] + amount <= g["bank"]:
+            g["bet"] += amount
+            g["message"] = f"APUESTA: ${g['bet']}"
+        else:
+            g["message"] = "FONDOS INSUFICIENTES"
     
-    save_game_state(user_id, g)
-    return serialize_state(g)
+        save_game_state(user_id, g)
+        return serialize_state(g)
 
 @router.post("/clear_bet")
 async def api_clear_bet(request: Request):
     """Borrar apuesta"""
     user_id = get_user_id_from_cookie(request)
-    g = get_game_state(user_id)
+    async with user_ops.hold(user_id):
+        g = get_game_state(user_id)
     
-    if g["phase"] == "BETTING":
-        g["bet"] = 0
-        g["message"] = "APUESTA BORRADA"
+        if g["phase"] == "BETTING":
+            g["bet"] = 0
+            g["message"] = "APUESTA BORRADA"
     
-    save_game_state(user_id, g)
-    return serialize_state(g)
+        save_game_state(user_id, g)
+        return serialize_state(g)
 
 @router.post("/deal")
 async def api_deal(request: Request):
     """Repartir cartas"""
     user_id = get_user_id_from_cookie(request)
-    g = get_game_state(user_id)
+    async with user_ops.hold(user_id):
+        g = get_game_state(user_id)
     
-    if g["phase"] != "BETTING":
-        return serialize_state(g)
+        if g["phase"] != "BETTING":
+            return serialize_state(g)
     
-    if g["bet"] <= 0:
-        g["message"] = "HAZ UNA APUESTA"
-        save_game_state(user_id, g)
-        return serialize_state(g)
+        if g["bet"] <= 0:
+            g["message"] = "HAZ UNA APUESTA"
+            save_game_state(user_id, g)
+            return serialize_state(g)
     
-    if g["bet"] > g["bank"]:
-        g["message"] = "FONDOS INSUFICIENTES"
-        save_game_state(user_id, g)
-        return serialize_state(g)
-
-    # Limpiar manos
-    g["player"] = []
-    g["dealer"] = []
-
-    # Repartir
-    draw_card(g, "player")
-    draw_card(g, "dealer")
-    draw_card(g, "player")
-    draw_card(g, "dealer")
+        if g["bet"] > g["bank"]:
+            g["message"] = "FONDOS INSUFICIENTES"
+            save_game_state(user_id, g)
+            return serialize_state(g)
+
+        limit_error = bet_limits.check(user_id, "blackjack", g["bet"])
+        if limit_error:
+            g["message"] = limit_error.upper()
+            save_game_state(user_id, g)
+            return serialize_state(g)
+
+        # La apuesta sale del saldo ahora: lo que se juegue en otra pestaña mientras
+        # tanto ya no puede dejarlo en negativo al perder esta mano
+        if not _cobrar(g, user_id, g["bet"]):
+            g["message"] = "FONDOS INSUFICIENTES"
+            save_game_state(user_id, g)
+            return serialize_state(g)
+
+        # Limpiar manos
+        g["player"] = []
+        g["dealer"] = []
+        g["payout"] = 0
+
+        # Repartir
+        draw_card(g, "player")
+        draw_card(g, "dealer")
+        draw_card(g, "player")
+        draw_card(g, "dealer")
 
-    g["phase"] = "PLAYER"
-    g["message"] = ""
+        g["phase"] = "PLAYER"
+        g["message"] = ""
 
-    # Verificar blackjack
-    if is_blackjack(g["player"]) or is_blackjack(g["dealer"]):
-        resolve_blackjack(g)
+        # Verificar blackjack
+        if is_blackjack(g["player"]) or is_blackjack(g["dealer"]):
+            resolve_blackjack(g, user_id)
 
-    save_game_state(user_id, g)
-    return serialize_state(g)
+        save_game_state(user_id, g)
+        record_round(user_id, g)
+        return serialize_state(g)
 
 @router.post("/hit")
 async def api_hit(request: Request):
     """Pedir carta"""
     user_id = get_user_id_from_cookie(request)
-    g = get_game_state(user_id)
+    async with user_ops.hold(user_id):
+        g = get_game_state(user_id)
     
-    if g["phase"] != "PLAYER":
-        return serialize_state(g)
+        if g["phase"] != "PLAYER":
+            return serialize_state(g)
     
-    draw_card(g, "player")
-    if hand_value(g["player"]) > 21:
-        g["bank"] -= g["bet"]
-        g["message"] = "TE PASASTE"
-        g["phase"] = "END"
+        draw_card(g, "player")
+        if hand_value(g["player"]) > 21:
+            # La apuesta ya se cobró al repartir: no hay nada que pagar
+            g["message"] = "TE PASASTE"
+            _pagar(g, user_id, 0)
     
-    save_game_state(user_id, g)
-    return serialize_state(g)
+        save_game_state(user_id, g)
+        record_round(user_id, g)
+        return serialize_state(g)
 
 @router.post("/stand")
 async def api_stand(request: Request):
     """Mantenerse"""
     user_id = get_user_id_from_cookie(request)
-    g = get_game_state(user_id)
+    async with user_ops.hold(user_id):
+        g = get_game_state(user_id)
     
-    if g["phase"] != "PLAYER":
-        return serialize_state(g)
+        if g["phase"] != "PLAYER":
+            return serialize_state(g)
     
-    # Turno dealer
-    while hand_value(g["dealer"]) < 17:
-        draw_card(g, "dealer")
-    
-    pv = hand_value(g["player"])
-    dv = hand_value(g["dealer"])
-    
-    if dv > 21:
-        g["bank"] += g["bet"]
-        g["message"] = "DEALER SE PASÓ • GANASTE"
-    elif pv > dv:
-        g["bank"] += g["bet"]
-        g["message"] = "GANASTE"
-    elif pv < dv:
-        g["bank"] -= g["bet"]
-        g["message"] = "PERDISTE"
-    else:
-        g["message"] = "EMPATE"
-    
-    g["phase"] = "END"
-    save_game_state(user_id, g)
-    return serialize_state(g)
+        # Turno dealer y pago
+        settle(g, user_id)
+        save_game_state(user_id, g)
+        record_round(user_id, g)
+        return serialize_state(g)
 
 @router.post("/double")
 async def api_double(request: Request):
     """Doblar apuesta"""
     user_id = get_user_id_from_cookie(request)
-    g = get_game_state(user_id)
+    async with user_ops.hold(user_id):
+        g = get_game_state(user_id)
     
-    if g["phase"] != "PLAYER":
-        return serialize_state(g)
+        if g["phase"] != "PLAYER":
+            return serialize_state(g)
     
-    if len(g["player"]) != 2 or g["bet"] * 2 > g["bank"]:
-        return serialize_state(g)
-
-    g["bank"] -= g["bet"]
-    g["bet"] *= 2
-    draw_card(g, "player")
+        if len(g["player"]) != 2:
+            return serialize_state(g)
+
+        # La apuesta extra también sale del saldo con UPDATE condicionado
+        if not _cobrar(g, user_id, g["bet"]):
+            g["message"] = "FONDOS INSUFICIENTES"
+            save_game_state(user_id, g)
+            return serialize_state(g)
+        g["bet"] *= 2
+        draw_card(g, "player")
     
-    if hand_value(g["player"]) > 21:
-        g["message"] = "TE PASASTE"
-        g["phase"] = "END"
-    else:
-        # Doble = 1 carta y stand automático
-        while hand_value(g["dealer"]) < 17:
-            draw_card(g, "dealer")
-        
-        pv = hand_value(g["player"])
-        dv = hand_value(g["dealer"])
-        
-        if dv > 21 or pv > dv:
-            g["bank"] += g["bet"]
-            g["message"] = "GANASTE"
-        elif pv < dv:
-            g["message"] = "PERDISTE"
+        if hand_value(g["player"]) > 21:
+            g["message"] = "TE PASASTE"
+            _pagar(g, user_id, 0)
         else:
-            g["message"] = "EMPATE"
-        
-        g["phase"] = "END"
+            # Doble = 1 carta y stand automático
+            settle(g, user_id)
     
-    save_game_state(user_id, g)
-    return serialize_state(g)
+        save_game_state(user_id, g)
+        record_round(user_id, g)
+        return serialize_state(g)
 
 @router.post("/new_round")
 async def api_new_round(request: Request):
     """Nueva ronda"""
     user_id = get_user_id_from_cookie(request)
-    g = get_game_state(user_id)
+    async with user_ops.hold(user_id):
+        g = get_game_state(user_id)
     
-    g["player"] = []
-    g["dealer"] = []
-    g["bet"] = 0
-    g["phase"] = "BETTING"
-    g["message"] = "HAZ TU APUESTA"
+        g["player"] = []
+        g["dealer"] = []
+        g["bet"] = 0
+        g["phase"] = "BETTING"
+        g["message"] = "HAZ TU APUESTA"
     
-    save_game_state(user_id, g)
-    return serialize_state(g)
+        save_game_state(user_id, g)
+        return serialize_state(g)
@@ -5,47 +5,29 @@ import psycopg2
 from psycopg2.extras import RealDictCursor
 from datetime import datetime
 from app.utils import serialize_data
+from app.services.bonus_engine import bonus_engine, ensure_bonus_columns, reclamar_bono, RECLAMADO, YA_RECLAMADO
 
 router = APIRouter(prefix="/api/bonos", tags=["Bonos"])
 
+ensure_bonus_columns()
+
 # ==========================================================
 #  OBTENER BONOS DISPONIBLES (Para 'account-bonos.html')
 # ==========================================================
 @router.get("/disponibles/{id_usuario}")
 async def api_get_available_bonos(id_usuario: int):
     """
-    Obtiene bonos que están activos Y que el usuario AÚN NO TIENE.
+    Obtiene bonos que están activos Y que el usuario AÚN NO TIENE, aplicando las
+    reglas de segmentación (jugadores nuevos, depósito mínimo, juego).
+    Se resuelve en memoria con el motor de elegibilidad (app/services/bonus_engine.py).
     """
-    conn = None
     try:
-        conn = db_connect.get_connection()
-        if conn is None: return JSONResponse({"error": "Error de conexión"}, status_code=500)
-        
-        cursor = conn.cursor(cursor_factory=RealDictCursor)
-        
-        # Este SQL usa un LEFT JOIN para encontrar bonos en la tabla 'Bono'
-        # que NO tengan una entrada correspondiente en 'Usuario_Bono' para ESE usuario.
-        cursor.execute(
-            """
-            SELECT b.id_bono, b.nombre_bono, b.tipo, b.descripcion
-            FROM Bono b
-            LEFT JOIN Usuario_Bono ub ON b.id_bono = ub.id_bono AND ub.id_usuario = %s
-            WHERE 
-                b.activo = true 
-                AND (b.fecha_expiracion IS NULL OR b.fecha_expiracion > NOW())
-                AND ub.id_bono IS NULL -- La clave: solo los que NO tiene
-            """,
-            (id_usuario,)
-        )
-        bonos = cursor.fetchall()
-        cursor.close()
-        return JSONResponse({"bonos": bonos})
+        bonos = bonus_engine.available(id_usuario)
+        return JSONResponse({"bonos": serialize_data(bonos)})
 
     except Exception as e:
         print(f"🚨 API ERROR (Bonos Disponibles): {e}")
         return JSONResponse({"error": f"Error interno: {e}"}, status_code=500)
-    finally:
-        if conn: conn.close()
 
 # ==========================================================
 #  RECLAMAR UN BONO (Para 'account-bonos.html')
@@ -56,7 +38,9 @@ async def api_claim_bono(
     id_bono: int = Form()
 ):
     """
-    Crea una nueva entrada en la tabla 'Usuario_Bono'
+    Crea una nueva entrada en la tabla 'Usuario_Bono'.
+    Validación e inserción van en un solo INSERT ... ON CONFLICT DO NOTHING
+    (reclamar_bono), así dos reclamos simultáneos no pueden duplicar el bono.
     """
     print(f"🔹 API: Usuario {id_usuario} intenta reclamar bono {id_bono}")
     conn = None
@@ -67,23 +51,22 @@ async def api_claim_bono(
         
         cursor = conn.cursor()
         
-        # Insertamos el bono para el usuario con estado 'Activo'
-        cursor.execute(
-            """
-            INSERT INTO Usuario_Bono (id_usuario, id_bono, fecha_adquisicion, estado, progreso)
-            VALUES (%s, %s, %s, 'Activo', 0.00)
-            """,
-            (id_usuario, id_bono, datetime.now())
-        )
+        # Insertamos el bono para el usuario con estado 'Activo' (si cumple las reglas)
+        resultado = reclamar_bono(cursor, id_usuario, id_bono)
         conn.commit()
-        
-        print(f"✅ API: Bono {id_bono} reclamado por {id_usuario}")
-        return JSONResponse({"success": True, "message": "Bono reclamado con éxito."})
 
-    except psycopg2.errors.UniqueViolation:
-        if conn: conn.rollback()
-        print(f"❌ API: Usuario {id_usuario} ya tiene el bono {id_bono}")
-        return JSONResponse({"error": "Ya has reclamado este bono."}, status_code=409)
+        if resultado == RECLAMADO:
+            bonus_engine.mark_claimed(id_usuario, id_bono)
+            print(f"✅ API: Bono {id_bono} reclamado por {id_usuario}")
+            return JSONResponse({"success": True, "message": "Bono reclamado con éxito."})
+
+        if resultado == YA_RECLAMADO:
+            bonus_engine.mark_claimed(id_usuario, id_bono)
+            print(f"❌ API: Usuario {id_usuario} ya tiene el bono {id_bono}")
+            return JSONResponse({"error": "Ya has reclamado este bono."}, status_code=409)
+
+        print(f"❌ API: Usuario {id_usuario} no cumple los requisitos del bono {id_bono}")
+        return JSONResponse({"error": "Este bono no está disponible para tu cuenta."}, status_code=403)
     except Exception as e:
         if conn: conn.rollback()
         print(f"🚨 API ERROR (Reclamar Bono): {e}")
@@ -0,0 +1,57 @@
+from fastapi import APIRouter, WebSocket, WebSocketDisconnect, HTTPException
+from datetime import datetime
+from typing import Optional
+from app.middleware.auth_roles import resolver_usuario, ROL_JUGADOR, ROL_AGENTE_SOPORTE
+from app.services.live_chat import live_chat, ChatError, ensure_chat_columns
+import json
+
+router = APIRouter(prefix="/api/chat", tags=["Chat"])
+
+ensure_chat_columns()
+
+# ==========================================================
+#  CHAT EN VIVO (WEBSOCKET)
+#  (Para 'agente-chat-activo.html' y 'support-chat-sala.html')
+# ==========================================================
+@router.websocket("/ws/{id_chat}")
+async def ws_chat(websocket: WebSocket, id_chat: int, desde: Optional[str] = None):
+    """
+    Socket de una sala de chat. Solo entran el jugador dueño del chat y el agente
+    que lo tomó. `desde` es la fecha del último mensaje que ya tiene el cliente:
+    al conectar recibe {"tipo": "historial"} con lo posterior (o los últimos si no
+    manda fecha) y después los mensajes en vivo, acks y cambios de estado.
+    """
+    await websocket.accept()
+    try:
+        usuario = resolver_usuario(websocket, ROL_JUGADOR, ROL_AGENTE_SOPORTE)
+    except HTTPException as e:
+        await websocket.close(code=4401 if e.status_code == 401 else 4403, reason=str(e.detail))
+        return
+
+    fecha_desde = None
+    if desde:
+        try:
+            fecha_desde = datetime.fromisoformat(desde)
+        except ValueError:
+            fecha_desde = None
+
+    try:
+        con = await live_chat.conectar(
+            websocket, usuario["id_usuario"], usuario["id_rol"] == ROL_AGENTE_SOPORTE, id_chat, fecha_desde
+        )
+    except ChatError as e:
+        await websocket.close(code=e.codigo, reason=str(e))
+        return
+
+    try:
+        while True:
+            texto = await websocket.receive_text()
+            try:
+                datos = json.loads(texto)
+            except ValueError:
+                continue
+            live_chat.recibir(con, datos)
+    except WebSocketDisconnect:
+        pass
+    finally:
+        live_chat.desconectar(con)
@@ -0,0 +1,51 @@
+from fastapi import APIRouter, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+from app.middleware.auth_roles import resolver_usuario, ROL_AGENTE_SOPORTE
+from app.services.event_hub import event_hub, ensure_event_triggers
+import asyncio
+import json
+
+router = APIRouter(prefix="/api/eventos", tags=["Eventos"])
+
+# Cada cuánto se manda un comentario para que proxies y navegador no cierren la conexión
+EVENTOS_HEARTBEAT_SECONDS = 15
+
+ensure_event_triggers()
+
+# ==========================================================
+#  EVENTOS EN VIVO (SSE) PARA TICKETS
+#  (Para 'agente-*.html' y 'support-tickets-activo.html')
+# ==========================================================
+@router.get("")
+async def api_event_stream(request: Request):
+    """
+    Stream de Server-Sent Events con los cambios de tickets del usuario en sesión.
+    El jugador recibe los de sus tickets; el agente, la cola y las respuestas de los
+    suyos. Cada evento trae solo ids y estado: la página recarga lo que necesite.
+    """
+    usuario = resolver_usuario(request)
+    sub = event_hub.subscribe(usuario["id_usuario"], usuario["id_rol"] == ROL_AGENTE_SOPORTE)
+    if sub is None:
+        return JSONResponse({"error": "Demasiadas conexiones abiertas, intenta más tarde."}, status_code=503)
+
+    async def stream():
+        try:
+            # El navegador reintenta solo; 5s entre intentos si se corta
+            yield "retry: 5000\n\n"
+            while True:
+                if await request.is_disconnected():
+                    break
+                try:
+                    evento = await asyncio.wait_for(sub.queue.get(), timeout=EVENTOS_HEARTBEAT_SECONDS)
+                except asyncio.TimeoutError:
+                    yield ": ping\n\n"
+                    continue
+                yield f"data: {json.dumps(evento)}\n\n"
+        finally:
+            event_hub.unsubscribe(sub)
+
+    return StreamingResponse(
+        stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
@@ -2,8 +2,18 @@ from fastapi import APIRouter, Request, HTTPException, Depends
 from fastapi.responses import JSONResponse
 from pydantic import BaseModel
 from app.db import db_connect
+from app.utils import etag_response
+from app.services.game_catalog import catalog as game_catalog
+from app.services.bet_limits import bet_limits
+from app.services.user_locks import user_ops, UserBusyError
+from app.services.jackpot import jackpot, ensure_jackpot_tables
+from app.services.leaderboard import leaderboard, ensure_leaderboard_table, PERIODOS, TODOS_LOS_JUEGOS
+from app.services.wagering import wagering, ensure_wagering_columns
+from app.services.session_tokens import sessions
 import random
 import decimal
+import math
+import time
 
 router = APIRouter(prefix="/api", tags=["Games"])
 
@@ -25,6 +35,87 @@ PAYOUTS = {
     "🔔": 50    # x50
 }
 
+ensure_jackpot_tables()
+ensure_leaderboard_table()
+ensure_wagering_columns()
+
+# Nombres públicos de jugadores que aparecen en el leaderboard ("Nombre A."):
+# {id_usuario: (cargado_en, nombre)}. Se releen pasado el TTL (cambios de nombre) y
+# al llenarse se descartan los más viejos, como en role_cache.
+LEADERBOARD_NAMES_TTL_SECONDS = 600
+LEADERBOARD_NAMES_MAX = 5_000
+_leaderboard_names = {}
+
+@router.get("/jackpot")
+async def api_get_jackpot():
+    """Pozo actual del jackpot progresivo (cacheado unos segundos)."""
+    try:
+        return {"jackpot": float(jackpot.current_total())}
+    except Exception as e:
+        print(f"🚨 API ERROR (Jackpot): {e}")
+        return JSONResponse({"detail": "Error interno del servidor"}, status_code=500)
+
+@router.get("/leaderboard")
+async def api_get_leaderboard(periodo: str = "diario", juego: str = TODOS_LOS_JUEGOS, limit: int = 10):
+    """
+    Mayores ganancias del periodo (diario, semanal, historico), por juego o globales.
+    Se sirve desde memoria; solo se consultan los nombres que aún no conocemos.
+    """
+    if periodo not in PERIODOS:
+        return JSONResponse({"detail": "Periodo inválido"}, status_code=400)
+    entries = leaderboard.top(periodo, juego, max(1, min(limit, 50)))
+
+    now = time.monotonic()
+    missing = [
+        id_usuario for id_usuario in {e["id_usuario"] for e in entries}
+        if now - _leaderboard_names.get(id_usuario, (-math.inf, None))[0] > LEADERBOARD_NAMES_TTL_SECONDS
+    ]
+    if missing:
+        conn = None
+        try:
+            conn = db_connect.get_connection()
+            cursor = conn.cursor()
+            cursor.execute(
+                "SELECT id_usuario, nombre, apellido FROM Usuario WHERE id_usuario = ANY(%s)",
+                (missing,)
+            )
+            filas = cursor.fetchall()
+            cursor.close()
+            if len(_leaderboard_names) + len(filas) > LEADERBOARD_NAMES_MAX:
+                oldest = sorted(_leaderboard_names, key=lambda k: _leaderboard_names[k][0])
+                for key in oldest[: max(len(filas), LEADERBOARD_NAMES_MAX // 10)]:
+                    del _leaderboard_names[key]
+            for id_usuario, nombre, apellido in filas:
+                _leaderboard_names[id_usuario] = (now, f"{nombre} {apellido[:1]}." if apellido else nombre)
+        except Exception as e:
+            print(f"⚠️ Leaderboard: no se pudieron obtener nombres ({e})")
+        finally:
+            if conn: conn.close()
+
+    for e in entries:
+        e["jugador"] = _leaderboard_names.get(e["id_usuario"], (0, "Jugador"))[1]
+        del e["id_usuario"]
+    return {"periodo": periodo, "juego": juego, "ganancias": entries}
+
+@router.get("/games")
+async def api_get_lobby_games(request: Request):
+    """
+    Catálogo público de juegos activos para el lobby.
+    Se sirve desde memoria con ETag para que el navegador revalide con 304.
+    """
+    try:
+        juegos, etag = game_catalog.get_games(only_active=True)
+        lobby = [
+            {"id_juego": g["id_juego"], "slug": g["slug"], "nombre": g["nombre"],
+             "descripcion": g["descripcion"], "min_apuesta": g["min_apuesta"],
+             "max_apuesta": g["max_apuesta"], "jugable": g["url"] is not None}
+            for g in juegos
+        ]
+        return etag_response(request, {"games": lobby}, etag)
+    except Exception as e:
+        print(f"🚨 API ERROR (Lobby Games): {e}")
+        return JSONResponse({"detail": "Error interno del servidor"}, status_code=500)
+
 @router.post("/reel")
 async def api_get_reel(request: ReelRequest):
     """
@@ -40,7 +131,7 @@ async def api_spin(request: Request, spin_data: SpinRequest):
     """
     Procesa la apuesta, descuenta saldo y calcula ganancias.
     """
-    user_id = request.cookies.get("userId")
+    user_id = sessions.user_id(request)
     if not user_id:
          # Intentar leer de query param si no hay cookie (para iframes cross-origin si fuera el caso, pero aquí es mismo origen)
          # Pero por seguridad, confiemos en la cookie o el frontend debe pasar el ID.
@@ -51,60 +142,148 @@ async def api_spin(request: Request, spin_data: SpinRequest):
     if bet <= 0:
         return JSONResponse({"detail": "La apuesta debe ser mayor a 0"}, status_code=400)
 
+    # Límites del juego y del usuario (en memoria, sin consulta extra)
+    limit_error = bet_limits.check(int(user_id), "tragamonedas", bet)
+    if limit_error:
+        return JSONResponse({"detail": limit_error}, status_code=400)
+
     conn = None
+    jackpot_drenado = 0
     try:
         conn = db_connect.get_connection()
         cwd = conn.cursor()
 
-        # 1. Verificar saldo
-        cwd.execute("SELECT saldo_actual FROM Saldo WHERE id_usuario = %s", (user_id,))
-        res = cwd.fetchone()
-        if not res:
-            return JSONResponse({"detail": "Usuario no encontrado"}, status_code=404)
-        
-        saldo_actual = float(res[0])
-        if saldo_actual < bet:
-            return JSONResponse({"detail": "Saldo insuficiente"}, status_code=400)
+        # Serializamos con las demás operaciones de saldo del usuario (otras pestañas / workers)
+        async with user_ops.hold(user_id, conn):
+            # 1. Calcular Victoria (RNG Simple por ahora para integración)
+            # Probabilidad de ganar: 30%
+            win_amount = 0
+            is_win = random.random() < 0.3
 
-        # 2. Descontar apuesta
-        nueva_saldo = saldo_actual - bet
-        cwd.execute("UPDATE Saldo SET saldo_actual = %s WHERE id_usuario = %s", (nueva_saldo, user_id))
-        
-        # 3. Calcular Victoria (RNG Simple por ahora para integración)
-        # Probabilidad de ganar: 30%
-        win_amount = 0
-        is_win = random.random() < 0.3
-        
-        if is_win:
-            # Multiplicador aleatorio simple (x2 a x5)
-            multiplier = random.choice([2, 3, 5]) 
-            win_amount = bet * multiplier
-            
-            # Actualizar saldo con ganancia
-            nueva_saldo += win_amount
-            cwd.execute("UPDATE Saldo SET saldo_actual = %s WHERE id_usuario = %s", (nueva_saldo, user_id))
-
-        # 4. Registrar Transacción (Opcional, pero bueno para historial)
-        # Solo registramos si hay cambio significativo o si se desea log de juego
-        # Por rendimiento, a veces los spins no se loguean en transacciones bancarias, 
-        # pero aquí es un casino simple.
-        
-        conn.commit()
+            if is_win:
+                # Multiplicador aleatorio simple (x2 a x5)
+                multiplier = random.choice([2, 3, 5])
+                win_amount = bet * multiplier
+
+            # 2. Descontar apuesta y abonar ganancia en una sola escritura relativa.
+            # La condición sobre saldo_actual reemplaza el "leer y comparar" en Python.
+            cwd.execute(
+                """
+                UPDATE Saldo SET saldo_actual = saldo_actual - %s + %s, ultima_actualizacion = NOW()
+                WHERE id_usuario = %s AND saldo_actual >= %s
+                RETURNING saldo_actual
+                """,
+                (bet, win_amount, user_id, bet)
+            )
+            res = cwd.fetchone()
+            if not res:
+                conn.rollback()
+                cwd.execute("SELECT 1 FROM Saldo WHERE id_usuario = %s", (user_id,))
+                if not cwd.fetchone():
+                    return JSONResponse({"detail": "Usuario no encontrado"}, status_code=404)
+                return JSONResponse({"detail": "Saldo insuficiente"}, status_code=400)
+            nueva_saldo = float(res[0])
+
+            # 3. Jackpot progresivo: si sale el premio, se paga en esta misma transacción.
+            # La contribución va al buffer en memoria solo cuando el giro queda confirmado.
+            jackpot_win, jackpot_drenado = jackpot.try_award(conn, int(user_id), bet)
+            if jackpot_win:
+                nueva_saldo += float(jackpot_win)
+
+            # 4. Registrar Transacción (Opcional, pero bueno para historial)
+            # Solo registramos si hay cambio significativo o si se desea log de juego
+            # Por rendimiento, a veces los spins no se loguean en transacciones bancarias,
+            # pero aquí es un casino simple.
+
+            conn.commit()
+            jackpot_drenado = 0
         cwd.close()
+        jackpot.contribute(bet)
+
+        # Ranking de ganancias (ganancia neta de la ronda)
+        leaderboard.record_win(int(user_id), "tragamonedas", win_amount - bet + float(jackpot_win or 0))
+        # Rollover de bonos activos (se vuelca en lote, no aquí)
+        wagering.record_bet(int(user_id), "tragamonedas", bet)
 
         return {
             "win": win_amount,
+            "jackpot": float(jackpot_win) if jackpot_win else 0,
             "nuevo_saldo": nueva_saldo,
             "detail": "Jiro completado"
         }
 
+    except UserBusyError as e:
+        if conn: conn.rollback()
+        return JSONResponse({"detail": e.detail}, status_code=e.status_code)
     except Exception as e:
         if conn: conn.rollback()
+        # El premio no se confirmó: lo drenado del buffer vuelve al pozo
+        jackpot.restore(jackpot_drenado)
         print(f"🚨 API ERROR (Spin): {e}")
         return JSONResponse({"detail": "Error interno del servidor"}, status_code=500)
     finally:
         if conn: conn.close()
 
+# Ruleta: pago por cantidad de números de la apuesta (pleno, caballo, calle,
+# cuadro, seisena, docena/columna, suertes sencillas). El cliente manda "odds",
+# pero el pago se calcula aquí y ese campo se ignora.
+PAGOS_RULETA = {1: 35, 2: 17, 3: 11, 4: 8, 6: 5, 12: 2, 18: 1}
+ROJOS_RULETA = frozenset({1, 3, 5, 7, 9, 12, 14, 16, 18, 19, 21, 23, 25, 27, 30, 32, 34, 36})
+
+
+def _apuestas_validas_ruleta():
+    """Todas las combinaciones de números que el paño de la ruleta permite apostar."""
+    validas = {frozenset({n}) for n in range(37)}
+    for n in range(1, 37):
+        if n % 3 != 0:
+            validas.add(frozenset({n, n + 1}))                  # caballo horizontal
+        if n <= 33:
+            validas.add(frozenset({n, n + 3}))                  # caballo vertical
+        if n % 3 != 0 and n <= 32:
+            validas.add(frozenset({n, n + 1, n + 3, n + 4}))    # cuadro
+    for fila in range(12):
+        base = 3 * fila + 1
+        validas.add(frozenset(range(base, base + 3)))           # calle
+        if fila < 11:
+            validas.add(frozenset(range(base, base + 6)))       # seisena
+    for i in range(3):
+        validas.add(frozenset(range(12 * i + 1, 12 * i + 13)))  # docena
+        validas.add(frozenset(range(i + 1, 37, 3)))             # columna
+    numeros = range(1, 37)
+    validas.add(frozenset(range(1, 19)))
+    validas.add(frozenset(range(19, 37)))
+    validas.add(frozenset(n for n in numeros if n % 2 == 0))
+    validas.add(frozenset(n for n in numeros if n % 2 == 1))
+    validas.add(ROJOS_RULETA)
+    validas.add(frozenset(numeros) - ROJOS_RULETA)
+    return frozenset(validas)
+
+
+APUESTAS_VALIDAS_RULETA = _apuestas_validas_ruleta()
+
+
+def parsear_apuestas_ruleta(bets: list):
+    """
+    Convierte las apuestas del cliente en [(monto, números, pago)].
+    Devuelve None si alguna no es válida: falta el monto o los números, el monto no
+    es finito o no es positivo, hay números repetidos, o la combinación no existe
+    en el paño.
+    """
+    apuestas = []
+    try:
+        for bet in bets:
+            amt = float(bet['amt'])
+            numeros = [int(x.strip()) for x in str(bet['numbers']).split(',')]
+            conjunto = frozenset(numeros)
+            if (not math.isfinite(amt) or amt <= 0 or len(conjunto) != len(numeros)
+                    or conjunto not in APUESTAS_VALIDAS_RULETA):
+                return None
+            apuestas.append((amt, conjunto, PAGOS_RULETA[len(conjunto)]))
+    except (KeyError, TypeError, ValueError):
+        return None
+    return apuestas
+
+
 # Roulette-specific models
 class RouletteSpinRequest(BaseModel):
     balance: float
@@ -117,12 +296,25 @@ async def api_spin_roulette(request: Request, spin_data: RouletteSpinRequest):
     """
     Procesa el giro de ruleta y calcula ganancias basadas en las apuestas.
     """
-    user_id = request.cookies.get("userId")
+    user_id = sessions.user_id(request)
     if not user_id:
         return JSONResponse({"detail": "No autenticado"}, status_code=401)
 
     conn = None
+    jackpot_drenado = 0
     try:
+        # Cada apuesta: {"amt": monto, "numbers": "1,2,3"}; el pago sale de PAGOS_RULETA
+        apuestas = parsear_apuestas_ruleta(spin_data.bets)
+        if apuestas is None:
+            return JSONResponse({"detail": "Apuesta inválida"}, status_code=400)
+
+        total_bet = sum(amt for amt, _, _ in apuestas)
+        if total_bet <= 0:
+            return JSONResponse({"detail": "La apuesta debe ser mayor a 0"}, status_code=400)
+        limit_error = bet_limits.check(int(user_id), "ruleta", total_bet)
+        if limit_error:
+            return JSONResponse({"detail": limit_error}, status_code=400)
+
         conn = db_connect.get_connection()
         cursor = conn.cursor()
 
@@ -131,27 +323,86 @@ async def api_spin_roulette(request: Request, spin_data: RouletteSpinRequest):
         
         # Calcular ganancias basadas en las apuestas
         win_value = 0
-        for bet in spin_data.bets:
-            bet_numbers = [int(x.strip()) for x in bet['numbers'].split(',')]
+        for amt, bet_numbers, pago in apuestas:
             if winning_spin in bet_numbers:
-                win_value += bet['amt'] * bet['odds']
+                win_value += amt * pago
         
-        # Actualizar saldo en BD
-        new_balance = spin_data.balance + win_value
-        cursor.execute("UPDATE Saldo SET saldo_actual = %s WHERE id_usuario = %s", (new_balance, user_id))
-        conn.commit()
+        # Actualizar saldo en BD de forma relativa: el saldo que manda el cliente
+        # puede estar desfasado si otra pestaña jugó mientras tanto.
+        async with user_ops.hold(user_id, conn):
+            cursor.execute(
+                """
+                UPDATE Saldo SET saldo_actual = saldo_actual - %s + %s, ultima_actualizacion = NOW()
+                WHERE id_usuario = %s AND saldo_actual >= %s
+                RETURNING saldo_actual
+                """,
+                (total_bet, win_value, user_id, total_bet)
+            )
+            res = cursor.fetchone()
+            if not res:
+                conn.rollback()
+                return JSONResponse({"detail": "Saldo insuficiente"}, status_code=400)
+            new_balance = float(res[0])
+
+            jackpot_win, jackpot_drenado = jackpot.try_award(conn, int(user_id), total_bet)
+            if jackpot_win:
+                new_balance += float(jackpot_win)
+            conn.commit()
+            jackpot_drenado = 0
         cursor.close()
+        jackpot.contribute(total_bet)
+
+        leaderboard.record_win(int(user_id), "ruleta", win_value - total_bet + float(jackpot_win or 0))
+        wagering.record_bet(int(user_id), "ruleta", total_bet)
 
         return {
             "winningSpin": winning_spin,
             "winValue": win_value,
+            "jackpot": float(jackpot_win) if jackpot_win else 0,
             "newBalance": new_balance
         }
 
+    except UserBusyError as e:
+        if conn: conn.rollback()
+        return JSONResponse({"detail": e.detail}, status_code=e.status_code)
     except Exception as e:
         if conn: conn.rollback()
+        jackpot.restore(jackpot_drenado)
         print(f"🚨 API ERROR (Roulette Spin): {e}")
         return JSONResponse({"detail": "Error interno del servidor"}, status_code=500)
     finally:
         if conn: conn.close()
 
+
+
+if __name__ == "__main__":
+    # Verificación de la ruleta: python -m api.game_endpoints
+    from fastapi import FastAPI
+    from fastapi.testclient import TestClient
+
+    bet_limits.check = lambda *args: None
+    app = FastAPI()
+    app.include_router(router)
+    client = TestClient(app)
+    client.cookies.set("session", sessions.issue(1, 1))
+
+    rechazadas = {
+        "pago del cliente inflado": [{"amt": 10, "numbers": "1, 2, 3, 4, 5, 6, 7", "odds": 1e6}],
+        "números repetidos": [{"amt": 10, "numbers": "7, 7", "odds": 17}],
+        "caballo no adyacente": [{"amt": 10, "numbers": "1, 36", "odds": 17}],
+        "número fuera del paño": [{"amt": 10, "numbers": "37", "odds": 35}],
+        "monto negativo": [{"amt": -10, "numbers": "7", "odds": 35}],
+        "monto no finito": [{"amt": "nan", "numbers": "7", "odds": 35}],
+        "sin números": [{"amt": 10, "odds": 35}],
+    }
+    fallas = 0
+    for caso, bets in rechazadas.items():
+        r = client.post("/api/spin-roulette", json={"balance": 0, "currentBet": 10, "bets": bets, "numbersBet": []})
+        if r.status_code != 400:
+            fallas += 1
+            print(f"🚨 {caso}: se esperaba 400 y llegó {r.status_code}")
+
+    assert len(APUESTAS_VALIDAS_RULETA) == 37 + 57 + 22 + 12 + 11 + 6 + 6
+    assert parsear_apuestas_ruleta([{"amt": 5, "numbers": "1, 2", "odds": 1e6}]) == [(5.0, frozenset({1, 2}), 17)]
+    assert parsear_apuestas_ruleta([{"amt": 5, "numbers": "0"}]) == [(5.0, frozenset({0}), 35)]
+    print("✅ Ruleta: apuestas inválidas rechazadas con 400" if not fallas else f"⛔ {fallas} casos sin rechazar")
@@ -1,10 +1,12 @@
-﻿from fastapi import APIRouter, Form
+﻿from fastapi import APIRouter, Form, Request
 from fastapi.responses import JSONResponse
 from app.db import db_connect
 import psycopg2
 from psycopg2.extras import RealDictCursor
 from datetime import datetime
 from app.utils import serialize_data
+from app.services.live_chat import crear_chat, CHAT_MAX_TEXTO
+from app.middleware.auth_roles import resolver_usuario, ROL_JUGADOR
 
 router = APIRouter(prefix="/api/support", tags=["Support"])
 
@@ -126,3 +128,97 @@ async def api_get_ticket_history(id_usuario: int):
         return JSONResponse({"error": f"Error interno: {e}"}, status_code=500)
     finally:
         if conn: conn.close()
+
+
+# ==========================================================
+#  CHAT EN VIVO
+#  (Los mensajes van por WebSocket: ver api/chat.py)
+# ==========================================================
+@router.post("/chats/create")
+async def api_create_chat(
+    request: Request,
+    asunto: str = Form(),
+    mensaje: str = Form()
+):
+    """
+    Abre un chat en espera con el primer mensaje del jugador de la sesión (o usa el que ya tenga abierto)
+    Llamada por: support-chat-nuevo.html
+    """
+    id_usuario = resolver_usuario(request, ROL_JUGADOR)["id_usuario"]
+    print(f"🔹 API: Iniciando chat para usuario: {id_usuario}, Asunto: {asunto}")
+    
+    texto = f"[{asunto}] {mensaje.strip()}"
+    if not mensaje.strip() or len(texto) > CHAT_MAX_TEXTO:
+        return JSONResponse({"error": f"El mensaje debe tener entre 1 y {CHAT_MAX_TEXTO} caracteres."}, status_code=400)
+    
+    conn = None
+    try:
+        conn = db_connect.get_connection()
+        if conn is None:
+            return JSONResponse({"error": "Error de conexión"}, status_code=500)
+        
+        cursor = conn.cursor()
+        # La tabla Chat no tiene asunto: va al inicio del primer mensaje
+        id_chat, es_nuevo = crear_chat(cursor, id_usuario, texto)
+        conn.commit()
+        cursor.close()
+        
+        print(f"✅ API: Chat {id_chat} {'creado' if es_nuevo else 'reutilizado'} para {id_usuario}")
+        return JSONResponse({"success": True, "id_chat": id_chat, "nuevo": es_nuevo})
+
+    except Exception as e:
+        if conn: conn.rollback()
+        print(f"🚨 API ERROR (Crear Chat): {e}")
+        return JSONResponse({"error": f"Error interno del servidor: {e}"}, status_code=500)
+    finally:
+        if conn: conn.close()
+
+
+def _chats_del_jugador(id_usuario: int, cerrados: bool):
+    conn = None
+    try:
+        conn = db_connect.get_connection()
+        if conn is None: return JSONResponse({"error": "Error de conexión"}, status_code=500)
+        
+        cursor = conn.cursor(cursor_factory=RealDictCursor)
+        cursor.execute(
+            f"""
+            SELECT c.id_chat, c.estado, c.fecha_inicio, c.fecha_cierre,
+                   a.nombre || ' ' || a.apellido AS nombre_agente
+            FROM Chat c
+            LEFT JOIN Usuario a ON a.id_usuario = c.id_agente
+            WHERE c.id_jugador = %s AND c.estado {'=' if cerrados else '<>'} 'Cerrado'
+            ORDER BY c.fecha_inicio DESC
+            LIMIT 50
+            """,
+            (id_usuario,)
+        )
+        chats = cursor.fetchall()
+        cursor.close()
+        return JSONResponse({"chats": serialize_data(chats)})
+
+    except Exception as e:
+        print(f"🚨 API ERROR (Chats del Jugador): {e}")
+        return JSONResponse({"error": f"Error interno: {e}"}, status_code=500)
+    finally:
+        if conn: conn.close()
+
+
+@router.get("/chats/active")
+async def api_get_active_chats(request: Request):
+    """
+    Chats 'Esperando' o 'Activo' del jugador de la sesión
+    Llamada por: support-chat-activo.html
+    """
+    id_usuario = resolver_usuario(request, ROL_JUGADOR)["id_usuario"]
+    return _chats_del_jugador(id_usuario, cerrados=False)
+
+
+@router.get("/chats/history")
+async def api_get_chat_history(request: Request):
+    """
+    Chats cerrados del jugador de la sesión
+    Llamada por: support-chat-historial.html
+    """
+    id_usuario = resolver_usuario(request, ROL_JUGADOR)["id_usuario"]
+    return _chats_del_jugador(id_usuario, cerrados=True)
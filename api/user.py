@@ -3,6 +3,7 @@ from fastapi.responses import JSONResponse
 from app.db import db_connect
 import psycopg2
 from psycopg2.extras import RealDictCursor
+from app.services.password_hasher import password_hasher, PasswordHasherBusyError
 
 router = APIRouter(prefix="/api/user", tags=["User"])
 
@@ -100,12 +101,7 @@ async def api_update_user_info(
         # 2. Si hay contraseña nueva, actualizarla también
         if contrasena and contrasena.strip():
             print(f"🔹 API: Actualizando contraseña para usuario {id_usuario}")
-            from api.auth import pwd_context # Importar aquí para evitar circular import si fuera necesario, o usar el global si está movido.
-            # Mejor importar pwd_context de un lugar comun si es posible, o re-instanciar.
-            # Dado que auth.py lo instancia, podemos importarlo de ahí. 
-            # api.auth ya está importado en main, así que debería estar bien.
-            
-            hashed_password = pwd_context.hash(contrasena)
+            hashed_password = await password_hasher.hash(contrasena)
             
             cursor.execute(
                 """
@@ -128,6 +124,12 @@ async def api_update_user_info(
         if conn: conn.rollback()
         print(f"❌ API: Conflicto, email ya existe")
         return JSONResponse({"error": "Ese correo electrónico ya está en uso por otra cuenta."}, status_code=409)
+
+    except PasswordHasherBusyError as e:
+        # El nombre/correo ya se actualizó en esta transacción: se deshace todo
+        if conn: conn.rollback()
+        print("⚠️ API (update_user_info): cola de hashing llena")
+        return JSONResponse({"error": e.detail}, status_code=e.status_code)
         
     except Exception as e:
         if conn: conn.rollback()
@@ -5,6 +5,8 @@ import psycopg2
 from psycopg2.extras import RealDictCursor
 from datetime import datetime
 from app.utils import serialize_data
+from app.services.user_locks import user_ops, UserBusyError
+from app.services.bonus_engine import bonus_engine
 import decimal # Para manejar el dinero de forma segura
 import random # Para simular la referencia
 
@@ -34,20 +36,25 @@ async def api_deposit_card(
         if conn is None: return JSONResponse({"error": "Error de conexión"}, status_code=500)
         
         cursor = conn.cursor()
-        # 1. Registrar la transacción como 'Completada'
-        cursor.execute(
-            "INSERT INTO Transaccion (id_usuario, tipo_transaccion, monto, estado, metodo_pago) VALUES (%s, 'Depósito', %s, 'Completada', 'Tarjeta')",
-            (id_usuario, monto_decimal)
-        )
-        # 2. Actualizar el saldo del usuario
-        cursor.execute(
-            "UPDATE Saldo SET saldo_actual = saldo_actual + %s WHERE id_usuario = %s",
-            (monto_decimal, id_usuario)
-        )
-        conn.commit()
+        async with user_ops.hold(id_usuario, conn):
+            # 1. Registrar la transacción como 'Completada'
+            cursor.execute(
+                "INSERT INTO Transaccion (id_usuario, tipo_transaccion, monto, estado, metodo_pago) VALUES (%s, 'Depósito', %s, 'Completada', 'Tarjeta')",
+                (id_usuario, monto_decimal)
+            )
+            # 2. Actualizar el saldo del usuario
+            cursor.execute(
+                "UPDATE Saldo SET saldo_actual = saldo_actual + %s WHERE id_usuario = %s",
+                (monto_decimal, id_usuario)
+            )
+            conn.commit()
         cursor.close()
+        bonus_engine.invalidate_user(id_usuario) # Puede habilitar bonos por depósito
         return JSONResponse({"success": True, "message": "Depósito realizado con éxito."})
 
+    except UserBusyError as e:
+        if conn: conn.rollback()
+        return JSONResponse({"error": e.detail}, status_code=e.status_code)
     except Exception as e:
         if conn: conn.rollback()
         print(f"🚨 API ERROR (Deposit Card): {e}")
@@ -127,32 +134,37 @@ async def api_withdraw_bank(
         
         cursor = conn.cursor(cursor_factory=RealDictCursor)
 
-        # 1. Verificar saldo suficiente
-        cursor.execute("SELECT saldo_actual FROM Saldo WHERE id_usuario = %s", (id_usuario,))
-        saldo = cursor.fetchone()
+        # El lock evita que dos retiros (o un retiro y un giro) lean el mismo saldo
+        async with user_ops.hold(id_usuario, conn):
+            # 1. Verificar saldo suficiente
+            cursor.execute("SELECT saldo_actual FROM Saldo WHERE id_usuario = %s", (id_usuario,))
+            saldo = cursor.fetchone()
         
-        if not saldo or saldo['saldo_actual'] < monto_decimal:
-            return JSONResponse({"error": "Saldo insuficiente."}, status_code=400)
+            if not saldo or saldo['saldo_actual'] < monto_decimal:
+                return JSONResponse({"error": "Saldo insuficiente."}, status_code=400)
 
-        # 2. Descontar saldo
-        cursor.execute(
-            "UPDATE Saldo SET saldo_actual = saldo_actual - %s, ultima_actualizacion = %s WHERE id_usuario = %s",
-            (monto_decimal, datetime.now(), id_usuario)
-        )
+            # 2. Descontar saldo
+            cursor.execute(
+                "UPDATE Saldo SET saldo_actual = saldo_actual - %s, ultima_actualizacion = %s WHERE id_usuario = %s",
+                (monto_decimal, datetime.now(), id_usuario)
+            )
 
-        # 3. Registrar transacción (Pendiente)
-        cursor.execute(
-            """
-            INSERT INTO Transaccion (id_usuario, tipo_transaccion, monto, estado, metodo_pago, fecha_transaccion)
-            VALUES (%s, 'Retiro', %s, 'Pendiente', 'Transferencia', %s)
-            """,
-            (id_usuario, monto_decimal, datetime.now())
-        )
+            # 3. Registrar transacción (Pendiente)
+            cursor.execute(
+                """
+                INSERT INTO Transaccion (id_usuario, tipo_transaccion, monto, estado, metodo_pago, fecha_transaccion)
+                VALUES (%s, 'Retiro', %s, 'Pendiente', 'Transferencia', %s)
+                """,
+                (id_usuario, monto_decimal, datetime.now())
+            )
 
-        conn.commit()
+            conn.commit()
         cursor.close()
         return JSONResponse({"success": True, "message": "Retiro solicitado correctamente."})
 
+    except UserBusyError as e:
+        if conn: conn.rollback()
+        return JSONResponse({"error": e.detail}, status_code=e.status_code)
     except Exception as e:
         if conn: conn.rollback()
         print(f"🚨 API ERROR (Withdraw Bank): {e}")
@@ -178,32 +190,37 @@ async def api_withdraw_card(
         
         cursor = conn.cursor(cursor_factory=RealDictCursor)
 
-        # 1. Verificar saldo suficiente
-        cursor.execute("SELECT saldo_actual FROM Saldo WHERE id_usuario = %s", (id_usuario,))
-        saldo = cursor.fetchone()
+        # El lock evita que dos retiros (o un retiro y un giro) lean el mismo saldo
+        async with user_ops.hold(id_usuario, conn):
+            # 1. Verificar saldo suficiente
+            cursor.execute("SELECT saldo_actual FROM Saldo WHERE id_usuario = %s", (id_usuario,))
+            saldo = cursor.fetchone()
         
-        if not saldo or saldo['saldo_actual'] < monto_decimal:
-            return JSONResponse({"error": "Saldo insuficiente."}, status_code=400)
+            if not saldo or saldo['saldo_actual'] < monto_decimal:
+                return JSONResponse({"error": "Saldo insuficiente."}, status_code=400)
 
-        # 2. Descontar saldo
-        cursor.execute(
-            "UPDATE Saldo SET saldo_actual = saldo_actual - %s, ultima_actualizacion = %s WHERE id_usuario = %s",
-            (monto_decimal, datetime.now(), id_usuario)
-        )
+            # 2. Descontar saldo
+            cursor.execute(
+                "UPDATE Saldo SET saldo_actual = saldo_actual - %s, ultima_actualizacion = %s WHERE id_usuario = %s",
+                (monto_decimal, datetime.now(), id_usuario)
+            )
 
-        # 3. Registrar transacción (Pendiente)
-        cursor.execute(
-            """
-            INSERT INTO Transaccion (id_usuario, tipo_transaccion, monto, estado, metodo_pago, fecha_transaccion)
-            VALUES (%s, 'Retiro', %s, 'Pendiente', 'Tarjeta', %s)
-            """,
-            (id_usuario, monto_decimal, datetime.now())
-        )
+            # 3. Registrar transacción (Pendiente)
+            cursor.execute(
+                """
+                INSERT INTO Transaccion (id_usuario, tipo_transaccion, monto, estado, metodo_pago, fecha_transaccion)
+                VALUES (%s, 'Retiro', %s, 'Pendiente', 'Tarjeta', %s)
+                """,
+                (id_usuario, monto_decimal, datetime.now())
+            )
 
-        conn.commit()
+            conn.commit()
         cursor.close()
         return JSONResponse({"success": True, "message": "Retiro solicitado correctamente."})
 
+    except UserBusyError as e:
+        if conn: conn.rollback()
+        return JSONResponse({"error": e.detail}, status_code=e.status_code)
     except Exception as e:
         if conn: conn.rollback()
         print(f"🚨 API ERROR (Withdraw Card): {e}")
@@ -438,33 +455,37 @@ async def api_request_loan(
         
         cursor = conn.cursor()
 
-        # 1. Registrar la transacción como 'Completada' (Préstamo)
-        cursor.execute(
-            """
-            INSERT INTO Transaccion 
-                (id_usuario, tipo_transaccion, monto, estado, metodo_pago, fecha_transaccion)
-            VALUES 
-                (%s, 'Préstamo', %s, 'Completada', 'Crédito Casino', %s)
-            """,
-            (id_usuario, monto_decimal, datetime.now())
-        )
+        async with user_ops.hold(id_usuario, conn):
+            # 1. Registrar la transacción como 'Completada' (Préstamo)
+            cursor.execute(
+                """
+                INSERT INTO Transaccion 
+                    (id_usuario, tipo_transaccion, monto, estado, metodo_pago, fecha_transaccion)
+                VALUES 
+                    (%s, 'Préstamo', %s, 'Completada', 'Crédito Casino', %s)
+                """,
+                (id_usuario, monto_decimal, datetime.now())
+            )
         
-        # 2. Actualizar el saldo del usuario (Incrementar)
-        cursor.execute(
-            """
-            UPDATE Saldo 
-            SET saldo_actual = saldo_actual + %s, ultima_actualizacion = %s 
-            WHERE id_usuario = %s
-            """,
-            (monto_decimal, datetime.now(), id_usuario)
-        )
+            # 2. Actualizar el saldo del usuario (Incrementar)
+            cursor.execute(
+                """
+                UPDATE Saldo 
+                SET saldo_actual = saldo_actual + %s, ultima_actualizacion = %s 
+                WHERE id_usuario = %s
+                """,
+                (monto_decimal, datetime.now(), id_usuario)
+            )
         
-        conn.commit()
+            conn.commit()
         cursor.close()
         
         print(f"✅ API: Préstamo de ${monto} abonado a {id_usuario}")
         return JSONResponse({"success": True, "message": "Préstamo aprobado y abonado a tu cuenta."})
 
+    except UserBusyError as e:
+        if conn: conn.rollback()
+        return JSONResponse({"error": e.detail}, status_code=e.status_code)
     except Exception as e:
         if conn: conn.rollback()
         print(f"🚨 API ERROR (Loan): {e}")
@@ -0,0 +1,75 @@
+from fastapi import Request, HTTPException, status
+from fastapi.responses import RedirectResponse
+from app.services.session_tokens import sessions
+from app.services.role_cache import role_cache
+
+# IDs de la tabla Rol (ver database_schema.sql)
+ROL_JUGADOR = 1
+ROL_ADMINISTRADOR = 2
+ROL_AUDITOR = 3
+ROL_AGENTE_SOPORTE = 4
+
+
+def resolver_usuario(request: Request, *roles: int):
+    """
+    Punto único de autorización: sesión firmada + rol/estado actual (cacheado).
+    Retorna {"id_usuario", "id_rol", "rol", "activo"} o lanza HTTPException.
+    Sin roles, solo exige un usuario autenticado y activo.
+    """
+    user_id = sessions.user_id(request)
+    if not user_id:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="No autenticado"
+        )
+
+    try:
+        usuario = role_cache.get(user_id)
+    except Exception as e:
+        print(f"🚨 Error al resolver rol del usuario {user_id}: {e}")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="Error al verificar permisos"
+        )
+
+    if not usuario:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Usuario no encontrado"
+        )
+
+    if not usuario['activo']:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Usuario inactivo"
+        )
+
+    if roles and usuario['id_rol'] not in roles:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Acceso denegado: rol no autorizado"
+        )
+
+    return usuario
+
+
+def requiere_rol(*roles: int):
+    """
+    Dependencia de FastAPI para rutas de API.
+    Uso: Depends(requiere_rol(ROL_ADMINISTRADOR)) o dependencies=[...] en el router.
+    """
+    async def dependencia(request: Request):
+        return resolver_usuario(request, *roles)
+    return dependencia
+
+
+def requiere_rol_redirect(request: Request, *roles: int):
+    """
+    Versión para rutas HTML: retorna un RedirectResponse al login si no hay permiso,
+    o None si el usuario puede continuar.
+    """
+    try:
+        resolver_usuario(request, *roles)
+    except HTTPException:
+        return RedirectResponse(url="/login", status_code=302)
+    return None
@@ -0,0 +1,26 @@
+from starlette.requests import HTTPConnection
+from fastapi.responses import JSONResponse
+from app.services.ip_filter import ip_filter
+from app.utils import client_ip
+
+
+class IPFilterMiddleware:
+    """
+    Rechaza peticiones HTTP y WebSocket de IPs en BloqueoIP (salvo que la lista
+    blanca las permita). La consulta es en memoria; no toca la BD. La IP es la que
+    agregó el proxy de confianza (client_ip), no la que dice el cliente.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] in ("http", "websocket") and ip_filter.is_blocked(client_ip(HTTPConnection(scope))):
+            if scope["type"] == "http":
+                response = JSONResponse({"error": "Acceso denegado desde esta dirección IP."}, status_code=403)
+                await response(scope, receive, send)
+            else:
+                # Cerrar antes de aceptar = handshake rechazado (403)
+                await send({"type": "websocket.close", "code": 1008})
+            return
+        await self.app(scope, receive, send)
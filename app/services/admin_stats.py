@@ -0,0 +1,216 @@
+import threading
+import time
+from datetime import datetime
+from app.db import db_connect
+
+# Cada cuánto se relee el snapshot de contadores
+ADMIN_STATS_TTL_SECONDS = 10
+
+# Filas por contador. Los triggers suman en una fila al azar para que depósitos y
+# registros concurrentes no se bloqueen en la misma fila.
+ADMIN_STATS_SHARDS = 8
+
+# Contadores mantenidos por triggers -> llave en la respuesta de /api/admin/stats
+CONTADORES = {
+    "jugadores": "total_users",
+    "jugadores_activos": "active_users",
+    "depositos": "total_deposits",
+    "retiros": "total_withdrawals",
+}
+
+# Respaldo: un solo statement con un scan por tabla (en vez de cuatro consultas)
+AGREGADO_SQL = """
+    SELECT u.total_users, u.active_users, t.total_deposits, t.total_withdrawals
+    FROM (
+        SELECT COUNT(*) FILTER (WHERE id_rol = 1) AS total_users,
+               COUNT(*) FILTER (WHERE id_rol = 1 AND activo) AS active_users
+        FROM Usuario
+    ) u, (
+        SELECT COALESCE(SUM(monto) FILTER (WHERE tipo_transaccion = 'Depósito'), 0) AS total_deposits,
+               COALESCE(SUM(monto) FILTER (WHERE tipo_transaccion = 'Retiro'), 0) AS total_withdrawals
+        FROM Transaccion
+        WHERE estado = 'Completada'
+    ) t
+"""
+
+
+def ensure_admin_stats_counters():
+    """
+    Crea la tabla Contador_Admin y los triggers que la mantienen al día.
+    La primera vez siembra los contadores con el agregado completo, bajo lock de
+    las tablas para que ningún cambio quede entre la siembra y los triggers.
+    """
+    conn = None
+    try:
+        conn = db_connect.get_connection()
+        cursor = conn.cursor()
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS Contador_Admin (
+                clave VARCHAR(30) NOT NULL,
+                shard SMALLINT NOT NULL,
+                valor NUMERIC(16, 2) NOT NULL DEFAULT 0,
+                PRIMARY KEY (clave, shard)
+            );
+
+            CREATE OR REPLACE FUNCTION fn_sumar_contador_admin(p_clave TEXT, p_delta NUMERIC) RETURNS void AS $$
+            BEGIN
+                IF p_delta <> 0 THEN
+                    INSERT INTO Contador_Admin (clave, shard, valor)
+                    VALUES (p_clave, floor(random() * %(shards)s)::smallint, p_delta)
+                    ON CONFLICT (clave, shard) DO UPDATE SET valor = Contador_Admin.valor + EXCLUDED.valor;
+                END IF;
+            END $$ LANGUAGE plpgsql;
+
+            CREATE OR REPLACE FUNCTION trg_contador_admin_usuario() RETURNS trigger AS $$
+            DECLARE
+                d_total INTEGER := 0;
+                d_activos INTEGER := 0;
+            BEGIN
+                IF TG_OP IN ('UPDATE', 'DELETE') AND OLD.id_rol = 1 THEN
+                    d_total := d_total - 1;
+                    IF OLD.activo THEN d_activos := d_activos - 1; END IF;
+                END IF;
+                IF TG_OP IN ('INSERT', 'UPDATE') AND NEW.id_rol = 1 THEN
+                    d_total := d_total + 1;
+                    IF NEW.activo THEN d_activos := d_activos + 1; END IF;
+                END IF;
+                PERFORM fn_sumar_contador_admin('jugadores', d_total);
+                PERFORM fn_sumar_contador_admin('jugadores_activos', d_activos);
+                RETURN NULL;
+            END $$ LANGUAGE plpgsql;
+
+            CREATE OR REPLACE FUNCTION trg_contador_admin_transaccion() RETURNS trigger AS $$
+            DECLARE
+                d_depositos NUMERIC := 0;
+                d_retiros NUMERIC := 0;
+            BEGIN
+                IF TG_OP IN ('UPDATE', 'DELETE') AND OLD.estado = 'Completada' THEN
+                    IF OLD.tipo_transaccion = 'Depósito' THEN d_depositos := d_depositos - OLD.monto; END IF;
+                    IF OLD.tipo_transaccion = 'Retiro' THEN d_retiros := d_retiros - OLD.monto; END IF;
+                END IF;
+                IF TG_OP IN ('INSERT', 'UPDATE') AND NEW.estado = 'Completada' THEN
+                    IF NEW.tipo_transaccion = 'Depósito' THEN d_depositos := d_depositos + NEW.monto; END IF;
+                    IF NEW.tipo_transaccion = 'Retiro' THEN d_retiros := d_retiros + NEW.monto; END IF;
+                END IF;
+                PERFORM fn_sumar_contador_admin('depositos', d_depositos);
+                PERFORM fn_sumar_contador_admin('retiros', d_retiros);
+                RETURN NULL;
+            END $$ LANGUAGE plpgsql;
+        """, {"shards": ADMIN_STATS_SHARDS})
+
+        cursor.execute("SELECT 1 FROM pg_trigger WHERE tgname = 'contador_admin_usuario'")
+        triggers_creados = cursor.fetchone() is not None
+        cursor.execute("SELECT 1 FROM Contador_Admin LIMIT 1")
+        sembrado = cursor.fetchone() is not None
+        if triggers_creados and not sembrado:
+            # Triggers creados desde database_schema.sql sobre una BD con datos
+            cursor.execute("LOCK TABLE Usuario, Transaccion IN SHARE MODE")
+            _sembrar(cursor)
+        elif not triggers_creados:
+            cursor.execute("LOCK TABLE Usuario, Transaccion IN SHARE MODE")
+            cursor.execute("""
+                CREATE TRIGGER contador_admin_usuario
+                    AFTER INSERT OR DELETE OR UPDATE OF id_rol, activo ON Usuario
+                    FOR EACH ROW EXECUTE FUNCTION trg_contador_admin_usuario();
+                CREATE TRIGGER contador_admin_transaccion
+                    AFTER INSERT OR DELETE OR UPDATE OF tipo_transaccion, monto, estado ON Transaccion
+                    FOR EACH ROW EXECUTE FUNCTION trg_contador_admin_transaccion();
+            """)
+            _sembrar(cursor)
+        conn.commit()
+        cursor.close()
+    except Exception as e:
+        print(f"Error creating Contador_Admin counters: {e}")
+    finally:
+        if conn: conn.close()
+
+
+def _sembrar(cursor):
+    """Reemplaza los contadores por el agregado completo (mismo snapshot de la transacción)."""
+    cursor.execute(AGREGADO_SQL)
+    row = cursor.fetchone()
+    cursor.execute("DELETE FROM Contador_Admin")
+    for clave, valor in zip(CONTADORES, row):
+        cursor.execute(
+            "INSERT INTO Contador_Admin (clave, shard, valor) VALUES (%s, 0, %s)",
+            (clave, valor)
+        )
+
+
+class AdminStats:
+    """
+    Snapshot cacheado de las estadísticas del dashboard del admin.
+    Lee los contadores (unas pocas filas) y, si no están disponibles, hace un único
+    agregado combinado sobre Usuario y Transaccion.
+    """
+
+    def __init__(self, ttl: int = ADMIN_STATS_TTL_SECONDS):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._snapshot = None
+        self._loaded_at = 0.0
+
+    def invalidate(self):
+        with self._lock:
+            self._loaded_at = 0.0
+
+    def _load(self) -> dict:
+        conn = db_connect.get_connection()
+        if conn is None:
+            raise RuntimeError("Error de conexión")
+        try:
+            cursor = conn.cursor()
+            fuente = "contadores"
+            try:
+                cursor.execute("SELECT clave, SUM(valor) FROM Contador_Admin GROUP BY clave")
+                valores = dict(cursor.fetchall())
+            except Exception as e:
+                conn.rollback()
+                print(f"⚠️ Estadísticas admin: contadores no disponibles ({e})")
+                valores = {}
+            if set(valores) != set(CONTADORES):
+                fuente = "agregado"
+                cursor.execute(AGREGADO_SQL)
+                valores = dict(zip(CONTADORES, cursor.fetchone()))
+            cursor.close()
+        finally:
+            conn.close()
+
+        stats = {CONTADORES[clave]: valores[clave] for clave in CONTADORES}
+        return {
+            "total_users": int(stats["total_users"]),
+            "active_users": int(stats["active_users"]),
+            "total_deposits": float(stats["total_deposits"]),
+            "total_withdrawals": float(stats["total_withdrawals"]),
+            "actualizado": datetime.now().isoformat(timespec="seconds"),
+            "fuente": fuente,
+        }
+
+    def get(self) -> dict:
+        if self._snapshot is None or (time.monotonic() - self._loaded_at) > self.ttl:
+            snapshot = self._load()
+            with self._lock:
+                self._snapshot = snapshot
+                self._loaded_at = time.monotonic()
+        return self._snapshot
+
+    def rebuild(self):
+        """Resincroniza los contadores con el agregado completo (mantenimiento)."""
+        conn = db_connect.get_connection()
+        if conn is None:
+            raise RuntimeError("Error de conexión")
+        try:
+            cursor = conn.cursor()
+            cursor.execute("LOCK TABLE Usuario, Transaccion IN SHARE MODE")
+            _sembrar(cursor)
+            conn.commit()
+            cursor.close()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
+        self.invalidate()
+
+
+admin_stats = AdminStats()
@@ -0,0 +1,260 @@
+import threading
+import time
+from datetime import datetime
+from app.db import db_connect
+
+# Cada cuánto se relee el snapshot (uno por worker, compartido por todos los agentes)
+AGENT_STATS_TTL_SECONDS = 5
+
+# Filas por contador: 'pendientes' lo tocan todos los tickets nuevos, así que los
+# triggers suman en una fila al azar para no serializar las inserciones
+AGENT_STATS_SHARDS = 4
+
+# Los contadores que no son por día usan esta fecha
+SIN_DIA = "infinity"
+
+# Contadores por día que se conservan (solo se lee el de hoy)
+AGENT_STATS_DIAS_RETENCION = 7
+
+# Claves en Contador_Agente:
+#   pendientes (id_agente 0): tickets 'Abierto' sin agente
+#   asignados  (por agente):  tickets del agente no cerrados
+#   cerrados   (por agente y día de fecha_cierre): tickets cerrados
+CONTADORES_AGENTE = """
+    CREATE TABLE IF NOT EXISTS Contador_Agente (
+        clave VARCHAR(20) NOT NULL,
+        id_agente INTEGER NOT NULL,
+        dia DATE NOT NULL,
+        shard SMALLINT NOT NULL,
+        valor INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (clave, id_agente, dia, shard)
+    );
+    CREATE INDEX IF NOT EXISTS idx_soporte_cerrado_fecha ON Soporte (fecha_cierre) WHERE estado = 'Cerrado';
+
+    CREATE OR REPLACE FUNCTION fn_sumar_contador_agente(p_clave TEXT, p_agente INTEGER, p_dia DATE, p_delta INTEGER)
+    RETURNS void AS $$
+    BEGIN
+        IF p_delta <> 0 THEN
+            INSERT INTO Contador_Agente (clave, id_agente, dia, shard, valor)
+            VALUES (p_clave, p_agente, p_dia, floor(random() * %(shards)s)::smallint, p_delta)
+            ON CONFLICT (clave, id_agente, dia, shard) DO UPDATE SET valor = Contador_Agente.valor + EXCLUDED.valor;
+        END IF;
+    END $$ LANGUAGE plpgsql;
+
+    CREATE OR REPLACE FUNCTION trg_contador_agente_soporte() RETURNS trigger AS $$
+    BEGIN
+        IF TG_OP IN ('UPDATE', 'DELETE') THEN
+            IF OLD.estado = 'Abierto' AND OLD.id_agente IS NULL THEN
+                PERFORM fn_sumar_contador_agente('pendientes', 0, 'infinity', -1);
+            END IF;
+            IF OLD.id_agente IS NOT NULL AND OLD.estado <> 'Cerrado' THEN
+                PERFORM fn_sumar_contador_agente('asignados', OLD.id_agente, 'infinity', -1);
+            END IF;
+            IF OLD.id_agente IS NOT NULL AND OLD.estado = 'Cerrado' AND OLD.fecha_cierre IS NOT NULL THEN
+                PERFORM fn_sumar_contador_agente('cerrados', OLD.id_agente, OLD.fecha_cierre::date, -1);
+            END IF;
+        END IF;
+        IF TG_OP IN ('INSERT', 'UPDATE') THEN
+            IF NEW.estado = 'Abierto' AND NEW.id_agente IS NULL THEN
+                PERFORM fn_sumar_contador_agente('pendientes', 0, 'infinity', 1);
+            END IF;
+            IF NEW.id_agente IS NOT NULL AND NEW.estado <> 'Cerrado' THEN
+                PERFORM fn_sumar_contador_agente('asignados', NEW.id_agente, 'infinity', 1);
+            END IF;
+            IF NEW.id_agente IS NOT NULL AND NEW.estado = 'Cerrado' AND NEW.fecha_cierre IS NOT NULL THEN
+                PERFORM fn_sumar_contador_agente('cerrados', NEW.id_agente, NEW.fecha_cierre::date, 1);
+            END IF;
+        END IF;
+        RETURN NULL;
+    END $$ LANGUAGE plpgsql;
+"""
+
+# Respaldo en frío: UN agregado para todos los agentes. Los dos lados del OR son
+# rangos de índices parciales (idx_soporte_abierto_fecha e idx_soporte_cerrado_fecha);
+# "cerrado hoy" es fecha_cierre >= CURRENT_DATE, no DATE(fecha_cierre) = ...
+AGREGADO_SQL = """
+    SELECT id_agente,
+           COUNT(*) FILTER (WHERE estado = 'Abierto') AS abiertos,
+           COUNT(*) FILTER (WHERE estado <> 'Cerrado') AS asignados,
+           COUNT(*) FILTER (WHERE estado = 'Cerrado') AS cerrados_hoy
+    FROM Soporte
+    WHERE estado IN ('Abierto', 'En Proceso')
+       OR (estado = 'Cerrado' AND fecha_cierre >= CURRENT_DATE)
+    GROUP BY id_agente
+"""
+
+SEMBRAR_SQL = """
+    INSERT INTO Contador_Agente (clave, id_agente, dia, shard, valor)
+    SELECT 'pendientes', 0, 'infinity'::date, 0, COUNT(*)
+    FROM Soporte WHERE estado = 'Abierto' AND id_agente IS NULL
+    UNION ALL
+    SELECT 'asignados', id_agente, 'infinity'::date, 0, COUNT(*)
+    FROM Soporte WHERE id_agente IS NOT NULL AND estado <> 'Cerrado'
+    GROUP BY id_agente
+    UNION ALL
+    SELECT 'cerrados', id_agente, fecha_cierre::date, 0, COUNT(*)
+    FROM Soporte WHERE id_agente IS NOT NULL AND estado = 'Cerrado' AND fecha_cierre >= CURRENT_DATE
+    GROUP BY id_agente, fecha_cierre::date
+"""
+
+
+def ensure_agent_stats_counters():
+    """
+    Crea Contador_Agente y el trigger de Soporte que la mantiene al día.
+    La primera vez siembra los contadores bajo lock de Soporte, para que ningún
+    cambio quede entre la siembra y el trigger.
+    """
+    conn = None
+    try:
+        conn = db_connect.get_connection()
+        cursor = conn.cursor()
+        cursor.execute(CONTADORES_AGENTE, {"shards": AGENT_STATS_SHARDS})
+
+        cursor.execute("SELECT 1 FROM pg_trigger WHERE tgname = 'contador_agente_soporte'")
+        trigger_creado = cursor.fetchone() is not None
+        cursor.execute("SELECT 1 FROM Contador_Agente WHERE clave = 'pendientes' LIMIT 1")
+        sembrado = cursor.fetchone() is not None
+        if trigger_creado and not sembrado:
+            # Trigger creado desde database_schema.sql sobre una BD con datos
+            cursor.execute("LOCK TABLE Soporte IN SHARE MODE")
+            _sembrar(cursor)
+        elif not trigger_creado:
+            cursor.execute("LOCK TABLE Soporte IN SHARE MODE")
+            cursor.execute("""
+                CREATE TRIGGER contador_agente_soporte
+                    AFTER INSERT OR DELETE OR UPDATE OF estado, id_agente, fecha_cierre ON Soporte
+                    FOR EACH ROW EXECUTE FUNCTION trg_contador_agente_soporte();
+            """)
+            _sembrar(cursor)
+        conn.commit()
+        cursor.close()
+    except Exception as e:
+        print(f"Error creating Contador_Agente counters: {e}")
+    finally:
+        if conn: conn.close()
+
+
+def _sembrar(cursor):
+    """Reemplaza los contadores por el estado actual de Soporte (mismo snapshot de la transacción)."""
+    cursor.execute("DELETE FROM Contador_Agente")
+    cursor.execute(SEMBRAR_SQL)
+
+
+def lote_contadores_agente_viejos(cursor, lote: int) -> int:
+    """Filas de 'cerrados' de días que ya no se muestran (para el barrido de mantenimiento)."""
+    cursor.execute(
+        """
+        DELETE FROM Contador_Agente c
+        USING (
+            SELECT clave, id_agente, dia, shard FROM Contador_Agente
+            WHERE dia < CURRENT_DATE - %s
+            LIMIT %s
+        ) v
+        WHERE c.clave = v.clave AND c.id_agente = v.id_agente AND c.dia = v.dia AND c.shard = v.shard
+        """,
+        (AGENT_STATS_DIAS_RETENCION, lote)
+    )
+    return cursor.rowcount
+
+
+class AgentStats:
+    """
+    Snapshot cacheado de los contadores del dashboard de TODOS los agentes.
+    Una lectura de Contador_Agente (pocas filas) sirve a cualquier agente durante
+    AGENT_STATS_TTL_SECONDS; si los contadores no están, un único agregado sobre
+    Soporte con el mismo resultado.
+    """
+
+    def __init__(self, ttl: int = AGENT_STATS_TTL_SECONDS):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._snapshot = None
+        self._loaded_at = 0.0
+
+    def invalidate(self):
+        with self._lock:
+            self._loaded_at = 0.0
+
+    def _load(self) -> dict:
+        conn = db_connect.get_connection()
+        if conn is None:
+            raise RuntimeError("Error de conexión")
+        pendientes, asignados, cerrados = None, {}, {}
+        try:
+            cursor = conn.cursor()
+            fuente = "contadores"
+            try:
+                cursor.execute(
+                    """
+                    SELECT clave, id_agente, SUM(valor) FROM Contador_Agente
+                    WHERE dia = 'infinity' OR dia = CURRENT_DATE
+                    GROUP BY clave, id_agente
+                    """
+                )
+                for clave, id_agente, valor in cursor.fetchall():
+                    if clave == "pendientes":
+                        pendientes = int(valor)
+                    elif clave == "asignados":
+                        asignados[id_agente] = int(valor)
+                    elif clave == "cerrados":
+                        cerrados[id_agente] = int(valor)
+            except Exception as e:
+                conn.rollback()
+                print(f"⚠️ Dashboard agentes: contadores no disponibles ({e})")
+            if pendientes is None:
+                fuente = "agregado"
+                pendientes, asignados, cerrados = 0, {}, {}
+                cursor.execute(AGREGADO_SQL)
+                for id_agente, abiertos, total_asignados, cerrados_hoy in cursor.fetchall():
+                    if id_agente is None:
+                        pendientes = int(abiertos)
+                    else:
+                        asignados[id_agente] = int(total_asignados)
+                        cerrados[id_agente] = int(cerrados_hoy)
+            cursor.close()
+        finally:
+            conn.close()
+
+        return {
+            "pendientes": pendientes, "asignados": asignados, "cerrados_hoy": cerrados,
+            "actualizado": datetime.now().isoformat(timespec="seconds"), "fuente": fuente,
+        }
+
+    def get(self) -> dict:
+        if self._snapshot is None or (time.monotonic() - self._loaded_at) > self.ttl:
+            snapshot = self._load()
+            with self._lock:
+                self._snapshot = snapshot
+                self._loaded_at = time.monotonic()
+        return self._snapshot
+
+    def dashboard(self, id_agente: int) -> dict:
+        """Las tres cifras del dashboard de un agente, del snapshot compartido."""
+        snapshot = self.get()
+        return {
+            "tickets_pendientes": snapshot["pendientes"],
+            "mis_tickets": snapshot["asignados"].get(id_agente, 0),
+            "cerrados_hoy": snapshot["cerrados_hoy"].get(id_agente, 0),
+            "actualizado": snapshot["actualizado"],
+        }
+
+    def rebuild(self):
+        """Resincroniza los contadores con el estado actual de Soporte (mantenimiento)."""
+        conn = db_connect.get_connection()
+        if conn is None:
+            raise RuntimeError("Error de conexión")
+        try:
+            cursor = conn.cursor()
+            cursor.execute("LOCK TABLE Soporte IN SHARE MODE")
+            _sembrar(cursor)
+            conn.commit()
+            cursor.close()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
+        self.invalidate()
+
+
+agent_stats = AgentStats()
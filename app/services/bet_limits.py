@@ -0,0 +1,138 @@
+import threading
+import time
+from psycopg2.extras import RealDictCursor
+from app.db import db_connect
+from app.services.game_catalog import catalog as game_catalog
+
+# Los overrides por usuario cambian muy poco; se recargan completos cada TTL
+# o al instante cuando el admin los modifica en este worker.
+OVERRIDES_TTL_SECONDS = 60
+
+
+def ensure_limits_table():
+    """Crea la tabla Limite_Apuesta_Usuario si no existe."""
+    conn = None
+    try:
+        conn = db_connect.get_connection()
+        cursor = conn.cursor()
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS Limite_Apuesta_Usuario (
+                id_limite SERIAL PRIMARY KEY,
+                id_usuario INTEGER NOT NULL REFERENCES Usuario(id_usuario) ON DELETE CASCADE,
+                id_juego INTEGER REFERENCES Juego(id_juego) ON DELETE CASCADE,
+                min_apuesta NUMERIC(8, 2),
+                max_apuesta NUMERIC(8, 2),
+                motivo VARCHAR(50),
+                fecha_actualizacion TIMESTAMP WITHOUT TIME ZONE NOT NULL DEFAULT NOW()
+            );
+            CREATE UNIQUE INDEX IF NOT EXISTS idx_limite_usuario_juego
+                ON Limite_Apuesta_Usuario (id_usuario, COALESCE(id_juego, 0));
+        """)
+        conn.commit()
+        cursor.close()
+    except Exception as e:
+        print(f"Error creating Limite_Apuesta_Usuario table: {e}")
+    finally:
+        if conn: conn.close()
+
+
+class BetLimits:
+    """
+    Valida apuestas contra los límites del juego (catálogo en memoria) y los
+    overrides por usuario (VIP, juego responsable), sin consultar la BD por apuesta.
+    """
+
+    def __init__(self, ttl: int = OVERRIDES_TTL_SECONDS):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        # {id_usuario: {id_juego | None: {"min": float | None, "max": float | None, "motivo": str}}}
+        self._overrides = {}
+        self._loaded_at = 0.0
+        self._stale = True
+
+    def invalidate(self):
+        with self._lock:
+            self._stale = True
+
+    def _load(self):
+        conn = db_connect.get_connection()
+        if conn is None:
+            raise RuntimeError("Error de conexión")
+        try:
+            cursor = conn.cursor(cursor_factory=RealDictCursor)
+            cursor.execute(
+                "SELECT id_usuario, id_juego, min_apuesta, max_apuesta, motivo FROM Limite_Apuesta_Usuario"
+            )
+            rows = cursor.fetchall()
+            cursor.close()
+        finally:
+            conn.close()
+
+        overrides = {}
+        for row in rows:
+            overrides.setdefault(row["id_usuario"], {})[row["id_juego"]] = {
+                "min": float(row["min_apuesta"]) if row["min_apuesta"] is not None else None,
+                "max": float(row["max_apuesta"]) if row["max_apuesta"] is not None else None,
+                "motivo": row["motivo"],
+            }
+        with self._lock:
+            self._overrides = overrides
+            self._loaded_at = time.monotonic()
+            self._stale = False
+
+    def _ensure_fresh(self):
+        if self._stale or (time.monotonic() - self._loaded_at) > self.ttl:
+            try:
+                self._load()
+            except Exception as e:
+                # Sin overrides cargados seguimos validando con los límites del juego
+                print(f"⚠️ Límites de apuesta: no se pudieron recargar overrides ({e})")
+                with self._lock:
+                    self._loaded_at = time.monotonic()
+
+    def get_limits(self, user_id: int, game_slug: str):
+        """
+        Retorna (juego, min, max) efectivos para el usuario.
+        Prioridad: override del juego > override global del usuario > límites del juego.
+        """
+        try:
+            game = game_catalog.get_by_slug(game_slug)
+        except Exception as e:
+            print(f"⚠️ Límites de apuesta: catálogo no disponible ({e})")
+            game = None
+        min_bet = float(game["min_apuesta"]) if game else None
+        max_bet = float(game["max_apuesta"]) if game else None
+
+        self._ensure_fresh()
+        user_overrides = self._overrides.get(int(user_id), {})
+        game_override = user_overrides.get(game["id_juego"]) if game else None
+        for override in (user_overrides.get(None), game_override):
+            if override:
+                if override["min"] is not None:
+                    min_bet = override["min"]
+                if override["max"] is not None:
+                    max_bet = override["max"]
+        return game, min_bet, max_bet
+
+    def check(self, user_id: int, game_slug: str, amount: float, check_min: bool = True):
+        """
+        Valida una apuesta. Retorna None si es válida o el mensaje de error.
+        check_min=False sirve para apuestas que se acumulan por fichas (blackjack)
+        y cuyo mínimo se valida al repartir.
+        """
+        game, min_bet, max_bet = self.get_limits(user_id, game_slug)
+        if game is None:
+            # Sin el juego no hay límites que aplicar: se rechaza en vez de dejar
+            # pasar una apuesta sin máximo
+            print(f"⛔ Límites de apuesta: juego '{game_slug}' no encontrado en el catálogo, apuesta rechazada")
+            return "Este juego no está disponible en este momento"
+        if not game["activo"]:
+            return "Este juego no está disponible en este momento"
+        if check_min and min_bet is not None and amount < min_bet:
+            return f"La apuesta mínima es ${min_bet:.2f}"
+        if max_bet is not None and amount > max_bet:
+            return f"La apuesta máxima es ${max_bet:.2f}"
+        return None
+
+
+bet_limits = BetLimits()
@@ -0,0 +1,411 @@
+import threading
+import time
+from datetime import date, datetime
+from app.db import db_connect
+from app.services.game_catalog import catalog as game_catalog
+
+# Tiempo máximo que se sirve el catálogo de bonos sin recargarlo (los demás workers
+# no reciben la invalidación del admin)
+BONUS_CATALOG_TTL_SECONDS = 60
+
+# Tiempo que se confía en el perfil de bonos de un usuario (reclamados, depósitos)
+BONUS_PROFILE_TTL_SECONDS = 60
+
+# Tope de perfiles en memoria; al llenarse se descartan los más viejos
+BONUS_PROFILE_MAX_USERS = 20_000
+
+# Columnas de segmentación de Bono. Todas opcionales (NULL = sin restricción) y se
+# combinan con AND.
+COLUMNAS_BONO = """
+    ALTER TABLE Bono ADD COLUMN IF NOT EXISTS valor NUMERIC(10, 2) NOT NULL DEFAULT 0;
+    ALTER TABLE Bono ADD COLUMN IF NOT EXISTS requisito_apuesta NUMERIC(10, 2) NOT NULL DEFAULT 0;
+    ALTER TABLE Bono ADD COLUMN IF NOT EXISTS solo_nuevos_dias INTEGER;
+    ALTER TABLE Bono ADD COLUMN IF NOT EXISTS deposito_minimo NUMERIC(10, 2);
+    ALTER TABLE Bono ADD COLUMN IF NOT EXISTS id_juego INTEGER REFERENCES Juego(id_juego) ON DELETE SET NULL;
+"""
+
+# Todo lo que hace falta para evaluar las reglas de un usuario, en una consulta
+PERFIL_SQL = """
+    SELECT u.fecha_registro,
+           (SELECT COALESCE(MAX(t.monto), 0) FROM Transaccion t
+            WHERE t.id_usuario = u.id_usuario AND t.tipo_transaccion = 'Depósito' AND t.estado = 'Completada'),
+           ARRAY(SELECT ub.id_bono FROM Usuario_Bono ub WHERE ub.id_usuario = u.id_usuario)
+    FROM Usuario u
+    WHERE u.id_usuario = %s
+"""
+
+# Reclamo en un solo statement: solo inserta si el bono está vigente y el usuario cumple
+# las mismas reglas que elegible(); la llave primaria (id_usuario, id_bono) hace que dos
+# reclamos simultáneos no puedan crear dos filas (el segundo no inserta nada).
+RECLAMO_SQL = """
+    INSERT INTO Usuario_Bono (id_usuario, id_bono, fecha_adquisicion, estado, progreso)
+    SELECT u.id_usuario, b.id_bono, NOW(), 'Activo', 0.00
+    FROM Bono b
+    JOIN Usuario u ON u.id_usuario = %(id_usuario)s
+    WHERE b.id_bono = %(id_bono)s
+      AND b.activo = true
+      AND (b.fecha_expiracion IS NULL OR b.fecha_expiracion > CURRENT_DATE)
+      AND (b.solo_nuevos_dias IS NULL OR u.fecha_registro::date >= CURRENT_DATE - b.solo_nuevos_dias)
+      AND (b.deposito_minimo IS NULL OR EXISTS (
+            SELECT 1 FROM Transaccion t
+            WHERE t.id_usuario = u.id_usuario AND t.tipo_transaccion = 'Depósito'
+              AND t.estado = 'Completada' AND t.monto >= b.deposito_minimo))
+      AND (b.id_juego IS NULL OR EXISTS (
+            SELECT 1 FROM Juego j WHERE j.id_juego = b.id_juego AND j.activo = true))
+    ON CONFLICT (id_usuario, id_bono) DO NOTHING
+    RETURNING id_bono
+"""
+
+# Resultados de reclamar_bono()
+RECLAMADO = "reclamado"
+YA_RECLAMADO = "ya_reclamado"
+NO_ELEGIBLE = "no_elegible"
+
+
+def ensure_bonus_columns():
+    """Agrega a Bono el valor, el requisito de apuesta y las columnas de segmentación."""
+    conn = None
+    try:
+        conn = db_connect.get_connection()
+        cursor = conn.cursor()
+        cursor.execute(COLUMNAS_BONO)
+        conn.commit()
+        cursor.close()
+    except Exception as e:
+        print(f"Error adding Bono targeting columns: {e}")
+    finally:
+        if conn: conn.close()
+
+
+def reclamar_bono(cursor, id_usuario: int, id_bono: int) -> str:
+    """
+    Reclama el bono de forma atómica (RECLAMO_SQL). Si no se insertó nada, una
+    lectura aparte solo distingue el motivo para el mensaje. El llamador hace commit.
+    """
+    cursor.execute(RECLAMO_SQL, {"id_usuario": id_usuario, "id_bono": id_bono})
+    if cursor.fetchone():
+        return RECLAMADO
+    cursor.execute(
+        "SELECT 1 FROM Usuario_Bono WHERE id_usuario = %s AND id_bono = %s",
+        (id_usuario, id_bono)
+    )
+    return YA_RECLAMADO if cursor.fetchone() else NO_ELEGIBLE
+
+
+class ReglaBono:
+    """Un bono activo del catálogo, con sus condiciones ya convertidas a tipos de Python."""
+
+    __slots__ = ("id_bono", "vence", "nuevos_dias", "deposito_minimo", "id_juego", "publico")
+
+    def __init__(self, row: dict):
+        self.id_bono = row["id_bono"]
+        self.vence = row.get("fecha_expiracion")
+        self.nuevos_dias = row.get("solo_nuevos_dias")
+        self.deposito_minimo = float(row["deposito_minimo"]) if row.get("deposito_minimo") is not None else None
+        self.id_juego = row.get("id_juego")
+        # Lo que ve el jugador en 'account-bonos.html'
+        self.publico = {
+            "id_bono": row["id_bono"],
+            "nombre_bono": row["nombre_bono"],
+            "tipo": row["tipo"],
+            "descripcion": row.get("descripcion"),
+            "valor": float(row.get("valor") or 0),
+            "requisito_apuesta": float(row.get("requisito_apuesta") or 0),
+            "id_juego": row.get("id_juego"),
+        }
+
+
+class PerfilBono:
+    """Datos del usuario que usan las reglas: antigüedad, mayor depósito y bonos ya reclamados."""
+
+    __slots__ = ("registro", "deposito_maximo", "reclamados")
+
+    def __init__(self, fecha_registro, deposito_maximo, reclamados):
+        self.registro = fecha_registro.date() if isinstance(fecha_registro, datetime) else fecha_registro
+        self.deposito_maximo = float(deposito_maximo or 0)
+        self.reclamados = set(reclamados or ())
+
+
+def elegible(regla: ReglaBono, perfil: PerfilBono, hoy: date, juegos_activos) -> bool:
+    """Evalúa las reglas de un bono para un usuario, sin consultas."""
+    if regla.id_bono in perfil.reclamados:
+        return False
+    # Mismo criterio que antes en SQL: fecha_expiracion > NOW()
+    if regla.vence is not None and regla.vence <= hoy:
+        return False
+    if regla.nuevos_dias is not None and (perfil.registro is None or (hoy - perfil.registro).days > regla.nuevos_dias):
+        return False
+    if regla.deposito_minimo is not None and perfil.deposito_maximo < regla.deposito_minimo:
+        return False
+    if regla.id_juego is not None and regla.id_juego not in juegos_activos:
+        return False
+    return True
+
+
+class BonusEngine:
+    """
+    Elegibilidad de bonos en memoria.
+
+    Guarda el catálogo de bonos activos y, por usuario, un perfil (bonos reclamados,
+    fecha de registro, mayor depósito) junto con la lista de disponibles ya calculada
+    para la versión actual del catálogo. Se invalida al reclamar, al depositar y
+    cuando el admin cambia los bonos.
+    """
+
+    def __init__(self, ttl: int = BONUS_CATALOG_TTL_SECONDS, profile_ttl: int = BONUS_PROFILE_TTL_SECONDS,
+                 max_users: int = BONUS_PROFILE_MAX_USERS):
+        self.ttl = ttl
+        self.profile_ttl = profile_ttl
+        self.max_users = max_users
+        self._lock = threading.Lock()
+        self._reglas = []
+        self._por_id = {}
+        self._version = 0
+        self._loaded_at = 0.0
+        self._stale = True
+        # {id_usuario: [cargado_en, PerfilBono, (version, hoy), disponibles]}
+        self._perfiles = {}
+        self._metrics = {"hits": 0, "profile_loads": 0, "evaluations": 0, "catalog_loads": 0}
+
+    # ------------------------------------------------------------------
+    #  Catálogo
+    # ------------------------------------------------------------------
+    def invalidate_catalog(self):
+        with self._lock:
+            self._stale = True
+
+    def _load_catalog(self):
+        conn = db_connect.get_connection()
+        if conn is None:
+            raise RuntimeError("Error de conexión")
+        try:
+            cursor = conn.cursor()
+            cursor.execute(
+                """
+                SELECT id_bono, nombre_bono, tipo, descripcion, fecha_expiracion, valor,
+                       requisito_apuesta, solo_nuevos_dias, deposito_minimo, id_juego
+                FROM Bono
+                WHERE activo = true
+                ORDER BY id_bono
+                """
+            )
+            columnas = [c[0] for c in cursor.description]
+            reglas = [ReglaBono(dict(zip(columnas, row))) for row in cursor.fetchall()]
+            cursor.close()
+        finally:
+            conn.close()
+        with self._lock:
+            self._reglas = reglas
+            self._por_id = {r.id_bono: r for r in reglas}
+            self._version += 1
+            self._loaded_at = time.monotonic()
+            self._stale = False
+            self._metrics["catalog_loads"] += 1
+
+    def _ensure_catalog(self):
+        if self._stale or (time.monotonic() - self._loaded_at) > self.ttl:
+            try:
+                self._load_catalog()
+            except Exception as e:
+                if self._version == 0:
+                    raise
+                print(f"⚠️ Bonos: no se pudo recargar el catálogo ({e}), usando versión {self._version}")
+
+    def get_rule(self, id_bono: int):
+        self._ensure_catalog()
+        return self._por_id.get(id_bono)
+
+    # ------------------------------------------------------------------
+    #  Perfiles por usuario
+    # ------------------------------------------------------------------
+    def invalidate_user(self, id_usuario: int):
+        with self._lock:
+            self._perfiles.pop(int(id_usuario), None)
+
+    def mark_claimed(self, id_usuario: int, id_bono: int):
+        """Tras un reclamo exitoso: el bono deja de estar disponible sin releer el perfil."""
+        with self._lock:
+            entry = self._perfiles.get(int(id_usuario))
+            if entry is not None:
+                entry[1].reclamados.add(id_bono)
+                entry[2] = None
+
+    def _load_profile(self, id_usuario: int):
+        conn = db_connect.get_connection()
+        if conn is None:
+            raise RuntimeError("Error de conexión")
+        try:
+            cursor = conn.cursor()
+            cursor.execute(PERFIL_SQL, (id_usuario,))
+            row = cursor.fetchone()
+            cursor.close()
+        finally:
+            conn.close()
+        self._metrics["profile_loads"] += 1
+        return PerfilBono(*row) if row else None
+
+    def _profile_entry(self, id_usuario: int):
+        now = time.monotonic()
+        entry = self._perfiles.get(id_usuario)
+        if entry is not None and now - entry[0] <= self.profile_ttl:
+            return entry
+        perfil = self._load_profile(id_usuario)
+        if perfil is None:
+            return None
+        entry = [now, perfil, None, None]
+        with self._lock:
+            if len(self._perfiles) >= self.max_users:
+                oldest = sorted(self._perfiles, key=lambda k: self._perfiles[k][0])[: self.max_users // 10 or 1]
+                for key in oldest:
+                    del self._perfiles[key]
+            self._perfiles[id_usuario] = entry
+        return entry
+
+    # ------------------------------------------------------------------
+    #  Evaluación
+    # ------------------------------------------------------------------
+    def _juegos_activos(self, reglas) -> set:
+        if not any(r.id_juego is not None for r in reglas):
+            return set()
+        juegos, _ = game_catalog.get_games(only_active=True)
+        return {g["id_juego"] for g in juegos}
+
+    def evaluate(self, reglas, perfil: PerfilBono, hoy: date, juegos_activos) -> list:
+        self._metrics["evaluations"] += len(reglas)
+        return [r.publico for r in reglas if elegible(r, perfil, hoy, juegos_activos)]
+
+    def available(self, id_usuario: int) -> list:
+        """Bonos que el usuario puede reclamar hoy (lista vacía si el usuario no existe)."""
+        id_usuario = int(id_usuario)
+        self._ensure_catalog()
+        entry = self._profile_entry(id_usuario)
+        if entry is None:
+            return []
+        hoy = date.today()
+        clave = (self._version, hoy)
+        if entry[2] == clave:
+            self._metrics["hits"] += 1
+            return entry[3]
+        reglas = self._reglas
+        disponibles = self.evaluate(reglas, entry[1], hoy, self._juegos_activos(reglas))
+        entry[2], entry[3] = clave, disponibles
+        return disponibles
+
+    def is_eligible(self, id_usuario: int, id_bono: int) -> bool:
+        return any(b["id_bono"] == id_bono for b in self.available(id_usuario))
+
+    def stats(self) -> dict:
+        return {
+            **self._metrics,
+            "catalog_version": self._version,
+            "active_bonuses": len(self._reglas),
+            "profiles_cached": len(self._perfiles),
+        }
+
+
+bonus_engine = BonusEngine()
+
+
+def benchmark_reclamos(hilos: int = 32, usuarios: int = 200, intentos_por_usuario: int = 8):
+    """
+    Reclamos concurrentes contra la BD real: cada usuario reclama el mismo bono
+    `intentos_por_usuario` veces desde hilos distintos. Debe haber exactamente un
+    RECLAMADO y una fila por usuario. Usa un bono temporal que se borra al final.
+    """
+    import random
+    from concurrent.futures import ThreadPoolExecutor
+
+    conn = db_connect.get_connection()
+    if conn is None:
+        print("⛔ Sin conexión a la BD: el benchmark de reclamos necesita Postgres.")
+        return
+    cursor = conn.cursor()
+    cursor.execute("SELECT id_usuario FROM Usuario ORDER BY id_usuario LIMIT %s", (usuarios,))
+    ids = [row[0] for row in cursor.fetchall()]
+    cursor.execute(
+        "INSERT INTO Bono (nombre_bono, tipo, descripcion, activo) "
+        "VALUES ('Benchmark reclamos', 'Benchmark', 'Temporal', true) RETURNING id_bono"
+    )
+    id_bono = cursor.fetchone()[0]
+    conn.commit()
+
+    intentos = [u for u in ids for _ in range(intentos_por_usuario)]
+    random.shuffle(intentos)
+
+    def reclamar(id_usuario):
+        c = db_connect.get_connection()
+        try:
+            cur = c.cursor()
+            resultado = reclamar_bono(cur, id_usuario, id_bono)
+            c.commit()
+            return id_usuario, resultado
+        finally:
+            c.close()
+
+    try:
+        t0 = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=hilos) as pool:
+            resultados = list(pool.map(reclamar, intentos))
+        elapsed = time.perf_counter() - t0
+
+        ganados = {}
+        for id_usuario, resultado in resultados:
+            if resultado == RECLAMADO:
+                ganados[id_usuario] = ganados.get(id_usuario, 0) + 1
+        cursor.execute("SELECT COUNT(*) FROM Usuario_Bono WHERE id_bono = %s", (id_bono,))
+        filas = cursor.fetchone()[0]
+        correcto = filas == len(ids) and all(ganados.get(u) == 1 for u in ids)
+        print(f"{len(intentos)} reclamos ({len(ids)} usuarios x {intentos_por_usuario}, {hilos} hilos): "
+              f"{elapsed:.2f}s -> {len(intentos) / elapsed:.0f} reclamos/s")
+        print(f"Filas en Usuario_Bono: {filas} | {'✅ sin duplicados' if correcto else '🚨 DUPLICADOS O FALTANTES'}")
+    finally:
+        cursor.execute("DELETE FROM Bono WHERE id_bono = %s", (id_bono,))
+        conn.commit()
+        cursor.close()
+        conn.close()
+
+
+# ======== Benchmark (python -m app.services.bonus_engine [--reclamos]) =========
+if __name__ == "__main__":
+    import random
+    import sys
+    from datetime import timedelta
+
+    if "--reclamos" in sys.argv:
+        benchmark_reclamos()
+        sys.exit(0)
+
+    n_reglas = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    n_usuarios = int(sys.argv[2]) if len(sys.argv) > 2 else 50_000
+    rnd = random.Random(7)
+    hoy = date.today()
+
+    reglas = [
+        ReglaBono({
+            "id_bono": i, "nombre_bono": f"Bono {i}", "tipo": "Promo", "descripcion": "",
+            "fecha_expiracion": hoy + timedelta(days=rnd.randint(-5, 60)) if rnd.random() < 0.5 else None,
+            "valor": 100, "requisito_apuesta": 10,
+            "solo_nuevos_dias": rnd.choice([None, None, 7, 30]),
+            "deposito_minimo": rnd.choice([None, None, 100, 500, 1000]),
+            "id_juego": rnd.choice([None, None, None, 1, 2, 3]),
+        })
+        for i in range(1, n_reglas + 1)
+    ]
+    perfiles = [
+        PerfilBono(
+            hoy - timedelta(days=rnd.randint(0, 400)),
+            rnd.choice([0, 50, 200, 800, 5000]),
+            rnd.sample(range(1, n_reglas + 1), rnd.randint(0, 10)),
+        )
+        for _ in range(n_usuarios)
+    ]
+    juegos_activos = {1, 3}
+
+    motor = BonusEngine()
+    t0 = time.perf_counter()
+    total = sum(len(motor.evaluate(reglas, p, hoy, juegos_activos)) for p in perfiles)
+    elapsed = time.perf_counter() - t0
+    evaluaciones = n_reglas * n_usuarios
+    print(f"{n_reglas} reglas x {n_usuarios} usuarios = {evaluaciones:,} evaluaciones en {elapsed:.2f}s "
+          f"({evaluaciones / elapsed / 1e6:.1f} M/s, {elapsed / n_usuarios * 1e6:.0f} µs por usuario)")
+    print(f"Promedio de bonos disponibles por usuario: {total / n_usuarios:.1f}")
@@ -0,0 +1,284 @@
+import asyncio
+import json
+import select
+import threading
+import time
+from app.db import db_connect
+
+# Canal de Postgres por el que los triggers publican los cambios de tickets (y chats)
+EVENTOS_CANAL = "casino_eventos"
+
+# Eventos en cola por suscriptor antes de descartarlos y pedirle al cliente que recargue
+EVENTOS_COLA_MAX = 100
+
+# Tope de conexiones SSE abiertas en este worker
+EVENTOS_MAX_SUSCRIPTORES = 5000
+
+# Espera máxima del listener en select() antes de revisar si debe detenerse
+_LISTEN_POLL_SECONDS = 5.0
+_RECONNECT_MAX_SECONDS = 30.0
+
+# Eventos de la cola general: todos los agentes los reciben (la vista de tickets
+# muestra la cola completa, la de chats los que esperan). Las respuestas solo le
+# llegan al agente asignado.
+EVENTOS_COLA = {"ticket_creado", "ticket_asignado", "ticket_cerrado", "ticket_reabierto", "ticket_actualizado",
+                "chat_creado", "chat_tomado"}
+
+# Eventos internos entre workers (llevan el texto de los mensajes de chat): nunca
+# salen por SSE, solo los consumen los listeners (app/services/live_chat.py)
+EVENTOS_INTERNOS = {"chat_mensaje"}
+
+# Los triggers mandan solo ids y estado (nunca el texto del mensaje): el cliente
+# vuelve a pedir lo que le interese por la API normal, con sus permisos de siempre.
+TRIGGERS_EVENTOS = """
+    CREATE OR REPLACE FUNCTION trg_evento_soporte() RETURNS trigger AS $$
+    DECLARE
+        tipo TEXT;
+        agente_anterior INTEGER;
+    BEGIN
+        IF TG_OP = 'INSERT' THEN
+            tipo := 'ticket_creado';
+        ELSE
+            IF NEW.estado IS NOT DISTINCT FROM OLD.estado AND NEW.id_agente IS NOT DISTINCT FROM OLD.id_agente THEN
+                RETURN NULL;
+            END IF;
+            agente_anterior := OLD.id_agente;
+            tipo := CASE
+                WHEN NEW.estado = 'Cerrado' AND OLD.estado <> 'Cerrado' THEN 'ticket_cerrado'
+                WHEN OLD.estado = 'Cerrado' AND NEW.estado <> 'Cerrado' THEN 'ticket_reabierto'
+                WHEN NEW.id_agente IS DISTINCT FROM OLD.id_agente THEN 'ticket_asignado'
+                ELSE 'ticket_actualizado' END;
+        END IF;
+        PERFORM pg_notify('""" + EVENTOS_CANAL + """', json_build_object(
+            'tipo', tipo, 'id_ticket', NEW.id_ticket, 'id_jugador', NEW.id_jugador,
+            'id_agente', NEW.id_agente, 'id_agente_anterior', agente_anterior, 'estado', NEW.estado)::text);
+        RETURN NULL;
+    END $$ LANGUAGE plpgsql;
+
+    CREATE OR REPLACE FUNCTION trg_evento_respuesta_ticket() RETURNS trigger AS $$
+    DECLARE
+        t RECORD;
+    BEGIN
+        SELECT id_jugador, id_agente, estado INTO t FROM Soporte WHERE id_ticket = NEW.id_ticket;
+        PERFORM pg_notify('""" + EVENTOS_CANAL + """', json_build_object(
+            'tipo', 'ticket_respondido', 'id_ticket', NEW.id_ticket, 'id_jugador', t.id_jugador,
+            'id_agente', t.id_agente, 'estado', t.estado, 'es_agente', NEW.es_agente)::text);
+        RETURN NULL;
+    END $$ LANGUAGE plpgsql;
+
+    CREATE OR REPLACE FUNCTION trg_evento_chat() RETURNS trigger AS $$
+    DECLARE
+        tipo TEXT;
+    BEGIN
+        IF TG_OP = 'INSERT' THEN
+            tipo := 'chat_creado';
+        ELSIF NEW.estado IS NOT DISTINCT FROM OLD.estado AND NEW.id_agente IS NOT DISTINCT FROM OLD.id_agente THEN
+            RETURN NULL;
+        ELSIF NEW.estado = 'Cerrado' THEN
+            tipo := 'chat_cerrado';
+        ELSE
+            tipo := 'chat_tomado';
+        END IF;
+        PERFORM pg_notify('""" + EVENTOS_CANAL + """', json_build_object(
+            'tipo', tipo, 'id_chat', NEW.id_chat, 'id_jugador', NEW.id_jugador,
+            'id_agente', NEW.id_agente, 'estado', NEW.estado)::text);
+        RETURN NULL;
+    END $$ LANGUAGE plpgsql;
+"""
+
+# Se crean solo si no existen (CREATE TRIGGER no tiene IF NOT EXISTS)
+TRIGGERS_TABLAS = {
+    "evento_soporte": """
+        CREATE TRIGGER evento_soporte
+            AFTER INSERT OR UPDATE OF estado, id_agente ON Soporte
+            FOR EACH ROW EXECUTE FUNCTION trg_evento_soporte()
+    """,
+    "evento_respuesta_ticket": """
+        CREATE TRIGGER evento_respuesta_ticket
+            AFTER INSERT ON RespuestaTicket
+            FOR EACH ROW EXECUTE FUNCTION trg_evento_respuesta_ticket()
+    """,
+    "evento_chat": """
+        CREATE TRIGGER evento_chat
+            AFTER INSERT OR UPDATE OF estado, id_agente ON Chat
+            FOR EACH ROW EXECUTE FUNCTION trg_evento_chat()
+    """,
+}
+
+
+def ensure_event_triggers():
+    """Crea los triggers que publican los cambios de Soporte, RespuestaTicket y Chat por NOTIFY."""
+    conn = None
+    try:
+        conn = db_connect.get_connection()
+        cursor = conn.cursor()
+        cursor.execute(TRIGGERS_EVENTOS)
+        cursor.execute("SELECT tgname FROM pg_trigger WHERE tgname = ANY(%s)", (list(TRIGGERS_TABLAS),))
+        existentes = {row[0] for row in cursor.fetchall()}
+        for nombre, ddl in TRIGGERS_TABLAS.items():
+            if nombre not in existentes:
+                cursor.execute(ddl)
+        conn.commit()
+        cursor.close()
+    except Exception as e:
+        print(f"Error creating event triggers: {e}")
+    finally:
+        if conn: conn.close()
+
+
+class Suscripcion:
+    """Una conexión SSE abierta: quién es y su cola de eventos pendientes."""
+
+    __slots__ = ("id_usuario", "es_agente", "queue")
+
+    def __init__(self, id_usuario: int, es_agente: bool):
+        self.id_usuario = id_usuario
+        self.es_agente = es_agente
+        self.queue = asyncio.Queue(maxsize=EVENTOS_COLA_MAX)
+
+    def acepta(self, evento: dict) -> bool:
+        if evento.get("tipo") == "resync":
+            return True
+        if evento.get("tipo") in EVENTOS_INTERNOS:
+            return False
+        if self.es_agente:
+            return (evento.get("tipo") in EVENTOS_COLA
+                    or evento.get("id_agente") in (None, self.id_usuario))
+        return evento.get("id_jugador") == self.id_usuario
+
+
+class EventHub:
+    """
+    Reparte a las páginas abiertas los cambios de tickets, sin polling.
+
+    Un hilo por worker mantiene una conexión con LISTEN sobre EVENTOS_CANAL; los
+    triggers de la BD publican cada cambio al hacer commit, venga de cualquier worker
+    (o del barrido de mantenimiento). Cada evento se filtra por suscriptor: el jugador
+    solo ve sus tickets, el agente ve la cola y las respuestas de los suyos.
+    """
+
+    def __init__(self):
+        self._subs = set()
+        self._listeners = []
+        self._loop = None
+        self._thread = None
+        self._stopping = threading.Event()
+        self._metrics = {
+            "received": 0, "delivered": 0, "dropped": 0, "invalid": 0,
+            "reconnects": 0, "connected": False,
+        }
+
+    # ------------------------------------------------------------------
+    #  Suscriptores (en el event loop)
+    # ------------------------------------------------------------------
+    def subscribe(self, id_usuario: int, es_agente: bool):
+        """Retorna la Suscripcion, o None si este worker ya tiene demasiadas conexiones."""
+        if len(self._subs) >= EVENTOS_MAX_SUSCRIPTORES:
+            return None
+        sub = Suscripcion(int(id_usuario), es_agente)
+        self._subs.add(sub)
+        return sub
+
+    def unsubscribe(self, sub):
+        self._subs.discard(sub)
+
+    def agentes_conectados(self) -> set:
+        """Agentes con al menos un stream abierto en este worker."""
+        return {sub.id_usuario for sub in list(self._subs) if sub.es_agente}
+
+    def add_listener(self, callback):
+        """Registra callback(evento) para recibir TODOS los eventos (en el event loop)."""
+        if callback not in self._listeners:
+            self._listeners.append(callback)
+
+    def remove_listener(self, callback):
+        if callback in self._listeners:
+            self._listeners.remove(callback)
+
+    def publish(self, evento: dict):
+        """Entrega un evento a los listeners y a los suscriptores que lo aceptan. Corre en el event loop."""
+        for callback in list(self._listeners):
+            try:
+                callback(evento)
+            except Exception as e:
+                print(f"⚠️ Eventos: un listener falló con '{evento.get('tipo')}' ({e})")
+        for sub in list(self._subs):
+            if not sub.acepta(evento):
+                continue
+            try:
+                sub.queue.put_nowait(evento)
+                self._metrics["delivered"] += 1
+            except asyncio.QueueFull:
+                # Cliente lento: se vacía su cola y se le pide recargar una vez
+                self._metrics["dropped"] += sub.queue.qsize()
+                while not sub.queue.empty():
+                    sub.queue.get_nowait()
+                sub.queue.put_nowait({"tipo": "resync"})
+
+    # ------------------------------------------------------------------
+    #  Listener (hilo propio)
+    # ------------------------------------------------------------------
+    def _dispatch(self, payload: str):
+        try:
+            evento = json.loads(payload)
+        except ValueError:
+            self._metrics["invalid"] += 1
+            return
+        self._metrics["received"] += 1
+        try:
+            self._loop.call_soon_threadsafe(self.publish, evento)
+        except RuntimeError:
+            pass  # El loop ya se cerró (apagando)
+
+    def _listen(self, conn):
+        conn.autocommit = True
+        cursor = conn.cursor()
+        cursor.execute(f"LISTEN {EVENTOS_CANAL}")
+        cursor.close()
+        self._metrics["connected"] = True
+        while not self._stopping.is_set():
+            if select.select([conn], [], [], _LISTEN_POLL_SECONDS) == ([], [], []):
+                continue
+            conn.poll()
+            while conn.notifies:
+                self._dispatch(conn.notifies.pop(0).payload)
+
+    def run_listener(self):
+        espera = 1.0
+        primera = True
+        while not self._stopping.is_set():
+            conn = db_connect.get_connection()
+            if conn is not None:
+                try:
+                    if not primera:
+                        # Lo publicado mientras no escuchábamos se perdió: que los clientes recarguen
+                        self._metrics["reconnects"] += 1
+                        self._dispatch(json.dumps({"tipo": "resync"}))
+                    primera = False
+                    espera = 1.0
+                    self._listen(conn)
+                except Exception as e:
+                    print(f"⚠️ Eventos: se perdió la conexión de LISTEN ({e}), reconectando")
+                finally:
+                    self._metrics["connected"] = False
+                    conn.close()
+            if self._stopping.wait(espera):
+                return
+            espera = min(espera * 2, _RECONNECT_MAX_SECONDS)
+
+    def start(self):
+        if self._thread is None:
+            self._stopping.clear()
+            self._loop = asyncio.get_running_loop()
+            self._thread = threading.Thread(target=self.run_listener, name="event-hub", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stopping.set()
+        self._thread = None
+
+    def stats(self) -> dict:
+        return {**self._metrics, "subscribers": len(self._subs)}
+
+
+event_hub = EventHub()
@@ -0,0 +1,137 @@
+import hashlib
+import json
+import os
+import threading
+import time
+import unicodedata
+from psycopg2.extras import RealDictCursor
+from app.db import db_connect
+from app.utils import serialize_data
+
+# Directorio donde viven los clientes web de cada juego (montado en /juegos)
+JUEGOS_DIR = "juegos"
+
+# Tiempo máximo que un worker sirve el catálogo sin recargarlo.
+# La invalidación explícita solo llega al worker que atendió el cambio del admin,
+# así que el TTL garantiza que los demás workers converjan.
+CATALOG_TTL_SECONDS = 60
+
+
+def game_slug(nombre: str) -> str:
+    """
+    Deriva el identificador de URL de un juego a partir de su nombre en la tabla Juego.
+    Ej: 'Tragamonedas Neon' -> 'tragamonedas', 'Ruleta Europea' -> 'ruleta'
+    """
+    base = unicodedata.normalize("NFKD", nombre or "").encode("ascii", "ignore").decode("ascii")
+    partes = base.strip().lower().split()
+    return partes[0] if partes else ""
+
+
+def game_client_url(slug: str):
+    """Retorna la URL local del cliente del juego si existe en /juegos, si no None."""
+    if not slug:
+        return None
+    if os.path.isfile(os.path.join(JUEGOS_DIR, f"{slug}-web", "index.html")):
+        return f"/juegos/{slug}-web/index.html"
+    return None
+
+
+class GameCatalog:
+    """
+    Catálogo versionado de juegos cargado desde la tabla Juego.
+    Se mantiene en memoria y se invalida cuando el admin crea o cambia un juego.
+    """
+
+    def __init__(self, ttl: int = CATALOG_TTL_SECONDS):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._games = []
+        self._by_id = {}
+        self._by_slug = {}
+        self._version = 0
+        self._etags = {}
+        self._loaded_at = 0.0
+        self._stale = True
+
+    def invalidate(self):
+        """Marca el catálogo como obsoleto; la siguiente lectura lo recarga."""
+        with self._lock:
+            self._stale = True
+
+    def _needs_reload(self) -> bool:
+        return self._stale or (time.monotonic() - self._loaded_at) > self.ttl
+
+    def _load(self):
+        conn = db_connect.get_connection()
+        if conn is None:
+            raise RuntimeError("Error de conexión")
+        try:
+            cursor = conn.cursor(cursor_factory=RealDictCursor)
+            cursor.execute("SELECT * FROM Juego ORDER BY nombre")
+            rows = serialize_data(cursor.fetchall())
+            cursor.close()
+        finally:
+            conn.close()
+
+        by_id = {}
+        by_slug = {}
+        for game in rows:
+            slug = game_slug(game["nombre"])
+            game["slug"] = slug
+            game["url"] = game_client_url(slug)
+            by_id[game["id_juego"]] = game
+            # Si dos juegos comparten slug, gana el activo
+            if slug and (slug not in by_slug or game["activo"]):
+                by_slug[slug] = game
+
+        payload = json.dumps(rows, sort_keys=True, ensure_ascii=False)
+        etag_base = hashlib.sha1(payload.encode("utf-8")).hexdigest()[:16]
+
+        with self._lock:
+            # Solo subimos versión si el contenido cambió realmente
+            if etag_base != self._etags.get("base"):
+                self._version += 1
+            self._games = rows
+            self._by_id = by_id
+            self._by_slug = by_slug
+            self._etags = {
+                "base": etag_base,
+                "all": f'W/"juegos-{self._version}-{etag_base}"',
+                "active": f'W/"juegos-activos-{self._version}-{etag_base}"',
+            }
+            self._loaded_at = time.monotonic()
+            self._stale = False
+
+    def _ensure_fresh(self):
+        if self._needs_reload():
+            try:
+                self._load()
+            except Exception as e:
+                # Si la BD falla pero ya tenemos datos, servimos los anteriores
+                if not self._games:
+                    raise
+                print(f"⚠️ Catálogo de juegos: no se pudo recargar ({e}), usando versión {self._version}")
+
+    @property
+    def version(self) -> int:
+        self._ensure_fresh()
+        return self._version
+
+    def get_games(self, only_active: bool = False):
+        """Retorna (lista_de_juegos, etag)."""
+        self._ensure_fresh()
+        with self._lock:
+            if only_active:
+                return [g for g in self._games if g["activo"]], self._etags["active"]
+            return list(self._games), self._etags["all"]
+
+    def get_by_id(self, id_juego: int):
+        self._ensure_fresh()
+        return self._by_id.get(id_juego)
+
+    def get_by_slug(self, slug: str):
+        self._ensure_fresh()
+        return self._by_slug.get((slug or "").lower())
+
+
+catalog = GameCatalog()
@@ -0,0 +1,330 @@
+import asyncio
+import ipaddress
+import socket
+import threading
+import time
+from array import array
+from app.db import db_connect
+
+# Cada cuánto se revisa si otro worker cambió las listas (firma barata, sin recargar)
+IP_FILTER_REFRESH_SECONDS = 30
+
+# Veredictos guardados en el trie. En el mismo prefijo gana la lista blanca.
+SIN_REGLA = 0
+BLOQUEADA = 1
+PERMITIDA = 2
+
+# Firma de las dos listas: cambia al agregar, quitar o (des)activar una entrada
+FIRMA_SQL = """
+    SELECT (SELECT COUNT(*) FROM BloqueoIP WHERE activo IS NOT FALSE),
+           (SELECT COALESCE(SUM(id_bloqueo), 0) FROM BloqueoIP WHERE activo IS NOT FALSE),
+           (SELECT COUNT(*) FROM ListaBlancaIP WHERE activo IS NOT FALSE),
+           (SELECT COALESCE(SUM(id_lista), 0) FROM ListaBlancaIP WHERE activo IS NOT FALSE)
+"""
+
+
+def ensure_allowlist_table():
+    """Crea la tabla ListaBlancaIP si no existe (misma forma que BloqueoIP)."""
+    conn = None
+    try:
+        conn = db_connect.get_connection()
+        cursor = conn.cursor()
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS ListaBlancaIP (
+                id_lista SERIAL PRIMARY KEY,
+                ip_address VARCHAR(50) UNIQUE NOT NULL,
+                descripcion TEXT,
+                fecha_alta TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                activo BOOLEAN DEFAULT TRUE
+            );
+        """)
+        conn.commit()
+        cursor.close()
+    except Exception as e:
+        print(f"Error creating ListaBlancaIP table: {e}")
+    finally:
+        if conn: conn.close()
+
+
+def normalizar_red(texto: str):
+    """
+    IP o rango CIDR (IPv4 o IPv6) -> ip_network. '10.1.2.3/8' se normaliza a
+    '10.0.0.0/8'. Lanza ValueError si el texto no es válido.
+    """
+    red = ipaddress.ip_network((texto or "").strip(), strict=False)
+    if red.version == 6 and red.prefixlen >= 96 and red.network_address.ipv4_mapped:
+        # ::ffff:a.b.c.d/n se guarda como la red IPv4 equivalente
+        red = ipaddress.ip_network(f"{red.network_address.ipv4_mapped}/{red.prefixlen - 96}")
+    return red
+
+
+def formato_red(red) -> str:
+    """Texto a guardar: la IP sola si es una dirección, el CIDR si es un rango."""
+    return str(red.network_address) if red.prefixlen == red.max_prefixlen else str(red)
+
+
+class PrefixTrie:
+    """
+    Trie binario de prefijos guardado en arreglos planos (un nodo = un índice), sin un
+    objeto por nodo: 100k reglas ocupan unos pocos MB. La búsqueda recorre a lo más
+    un nodo por bit de la dirección y devuelve el veredicto del prefijo más largo.
+    """
+
+    __slots__ = ("bits", "_zero", "_one", "_value", "rules")
+
+    def __init__(self, bits: int):
+        self.bits = bits
+        # Nodo 0 = raíz. Un hijo 0 significa "no existe" (la raíz no es hija de nadie).
+        self._zero = array("i", [0])
+        self._one = array("i", [0])
+        self._value = array("b", [SIN_REGLA])
+        self.rules = 0
+
+    def insert(self, network: int, prefixlen: int, verdict: int):
+        zero, one, value = self._zero, self._one, self._value
+        node = 0
+        for shift in range(self.bits - 1, self.bits - 1 - prefixlen, -1):
+            children = one if (network >> shift) & 1 else zero
+            child = children[node]
+            if child == 0:
+                child = len(value)
+                zero.append(0)
+                one.append(0)
+                value.append(SIN_REGLA)
+                children[node] = child
+            node = child
+        value[node] = max(value[node], verdict)
+        self.rules += 1
+
+    def lookup(self, address: int) -> int:
+        zero, one, value = self._zero, self._one, self._value
+        node = 0
+        best = value[0]
+        for shift in range(self.bits - 1, -1, -1):
+            node = (one if (address >> shift) & 1 else zero)[node]
+            if node == 0:
+                break
+            if value[node]:
+                best = value[node]
+        return best
+
+    def __len__(self):
+        return len(self._value)
+
+
+def construir_tries(bloqueadas, permitidas):
+    """
+    (trie IPv4, trie IPv6, inválidas) a partir de los textos de ambas listas.
+    Las entradas que no son IP/CIDR válidas se cuentan y se ignoran.
+    """
+    tries = {4: PrefixTrie(32), 6: PrefixTrie(128)}
+    invalidas = 0
+    for textos, verdict in ((bloqueadas, BLOQUEADA), (permitidas, PERMITIDA)):
+        for texto in textos:
+            try:
+                red = normalizar_red(texto)
+            except ValueError:
+                invalidas += 1
+                continue
+            tries[red.version].insert(int(red.network_address), red.prefixlen, verdict)
+    return tries[4], tries[6], invalidas
+
+
+class IPFilter:
+    """
+    Listas de IPs bloqueadas y permitidas (BloqueoIP / ListaBlancaIP) en memoria.
+
+    Cada petición se resuelve contra el trie sin tocar la BD: gana la regla del prefijo
+    más largo y, en empate, la lista blanca. El trie se reconstruye aparte y se publica
+    cambiando una sola referencia, así que las peticiones nunca ven uno a medias.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._tries = (PrefixTrie(32), PrefixTrie(128))
+        self._firma = None
+        self._task = None
+        self._loop = None
+        self._wake = None
+        self._metrics = {
+            "checked": 0, "blocked": 0, "reloads": 0, "reload_errors": 0,
+            "last_reload_ms": 0.0, "invalid_entries": 0,
+        }
+
+    # ------------------------------------------------------------------
+    #  Consulta (por petición)
+    # ------------------------------------------------------------------
+    def verdict(self, ip: str) -> int:
+        trie4, trie6 = self._tries
+        # inet_pton es bastante más rápido que ipaddress para el caso común (IPv4)
+        try:
+            return trie4.lookup(int.from_bytes(socket.inet_pton(socket.AF_INET, ip), "big"))
+        except (OSError, TypeError):
+            pass
+        try:
+            address = ipaddress.IPv6Address(ip)
+        except ValueError:
+            return SIN_REGLA
+        if address.ipv4_mapped:
+            return trie4.lookup(int(address.ipv4_mapped))
+        return trie6.lookup(int(address))
+
+    def is_blocked(self, ip: str) -> bool:
+        blocked = self.verdict(ip) == BLOQUEADA
+        self._metrics["checked"] += 1
+        if blocked:
+            self._metrics["blocked"] += 1
+        return blocked
+
+    # ------------------------------------------------------------------
+    #  Recarga
+    # ------------------------------------------------------------------
+    def reload(self, force: bool = False):
+        """Relee las listas si cambiaron (o si force) y publica el trie nuevo."""
+        conn = None
+        try:
+            conn = db_connect.get_connection()
+            if conn is None:
+                raise RuntimeError("Error de conexión")
+            cursor = conn.cursor()
+            cursor.execute(FIRMA_SQL)
+            firma = cursor.fetchone()
+            if not force and firma == self._firma:
+                cursor.close()
+                return
+            t0 = time.perf_counter()
+            cursor.execute("SELECT ip_address FROM BloqueoIP WHERE activo IS NOT FALSE")
+            bloqueadas = [row[0] for row in cursor.fetchall()]
+            cursor.execute("SELECT ip_address FROM ListaBlancaIP WHERE activo IS NOT FALSE")
+            permitidas = [row[0] for row in cursor.fetchall()]
+            cursor.close()
+        except Exception as e:
+            # Se sigue usando el trie anterior
+            self._metrics["reload_errors"] += 1
+            print(f"⚠️ Filtro IP: no se pudieron recargar las listas ({e})")
+            return
+        finally:
+            if conn: conn.close()
+
+        trie4, trie6, invalidas = construir_tries(bloqueadas, permitidas)
+        with self._lock:
+            self._tries = (trie4, trie6)
+            self._firma = firma
+            self._metrics["reloads"] += 1
+            self._metrics["invalid_entries"] = invalidas
+            self._metrics["last_reload_ms"] = round((time.perf_counter() - t0) * 1000, 1)
+        if invalidas:
+            print(f"⚠️ Filtro IP: {invalidas} entradas no son IP/CIDR válidas y se ignoran")
+
+    def invalidate(self):
+        """Pide a la tarea de fondo recargar ya (tras un cambio del admin en este worker)."""
+        with self._lock:
+            self._firma = None
+        if self._wake is not None:
+            try:
+                self._loop.call_soon_threadsafe(self._wake.set)
+            except RuntimeError:
+                pass
+
+    async def run_refresher(self, interval: float = IP_FILTER_REFRESH_SECONDS):
+        while True:
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            await asyncio.to_thread(self.reload)
+
+    async def start(self):
+        await asyncio.to_thread(self.reload, True)
+        if self._task is None:
+            self._loop = asyncio.get_running_loop()
+            self._wake = asyncio.Event()
+            self._task = self._loop.create_task(self.run_refresher())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    def stats(self) -> dict:
+        trie4, trie6 = self._tries
+        return {
+            **self._metrics,
+            "rules_ipv4": trie4.rules,
+            "rules_ipv6": trie6.rules,
+            "nodes": len(trie4) + len(trie6),
+        }
+
+
+ip_filter = IPFilter()
+
+
+# ======== Benchmark (python -m app.services.ip_filter) =========
+if __name__ == "__main__":
+    import random
+    import sys
+
+    entradas = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    consultas = 200_000
+    rnd = random.Random(42)
+
+    def _ip4():
+        return str(ipaddress.IPv4Address(rnd.getrandbits(32)))
+
+    # Mezcla realista: mayoría de IPs sueltas, rangos de /16 a /30 y algo de IPv6
+    bloqueadas = []
+    for i in range(entradas):
+        r = rnd.random()
+        if r < 0.7:
+            bloqueadas.append(_ip4())
+        elif r < 0.95:
+            bloqueadas.append(f"{_ip4()}/{rnd.randint(16, 30)}")
+        else:
+            bloqueadas.append(f"{ipaddress.IPv6Address(rnd.getrandbits(128))}/{rnd.choice([48, 64, 128])}")
+    permitidas = [f"{_ip4()}/{rnd.randint(24, 32)}" for _ in range(entradas // 100)]
+
+    t0 = time.perf_counter()
+    trie4, trie6, invalidas = construir_tries(bloqueadas, permitidas)
+    build = time.perf_counter() - t0
+    memoria = sum(a.itemsize * len(a) for t in (trie4, trie6) for a in (t._zero, t._one, t._value))
+    print(f"Reglas: {trie4.rules + trie6.rules} ({invalidas} inválidas) | nodos: {len(trie4) + len(trie6)} "
+          f"| ~{memoria / 1e6:.1f} MB | construcción: {build:.2f}s")
+
+    filtro = IPFilter()
+    filtro._tries = (trie4, trie6)
+    # La mitad de las consultas caen en IPs bloqueadas conocidas (peor caso: recorren 32 bits)
+    sueltas = [b for b in bloqueadas if "/" not in b]
+    ips = [sueltas[i % len(sueltas)] if i % 2 else _ip4() for i in range(consultas)]
+
+    t0 = time.perf_counter()
+    bloqueos = sum(filtro.is_blocked(ip) for ip in ips)
+    elapsed = time.perf_counter() - t0
+    print(f"{consultas} consultas: {elapsed:.2f}s -> {elapsed / consultas * 1e6:.2f} µs/consulta "
+          f"({bloqueos} bloqueadas)")
+
+    # Comparación: recorrer la lista completa de redes (lo que haría una búsqueda lineal)
+    redes = [normalizar_red(b) for b in bloqueadas[:10_000]]
+    muestra = ips[:200]
+    t0 = time.perf_counter()
+    for ip in muestra:
+        direccion = ipaddress.ip_address(ip)
+        any(direccion in red for red in redes)
+    lineal = (time.perf_counter() - t0) / len(muestra) * (entradas / len(redes))
+    print(f"Búsqueda lineal estimada con {entradas} reglas: {lineal * 1e6:.0f} µs/consulta")
+
+    # X-Forwarded-For falsificado: una IP bloqueada que antepone otra dirección sigue bloqueada
+    from starlette.requests import HTTPConnection
+    from app.utils import client_ip, TRUSTED_PROXY_HOPS
+
+    def _conexion(xff: str):
+        cabeceras = [(b"x-forwarded-for", xff.encode())] if xff else []
+        return HTTPConnection({"type": "http", "headers": cabeceras, "client": ("10.0.0.1", 5000)})
+
+    bloqueada = sueltas[0]
+    proxies = ", ".join(["10.0.0.2"] * (TRUSTED_PROXY_HOPS - 1))
+    real = f"{bloqueada}, {proxies}" if proxies else bloqueada
+    falsa = f"1.2.3.4, {real}"
+    assert client_ip(_conexion(real)) == client_ip(_conexion(falsa)) == bloqueada
+    assert filtro.is_blocked(client_ip(_conexion(falsa)))
+    print(f"X-Forwarded-For falsificado ({falsa}): sigue bloqueada ✅")
@@ -0,0 +1,299 @@
+import asyncio
+import decimal
+import random
+import threading
+import time
+from app.db import db_connect
+
+# Porcentaje de cada apuesta (tragamonedas y ruleta) que alimenta el jackpot
+JACKPOT_CONTRIBUTION_RATE = decimal.Decimal("0.01")
+
+# Monto con el que arranca cada jackpot nuevo
+JACKPOT_SEED = decimal.Decimal("1000.00")
+
+# Probabilidad de ganar el jackpot por cada peso apostado
+JACKPOT_HIT_PER_UNIT = 1 / 2_000_000
+
+# Número de filas contador por jackpot. Cada flush cae en una fila al azar,
+# así los workers no se pelean por la misma fila.
+JACKPOT_SHARDS = 16
+
+# Cada cuánto se vuelca el buffer en memoria a la BD
+JACKPOT_FLUSH_SECONDS = 2.0
+
+# Cada cuánto se recalcula el pozo mostrado en el lobby
+JACKPOT_TOTAL_TTL_SECONDS = 5.0
+
+_CENT = decimal.Decimal("0.01")
+
+
+def ensure_jackpot_tables():
+    """Crea las tablas Jackpot y Jackpot_Contribucion si no existen."""
+    conn = None
+    try:
+        conn = db_connect.get_connection()
+        cursor = conn.cursor()
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS Jackpot (
+                id_jackpot SERIAL PRIMARY KEY,
+                semilla NUMERIC(12, 2) NOT NULL,
+                estado VARCHAR(20) NOT NULL DEFAULT 'Activo' CHECK (estado IN ('Activo', 'Ganado')),
+                fecha_inicio TIMESTAMP WITHOUT TIME ZONE NOT NULL DEFAULT NOW(),
+                id_ganador INTEGER REFERENCES Usuario(id_usuario) ON DELETE SET NULL,
+                monto_ganado NUMERIC(12, 2),
+                fecha_ganado TIMESTAMP WITHOUT TIME ZONE
+            );
+            CREATE UNIQUE INDEX IF NOT EXISTS idx_jackpot_unico_activo ON Jackpot (estado) WHERE estado = 'Activo';
+            CREATE TABLE IF NOT EXISTS Jackpot_Contribucion (
+                id_jackpot INTEGER NOT NULL REFERENCES Jackpot(id_jackpot) ON DELETE CASCADE,
+                shard SMALLINT NOT NULL,
+                monto NUMERIC(14, 4) NOT NULL DEFAULT 0,
+                PRIMARY KEY (id_jackpot, shard)
+            );
+        """)
+        cursor.execute(
+            "INSERT INTO Jackpot (semilla) VALUES (%s) ON CONFLICT (estado) WHERE estado = 'Activo' DO NOTHING",
+            (JACKPOT_SEED,)
+        )
+        conn.commit()
+        cursor.close()
+    except Exception as e:
+        print(f"Error creating Jackpot tables: {e}")
+    finally:
+        if conn: conn.close()
+
+
+class ProgressiveJackpot:
+    """
+    Jackpot progresivo alimentado por un porcentaje de cada apuesta.
+
+    Las contribuciones se acumulan en memoria y se vuelcan periódicamente, sumadas,
+    en una de N filas de Jackpot_Contribucion. El pozo es semilla + SUM(shards).
+    El premio se paga una sola vez: el ganador toma el lock de la fila Jackpot
+    activa y solo la transacción que la encuentra 'Activo' la marca 'Ganado'.
+    """
+
+    def __init__(self, shards: int = JACKPOT_SHARDS):
+        self.shards = shards
+        self._lock = threading.Lock()
+        self._buffer = decimal.Decimal("0")
+        self._total = None
+        self._total_at = 0.0
+        self._task = None
+        self._metrics = {"contributions": 0, "flushes": 0, "flush_errors": 0, "awards": 0}
+
+    # ------------------------------------------------------------------
+    #  Contribuciones
+    # ------------------------------------------------------------------
+    def contribute(self, bet):
+        """Suma al buffer local la parte de la apuesta que va al pozo. No toca la BD."""
+        amount = decimal.Decimal(str(bet)) * JACKPOT_CONTRIBUTION_RATE
+        with self._lock:
+            self._buffer += amount
+            self._metrics["contributions"] += 1
+
+    def _drain(self):
+        with self._lock:
+            amount, self._buffer = self._buffer, decimal.Decimal("0")
+        return amount
+
+    def restore(self, amount):
+        """Devuelve al buffer contribuciones drenadas que no llegaron a la BD."""
+        if not amount:
+            return
+        with self._lock:
+            self._buffer += amount
+
+    def _write_contribution(self, cursor, amount) -> bool:
+        # FOR SHARE sobre el jackpot activo: convive con otros flushes pero espera a un
+        # premio en curso. Si el jackpot se ganó mientras esperábamos, la fila ya no es
+        # 'Activo' y no se inserta nada; el llamador reintenta contra el jackpot nuevo.
+        cursor.execute(
+            """
+            INSERT INTO Jackpot_Contribucion (id_jackpot, shard, monto)
+            SELECT id_jackpot, %s, %s FROM Jackpot WHERE estado = 'Activo' FOR SHARE
+            ON CONFLICT (id_jackpot, shard)
+            DO UPDATE SET monto = Jackpot_Contribucion.monto + EXCLUDED.monto
+            """,
+            (random.randrange(self.shards), amount)
+        )
+        return cursor.rowcount > 0
+
+    def flush(self):
+        """Vuelca el buffer a una fila contador. Se llama desde el hilo del flusher."""
+        amount = self._drain()
+        if amount <= 0:
+            return
+        conn = None
+        try:
+            conn = db_connect.get_connection()
+            if conn is None:
+                raise RuntimeError("Error de conexión")
+            cursor = conn.cursor()
+            for _ in range(3):
+                if self._write_contribution(cursor, amount):
+                    break
+                conn.rollback()
+            else:
+                raise RuntimeError("No hay jackpot activo")
+            conn.commit()
+            cursor.close()
+            self._metrics["flushes"] += 1
+            with self._lock:
+                if self._total is not None:
+                    self._total += amount
+        except Exception as e:
+            if conn: conn.rollback()
+            self.restore(amount)
+            self._metrics["flush_errors"] += 1
+            print(f"⚠️ Jackpot: error al volcar contribuciones ({e}), se reintentará")
+        finally:
+            if conn: conn.close()
+
+    async def run_flusher(self, interval: float = JACKPOT_FLUSH_SECONDS):
+        while True:
+            await asyncio.sleep(interval)
+            await asyncio.to_thread(self.flush)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self.run_flusher())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        await asyncio.to_thread(self.flush)
+
+    # ------------------------------------------------------------------
+    #  Pozo y premio
+    # ------------------------------------------------------------------
+    def current_total(self):
+        """Pozo actual (cacheado unos segundos) + lo pendiente en este worker."""
+        if self._total is None or (time.monotonic() - self._total_at) > JACKPOT_TOTAL_TTL_SECONDS:
+            conn = db_connect.get_connection()
+            if conn is None:
+                raise RuntimeError("Error de conexión")
+            try:
+                cursor = conn.cursor()
+                cursor.execute(
+                    """
+                    SELECT j.semilla + COALESCE(SUM(c.monto), 0)
+                    FROM Jackpot j
+                    LEFT JOIN Jackpot_Contribucion c ON c.id_jackpot = j.id_jackpot
+                    WHERE j.estado = 'Activo'
+                    GROUP BY j.id_jackpot, j.semilla
+                    """
+                )
+                row = cursor.fetchone()
+                cursor.close()
+            finally:
+                conn.close()
+            self._total = row[0] if row else JACKPOT_SEED
+            self._total_at = time.monotonic()
+        with self._lock:
+            return (self._total + self._buffer).quantize(_CENT)
+
+    def try_award(self, conn, user_id: int, bet):
+        """
+        Tira el dado del jackpot para esta apuesta. Si sale, paga el pozo dentro de la
+        transacción de `conn` (la misma del giro, con el lock del usuario tomado).
+        Retorna (monto ganado o None, contribuciones pendientes drenadas al premio).
+        El llamador hace commit; si la transacción no se confirma debe devolver lo
+        drenado con restore().
+        """
+        if random.random() >= float(bet) * JACKPOT_HIT_PER_UNIT:
+            return None, 0
+
+        # Lo pendiente en este worker entra en el premio
+        pending = self._drain()
+        try:
+            cursor = conn.cursor()
+
+            # Exactamente una vez: el FOR UPDATE espera a los flushes en vuelo y a
+            # cualquier otro ganador; si otro ya lo cobró, no encontramos fila activa.
+            cursor.execute("SELECT id_jackpot, semilla FROM Jackpot WHERE estado = 'Activo' FOR UPDATE")
+            row = cursor.fetchone()
+            if not row:
+                cursor.close()
+                self.restore(pending)
+                return None, 0
+            id_jackpot, semilla = row
+
+            if pending > 0:
+                cursor.execute(
+                    """
+                    INSERT INTO Jackpot_Contribucion (id_jackpot, shard, monto) VALUES (%s, %s, %s)
+                    ON CONFLICT (id_jackpot, shard)
+                    DO UPDATE SET monto = Jackpot_Contribucion.monto + EXCLUDED.monto
+                    """,
+                    (id_jackpot, random.randrange(self.shards), pending)
+                )
+
+            cursor.execute(
+                "SELECT COALESCE(SUM(monto), 0) FROM Jackpot_Contribucion WHERE id_jackpot = %s",
+                (id_jackpot,)
+            )
+            acumulado = cursor.fetchone()[0]
+            premio = (decimal.Decimal(semilla) + decimal.Decimal(acumulado)).quantize(_CENT, rounding=decimal.ROUND_DOWN)
+
+            cursor.execute(
+                """
+                UPDATE Jackpot SET estado = 'Ganado', id_ganador = %s, monto_ganado = %s, fecha_ganado = NOW()
+                WHERE id_jackpot = %s AND estado = 'Activo'
+                """,
+                (user_id, premio, id_jackpot)
+            )
+            cursor.execute("INSERT INTO Jackpot (semilla) VALUES (%s)", (JACKPOT_SEED,))
+            cursor.execute(
+                "UPDATE Saldo SET saldo_actual = saldo_actual + %s, ultima_actualizacion = NOW() WHERE id_usuario = %s",
+                (premio, user_id)
+            )
+            cursor.execute(
+                """
+                INSERT INTO Transaccion (id_usuario, tipo_transaccion, monto, estado, metodo_pago)
+                VALUES (%s, 'Ajuste', %s, 'Completada', 'Jackpot')
+                """,
+                (user_id, premio)
+            )
+            cursor.close()
+        except Exception:
+            self.restore(pending)
+            raise
+
+        self._metrics["awards"] += 1
+        self._total = None
+        print(f"🎰 Jackpot {id_jackpot} ganado por usuario {user_id}: ${premio}")
+        return premio, pending
+
+    def stats(self) -> dict:
+        with self._lock:
+            pending = float(self._buffer)
+        return {**self._metrics, "pending_local": pending, "shards": self.shards}
+
+
+jackpot = ProgressiveJackpot()
+
+
+# ======== Benchmark directo (python -m app.services.jackpot [giros]) =========
+if __name__ == "__main__":
+    # Mide el costo de contribute() a tasas altas de giros y, si hay BD, el de flush().
+    import sys
+    spins = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    workers = 8
+
+    def _spin_loop(n):
+        for _ in range(n):
+            jackpot.contribute(25)
+
+    threads = [threading.Thread(target=_spin_loop, args=(spins // workers,)) for _ in range(workers)]
+    t0 = time.perf_counter()
+    for t in threads: t.start()
+    for t in threads: t.join()
+    elapsed = time.perf_counter() - t0
+    print(f"contribute(): {spins} giros en {elapsed:.3f}s -> {spins / elapsed:,.0f} giros/s")
+    print(f"Buffer acumulado: ${jackpot.stats()['pending_local']:.2f}")
+
+    t0 = time.perf_counter()
+    jackpot.flush()
+    print(f"flush(): {(time.perf_counter() - t0) * 1000:.2f} ms ({jackpot.stats()})")
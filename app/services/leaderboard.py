@@ -0,0 +1,231 @@
+import asyncio
+import heapq
+import itertools
+import json
+import os
+import threading
+import time
+from datetime import datetime
+from app.db import db_connect
+
+# Cuántas ganancias se guardan por tabla
+LEADERBOARD_SIZE = 50
+
+# Cada cuánto se guardan en Postgres las tablas que cambiaron
+LEADERBOARD_SNAPSHOT_SECONDS = 60.0
+
+PERIODOS = ("diario", "semanal", "historico")
+
+# Tabla que agrupa todos los juegos
+TODOS_LOS_JUEGOS = "todos"
+
+
+def ensure_leaderboard_table():
+    """Crea la tabla Leaderboard_Snapshot si no existe."""
+    conn = None
+    try:
+        conn = db_connect.get_connection()
+        cursor = conn.cursor()
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS Leaderboard_Snapshot (
+                periodo VARCHAR(10) NOT NULL,
+                bucket VARCHAR(10) NOT NULL,
+                juego VARCHAR(50) NOT NULL,
+                datos JSONB NOT NULL,
+                fecha_actualizacion TIMESTAMP WITHOUT TIME ZONE NOT NULL DEFAULT NOW(),
+                PRIMARY KEY (periodo, bucket, juego)
+            );
+        """)
+        conn.commit()
+        cursor.close()
+    except Exception as e:
+        print(f"Error creating Leaderboard_Snapshot table: {e}")
+    finally:
+        if conn: conn.close()
+
+
+def _buckets(ts: datetime):
+    """Bucket de cada periodo para una fecha: día ISO, semana ISO y 'all'."""
+    year, week, _ = ts.isocalendar()
+    return {
+        "diario": ts.strftime("%Y-%m-%d"),
+        "semanal": f"{year}-W{week:02d}",
+        "historico": "all",
+    }
+
+
+class _TopK:
+    """Min-heap acotado: la raíz es la ganancia más chica que sigue en la tabla."""
+
+    __slots__ = ("heap", "ids")
+
+    def __init__(self):
+        self.heap = []
+        self.ids = set()
+
+    def push(self, entry) -> bool:
+        # entry = (monto, ts, id_entrada, id_usuario)
+        if entry[2] in self.ids:
+            return False
+        if len(self.heap) < LEADERBOARD_SIZE:
+            heapq.heappush(self.heap, entry)
+        elif entry > self.heap[0]:
+            removed = heapq.heapreplace(self.heap, entry)
+            self.ids.discard(removed[2])
+        else:
+            return False
+        self.ids.add(entry[2])
+        return True
+
+    def sorted(self):
+        return sorted(self.heap, reverse=True)
+
+
+class Leaderboard:
+    """
+    Tablas de mayores ganancias (diaria, semanal e histórica; por juego y global),
+    actualizadas de forma incremental al liquidar cada ronda y servidas desde memoria.
+    Se guardan periódicamente en Leaderboard_Snapshot para reconstruirlas al reiniciar.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # {(periodo, bucket, juego): _TopK}
+        self._boards = {}
+        self._dirty = set()
+        self._seq = itertools.count()
+        self._prefix = f"{os.getpid()}-{int(time.time())}"
+        self._task = None
+
+    def _board(self, key):
+        board = self._boards.get(key)
+        if board is None:
+            board = self._boards[key] = _TopK()
+        return board
+
+    def record_win(self, user_id: int, game_slug: str, amount):
+        """Registra la ganancia neta de una ronda. O(log K) por tabla, sin BD."""
+        amount = round(float(amount), 2)
+        if amount <= 0:
+            return
+        now = datetime.now()
+        entry = (amount, now.isoformat(timespec="seconds"), f"{self._prefix}-{next(self._seq)}", int(user_id))
+        with self._lock:
+            for periodo, bucket in _buckets(now).items():
+                for juego in (game_slug, TODOS_LOS_JUEGOS):
+                    key = (periodo, bucket, juego)
+                    if self._board(key).push(entry):
+                        self._dirty.add(key)
+
+    def top(self, periodo: str = "diario", juego: str = TODOS_LOS_JUEGOS, limit: int = 10):
+        bucket = _buckets(datetime.now())[periodo]
+        with self._lock:
+            board = self._boards.get((periodo, bucket, juego))
+            entries = board.sorted()[:limit] if board else []
+        return [
+            {"id_usuario": e[3], "monto": e[0], "fecha": e[1]}
+            for e in entries
+        ]
+
+    # ------------------------------------------------------------------
+    #  Snapshots en Postgres
+    # ------------------------------------------------------------------
+    def load(self):
+        """Carga los snapshots de los buckets vigentes (arranque del worker)."""
+        buckets = _buckets(datetime.now())
+        conn = db_connect.get_connection()
+        if conn is None:
+            raise RuntimeError("Error de conexión")
+        try:
+            cursor = conn.cursor()
+            cursor.execute(
+                """
+                SELECT periodo, bucket, juego, datos FROM Leaderboard_Snapshot
+                WHERE (periodo, bucket) IN (('diario', %s), ('semanal', %s), ('historico', 'all'))
+                """,
+                (buckets["diario"], buckets["semanal"])
+            )
+            rows = cursor.fetchall()
+            cursor.close()
+        finally:
+            conn.close()
+        with self._lock:
+            for periodo, bucket, juego, datos in rows:
+                board = self._board((periodo, bucket, juego))
+                for e in datos:
+                    board.push(tuple(e))
+
+    def snapshot(self):
+        """
+        Guarda las tablas modificadas. Fusiona con lo que otros workers ya guardaron,
+        así cada worker termina viendo también las ganancias de los demás.
+        """
+        with self._lock:
+            dirty, self._dirty = self._dirty, set()
+            current = _buckets(datetime.now())
+            # Tiramos de memoria los días/semanas que ya pasaron
+            for key in [k for k in self._boards if k[1] != current[k[0]] and k not in dirty]:
+                del self._boards[key]
+            pending = {key: list(self._boards[key].heap) for key in dirty if key in self._boards}
+        if not pending:
+            return
+
+        conn = None
+        try:
+            conn = db_connect.get_connection()
+            if conn is None:
+                raise RuntimeError("Error de conexión")
+            cursor = conn.cursor()
+            for key, entries in pending.items():
+                cursor.execute(
+                    "SELECT datos FROM Leaderboard_Snapshot WHERE periodo = %s AND bucket = %s AND juego = %s FOR UPDATE",
+                    key
+                )
+                row = cursor.fetchone()
+                merged = _TopK()
+                for e in entries + [tuple(e) for e in (row[0] if row else [])]:
+                    merged.push(e)
+                cursor.execute(
+                    """
+                    INSERT INTO Leaderboard_Snapshot (periodo, bucket, juego, datos, fecha_actualizacion)
+                    VALUES (%s, %s, %s, %s, NOW())
+                    ON CONFLICT (periodo, bucket, juego)
+                    DO UPDATE SET datos = EXCLUDED.datos, fecha_actualizacion = NOW()
+                    """,
+                    (*key, json.dumps(merged.sorted()))
+                )
+                with self._lock:
+                    board = self._board(key)
+                    for e in merged.heap:
+                        board.push(e)
+            conn.commit()
+            cursor.close()
+        except Exception as e:
+            if conn: conn.rollback()
+            with self._lock:
+                self._dirty |= set(pending)
+            print(f"⚠️ Leaderboard: error al guardar snapshot ({e}), se reintentará")
+        finally:
+            if conn: conn.close()
+
+    async def run_snapshots(self, interval: float = LEADERBOARD_SNAPSHOT_SECONDS):
+        while True:
+            await asyncio.sleep(interval)
+            await asyncio.to_thread(self.snapshot)
+
+    async def start(self):
+        try:
+            await asyncio.to_thread(self.load)
+        except Exception as e:
+            print(f"⚠️ Leaderboard: no se pudieron cargar snapshots ({e})")
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self.run_snapshots())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        await asyncio.to_thread(self.snapshot)
+
+
+leaderboard = Leaderboard()
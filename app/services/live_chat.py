@@ -0,0 +1,751 @@
+import asyncio
+import json
+import random
+import time
+import uuid
+from datetime import datetime, timedelta
+import psycopg2
+from app.db import db_connect
+from app.services.event_hub import event_hub, EVENTOS_CANAL
+
+# Cada cuánto se guardan los mensajes recibidos, y tamaño máximo de cada lote
+# (si se llena antes, se guarda en cuanto se llena)
+CHAT_FLUSH_SECONDS = 0.2
+CHAT_FLUSH_MAX_BATCH = 500
+_FLUSH_RETRY_MAX_SECONDS = 10.0
+
+# Largo máximo de un mensaje. El texto viaja en el NOTIFY hacia los otros workers y
+# Postgres limita cada payload a 8000 bytes: 1000 caracteres caben aun con emojis.
+CHAT_MAX_TEXTO = 1000
+
+# Mensajes por conexión esperando salir por el socket; si el cliente no los lee se
+# corta y al reconectar se pone al día desde la BD
+CHAT_COLA_MAX = 500
+
+# Con la BD caída los mensajes se acumulan en memoria hasta este tope; después se
+# rechazan y el cliente los reintenta (los tiene en su bandeja de salida)
+CHAT_MAX_PENDIENTES = 20000
+
+# Tope de sockets de chat abiertos en este worker
+CHAT_MAX_CONEXIONES = 10000
+
+# Puesta al día al (re)conectar: mensajes desde la fecha que manda el cliente, con un
+# margen por los lotes de otros workers que hicieron commit un poco después
+CHAT_BACKFILL_LIMIT = 500
+CHAT_BACKFILL_MARGEN = timedelta(seconds=5)
+
+# Errores de un lote que son culpa de algún mensaje (texto que Postgres no acepta,
+# chat o usuario borrados a mitad de lote), no de la BD: reintentar igual volvería a
+# fallar. El lote se parte para guardar el resto y descartar solo el culpable.
+ERRORES_DE_MENSAJE = (ValueError, psycopg2.DataError, psycopg2.IntegrityError)
+
+# Identifica a este worker en los NOTIFY, para no entregar dos veces lo propio
+WORKER_ID = uuid.uuid4().hex[:12]
+
+COLUMNAS_CHAT = """
+    ALTER TABLE Mensaje_Chat ADD COLUMN IF NOT EXISTS uuid UUID;
+    CREATE UNIQUE INDEX IF NOT EXISTS idx_mensaje_chat_uuid ON Mensaje_Chat (uuid);
+    CREATE INDEX IF NOT EXISTS idx_chat_esperando ON Chat (fecha_inicio) WHERE estado = 'Esperando';
+"""
+
+# Un lote = un INSERT. El uuid lo genera el cliente: un reenvío (ack perdido,
+# reconexión) choca con el índice único y no se duplica. Solo los mensajes nuevos se
+# publican por NOTIFY, que Postgres entrega a los demás workers al hacer commit.
+GUARDAR_SQL = """
+    WITH nuevos AS (
+        INSERT INTO Mensaje_Chat (uuid, id_chat, id_usuario, es_agente, mensaje, fecha_mensaje)
+        SELECT m.uuid, m.id_chat, m.id_usuario, m.es_agente, m.mensaje, NOW()
+        FROM unnest(%s::uuid[], %s::int[], %s::int[], %s::boolean[], %s::text[])
+             WITH ORDINALITY AS m(uuid, id_chat, id_usuario, es_agente, mensaje, orden)
+        ORDER BY m.orden
+        ON CONFLICT (uuid) DO NOTHING
+        RETURNING id_mensaje, uuid, id_chat, id_usuario, es_agente, mensaje, fecha_mensaje
+    )
+    SELECT n.uuid::text, n.fecha_mensaje, pg_notify(%s, json_build_object(
+        'tipo', 'chat_mensaje', 'origen', %s::text, 'id_mensaje', n.id_mensaje, 'uuid', n.uuid,
+        'id_chat', n.id_chat, 'id_usuario', n.id_usuario, 'es_agente', n.es_agente,
+        'nombre_usuario', u.nombre, 'mensaje', n.mensaje, 'fecha_mensaje', n.fecha_mensaje)::text)
+    FROM nuevos n
+    JOIN Usuario u ON u.id_usuario = n.id_usuario
+"""
+
+COLUMNAS_MENSAJE = """
+    m.id_mensaje, COALESCE(m.uuid::text, m.id_mensaje::text) AS uuid, m.id_chat, m.id_usuario,
+    m.es_agente, u.nombre AS nombre_usuario, m.mensaje, m.fecha_mensaje
+"""
+
+
+def ensure_chat_columns():
+    """Agrega Mensaje_Chat.uuid (idempotencia de reenvíos) y el índice de chats en espera."""
+    conn = None
+    try:
+        conn = db_connect.get_connection()
+        cursor = conn.cursor()
+        cursor.execute(COLUMNAS_CHAT)
+        conn.commit()
+        cursor.close()
+    except Exception as e:
+        print(f"Error adding Mensaje_Chat columns: {e}")
+    finally:
+        if conn: conn.close()
+
+
+# ======================================================================
+#  Ciclo de vida del chat (lo usan las rutas REST del jugador y del agente).
+#  Los cambios de Chat se publican solos por el trigger evento_chat.
+# ======================================================================
+def crear_chat(cursor, id_jugador: int, mensaje: str) -> tuple:
+    """
+    Abre un chat 'Esperando' con el primer mensaje del jugador. Si ya tiene uno sin
+    cerrar, lo reutiliza (agregando el mensaje). Retorna (id_chat, es_nuevo).
+    """
+    cursor.execute(
+        "SELECT id_chat FROM Chat WHERE id_jugador = %s AND estado <> 'Cerrado' ORDER BY fecha_inicio DESC LIMIT 1",
+        (id_jugador,)
+    )
+    row = cursor.fetchone()
+    es_nuevo = row is None
+    if es_nuevo:
+        cursor.execute(
+            "INSERT INTO Chat (id_jugador, estado, fecha_inicio) VALUES (%s, 'Esperando', NOW()) RETURNING id_chat",
+            (id_jugador,)
+        )
+        row = cursor.fetchone()
+    id_chat = row[0]
+    cursor.execute(
+        """
+        INSERT INTO Mensaje_Chat (uuid, id_chat, id_usuario, es_agente, mensaje, fecha_mensaje)
+        VALUES (%s::uuid, %s, %s, FALSE, %s, NOW())
+        """,
+        (str(uuid.uuid4()), id_chat, id_jugador, mensaje[:CHAT_MAX_TEXTO])
+    )
+    return id_chat, es_nuevo
+
+
+def tomar_chat(cursor, id_chat: int, id_agente: int) -> bool:
+    """Asigna el chat al agente solo si sigue 'Esperando' (dos agentes no pueden tomarlo)."""
+    cursor.execute(
+        """
+        UPDATE Chat SET estado = 'Activo', id_agente = %s, fecha_asignacion = NOW()
+        WHERE id_chat = %s AND estado = 'Esperando'
+        RETURNING id_chat
+        """,
+        (id_agente, id_chat)
+    )
+    return cursor.fetchone() is not None
+
+
+def cerrar_chat(cursor, id_chat: int, id_agente: int) -> bool:
+    """Cierra el chat solo si lo atiende `id_agente` y sigue abierto."""
+    cursor.execute(
+        """
+        UPDATE Chat SET estado = 'Cerrado', fecha_cierre = NOW()
+        WHERE id_chat = %s AND id_agente = %s AND estado <> 'Cerrado'
+        RETURNING id_chat
+        """,
+        (id_chat, id_agente)
+    )
+    return cursor.fetchone() is not None
+
+
+class ChatError(Exception):
+    """Conexión rechazada; `codigo` es el close code del WebSocket."""
+
+    def __init__(self, mensaje: str, codigo: int):
+        super().__init__(mensaje)
+        self.codigo = codigo
+
+
+class Conexion:
+    """Un WebSocket abierto en una sala, con su cola de salida propia."""
+
+    __slots__ = ("ws", "id_chat", "id_usuario", "es_agente", "nombre", "cola", "escritor")
+
+    def __init__(self, ws, id_chat: int, id_usuario: int, es_agente: bool, nombre: str):
+        self.ws = ws
+        self.id_chat = id_chat
+        self.id_usuario = id_usuario
+        self.es_agente = es_agente
+        self.nombre = nombre
+        self.cola = asyncio.Queue(maxsize=CHAT_COLA_MAX)
+        self.escritor = None
+
+    def enviar(self, evento: dict) -> bool:
+        try:
+            self.cola.put_nowait(evento)
+            return True
+        except asyncio.QueueFull:
+            return False
+
+
+class Sala:
+    """Chat con al menos una conexión en este worker; el estado se mantiene con los eventos de Chat."""
+
+    __slots__ = ("id_chat", "id_jugador", "id_agente", "estado", "conexiones")
+
+    def __init__(self, id_chat: int, id_jugador: int, id_agente, estado: str):
+        self.id_chat = id_chat
+        self.id_jugador = id_jugador
+        self.id_agente = id_agente
+        self.estado = estado
+        self.conexiones = set()
+
+
+class ChatEngine:
+    """
+    Chat en vivo jugador-agente por WebSocket (/api/chat/ws/{id_chat}).
+
+    Cada worker lleva un registro en memoria de sus salas (chat -> sockets abiertos).
+    Un mensaje se reparte al instante a los sockets de la sala en este worker y queda
+    en un buffer que se guarda por lotes (un INSERT cada CHAT_FLUSH_SECONDS). Al
+    guardarse se confirma al remitente ('ack') y el NOTIFY del mismo INSERT lo lleva a
+    los demás workers por el event_hub.
+
+    Entrega al menos una vez: el cliente guarda lo que manda hasta recibir el ack y lo
+    reenvía al reconectar (el uuid lo hace idempotente); al reconectar pide la puesta
+    al día desde la fecha del último mensaje que vio (índice id_chat, fecha_mensaje) y
+    descarta por uuid lo que ya tenía.
+    """
+
+    def __init__(self, worker_id: str = WORKER_ID):
+        self.worker_id = worker_id
+        self._salas = {}
+        self._conexiones = 0
+        self._pendientes = []
+        self._en_vuelo = []
+        self._uuids_pendientes = set()
+        # uuid -> Conexion que espera el ack (la última que lo mandó)
+        self._por_confirmar = {}
+        self._despertar = None
+        self._task = None
+        self._metrics = {
+            "received": 0, "rejected": 0, "delivered": 0, "remote_delivered": 0,
+            "flushes": 0, "flush_errors": 0, "saved": 0, "duplicates": 0,
+            "slow_disconnects": 0, "backfilled": 0, "discarded": 0, "last_flush_ms": 0.0,
+        }
+
+    # ------------------------------------------------------------------
+    #  BD (en hilos, vía asyncio.to_thread)
+    # ------------------------------------------------------------------
+    def _cargar_chat(self, id_chat: int, id_usuario: int):
+        conn = db_connect.get_connection()
+        if conn is None:
+            raise RuntimeError("Error de conexión")
+        try:
+            cursor = conn.cursor()
+            cursor.execute(
+                """
+                SELECT c.id_jugador, c.id_agente, c.estado, j.nombre || ' ' || j.apellido, u.nombre
+                FROM Chat c
+                JOIN Usuario j ON j.id_usuario = c.id_jugador
+                JOIN Usuario u ON u.id_usuario = %s
+                WHERE c.id_chat = %s
+                """,
+                (id_usuario, id_chat)
+            )
+            row = cursor.fetchone()
+            cursor.close()
+            if row is None:
+                return None
+            return {"id_jugador": row[0], "id_agente": row[1], "estado": row[2],
+                    "nombre_jugador": row[3], "nombre_usuario": row[4]}
+        finally:
+            conn.close()
+
+    def _historial(self, id_chat: int, desde) -> list:
+        conn = db_connect.get_connection()
+        if conn is None:
+            raise RuntimeError("Error de conexión")
+        try:
+            cursor = conn.cursor()
+            if desde is None:
+                # Primera carga: los últimos CHAT_BACKFILL_LIMIT
+                cursor.execute(
+                    f"""
+                    SELECT * FROM (
+                        SELECT {COLUMNAS_MENSAJE}
+                        FROM Mensaje_Chat m JOIN Usuario u ON u.id_usuario = m.id_usuario
+                        WHERE m.id_chat = %s
+                        ORDER BY m.fecha_mensaje DESC, m.id_mensaje DESC
+                        LIMIT %s
+                    ) t ORDER BY fecha_mensaje, id_mensaje
+                    """,
+                    (id_chat, CHAT_BACKFILL_LIMIT)
+                )
+            else:
+                cursor.execute(
+                    f"""
+                    SELECT {COLUMNAS_MENSAJE}
+                    FROM Mensaje_Chat m JOIN Usuario u ON u.id_usuario = m.id_usuario
+                    WHERE m.id_chat = %s AND m.fecha_mensaje >= %s
+                    ORDER BY m.fecha_mensaje, m.id_mensaje
+                    LIMIT %s
+                    """,
+                    (id_chat, desde - CHAT_BACKFILL_MARGEN, CHAT_BACKFILL_LIMIT)
+                )
+            columnas = [c[0] for c in cursor.description]
+            filas = [dict(zip(columnas, row)) for row in cursor.fetchall()]
+            cursor.close()
+            return [self._como_evento(fila) for fila in filas]
+        finally:
+            conn.close()
+
+    def _guardar(self, lote: list) -> dict:
+        """Inserta el lote en una transacción. Retorna {uuid: fecha_mensaje} de los nuevos."""
+        conn = db_connect.get_connection()
+        if conn is None:
+            raise RuntimeError("Error de conexión")
+        try:
+            cursor = conn.cursor()
+            cursor.execute(GUARDAR_SQL, (
+                [m["uuid"] for m in lote], [m["id_chat"] for m in lote],
+                [m["id_usuario"] for m in lote], [m["es_agente"] for m in lote],
+                [m["mensaje"] for m in lote], EVENTOS_CANAL, self.worker_id,
+            ))
+            fechas = {row[0]: row[1].isoformat() for row in cursor.fetchall()}
+            conn.commit()
+            cursor.close()
+            return fechas
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
+
+    @staticmethod
+    def _como_evento(fila: dict) -> dict:
+        fecha = fila["fecha_mensaje"]
+        return {
+            "tipo": "mensaje", "uuid": str(fila["uuid"]), "id_chat": fila["id_chat"],
+            "id_usuario": fila["id_usuario"], "es_agente": fila["es_agente"],
+            "nombre_usuario": fila["nombre_usuario"], "mensaje": fila["mensaje"],
+            "fecha_mensaje": fecha.isoformat() if isinstance(fecha, datetime) else fecha,
+        }
+
+    # ------------------------------------------------------------------
+    #  Conexiones (en el event loop)
+    # ------------------------------------------------------------------
+    async def conectar(self, ws, id_usuario: int, es_agente: bool, id_chat: int, desde=None) -> Conexion:
+        """
+        Registra el socket en la sala y le manda la puesta al día. Lanza ChatError si el
+        chat no existe o el usuario no participa en él.
+        """
+        if self._conexiones >= CHAT_MAX_CONEXIONES:
+            raise ChatError("Demasiadas conexiones abiertas, intenta más tarde.", 1013)
+        try:
+            info = await asyncio.to_thread(self._cargar_chat, id_chat, id_usuario)
+        except Exception as e:
+            print(f"🚨 Chat: no se pudo cargar el chat {id_chat}: {e}")
+            raise ChatError("Error de conexión", 1011)
+        if info is None:
+            raise ChatError("Chat no encontrado", 4404)
+
+        sala = self._salas.get(id_chat)
+        if sala is None:
+            sala = Sala(id_chat, info["id_jugador"], info["id_agente"], info["estado"])
+            self._salas[id_chat] = sala
+        permitido = (sala.id_agente == id_usuario) if es_agente else (sala.id_jugador == id_usuario)
+        if not permitido:
+            if not sala.conexiones:
+                del self._salas[id_chat]
+            raise ChatError("No participas en este chat", 4403)
+
+        # Se registra ANTES de leer el historial: lo que llegue mientras tanto queda en
+        # su cola (y si se repite con el historial, el cliente lo descarta por uuid)
+        con = Conexion(ws, id_chat, id_usuario, es_agente, info["nombre_usuario"])
+        sala.conexiones.add(con)
+        self._conexiones += 1
+        try:
+            mensajes = await asyncio.to_thread(self._historial, id_chat, desde)
+        except Exception as e:
+            self.desconectar(con)
+            print(f"🚨 Chat: no se pudo leer el historial del chat {id_chat}: {e}")
+            raise ChatError("Error de conexión", 1011)
+        # Lo de este worker que aún no se guarda también cuenta
+        mensajes += [m for m in self._en_vuelo + self._pendientes if m["id_chat"] == id_chat]
+        self._metrics["backfilled"] += len(mensajes)
+
+        await ws.send_text(json.dumps({
+            "tipo": "historial",
+            "chat": {"id_chat": id_chat, "estado": sala.estado, "id_agente": sala.id_agente,
+                     "nombre_usuario": info["nombre_jugador"]},
+            "mensajes": mensajes,
+        }))
+        con.escritor = asyncio.get_running_loop().create_task(self._escribir(con))
+        return con
+
+    def desconectar(self, con: Conexion):
+        sala = self._salas.get(con.id_chat)
+        if sala is not None and con in sala.conexiones:
+            sala.conexiones.discard(con)
+            self._conexiones -= 1
+            if not sala.conexiones:
+                del self._salas[con.id_chat]
+        if con.escritor is not None:
+            con.escritor.cancel()
+            con.escritor = None
+
+    async def _escribir(self, con: Conexion):
+        try:
+            while True:
+                evento = await con.cola.get()
+                await con.ws.send_text(json.dumps(evento))
+        except asyncio.CancelledError:
+            pass
+        except Exception:
+            # Socket cerrado: el lector se entera y llama a desconectar()
+            pass
+
+    def _cortar(self, con: Conexion, codigo: int, razon: str):
+        self.desconectar(con)
+        asyncio.get_running_loop().create_task(self._cerrar_ws(con.ws, codigo, razon))
+
+    @staticmethod
+    async def _cerrar_ws(ws, codigo: int, razon: str):
+        try:
+            await ws.close(code=codigo, reason=razon)
+        except Exception:
+            pass
+
+    def _difundir(self, sala: Sala, evento: dict):
+        for con in list(sala.conexiones):
+            if con.enviar(evento):
+                self._metrics["delivered"] += 1
+            else:
+                # Cliente que no lee: se corta y al reconectar se pone al día desde la BD
+                self._metrics["slow_disconnects"] += 1
+                self._cortar(con, 1013, "Cliente lento")
+
+    # ------------------------------------------------------------------
+    #  Mensajes entrantes
+    # ------------------------------------------------------------------
+    def recibir(self, con: Conexion, datos: dict):
+        """Procesa un mensaje {"tipo": "mensaje", "uuid", "texto"} del socket."""
+        if not isinstance(datos, dict) or datos.get("tipo") != "mensaje":
+            return
+        try:
+            id_mensaje = str(uuid.UUID(str(datos.get("uuid"))))
+        except ValueError:
+            con.enviar({"tipo": "error", "error": "Mensaje sin uuid válido"})
+            return
+        # Postgres no acepta NUL en un texto ni surrogates sueltos (no son UTF-8)
+        texto = str(datos.get("texto") or "").replace("\x00", "").strip()
+        error = None
+        sala = self._salas.get(con.id_chat)
+        if not texto:
+            error = "El mensaje está vacío"
+        elif any("\ud800" <= c <= "\udfff" for c in texto):
+            error = "El mensaje tiene caracteres inválidos"
+        elif len(texto) > CHAT_MAX_TEXTO:
+            error = f"El mensaje supera los {CHAT_MAX_TEXTO} caracteres"
+        elif sala is None or sala.estado == "Cerrado":
+            error = "El chat está cerrado"
+        elif con.es_agente and sala.id_agente != con.id_usuario:
+            error = "El chat lo atiende otro agente"
+        elif len(self._pendientes) >= CHAT_MAX_PENDIENTES:
+            # Sin 'definitivo': el cliente lo deja en su bandeja y lo reintenta
+            self._metrics["rejected"] += 1
+            con.enviar({"tipo": "error", "uuid": id_mensaje, "error": "Servidor ocupado, reintentando..."})
+            return
+        if error:
+            self._metrics["rejected"] += 1
+            con.enviar({"tipo": "error", "uuid": id_mensaje, "error": error, "definitivo": True})
+            return
+
+        self._metrics["received"] += 1
+        self._por_confirmar[id_mensaje] = con
+        if id_mensaje in self._uuids_pendientes:
+            return  # Reenvío de algo que todavía no se guarda: solo cambia a quién confirmar
+        mensaje = {
+            "tipo": "mensaje", "uuid": id_mensaje, "id_chat": con.id_chat,
+            "id_usuario": con.id_usuario, "es_agente": con.es_agente,
+            "nombre_usuario": con.nombre, "mensaje": texto,
+            "fecha_mensaje": datetime.now().isoformat(),
+        }
+        self._uuids_pendientes.add(id_mensaje)
+        self._pendientes.append(mensaje)
+        self._difundir(sala, mensaje)
+        if len(self._pendientes) >= CHAT_FLUSH_MAX_BATCH and self._despertar is not None:
+            self._despertar.set()
+
+    # ------------------------------------------------------------------
+    #  Eventos de la BD (NOTIFY vía event_hub, en el event loop)
+    # ------------------------------------------------------------------
+    def on_evento(self, evento: dict):
+        tipo = evento.get("tipo")
+        if tipo == "resync":
+            # El LISTEN se cortó y pudo perderse algo: todos reconectan y se ponen al día
+            for sala in list(self._salas.values()):
+                for con in list(sala.conexiones):
+                    self._cortar(con, 1012, "Reconectar")
+            return
+        sala = self._salas.get(evento.get("id_chat"))
+        if sala is None:
+            return
+        if tipo == "chat_mensaje":
+            if evento.get("origen") == self.worker_id:
+                return  # Ya se repartió al recibirlo
+            mensaje = {k: v for k, v in evento.items() if k != "origen"}
+            mensaje["tipo"] = "mensaje"
+            mensaje["uuid"] = str(mensaje.get("uuid"))
+            self._metrics["remote_delivered"] += len(sala.conexiones)
+            self._difundir(sala, mensaje)
+        elif tipo in ("chat_tomado", "chat_cerrado"):
+            sala.estado = evento.get("estado")
+            sala.id_agente = evento.get("id_agente")
+            self._difundir(sala, {"tipo": "estado", "estado": sala.estado, "id_agente": sala.id_agente})
+
+    # ------------------------------------------------------------------
+    #  Guardado por lotes
+    # ------------------------------------------------------------------
+    async def _guardar_partido(self, lote: list) -> tuple:
+        """
+        Guarda el lote; si falla por un mensaje (ERRORES_DE_MENSAJE) lo parte en dos
+        y guarda cada mitad, hasta aislar a los culpables. Retorna ({uuid: fecha},
+        [(mensaje, error)] descartados). Los errores de la BD se propagan.
+        """
+        try:
+            return await asyncio.to_thread(self._guardar, lote), []
+        except ERRORES_DE_MENSAJE as e:
+            if len(lote) == 1:
+                return {}, [(lote[0], e)]
+        mitad = len(lote) // 2
+        fechas, descartados = await self._guardar_partido(lote[:mitad])
+        fechas_resto, descartados_resto = await self._guardar_partido(lote[mitad:])
+        return {**fechas, **fechas_resto}, descartados + descartados_resto
+
+    async def flush(self) -> bool:
+        """
+        Guarda un lote del buffer. Si la BD falla, lo devuelve al frente para
+        reintentarlo; un mensaje que Postgres rechaza se descarta y el resto se guarda.
+        """
+        if not self._pendientes:
+            return True
+        lote = self._pendientes[:CHAT_FLUSH_MAX_BATCH]
+        del self._pendientes[:CHAT_FLUSH_MAX_BATCH]
+        self._en_vuelo = lote
+        t0 = time.perf_counter()
+        try:
+            fechas, descartados = await self._guardar_partido(lote)
+        except Exception as e:
+            self._pendientes[:0] = lote
+            self._metrics["flush_errors"] += 1
+            print(f"⚠️ Chat: error al guardar {len(lote)} mensajes ({e}), se reintentará")
+            return False
+        finally:
+            self._en_vuelo = []
+
+        for mensaje, error in descartados:
+            # Sin reintento posible: se avisa al remitente con 'definitivo' (lo quita
+            # de su bandeja de salida) y queda en el log
+            print(f"🚨 Chat: mensaje {mensaje['uuid']} del chat {mensaje['id_chat']} descartado: {error}")
+            self._uuids_pendientes.discard(mensaje["uuid"])
+            con = self._por_confirmar.pop(mensaje["uuid"], None)
+            if con is not None:
+                con.enviar({"tipo": "error", "uuid": mensaje["uuid"], "error": "No se pudo guardar el mensaje", "definitivo": True})
+        if descartados:
+            self._metrics["discarded"] += len(descartados)
+            ids_descartados = {mensaje["uuid"] for mensaje, _ in descartados}
+            lote = [m for m in lote if m["uuid"] not in ids_descartados]
+
+        for mensaje in lote:
+            self._uuids_pendientes.discard(mensaje["uuid"])
+            con = self._por_confirmar.pop(mensaje["uuid"], None)
+            if con is not None:
+                con.enviar({"tipo": "ack", "uuid": mensaje["uuid"], "fecha_mensaje": fechas.get(mensaje["uuid"])})
+        self._metrics["flushes"] += 1
+        self._metrics["saved"] += len(fechas)
+        self._metrics["duplicates"] += len(lote) - len(fechas)
+        self._metrics["last_flush_ms"] = round((time.perf_counter() - t0) * 1000, 1)
+        return True
+
+    async def run_flusher(self):
+        espera = CHAT_FLUSH_SECONDS
+        while True:
+            try:
+                await asyncio.wait_for(self._despertar.wait(), CHAT_FLUSH_SECONDS)
+            except asyncio.TimeoutError:
+                pass
+            self._despertar.clear()
+            while self._pendientes:
+                if not await self.flush():
+                    # BD con problemas: se espera cada vez más (con tope) antes de reintentar
+                    await asyncio.sleep(espera)
+                    espera = min(espera * 2, _FLUSH_RETRY_MAX_SECONDS)
+                    break
+                espera = CHAT_FLUSH_SECONDS
+
+    def start(self):
+        if self._task is None:
+            self._despertar = asyncio.Event()
+            event_hub.add_listener(self.on_evento)
+            self._task = asyncio.get_running_loop().create_task(self.run_flusher())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        event_hub.remove_listener(self.on_evento)
+        # Lo que quede en el buffer se guarda antes de cerrar los sockets
+        for _ in range(2):
+            while self._pendientes and await self.flush():
+                pass
+        for sala in list(self._salas.values()):
+            for con in list(sala.conexiones):
+                self._cortar(con, 1012, "Servidor reiniciando")
+
+    def stats(self) -> dict:
+        return {
+            **self._metrics,
+            "rooms": len(self._salas), "connections": self._conexiones,
+            "pending": len(self._pendientes) + len(self._en_vuelo),
+            "awaiting_ack": len(self._por_confirmar), "worker": self.worker_id,
+        }
+
+
+live_chat = ChatEngine()
+
+
+# ======================================================================
+#  Prueba de carga en proceso: python -m app.services.live_chat [chats] [mensajes]
+#
+#  Varios ChatEngine (uno por "worker") con sockets simulados. Cada chat tiene
+#  al jugador en un worker y al agente en otro, así todo mensaje cruza de worker
+#  como en producción (el NOTIFY se simula al "guardar"). La BD se simula con
+#  latencia por lote y el primer lote de cada worker falla, para ejercitar el
+#  reintento; unos pocos mensajes los rechaza la BD y deben descartarse sin
+#  frenar a los demás. Verifica que todo mensaje se entregue al otro participante, se
+#  confirme al remitente y se guarde exactamente una vez.
+# ======================================================================
+class _SocketSimulado:
+    def __init__(self):
+        self.recibidos = []
+        self.acks = set()
+        self.errores = set()
+        self.cerrado = None
+
+    async def send_text(self, texto: str):
+        evento = json.loads(texto)
+        if evento["tipo"] == "mensaje":
+            self.recibidos.append((evento["uuid"], time.perf_counter()))
+        elif evento["tipo"] == "ack":
+            self.acks.add(evento["uuid"])
+        elif evento["tipo"] == "error" and evento.get("definitivo"):
+            self.errores.add(evento["uuid"])
+
+    async def close(self, code: int = 1000, reason: str = ""):
+        self.cerrado = code
+
+
+async def _prueba_carga(chats: int, mensajes_por_chat: int, workers: int = 4):
+    loop = asyncio.get_running_loop()
+    motores = [ChatEngine(worker_id=f"w{i}") for i in range(workers)]
+    guardados = {}
+    enviados = {}
+
+    for motor in motores:
+        fallas = {"pendientes": 1}
+
+        def cargar(id_chat, id_usuario):
+            return {"id_jugador": id_chat * 2, "id_agente": id_chat * 2 + 1, "estado": "Activo",
+                    "nombre_jugador": f"Jugador {id_chat}", "nombre_usuario": f"U{id_usuario}"}
+
+        def guardar(lote, motor=motor, fallas=fallas):
+            time.sleep(0.003 + 0.00002 * len(lote))
+            if fallas["pendientes"]:
+                fallas["pendientes"] -= 1
+                raise RuntimeError("falla simulada")
+            if any(m["mensaje"] == "veneno" for m in lote):
+                # Como una FK rota (chat borrado a mitad de lote): falla todo el lote
+                raise psycopg2.IntegrityError("violates foreign key constraint")
+            fechas = {}
+            for m in lote:
+                if m["uuid"] not in guardados:
+                    guardados[m["uuid"]] = m
+                    fechas[m["uuid"]] = datetime.now().isoformat()
+                    evento = {**m, "tipo": "chat_mensaje", "origen": motor.worker_id}
+                    for otro in motores:
+                        loop.call_soon_threadsafe(otro.on_evento, evento)
+            return fechas
+
+        motor._cargar_chat = cargar
+        motor._historial = lambda id_chat, desde: []
+        motor._guardar = guardar
+        motor._despertar = asyncio.Event()
+        motor._task = loop.create_task(motor.run_flusher())
+
+    participantes = []
+    for id_chat in range(1, chats + 1):
+        for lado, es_agente in ((0, False), (1, True)):
+            ws = _SocketSimulado()
+            motor = motores[(id_chat + lado) % workers]
+            con = await motor.conectar(ws, id_chat * 2 + lado, es_agente, id_chat)
+            participantes.append((motor, con, ws))
+
+    venenos = {}
+
+    async def conversar(motor, con, ws):
+        for _ in range(mensajes_por_chat // 2):
+            await asyncio.sleep(random.uniform(0, 2.0))
+            if random.random() < 0.001:
+                # Mensaje que la BD rechaza: se descarta solo, sin frenar al resto
+                id_veneno = str(uuid.uuid4())
+                venenos[id_veneno] = ws
+                motor.recibir(con, {"tipo": "mensaje", "uuid": id_veneno, "texto": "veneno"})
+            id_mensaje = str(uuid.uuid4())
+            enviados[id_mensaje] = (con.id_chat, con.id_usuario, time.perf_counter())
+            motor.recibir(con, {"tipo": "mensaje", "uuid": id_mensaje, "texto": "hola"})
+            if random.random() < 0.02:
+                # Ack "perdido": el cliente reenvía el mismo uuid
+                motor.recibir(con, {"tipo": "mensaje", "uuid": id_mensaje, "texto": "hola"})
+
+    t0 = time.perf_counter()
+    await asyncio.gather(*(conversar(*p) for p in participantes))
+    limite = time.perf_counter() + 30
+    while time.perf_counter() < limite:
+        acks = sum(len(ws.acks) for _, _, ws in participantes)
+        if acks >= len(enviados) and not any(m._pendientes or m._en_vuelo for m in motores):
+            break
+        await asyncio.sleep(0.1)
+    await asyncio.sleep(0.2)
+    duracion = time.perf_counter() - t0
+
+    # Entrega: cada mensaje debe llegar al OTRO participante del chat
+    latencias = []
+    faltantes = 0
+    por_usuario = {con.id_usuario: ws for _, con, ws in participantes}
+    for id_mensaje, (id_chat, id_usuario, enviado_en) in enviados.items():
+        otro = id_chat * 2 + (1 - (id_usuario - id_chat * 2))
+        llegadas = [t for u, t in por_usuario[otro].recibidos if u == id_mensaje]
+        if not llegadas:
+            faltantes += 1
+        else:
+            latencias.append((llegadas[0] - enviado_en) * 1000)
+    latencias.sort()
+    acks = sum(len(ws.acks) for _, _, ws in participantes)
+
+    for motor in motores:
+        motor._task.cancel()
+    print(f"Chats: {chats} | sockets: {len(participantes)} | workers: {workers}")
+    print(f"Mensajes enviados: {len(enviados)} | guardados: {len(guardados)} | confirmados: {acks} | sin entregar: {faltantes}")
+    if latencias:
+        p = lambda q: latencias[min(len(latencias) - 1, int(q * len(latencias)))]
+        print(f"Latencia entre workers: p50 {p(0.5):.1f} ms | p99 {p(0.99):.1f} ms | máx {latencias[-1]:.1f} ms")
+    print(f"Duración: {duracion:.1f} s ({len(enviados) / duracion:.0f} mensajes/s)")
+    for motor in motores:
+        s = motor.stats()
+        print(f"  {s['worker']}: lotes {s['flushes']}, errores {s['flush_errors']}, duplicados {s['duplicates']}, "
+              f"último lote {s['last_flush_ms']} ms")
+    rechazados = sum(id_veneno in ws.errores for id_veneno, ws in venenos.items())
+    print(f"Mensajes que la BD rechaza: {len(venenos)} | descartados con aviso al remitente: {rechazados}")
+    ok = (faltantes == 0 and len(guardados) == len(enviados) and acks == len(enviados)
+          and rechazados == len(venenos))
+    print("✅ Todo entregado, confirmado y guardado una vez" if ok else "🚨 Hubo mensajes perdidos")
+    return ok
+
+
+if __name__ == "__main__":
+    import sys
+    total_chats = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    total_mensajes = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+    asyncio.run(_prueba_carga(total_chats, total_mensajes))
@@ -0,0 +1,309 @@
+import asyncio
+import collections
+import random
+import threading
+import time
+from datetime import datetime
+from app.db import db_connect
+from app.services.user_locks import USER_LOCK_NAMESPACE
+from app.services.agent_stats import lote_contadores_agente_viejos
+
+# Cada cuánto corre el barrido y cuánto se desvía al azar (±20 %) para que los
+# workers no consulten todos a la vez
+MAINT_INTERVAL_SECONDS = 15 * 60
+MAINT_JITTER = 0.2
+
+# Filas por lote (una transacción corta cada uno) y tope de lotes por tarea en una
+# corrida: lo que no alcance se procesa en la siguiente.
+MAINT_BATCH_SIZE = 500
+MAINT_MAX_BATCHES = 50
+MAINT_BATCH_PAUSE_SECONDS = 0.05
+MAINT_LOCK_TIMEOUT = "2s"
+
+# Antigüedad a partir de la cual se da por vencido un registro pendiente
+MAINT_RETIRO_PENDIENTE_DIAS = 30
+MAINT_TICKET_INACTIVO_DIAS = 30
+
+# pg_try_advisory_lock(clase, 0): solo el worker que lo obtiene corre el barrido
+MAINT_LOCK_CLASS = 4301
+
+# Corridas recientes que se guardan para /metrics/maintenance
+MAINT_HISTORY = 20
+
+# Índices parciales con EXACTAMENTE los predicados de los lotes: solo contienen las
+# filas vivas (pocas), así cada lote no recorre el histórico.
+INDICES_MANTENIMIENTO = """
+    CREATE INDEX IF NOT EXISTS idx_usuario_bono_activo ON Usuario_Bono (id_bono) WHERE estado = 'Activo';
+    CREATE INDEX IF NOT EXISTS idx_bono_expiracion ON Bono (fecha_expiracion) WHERE fecha_expiracion IS NOT NULL;
+    CREATE INDEX IF NOT EXISTS idx_transaccion_retiro_pendiente ON Transaccion (fecha_transaccion)
+        WHERE tipo_transaccion = 'Retiro' AND estado = 'Pendiente';
+    CREATE INDEX IF NOT EXISTS idx_soporte_abierto_fecha ON Soporte (fecha_creacion)
+        WHERE estado IN ('Abierto', 'En Proceso');
+"""
+
+
+def ensure_maintenance_indexes():
+    """Crea los índices parciales que usan los lotes del barrido."""
+    conn = None
+    try:
+        conn = db_connect.get_connection()
+        cursor = conn.cursor()
+        cursor.execute(INDICES_MANTENIMIENTO)
+        conn.commit()
+        cursor.close()
+    except Exception as e:
+        print(f"Error creating maintenance indexes: {e}")
+    finally:
+        if conn: conn.close()
+
+
+# ======================================================================
+#  Lotes. Cada uno procesa como mucho `lote` filas y devuelve cuántas
+#  cambió; FOR UPDATE SKIP LOCKED salta las filas que otra transacción
+#  está tocando en ese momento.
+# ======================================================================
+def lote_bonos_expirados(cursor, lote: int) -> int:
+    """
+    Usuario_Bono 'Activo' cuyo bono ya venció -> 'Expirado' (pasa al historial).
+    Vence el mismo día de fecha_expiracion, igual que al reclamar (elegible, RECLAMO_SQL).
+    """
+    cursor.execute(
+        """
+        UPDATE Usuario_Bono ub SET estado = 'Expirado'
+        FROM (
+            SELECT ub2.id_usuario, ub2.id_bono
+            FROM Usuario_Bono ub2
+            JOIN Bono b ON b.id_bono = ub2.id_bono
+            WHERE ub2.estado = 'Activo' AND b.fecha_expiracion IS NOT NULL AND b.fecha_expiracion <= CURRENT_DATE
+            LIMIT %s
+            FOR UPDATE OF ub2 SKIP LOCKED
+        ) v
+        WHERE ub.id_usuario = v.id_usuario AND ub.id_bono = v.id_bono
+        """,
+        (lote,)
+    )
+    return cursor.rowcount
+
+
+def lote_retiros_vencidos(cursor, lote: int) -> int:
+    """
+    Retiros 'Pendiente' sin resolver en MAINT_RETIRO_PENDIENTE_DIAS -> 'Fallida',
+    devolviendo el monto al saldo (se descontó al solicitarlo).
+
+    El saldo se toca con el mismo advisory lock por usuario que los juegos y la
+    billetera; los usuarios con una operación en curso se dejan para la siguiente corrida.
+    """
+    cursor.execute(
+        """
+        SELECT id_transaccion, id_usuario, monto
+        FROM Transaccion
+        WHERE tipo_transaccion = 'Retiro' AND estado = 'Pendiente'
+          AND fecha_transaccion < NOW() - make_interval(days => %s)
+        ORDER BY fecha_transaccion
+        LIMIT %s
+        FOR UPDATE SKIP LOCKED
+        """,
+        (MAINT_RETIRO_PENDIENTE_DIAS, lote)
+    )
+    filas = cursor.fetchall()
+    if not filas:
+        return 0
+
+    usuarios = sorted({row[1] for row in filas})
+    cursor.execute(
+        "SELECT u FROM unnest(%s::int[]) AS u WHERE pg_try_advisory_xact_lock(%s, u)",
+        (usuarios, USER_LOCK_NAMESPACE)
+    )
+    libres = {row[0] for row in cursor.fetchall()}
+    filas = [row for row in filas if row[1] in libres]
+    if not filas:
+        return 0
+
+    cursor.execute(
+        "UPDATE Transaccion SET estado = 'Fallida' WHERE id_transaccion = ANY(%s)",
+        ([row[0] for row in filas],)
+    )
+    reembolsos = {}
+    for _, id_usuario, monto in filas:
+        reembolsos[id_usuario] = reembolsos.get(id_usuario, 0) + monto
+    cursor.execute(
+        """
+        UPDATE Saldo s SET saldo_actual = s.saldo_actual + r.monto, ultima_actualizacion = NOW()
+        FROM unnest(%s::int[], %s::numeric[]) AS r(id_usuario, monto)
+        WHERE s.id_usuario = r.id_usuario
+        """,
+        (list(reembolsos.keys()), list(reembolsos.values()))
+    )
+    return len(filas)
+
+
+def lote_tickets_inactivos(cursor, lote: int) -> int:
+    """Tickets abiertos sin respuestas en MAINT_TICKET_INACTIVO_DIAS -> 'Cerrado'."""
+    cursor.execute(
+        """
+        UPDATE Soporte s SET estado = 'Cerrado', fecha_cierre = NOW()
+        FROM (
+            SELECT t.id_ticket
+            FROM Soporte t
+            WHERE t.estado IN ('Abierto', 'En Proceso')
+              AND t.fecha_creacion < NOW() - make_interval(days => %(dias)s)
+              AND NOT EXISTS (
+                  SELECT 1 FROM RespuestaTicket r
+                  WHERE r.id_ticket = t.id_ticket
+                    AND r.fecha_respuesta >= NOW() - make_interval(days => %(dias)s))
+            ORDER BY t.fecha_creacion
+            LIMIT %(lote)s
+            FOR UPDATE OF t SKIP LOCKED
+        ) v
+        WHERE s.id_ticket = v.id_ticket
+        """,
+        {"dias": MAINT_TICKET_INACTIVO_DIAS, "lote": lote}
+    )
+    return cursor.rowcount
+
+
+TAREAS = [
+    ("bonos_expirados", lote_bonos_expirados),
+    ("retiros_vencidos", lote_retiros_vencidos),
+    ("tickets_inactivos", lote_tickets_inactivos),
+    ("contadores_agente", lote_contadores_agente_viejos),
+]
+
+
+class MaintenanceSweeper:
+    """
+    Barrido periódico que vence y cierra registros olvidados, en lotes acotados.
+
+    Corre en todos los workers pero solo uno trabaja a la vez: el que obtiene el
+    advisory lock de sesión MAINT_LOCK_CLASS (se libera solo si el worker muere).
+    También se puede correr a mano: python -m app.services.maintenance
+    """
+
+    def __init__(self, interval: float = MAINT_INTERVAL_SECONDS, batch_size: int = MAINT_BATCH_SIZE):
+        self.interval = interval
+        self.batch_size = batch_size
+        self._lock = threading.Lock()
+        self._stopping = threading.Event()
+        self._task = None
+        self._history = collections.deque(maxlen=MAINT_HISTORY)
+        self._metrics = {"runs": 0, "skipped_not_leader": 0, "errors": 0, "lock_timeouts": 0}
+        self._totals = {nombre: 0 for nombre, _ in TAREAS}
+
+    def run_once(self):
+        """
+        Una corrida completa si este proceso es el líder. Devuelve el resumen de la
+        corrida o None si otro worker la tiene.
+        """
+        conn = db_connect.get_connection()
+        if conn is None:
+            return None
+        try:
+            cursor = conn.cursor()
+            cursor.execute("SELECT pg_try_advisory_lock(%s, 0)", (MAINT_LOCK_CLASS,))
+            if not cursor.fetchone()[0]:
+                conn.rollback()
+                with self._lock:
+                    self._metrics["skipped_not_leader"] += 1
+                return None
+            conn.commit()
+            try:
+                return self._run_tasks(conn, cursor)
+            finally:
+                conn.rollback()
+                cursor.execute("SELECT pg_advisory_unlock(%s, 0)", (MAINT_LOCK_CLASS,))
+                conn.commit()
+                cursor.close()
+        except Exception as e:
+            with self._lock:
+                self._metrics["errors"] += 1
+            print(f"🚨 Mantenimiento: error en el barrido: {e}")
+            return None
+        finally:
+            conn.close()
+
+    def _run_tasks(self, conn, cursor) -> dict:
+        t0 = time.perf_counter()
+        corrida = {"inicio": datetime.now().isoformat(timespec="seconds"), "tareas": {}, "lotes": 0}
+        for nombre, lote_fn in TAREAS:
+            filas = 0
+            for _ in range(MAINT_MAX_BATCHES):
+                if self._stopping.is_set():
+                    break
+                try:
+                    cursor.execute(f"SET LOCAL lock_timeout = '{MAINT_LOCK_TIMEOUT}'")
+                    procesadas = lote_fn(cursor, self.batch_size)
+                    conn.commit()
+                except Exception as e:
+                    conn.rollback()
+                    if getattr(e, "pgcode", None) == "55P03":  # lock_not_available
+                        with self._lock:
+                            self._metrics["lock_timeouts"] += 1
+                    else:
+                        with self._lock:
+                            self._metrics["errors"] += 1
+                        print(f"⚠️ Mantenimiento: falló un lote de '{nombre}' ({e})")
+                    break
+                filas += procesadas
+                corrida["lotes"] += 1
+                if procesadas < self.batch_size:
+                    break
+                time.sleep(MAINT_BATCH_PAUSE_SECONDS)
+            corrida["tareas"][nombre] = filas
+
+        corrida["duracion_ms"] = round((time.perf_counter() - t0) * 1000, 1)
+        with self._lock:
+            self._metrics["runs"] += 1
+            for nombre, filas in corrida["tareas"].items():
+                self._totals[nombre] += filas
+            self._history.append(corrida)
+        if any(corrida["tareas"].values()):
+            print(f"✅ Mantenimiento: {corrida['tareas']} en {corrida['duracion_ms']} ms")
+        return corrida
+
+    # ------------------------------------------------------------------
+    #  Tarea de fondo
+    # ------------------------------------------------------------------
+    def _next_delay(self) -> float:
+        return self.interval * random.uniform(1 - MAINT_JITTER, 1 + MAINT_JITTER)
+
+    async def run_worker(self):
+        # Arranque escalonado: los workers de gunicorn suelen levantarse juntos
+        await asyncio.sleep(random.uniform(0, self.interval * MAINT_JITTER))
+        while True:
+            await asyncio.to_thread(self.run_once)
+            await asyncio.sleep(self._next_delay())
+
+    def start(self):
+        if self._task is None:
+            self._stopping.clear()
+            self._task = asyncio.get_running_loop().create_task(self.run_worker())
+
+    async def stop(self):
+        # El lote en curso termina; el resto se retoma en la siguiente corrida
+        self._stopping.set()
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                **self._metrics,
+                "totals": dict(self._totals),
+                "last_run": self._history[-1] if self._history else None,
+                "history": list(self._history),
+                "running": self._task is not None,
+            }
+
+
+maintenance = MaintenanceSweeper()
+
+
+# ======== Corrida manual (python -m app.services.maintenance) =========
+if __name__ == "__main__":
+    ensure_maintenance_indexes()
+    resultado = maintenance.run_once()
+    if resultado is None:
+        print("⛔ Otro proceso tiene el barrido en curso (o no hay conexión).")
+    else:
+        print(resultado)
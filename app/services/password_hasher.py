@@ -0,0 +1,217 @@
+import asyncio
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from fastapi import HTTPException, status
+from passlib.context import CryptContext
+
+# Parámetros de Argon2id. Los valores por defecto son los de passlib; para ajustarlos
+# al hardware de producción usar calibrate_argon2.py y configurar estas variables.
+# Los hashes guardados con otros parámetros se rehashean al hacer login.
+ARGON2_TIME_COST = int(os.getenv("ARGON2_TIME_COST", "3"))
+ARGON2_MEMORY_COST = int(os.getenv("ARGON2_MEMORY_COST", "65536"))  # KiB
+ARGON2_PARALLELISM = int(os.getenv("ARGON2_PARALLELISM", "4"))
+
+# Configura el contexto de hasheo
+# Usamos Argon2 porque bcrypt estaba dando problemas en Render
+pwd_context = CryptContext(
+    schemes=["argon2"],
+    deprecated="auto",
+    argon2__rounds=ARGON2_TIME_COST,
+    argon2__memory_cost=ARGON2_MEMORY_COST,
+    argon2__parallelism=ARGON2_PARALLELISM,
+)
+
+# Procesos dedicados a Argon2 por worker de gunicorn
+PASSWORD_HASH_PROCESSES = int(os.getenv("PASSWORD_HASH_PROCESSES", "2"))
+
+# Hashes en vuelo por proceso. Un poco más de 1 mantiene los procesos ocupados
+# sin acumular trabajo dentro del executor, donde ya no se puede medir ni cancelar.
+PASSWORD_HASH_PER_PROCESS = 2
+
+# Peticiones esperando turno a partir de las cuales se rechaza con 503
+PASSWORD_HASH_MAX_QUEUE = int(os.getenv("PASSWORD_HASH_MAX_QUEUE", "200"))
+
+
+class PasswordHasherBusyError(HTTPException):
+    """Demasiados hashes esperando turno; el cliente debe reintentar más tarde."""
+
+    def __init__(self):
+        super().__init__(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="El servidor está ocupado. Intenta de nuevo en unos segundos."
+        )
+
+
+# Funciones de nivel de módulo para que el pool de procesos pueda serializarlas
+def _hash(password: str) -> str:
+    return pwd_context.hash(password)
+
+
+def _verify(password: str, password_hash: str) -> bool:
+    return pwd_context.verify(password, password_hash)
+
+
+def _verify_and_update(password: str, password_hash: str):
+    return pwd_context.verify_and_update(password, password_hash)
+
+
+class PasswordHasher:
+    """
+    Ejecuta hash/verify de Argon2 en un pool de procesos acotado, fuera del event loop.
+
+    Un semáforo limita cuántas operaciones están dentro del pool; el resto espera
+    en el event loop (cola medible) y, si la cola se llena, se rechaza con 503.
+    """
+
+    def __init__(self, processes: int = PASSWORD_HASH_PROCESSES, max_queue: int = PASSWORD_HASH_MAX_QUEUE):
+        self.processes = max(1, processes)
+        self.max_queue = max_queue
+        self.concurrency = self.processes * PASSWORD_HASH_PER_PROCESS
+        self._executor = None
+        self._semaphore = None
+        self._waiting = 0
+        self._running = 0
+        self._metrics = {
+            "completed": 0,
+            "rejected": 0,
+            "errors": 0,
+            "queue_max": 0,
+            "wait_total_ms": 0.0,
+            "wait_max_ms": 0.0,
+            "run_total_ms": 0.0,
+        }
+
+    def _get_executor(self):
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(max_workers=self.processes)
+        return self._executor
+
+    def _get_semaphore(self):
+        # Se crea perezosamente para quedar atado al event loop que atiende peticiones
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+        return self._semaphore
+
+    def start(self):
+        """Levanta los procesos al arrancar para no pagar el fork en el primer login."""
+        executor = self._get_executor()
+        for _ in range(self.processes):
+            executor.submit(os.getpid)
+
+    def stop(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    async def _run(self, func, *args):
+        if self._waiting >= self.max_queue:
+            self._metrics["rejected"] += 1
+            raise PasswordHasherBusyError()
+
+        semaphore = self._get_semaphore()
+        queued_at = time.monotonic()
+        self._waiting += 1
+        self._metrics["queue_max"] = max(self._metrics["queue_max"], self._waiting)
+        try:
+            await semaphore.acquire()
+        finally:
+            self._waiting -= 1
+
+        started = time.monotonic()
+        waited_ms = (started - queued_at) * 1000
+        self._metrics["wait_total_ms"] += waited_ms
+        self._metrics["wait_max_ms"] = max(self._metrics["wait_max_ms"], waited_ms)
+        self._running += 1
+        try:
+            loop = asyncio.get_running_loop()
+            try:
+                return await loop.run_in_executor(self._get_executor(), func, *args)
+            except BrokenProcessPool:
+                # Un proceso murió (OOM, kill); recreamos el pool y reintentamos una vez
+                print("⚠️ Password hasher: pool de procesos roto, recreándolo")
+                self._executor = None
+                return await loop.run_in_executor(self._get_executor(), func, *args)
+        except Exception:
+            self._metrics["errors"] += 1
+            raise
+        finally:
+            self._running -= 1
+            self._metrics["completed"] += 1
+            self._metrics["run_total_ms"] += (time.monotonic() - started) * 1000
+            semaphore.release()
+
+    async def hash(self, password: str) -> str:
+        return await self._run(_hash, password)
+
+    async def verify(self, password: str, password_hash: str) -> bool:
+        return await self._run(_verify, password, password_hash)
+
+    async def verify_and_update(self, password: str, password_hash: str):
+        """
+        Verifica y, si el hash usa parámetros viejos, retorna también el hash nuevo.
+        Retorna (valido, nuevo_hash_o_None); el rehash corre en el mismo viaje al pool.
+        """
+        return await self._run(_verify_and_update, password, password_hash)
+
+    def stats(self) -> dict:
+        completed = self._metrics["completed"]
+        return {
+            **self._metrics,
+            "processes": self.processes,
+            "concurrency": self.concurrency,
+            "queue_depth": self._waiting,
+            "running": self._running,
+            "wait_avg_ms": round(self._metrics["wait_total_ms"] / completed, 3) if completed else 0.0,
+            "run_avg_ms": round(self._metrics["run_total_ms"] / completed, 3) if completed else 0.0,
+        }
+
+
+password_hasher = PasswordHasher()
+
+
+# ======== Benchmark directo (python -m app.services.password_hasher [logins]) =========
+if __name__ == "__main__":
+    # Tormenta de logins + un endpoint "ligero" concurrente: mide la latencia del
+    # endpoint ligero con Argon2 en el event loop y con Argon2 en el pool de procesos.
+    import statistics
+    import sys
+    logins = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    stored = pwd_context.hash("contrasena-de-prueba")
+
+    async def _light_endpoint(latencies, stop):
+        # Latencia = cuánto tarda el loop en atender una tarea lista para correr
+        while not stop.is_set():
+            t0 = time.perf_counter()
+            await asyncio.sleep(0.005)
+            latencies.append((time.perf_counter() - t0) * 1000 - 5)
+
+    async def _storm(offloaded: bool):
+        latencies = []
+        stop = asyncio.Event()
+        probe = asyncio.create_task(_light_endpoint(latencies, stop))
+
+        async def _login():
+            if offloaded:
+                await password_hasher.verify("contrasena-de-prueba", stored)
+            else:
+                pwd_context.verify("contrasena-de-prueba", stored)
+                await asyncio.sleep(0)
+
+        t0 = time.perf_counter()
+        await asyncio.gather(*(_login() for _ in range(logins)))
+        elapsed = time.perf_counter() - t0
+        stop.set()
+        await probe
+        latencies.sort()
+        p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))] if latencies else 0.0
+        label = "pool de procesos" if offloaded else "event loop     "
+        print(f"{label}: {logins} logins en {elapsed:.2f}s | endpoint ligero "
+              f"p50={statistics.median(latencies):.2f}ms p99={p99:.2f}ms (n={len(latencies)})")
+
+    password_hasher.start()
+    asyncio.run(_storm(offloaded=False))
+    asyncio.run(_storm(offloaded=True))
+    print(password_hasher.stats())
+    password_hasher.stop()
@@ -0,0 +1,235 @@
+import math
+import os
+import threading
+import time
+from fastapi import HTTPException, status
+from app.db import db_connect
+
+# Reglas por acción: (máximo de intentos, ventana en segundos) por IP y por correo.
+# Un credential stuffing rota correos desde pocas IPs; un ataque dirigido rota IPs
+# contra un correo. Cada clave se limita por separado.
+RATE_LIMIT_RULES = {
+    "login": {"ip": (20, 60), "email": (5, 60)},
+    "register": {"ip": (5, 600)},
+    "forgot-password": {"ip": (5, 900), "email": (3, 900)},
+    "reset-password": {"ip": (5, 900), "email": (3, 900)},
+}
+
+# 'memory' (por worker) o 'postgres' (compartido entre workers via Limite_Tasa)
+RATE_LIMIT_BACKEND = os.getenv("RATE_LIMIT_BACKEND", "memory")
+
+# Tope de claves en memoria antes de purgar las que ya no tienen intentos recientes
+RATE_LIMIT_MAX_KEYS = 50_000
+
+
+def ensure_rate_limit_table():
+    """Crea la tabla Limite_Tasa (backend compartido) si no existe."""
+    conn = None
+    try:
+        conn = db_connect.get_connection()
+        cursor = conn.cursor()
+        cursor.execute("""
+            CREATE UNLOGGED TABLE IF NOT EXISTS Limite_Tasa (
+                clave VARCHAR(200) NOT NULL,
+                ventana BIGINT NOT NULL,
+                conteo INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (clave, ventana)
+            );
+        """)
+        conn.commit()
+        cursor.close()
+    except Exception as e:
+        print(f"Error creating Limite_Tasa table: {e}")
+    finally:
+        if conn: conn.close()
+
+
+class RateLimitedError(HTTPException):
+    """Demasiados intentos para una IP o correo."""
+
+    def __init__(self, retry_after: int):
+        super().__init__(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail="Demasiados intentos. Intenta de nuevo más tarde.",
+            headers={"Retry-After": str(retry_after)}
+        )
+        self.retry_after = retry_after
+
+
+def _sliding_count(previous: int, current: int, window: int, now: float) -> float:
+    """
+    Ventana deslizante aproximada con dos contadores fijos: los intentos de la ventana
+    anterior pesan en proporción a cuánto de ella sigue dentro de la ventana deslizante.
+    """
+    elapsed = (now % window) / window
+    return previous * (1 - elapsed) + current
+
+
+class MemoryBackend:
+    """Contadores por worker. {clave: [ventana, conteo_actual, conteo_anterior]}."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = {}
+
+    def hit(self, key: str, window: int, now: float) -> float:
+        bucket = int(now // window)
+        with self._lock:
+            entry = self._counters.get(key)
+            if entry is None:
+                entry = self._counters[key] = [bucket, 0, 0]
+            elif entry[0] != bucket:
+                # Si pasó más de una ventana, la anterior quedó vacía
+                entry[2] = entry[1] if entry[0] == bucket - 1 else 0
+                entry[1] = 0
+                entry[0] = bucket
+            entry[1] += 1
+            if len(self._counters) > RATE_LIMIT_MAX_KEYS:
+                self._prune(now)
+            return _sliding_count(entry[2], entry[1], window, now)
+
+    def _prune(self, now: float):
+        # Las claves llevan la ventana como sufijo ('...:60'); sin intentos en las dos
+        # últimas ventanas ya no influyen en nada.
+        for key, entry in list(self._counters.items()):
+            window = int(key.rsplit(":", 1)[1])
+            if entry[0] < int(now // window) - 1:
+                del self._counters[key]
+
+    def __len__(self):
+        return len(self._counters)
+
+
+class PostgresBackend:
+    """Contadores compartidos entre workers: un UPSERT por intento y clave."""
+
+    def hit(self, key: str, window: int, now: float) -> float:
+        bucket = int(now // window)
+        conn = db_connect.get_connection()
+        if conn is None:
+            raise RuntimeError("Error de conexión")
+        try:
+            cursor = conn.cursor()
+            cursor.execute(
+                """
+                WITH actual AS (
+                    INSERT INTO Limite_Tasa (clave, ventana, conteo) VALUES (%s, %s, 1)
+                    ON CONFLICT (clave, ventana) DO UPDATE SET conteo = Limite_Tasa.conteo + 1
+                    RETURNING conteo
+                )
+                SELECT (SELECT conteo FROM actual),
+                       COALESCE((SELECT conteo FROM Limite_Tasa WHERE clave = %s AND ventana = %s), 0)
+                """,
+                (key, bucket, key, bucket - 1)
+            )
+            current, previous = cursor.fetchone()
+            # Limpieza oportunista de ventanas viejas de esta clave
+            cursor.execute("DELETE FROM Limite_Tasa WHERE clave = %s AND ventana < %s", (key, bucket - 1))
+            conn.commit()
+            cursor.close()
+        finally:
+            conn.close()
+        return _sliding_count(previous, current, window, now)
+
+    def __len__(self):
+        return 0
+
+
+class RateLimiter:
+    """
+    Limita intentos por acción, IP y correo con ventanas deslizantes.
+    Se consulta al inicio del endpoint, antes de hashear o tocar la BD de usuarios.
+    """
+
+    def __init__(self, rules: dict = None, backend: str = RATE_LIMIT_BACKEND):
+        self.rules = rules or RATE_LIMIT_RULES
+        self._memory = MemoryBackend()
+        self._backend = PostgresBackend() if backend == "postgres" else self._memory
+        self._lock = threading.Lock()
+        # {"accion:tipo:valor": {"allowed": n, "blocked": n}}
+        self._stats = {}
+        self._metrics = {"allowed": 0, "blocked": 0, "backend_errors": 0}
+
+    def _hit(self, key: str, window: int, now: float) -> float:
+        try:
+            return self._backend.hit(key, window, now)
+        except Exception as e:
+            # Si el backend compartido falla, seguimos limitando por worker
+            self._metrics["backend_errors"] += 1
+            print(f"⚠️ Rate limit: backend compartido no disponible ({e}), usando memoria")
+            return self._memory.hit(key, window, now)
+
+    def check(self, action: str, ip: str = None, email: str = None):
+        """Cuenta el intento. Lanza RateLimitedError si alguna clave superó su límite."""
+        now = time.time()
+        retry_after = 0
+        values = {"ip": ip, "email": (email or "").strip().lower() or None}
+        for kind, (limit, window) in self.rules.get(action, {}).items():
+            value = values.get(kind)
+            if not value:
+                continue
+            name = f"{action}:{kind}:{value}"
+            count = self._hit(f"{name}:{window}", window, now)
+            blocked = count > limit
+            with self._lock:
+                stat = self._stats.get(name)
+                if stat is None:
+                    if len(self._stats) >= RATE_LIMIT_MAX_KEYS:
+                        self._stats.clear()
+                    stat = self._stats[name] = {"allowed": 0, "blocked": 0}
+                stat["blocked" if blocked else "allowed"] += 1
+            if blocked:
+                # Tiempo hasta que la ventana anterior deje de pesar lo suficiente
+                retry_after = max(retry_after, math.ceil(window - (now % window)))
+
+        if retry_after:
+            self._metrics["blocked"] += 1
+            raise RateLimitedError(retry_after)
+        self._metrics["allowed"] += 1
+
+    def stats(self, top: int = 20) -> dict:
+        with self._lock:
+            ranked = sorted(self._stats.items(), key=lambda kv: kv[1]["blocked"], reverse=True)[:top]
+        return {
+            **self._metrics,
+            "keys_tracked": len(self._stats),
+            "top_blocked": [{"clave": name, **stat} for name, stat in ranked if stat["blocked"]],
+        }
+
+
+auth_limiter = RateLimiter()
+
+
+# ======== Comprobación (python -m app.services.rate_limiter) =========
+# Un atacante que manda un X-Forwarded-For distinto en cada intento no puede
+# cambiar su clave de IP: el límite de login lo corta igual.
+if __name__ == "__main__":
+    import random
+    from starlette.requests import HTTPConnection
+    from app.utils import client_ip, TRUSTED_PROXY_HOPS
+
+    atacante = "203.0.113.7"
+    proxies = ["10.0.0.2"] * max(0, TRUSTED_PROXY_HOPS - 1)
+
+    def _peticion(falsa: str):
+        xff = ", ".join([falsa, atacante, *proxies]) if TRUSTED_PROXY_HOPS else falsa
+        socket_ip = "10.0.0.1" if TRUSTED_PROXY_HOPS else atacante
+        cabeceras = [(b"x-forwarded-for", xff.encode())]
+        return HTTPConnection({"type": "http", "headers": cabeceras, "client": (socket_ip, 5000)})
+
+    limiter = RateLimiter(backend="memory")
+    limite = RATE_LIMIT_RULES["login"]["ip"][0]
+    claves = set()
+    bloqueado_en = None
+    for intento in range(1, limite * 2 + 1):
+        ip = client_ip(_peticion(f"198.51.100.{random.randint(1, 254)}"))
+        claves.add(ip)
+        try:
+            limiter.check("login", ip, f"victima{intento}@example.com")
+        except RateLimitedError:
+            bloqueado_en = intento
+            break
+
+    assert claves == {atacante}, f"La cabecera falsa cambió la clave: {claves}"
+    assert bloqueado_en == limite + 1, f"Bloqueado en el intento {bloqueado_en}, se esperaba {limite + 1}"
+    print(f"X-Forwarded-For falsificado en cada intento: clave {atacante}, bloqueado en el intento {bloqueado_en} ✅")
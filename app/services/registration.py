@@ -0,0 +1,141 @@
+import psycopg2
+from app.db import db_connect
+
+# ID del rol 'Jugador' en la tabla Rol
+ROL_JUGADOR = 1
+
+# Alta de Usuario + Saldo en una sola sentencia (un viaje a la BD).
+# Los duplicados los detectan los índices únicos de email y CURP.
+REGISTRO_SQL = """
+    WITH nuevo AS (
+        INSERT INTO Usuario (nombre, apellido, curp, email, password_hash, id_rol, fecha_registro, activo)
+        VALUES (%s, %s, %s, %s, %s, %s, NOW(), true)
+        RETURNING id_usuario
+    ), saldo AS (
+        INSERT INTO Saldo (id_usuario, saldo_actual, ultima_actualizacion)
+        SELECT id_usuario, 0.00, NOW() FROM nuevo
+    )
+    SELECT id_usuario FROM nuevo
+"""
+
+# Columnas esperadas (con encabezado) en el CSV de importación masiva.
+# password_hash debe ser un hash Argon2 exportado del sistema anterior.
+IMPORT_COLUMNS = ("nombre", "apellido", "curp", "email", "password_hash", "saldo")
+
+
+def ensure_registration_indexes():
+    """
+    Índice único de CURP (email ya es UNIQUE en la tabla). Parcial porque los
+    administradores y auditores se crean sin CURP.
+    """
+    conn = None
+    try:
+        conn = db_connect.get_connection()
+        cursor = conn.cursor()
+        cursor.execute("""
+            CREATE UNIQUE INDEX IF NOT EXISTS idx_usuario_curp_unico
+                ON Usuario (curp) WHERE curp IS NOT NULL AND curp <> '';
+        """)
+        conn.commit()
+        cursor.close()
+    except Exception as e:
+        print(f"Error creating Usuario CURP index: {e}")
+    finally:
+        if conn: conn.close()
+
+
+def registrar_usuario(cursor, nombre, apellido, curp, email, password_hash, id_rol: int = ROL_JUGADOR) -> int:
+    """Inserta Usuario y su Saldo inicial en un solo statement. El llamador hace commit."""
+    cursor.execute(REGISTRO_SQL, (nombre, apellido, curp, email, password_hash, id_rol))
+    return cursor.fetchone()[0]
+
+
+def campo_duplicado(error: psycopg2.errors.UniqueViolation) -> str:
+    """Nombre legible del campo que causó la violación de unicidad."""
+    constraint = (getattr(error.diag, "constraint_name", None) or "").lower()
+    if "curp" in constraint:
+        return "curp"
+    if "email" in constraint:
+        return "email"
+    return "desconocido"
+
+
+def importar_usuarios(archivo) -> dict:
+    """
+    Alta masiva de jugadores desde un CSV (archivo binario o de texto) con COPY.
+
+    El CSV se carga a una tabla temporal y de ahí se insertan Usuario y Saldo en una
+    sola sentencia. Las filas inválidas o duplicadas (email/CURP ya registrados o
+    repetidos en el archivo) se omiten sin abortar la importación.
+    """
+    conn = db_connect.get_connection()
+    if conn is None:
+        raise RuntimeError("Error de conexión")
+    try:
+        cursor = conn.cursor()
+        cursor.execute("""
+            CREATE TEMP TABLE importacion_usuario (
+                nombre TEXT, apellido TEXT, curp TEXT, email TEXT, password_hash TEXT, saldo NUMERIC(10, 2)
+            ) ON COMMIT DROP
+        """)
+        cursor.copy_expert(
+            f"COPY importacion_usuario ({', '.join(IMPORT_COLUMNS)}) FROM STDIN WITH (FORMAT csv, HEADER true)",
+            archivo
+        )
+        cursor.execute(
+            """
+            WITH validos AS (
+                SELECT DISTINCT ON (lower(trim(email)))
+                       trim(nombre) AS nombre, trim(apellido) AS apellido, trim(curp) AS curp,
+                       lower(trim(email)) AS email, password_hash, COALESCE(saldo, 0) AS saldo
+                FROM importacion_usuario
+                WHERE email LIKE '%%_@_%%'
+                  AND password_hash LIKE '$argon2%%'
+                  AND COALESCE(trim(nombre), '') <> '' AND COALESCE(trim(apellido), '') <> ''
+                  AND COALESCE(trim(curp), '') <> ''
+                  AND COALESCE(saldo, 0) >= 0
+            ), nuevos AS (
+                INSERT INTO Usuario (nombre, apellido, curp, email, password_hash, id_rol, fecha_registro, activo)
+                SELECT nombre, apellido, curp, email, password_hash, %s, NOW(), true FROM validos
+                ON CONFLICT DO NOTHING
+                RETURNING id_usuario, email
+            ), saldos AS (
+                INSERT INTO Saldo (id_usuario, saldo_actual, ultima_actualizacion)
+                SELECT n.id_usuario, v.saldo, NOW()
+                FROM nuevos n JOIN validos v ON v.email = n.email
+            )
+            SELECT (SELECT COUNT(*) FROM importacion_usuario),
+                   (SELECT COUNT(*) FROM validos),
+                   (SELECT COUNT(*) FROM nuevos)
+            """,
+            (ROL_JUGADOR,)
+        )
+        total, validos, insertados = cursor.fetchone()
+        conn.commit()
+        cursor.close()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+    return {
+        "filas": total,
+        "insertados": insertados,
+        "invalidos": total - validos,
+        "duplicados": validos - insertados,
+    }
+
+
+# ======== Importación directa (python -m app.services.registration archivo.csv) =========
+if __name__ == "__main__":
+    import sys
+    import time
+    if len(sys.argv) < 2:
+        print(f"Uso: python -m app.services.registration archivo.csv  (columnas: {', '.join(IMPORT_COLUMNS)})")
+        sys.exit(1)
+    t0 = time.perf_counter()
+    with open(sys.argv[1], "rb") as f:
+        resultado = importar_usuarios(f)
+    elapsed = time.perf_counter() - t0
+    print(f"✅ Importación terminada en {elapsed:.2f}s: {resultado}")
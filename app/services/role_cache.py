@@ -0,0 +1,96 @@
+import threading
+import time
+from psycopg2.extras import RealDictCursor
+from app.db import db_connect
+
+# Tiempo que se confía en el rol/estado cacheado de un usuario.
+# El admin invalida al instante en su worker; los demás convergen en este plazo.
+ROLE_CACHE_TTL_SECONDS = 30
+
+# Tope de usuarios en memoria; al llenarse se descartan las entradas más viejas
+ROLE_CACHE_MAX_USERS = 10_000
+
+
+class RoleCache:
+    """
+    Cache por usuario de (id_rol, nombre del rol, activo) para las rutas protegidas
+    por rol. Evita el JOIN Usuario/Rol en cada página y llamada de API.
+    """
+
+    def __init__(self, ttl: int = ROLE_CACHE_TTL_SECONDS, max_users: int = ROLE_CACHE_MAX_USERS):
+        self.ttl = ttl
+        self.max_users = max_users
+        self._lock = threading.Lock()
+        # {id_usuario: (cargado_en, {"id_usuario", "id_rol", "rol", "activo"})}
+        self._users = {}
+        self._metrics = {"hits": 0, "misses": 0, "invalidations": 0, "evictions": 0}
+
+    def invalidate(self, user_id: int = None):
+        """Olvida un usuario (o todos si no se indica) para releerlo en la siguiente petición."""
+        with self._lock:
+            if user_id is None:
+                self._users.clear()
+            else:
+                self._users.pop(int(user_id), None)
+            self._metrics["invalidations"] += 1
+
+    def _load(self, user_id: int):
+        conn = db_connect.get_connection()
+        if conn is None:
+            raise RuntimeError("Error de conexión")
+        try:
+            cursor = conn.cursor(cursor_factory=RealDictCursor)
+            cursor.execute(
+                """
+                SELECT u.id_usuario, u.id_rol, r.nombre AS rol, u.activo
+                FROM Usuario u
+                JOIN Rol r ON u.id_rol = r.id_rol
+                WHERE u.id_usuario = %s
+                """,
+                (user_id,)
+            )
+            row = cursor.fetchone()
+            cursor.close()
+        finally:
+            conn.close()
+        return dict(row) if row else None
+
+    def get(self, user_id: int):
+        """Retorna {"id_usuario", "id_rol", "rol", "activo"} o None si el usuario no existe."""
+        user_id = int(user_id)
+        now = time.monotonic()
+        # Los contadores se actualizan bajo el mismo lock que el diccionario: las
+        # rutas síncronas corren en el threadpool y un += sin lock pierde cuentas.
+        with self._lock:
+            entry = self._users.get(user_id)
+            if entry is not None and now - entry[0] <= self.ttl:
+                self._metrics["hits"] += 1
+                return entry[1]
+            self._metrics["misses"] += 1
+
+        usuario = self._load(user_id)
+        if usuario is None:
+            # No cacheamos ausencias: un id inexistente no debe ocupar memoria
+            return None
+        with self._lock:
+            if len(self._users) >= self.max_users:
+                oldest = sorted(self._users, key=lambda k: self._users[k][0])[: self.max_users // 10 or 1]
+                for key in oldest:
+                    del self._users[key]
+                self._metrics["evictions"] += len(oldest)
+            self._users[user_id] = (now, usuario)
+        return usuario
+
+    def stats(self) -> dict:
+        with self._lock:
+            metrics = dict(self._metrics)
+            users_cached = len(self._users)
+        lookups = metrics["hits"] + metrics["misses"]
+        return {
+            **metrics,
+            "users_cached": users_cached,
+            "hit_rate": round(metrics["hits"] / lookups, 3) if lookups else 0.0,
+        }
+
+
+role_cache = RoleCache()
@@ -0,0 +1,266 @@
+import base64
+import hashlib
+import hmac
+import os
+import secrets
+import threading
+import time
+from datetime import datetime
+from app.db import db_connect
+
+# Nombre de la cookie de sesión (reemplaza a la cookie 'userId' en texto plano)
+SESSION_COOKIE = "session"
+
+# Duración de una sesión
+SESSION_TTL_SECONDS = 12 * 60 * 60
+
+# Cada cuánto se recarga la lista de sesiones revocadas desde la BD.
+# Una revocación hecha en otro worker tarda como máximo esto en aplicarse aquí.
+DENYLIST_TTL_SECONDS = 15
+
+
+def _load_secret() -> bytes:
+    """
+    Clave HMAC de las sesiones. Nunca se deriva de algo adivinable: quien conozca la
+    clave puede firmar una sesión de cualquier usuario, admins incluidos.
+    """
+    secret = os.getenv("SESSION_SECRET")
+    if secret:
+        return secret.encode("utf-8")
+    # Con varios workers todos deben firmar con la misma clave: sin SESSION_SECRET no
+    # se arranca. Con uno solo (desarrollo) sirve una clave al azar, que invalida las
+    # sesiones en cada reinicio.
+    workers = int(os.getenv("WEB_CONCURRENCY", "1"))
+    if workers > 1:
+        raise RuntimeError(f"SESSION_SECRET es obligatorio con {workers} workers (WEB_CONCURRENCY)")
+    print("⚠️ Sesiones: SESSION_SECRET no configurado, usando una clave al azar (las sesiones no sobreviven un reinicio)")
+    return secrets.token_bytes(32)
+
+
+def _b64(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).rstrip(b"=").decode("ascii")
+
+
+def ensure_session_tables():
+    """Crea la tabla Sesion_Revocada si no existe."""
+    conn = None
+    try:
+        conn = db_connect.get_connection()
+        cursor = conn.cursor()
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS Sesion_Revocada (
+                id_revocacion SERIAL PRIMARY KEY,
+                jti VARCHAR(32) UNIQUE,
+                id_usuario INTEGER NOT NULL,
+                revocado_desde TIMESTAMP WITHOUT TIME ZONE,
+                expira TIMESTAMP WITHOUT TIME ZONE NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_sesion_revocada_expira ON Sesion_Revocada (expira);
+        """)
+        conn.commit()
+        cursor.close()
+    except Exception as e:
+        print(f"Error creating Sesion_Revocada table: {e}")
+    finally:
+        if conn: conn.close()
+
+
+class SessionManager:
+    """
+    Tokens de sesión firmados con HMAC-SHA256: 'id_usuario.id_rol.emitido.expira.jti.firma'
+    (emitido en milisegundos, expira en segundos epoch).
+
+    Se verifican sin consultar la BD. Para cerrar sesiones antes de que expiren hay una
+    lista de revocación (Sesion_Revocada) cacheada en memoria: por token (logout) o por
+    usuario (todas las sesiones emitidas antes de cierto momento).
+    """
+
+    def __init__(self, secret: bytes = None, ttl: int = SESSION_TTL_SECONDS):
+        self._secret = secret or _load_secret()
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        # {jti: expira_epoch}
+        self._revoked_tokens = {}
+        # {id_usuario: revocado_desde_epoch}
+        self._revoked_users = {}
+        self._loaded_at = 0.0
+        self._stale = True
+
+    def _sign(self, payload: str) -> str:
+        return _b64(hmac.new(self._secret, payload.encode("ascii"), hashlib.sha256).digest()[:16])
+
+    # ------------------------------------------------------------------
+    #  Emisión y verificación
+    # ------------------------------------------------------------------
+    def issue(self, user_id: int, id_rol: int) -> str:
+        now = time.time()
+        payload = f"{int(user_id)}.{int(id_rol)}.{int(now * 1000)}.{int(now) + self.ttl}.{secrets.token_hex(8)}"
+        return f"{payload}.{self._sign(payload)}"
+
+    def verify(self, token: str):
+        """
+        Retorna {"id_usuario", "id_rol", "emitido", "expira", "jti"} si el token es válido,
+        o None si está mal formado, la firma no coincide, expiró o fue revocado.
+        """
+        if not token:
+            return None
+        payload, _, signature = token.rpartition(".")
+        if not payload or not hmac.compare_digest(signature, self._sign(payload)):
+            return None
+        try:
+            user_id, id_rol, issued, expires, jti = payload.split(".")
+            session = {
+                "id_usuario": int(user_id),
+                "id_rol": int(id_rol),
+                "emitido": int(issued),
+                "expira": int(expires),
+                "jti": jti,
+            }
+        except ValueError:
+            return None
+        if session["expira"] <= time.time():
+            return None
+        if self.is_revoked(session):
+            return None
+        return session
+
+    def from_request(self, request):
+        """Sesión de la cookie o del header 'Authorization: Bearer <token>' (APIs)."""
+        token = request.cookies.get(SESSION_COOKIE)
+        if not token:
+            auth = request.headers.get("Authorization", "")
+            if auth.startswith("Bearer "):
+                token = auth[7:].strip()
+        return self.verify(token)
+
+    def user_id(self, request):
+        session = self.from_request(request)
+        return session["id_usuario"] if session else None
+
+    def set_cookie(self, response, token: str):
+        response.set_cookie(
+            key=SESSION_COOKIE, value=token, max_age=self.ttl,
+            httponly=True, samesite="lax"
+        )
+
+    def clear_cookie(self, response):
+        response.delete_cookie(key=SESSION_COOKIE)
+
+    # ------------------------------------------------------------------
+    #  Revocación
+    # ------------------------------------------------------------------
+    def invalidate(self):
+        with self._lock:
+            self._stale = True
+
+    def _load(self):
+        conn = db_connect.get_connection()
+        if conn is None:
+            raise RuntimeError("Error de conexión")
+        try:
+            cursor = conn.cursor()
+            # Las revocaciones vencidas ya no sirven: el token que cubrían expiró
+            cursor.execute("DELETE FROM Sesion_Revocada WHERE expira < NOW()")
+            cursor.execute("SELECT jti, id_usuario, revocado_desde, expira FROM Sesion_Revocada")
+            rows = cursor.fetchall()
+            conn.commit()
+            cursor.close()
+        finally:
+            conn.close()
+
+        tokens = {}
+        users = {}
+        for jti, user_id, revoked_since, expires in rows:
+            if jti:
+                tokens[jti] = expires.timestamp()
+            elif revoked_since is not None:
+                users[user_id] = max(users.get(user_id, 0.0), revoked_since.timestamp())
+        with self._lock:
+            self._revoked_tokens = tokens
+            self._revoked_users = users
+            self._loaded_at = time.monotonic()
+            self._stale = False
+
+    def _ensure_fresh(self):
+        if self._stale or (time.monotonic() - self._loaded_at) > DENYLIST_TTL_SECONDS:
+            try:
+                self._load()
+            except Exception as e:
+                # Seguimos con la última lista conocida
+                print(f"⚠️ Sesiones: no se pudo recargar la lista de revocación ({e})")
+                with self._lock:
+                    self._loaded_at = time.monotonic()
+
+    def is_revoked(self, session) -> bool:
+        self._ensure_fresh()
+        if session["jti"] in self._revoked_tokens:
+            return True
+        revoked_since = self._revoked_users.get(session["id_usuario"])
+        return revoked_since is not None and session["emitido"] / 1000 <= revoked_since
+
+    def revoke(self, session):
+        """Revoca un token concreto (logout)."""
+        conn = None
+        try:
+            conn = db_connect.get_connection()
+            if conn is None:
+                raise RuntimeError("Error de conexión")
+            cursor = conn.cursor()
+            cursor.execute(
+                """
+                INSERT INTO Sesion_Revocada (jti, id_usuario, expira) VALUES (%s, %s, %s)
+                ON CONFLICT (jti) DO NOTHING
+                """,
+                (session["jti"], session["id_usuario"], datetime.fromtimestamp(session["expira"]))
+            )
+            conn.commit()
+            cursor.close()
+        finally:
+            if conn: conn.close()
+        with self._lock:
+            self._revoked_tokens[session["jti"]] = float(session["expira"])
+
+    def revoke_user(self, user_id: int):
+        """Revoca todas las sesiones emitidas hasta ahora para un usuario (desactivación, cambio de rol)."""
+        now = time.time()
+        conn = None
+        try:
+            conn = db_connect.get_connection()
+            if conn is None:
+                raise RuntimeError("Error de conexión")
+            cursor = conn.cursor()
+            cursor.execute(
+                "INSERT INTO Sesion_Revocada (id_usuario, revocado_desde, expira) VALUES (%s, %s, %s)",
+                (int(user_id), datetime.fromtimestamp(now), datetime.fromtimestamp(now + self.ttl))
+            )
+            conn.commit()
+            cursor.close()
+        finally:
+            if conn: conn.close()
+        with self._lock:
+            self._revoked_users[int(user_id)] = now
+
+    def stats(self) -> dict:
+        return {
+            "revoked_tokens": len(self._revoked_tokens),
+            "revoked_users": len(self._revoked_users),
+            "denylist_age_s": round(time.monotonic() - self._loaded_at, 1) if self._loaded_at else None,
+        }
+
+
+sessions = SessionManager()
+
+
+# ======== Benchmark directo (python -m app.services.session_tokens [tokens]) =========
+if __name__ == "__main__":
+    import sys
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    manager = SessionManager(secret=b"benchmark")
+    manager._stale = False
+    manager._loaded_at = time.monotonic() + 3600
+    token = manager.issue(42, 1)
+    t0 = time.perf_counter()
+    for _ in range(n):
+        manager.verify(token)
+    elapsed = time.perf_counter() - t0
+    print(f"verify(): {n} tokens en {elapsed:.3f}s -> {elapsed / n * 1e6:.2f} µs/token ({token})")
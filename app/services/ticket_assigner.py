@@ -0,0 +1,337 @@
+import asyncio
+import collections
+import heapq
+import random
+import threading
+import time
+from app.db import db_connect
+from app.services.event_hub import event_hub
+from app.middleware.auth_roles import ROL_AGENTE_SOPORTE
+
+# Cada cuánto se revisa la cola si no llega ningún ticket nuevo (un 'ticket_creado'
+# despierta al asignador antes)
+ASSIGN_INTERVAL_SECONDS = 2.0
+
+# Tickets reclamados por transacción
+ASSIGN_BATCH_SIZE = 200
+
+# Tickets abiertos que puede tener un agente antes de dejar de recibir más
+ASSIGN_MAX_POR_AGENTE = 15
+
+# Un agente está disponible si tiene una página abierta (stream SSE de /api/eventos)
+# en algún worker: cada worker renueva la señal de los suyos cada ASSIGN_SENAL_SECONDS
+ASSIGN_SENAL_SECONDS = 30
+ASSIGN_SENAL_VIGENCIA_SECONDS = 90
+
+# pg_try_advisory_xact_lock(clase, 0): un solo worker asigna a la vez; los demás
+# saltan la vuelta en lugar de pelear por los mismos tickets
+ASSIGN_LOCK_CLASS = 4302
+
+# Latencias recientes (creación -> asignación) para /metrics/assignment
+ASSIGN_LATENCY_SAMPLES = 2000
+
+TABLA_DISPONIBILIDAD = """
+    CREATE TABLE IF NOT EXISTS Agente_Disponible (
+        id_agente INTEGER PRIMARY KEY REFERENCES Usuario(id_usuario) ON DELETE CASCADE,
+        ultima_senal TIMESTAMP WITHOUT TIME ZONE NOT NULL DEFAULT NOW()
+    );
+"""
+
+
+def ensure_assignment_table():
+    """Crea Agente_Disponible (última señal de vida de cada agente con una página abierta)."""
+    conn = None
+    try:
+        conn = db_connect.get_connection()
+        cursor = conn.cursor()
+        cursor.execute(TABLA_DISPONIBILIDAD)
+        conn.commit()
+        cursor.close()
+    except Exception as e:
+        print(f"Error creating Agente_Disponible table: {e}")
+    finally:
+        if conn: conn.close()
+
+
+def repartir(tickets: list, cargas: dict, turnos: dict, capacidad: int = ASSIGN_MAX_POR_AGENTE) -> list:
+    """
+    Reparte los tickets (en orden de llegada) al agente con menos carga. Entre agentes
+    con la misma carga gana el que hace más tiempo recibió uno (round-robin), según
+    `turnos` {id_agente: último turno}, que se actualiza aquí. Los agentes llenos
+    (capacidad) no reciben más. Retorna [(id_ticket, id_agente)] y suma a `cargas`.
+    """
+    heap = [(carga, turnos.get(id_agente, 0), id_agente)
+            for id_agente, carga in cargas.items() if carga < capacidad]
+    heapq.heapify(heap)
+    siguiente = max(turnos.values(), default=0) + 1
+    asignaciones = []
+    for id_ticket in tickets:
+        if not heap:
+            break
+        carga, _, id_agente = heapq.heappop(heap)
+        asignaciones.append((id_ticket, id_agente))
+        cargas[id_agente] = carga + 1
+        turnos[id_agente] = siguiente
+        siguiente += 1
+        if carga + 1 < capacidad:
+            heapq.heappush(heap, (carga + 1, turnos[id_agente], id_agente))
+    return asignaciones
+
+
+def indice_jain(valores) -> float:
+    """Equidad del reparto: 1.0 = todos iguales, 1/n = todo a uno."""
+    valores = list(valores)
+    if not valores or not any(valores):
+        return 1.0
+    return round(sum(valores) ** 2 / (len(valores) * sum(v * v for v in valores)), 4)
+
+
+class TicketAssigner:
+    """
+    Asigna solo los tickets 'Abierto' sin agente al agente disponible con menos carga.
+
+    En cada vuelta un worker (advisory lock de transacción) lee la carga de los
+    agentes disponibles, reclama un lote con FOR UPDATE SKIP LOCKED y lo reparte en
+    memoria (repartir) con un solo UPDATE. La asignación manual de
+    /api/agente/tickets/asignar sigue funcionando: SKIP LOCKED salta los tickets que un
+    agente está tomando en ese momento y el lote toma los siguientes.
+    """
+
+    def __init__(self, interval: float = ASSIGN_INTERVAL_SECONDS, batch_size: int = ASSIGN_BATCH_SIZE):
+        self.interval = interval
+        self.batch_size = batch_size
+        self._lock = threading.Lock()
+        self._task = None
+        self._despertar = None
+        self._ultima_senal = 0.0
+        # id_agente -> turno de su última asignación (desempate round-robin)
+        self._turnos = {}
+        self._latencias = collections.deque(maxlen=ASSIGN_LATENCY_SAMPLES)
+        self._por_agente = collections.Counter()
+        self._metrics = {
+            "runs": 0, "batches": 0, "assigned": 0, "skipped_not_leader": 0,
+            "no_agents": 0, "errors": 0, "last_batch_ms": 0.0, "last_fairness": 1.0,
+        }
+
+    # ------------------------------------------------------------------
+    #  Disponibilidad
+    # ------------------------------------------------------------------
+    def renovar_senal(self, cursor):
+        """Marca como disponibles a los agentes conectados a este worker."""
+        agentes = sorted(event_hub.agentes_conectados())
+        if agentes:
+            cursor.execute(
+                """
+                INSERT INTO Agente_Disponible (id_agente, ultima_senal)
+                SELECT a, NOW() FROM unnest(%s::int[]) AS a
+                ON CONFLICT (id_agente) DO UPDATE SET ultima_senal = NOW()
+                """,
+                (agentes,)
+            )
+
+    def _cargas(self, cursor) -> dict:
+        """Tickets abiertos de cada agente disponible y activo."""
+        cursor.execute(
+            """
+            SELECT d.id_agente, COUNT(s.id_ticket)
+            FROM Agente_Disponible d
+            JOIN Usuario u ON u.id_usuario = d.id_agente AND u.id_rol = %s AND u.activo
+            LEFT JOIN Soporte s ON s.id_agente = d.id_agente AND s.estado <> 'Cerrado'
+            WHERE d.ultima_senal > NOW() - make_interval(secs => %s)
+            GROUP BY d.id_agente
+            """,
+            (ROL_AGENTE_SOPORTE, ASSIGN_SENAL_VIGENCIA_SECONDS)
+        )
+        return {id_agente: int(carga) for id_agente, carga in cursor.fetchall()}
+
+    # ------------------------------------------------------------------
+    #  Lotes
+    # ------------------------------------------------------------------
+    def _lote(self, cursor) -> int:
+        """Un lote en la transacción actual. Retorna los tickets asignados (-1 = otro worker)."""
+        cursor.execute("SELECT pg_try_advisory_xact_lock(%s, 0)", (ASSIGN_LOCK_CLASS,))
+        if not cursor.fetchone()[0]:
+            return -1
+        cargas = self._cargas(cursor)
+        libres = sum(max(0, ASSIGN_MAX_POR_AGENTE - c) for c in cargas.values())
+        if not libres:
+            with self._lock:
+                self._metrics["no_agents"] += 1
+            return 0
+
+        cursor.execute(
+            """
+            SELECT id_ticket FROM Soporte
+            WHERE estado = 'Abierto' AND id_agente IS NULL
+            ORDER BY fecha_creacion
+            LIMIT %s
+            FOR UPDATE SKIP LOCKED
+            """,
+            (min(self.batch_size, libres),)
+        )
+        tickets = [row[0] for row in cursor.fetchall()]
+        if not tickets:
+            return 0
+
+        with self._lock:
+            turnos = dict(self._turnos)
+        asignaciones = repartir(tickets, cargas, turnos)
+        cursor.execute(
+            """
+            UPDATE Soporte s SET id_agente = a.id_agente, estado = 'En Proceso'
+            FROM unnest(%s::int[], %s::int[]) AS a(id_ticket, id_agente)
+            WHERE s.id_ticket = a.id_ticket
+            RETURNING s.id_agente, EXTRACT(EPOCH FROM (NOW() - s.fecha_creacion))
+            """,
+            ([t for t, _ in asignaciones], [a for _, a in asignaciones])
+        )
+        filas = cursor.fetchall()
+        with self._lock:
+            self._turnos.update(turnos)
+            for id_agente, segundos in filas:
+                self._por_agente[id_agente] += 1
+                self._latencias.append(float(segundos) * 1000)
+            self._metrics["last_fairness"] = indice_jain(cargas.values())
+        return len(filas)
+
+    def run_once(self) -> int:
+        """Asigna lotes hasta vaciar la cola o llenar a los agentes. Retorna cuántos asignó."""
+        conn = db_connect.get_connection()
+        if conn is None:
+            return 0
+        total = 0
+        try:
+            cursor = conn.cursor()
+            if time.monotonic() - self._ultima_senal >= ASSIGN_SENAL_SECONDS:
+                self.renovar_senal(cursor)
+                conn.commit()
+                self._ultima_senal = time.monotonic()
+            while True:
+                t0 = time.perf_counter()
+                asignados = self._lote(cursor)
+                conn.commit()
+                if asignados < 0:
+                    with self._lock:
+                        self._metrics["skipped_not_leader"] += 1
+                    break
+                with self._lock:
+                    self._metrics["last_batch_ms"] = round((time.perf_counter() - t0) * 1000, 1)
+                    if asignados:
+                        self._metrics["batches"] += 1
+                        self._metrics["assigned"] += asignados
+                total += asignados
+                if asignados < self.batch_size:
+                    break
+            cursor.close()
+        except Exception as e:
+            conn.rollback()
+            with self._lock:
+                self._metrics["errors"] += 1
+            print(f"🚨 Asignación: error al repartir tickets: {e}")
+        finally:
+            conn.close()
+        with self._lock:
+            self._metrics["runs"] += 1
+        if total:
+            print(f"✅ Asignación: {total} tickets repartidos")
+        return total
+
+    # ------------------------------------------------------------------
+    #  Tarea de fondo
+    # ------------------------------------------------------------------
+    def on_evento(self, evento: dict):
+        if evento.get("tipo") in ("ticket_creado", "ticket_reabierto") and self._despertar is not None:
+            self._despertar.set()
+
+    async def run_worker(self):
+        while True:
+            try:
+                # Con jitter: los workers no compiten por el lock en el mismo instante
+                await asyncio.wait_for(self._despertar.wait(), self.interval * random.uniform(0.8, 1.2))
+            except asyncio.TimeoutError:
+                pass
+            self._despertar.clear()
+            await asyncio.to_thread(self.run_once)
+
+    def start(self):
+        if self._task is None:
+            self._despertar = asyncio.Event()
+            event_hub.add_listener(self.on_evento)
+            self._task = asyncio.get_running_loop().create_task(self.run_worker())
+
+    async def stop(self):
+        event_hub.remove_listener(self.on_evento)
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    def stats(self) -> dict:
+        with self._lock:
+            latencias = sorted(self._latencias)
+            p = lambda q: round(latencias[min(len(latencias) - 1, int(q * len(latencias)))], 1) if latencias else 0.0
+            return {
+                **self._metrics,
+                "latency_ms": {"p50": p(0.5), "p99": p(0.99), "max": p(1.0)},
+                "assigned_by_agent": dict(self._por_agente),
+                "running": self._task is not None,
+            }
+
+
+ticket_assigner = TicketAssigner()
+
+
+# ======================================================================
+#  Simulación: python -m app.services.ticket_assigner [tickets] [agentes]
+#
+#  Ráfaga de tickets nuevos (todos en ~1 s) contra agentes con carga inicial
+#  al azar. Cada vuelta del asignador reclama un lote (con latencia de BD
+#  simulada) y lo reparte con repartir(). Mide la latencia creación ->
+#  asignación y la equidad (índice de Jain) de los tickets recibidos y de la
+#  carga final. Con pocos agentes se llenan (capacidad) y el resto espera.
+# ======================================================================
+def _simular(total_tickets: int, total_agentes: int, capacidad: int):
+    random.seed(7)
+    iniciales = {a: random.randint(0, 5) for a in range(1, total_agentes + 1)}
+    llegadas = sorted(random.uniform(0, 1.0) for _ in range(total_tickets))
+
+    # Asignador: una vuelta cada 50 ms (despertado por los ticket_creado) y
+    # ~2 ms de BD por lote de 200
+    cargas = dict(iniciales)
+    turnos = {}
+    recibidos = collections.Counter()
+    latencias = []
+    reloj, siguiente = 0.0, 0
+    pendientes = collections.deque()
+    while siguiente < len(llegadas) or pendientes:
+        reloj += 0.05
+        while siguiente < len(llegadas) and llegadas[siguiente] <= reloj:
+            pendientes.append((siguiente, llegadas[siguiente]))
+            siguiente += 1
+        while pendientes:
+            lote = [pendientes.popleft() for _ in range(min(ASSIGN_BATCH_SIZE, len(pendientes)))]
+            reloj += 0.002
+            asignaciones = repartir([t for t, _ in lote], cargas, turnos, capacidad)
+            creados = dict(lote)
+            for id_ticket, id_agente in asignaciones:
+                recibidos[id_agente] += 1
+                latencias.append((reloj - creados[id_ticket]) * 1000)
+            if len(asignaciones) < len(lote):
+                break  # Todos llenos: el resto espera a que cierren tickets
+        if all(c >= capacidad for c in cargas.values()):
+            break
+    latencias.sort()
+
+    p = lambda q: latencias[min(len(latencias) - 1, int(q * len(latencias)))] if latencias else 0
+    print(f"Ráfaga: {total_tickets} tickets en 1 s | agentes: {total_agentes} | capacidad: {capacidad}")
+    print(f"Asignados: {len(latencias)} | sin asignar (agentes llenos): {total_tickets - len(latencias)}")
+    print(f"Latencia creación -> asignación: p50 {p(0.5):.0f} ms | p99 {p(0.99):.0f} ms | máx {latencias[-1] if latencias else 0:.0f} ms")
+    print(f"Equidad (Jain) tickets recibidos: {indice_jain(recibidos[a] for a in iniciales)} | "
+          f"carga final: {indice_jain(cargas.values())} | spread carga: {min(cargas.values())}-{max(cargas.values())}")
+
+
+if __name__ == "__main__":
+    import sys
+    n_tickets = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    n_agentes = int(sys.argv[2]) if len(sys.argv) > 2 else 40
+    _simular(n_tickets, n_agentes, ASSIGN_MAX_POR_AGENTE)
+    _simular(n_tickets, n_agentes * 10, ASSIGN_MAX_POR_AGENTE)
@@ -0,0 +1,118 @@
+import base64
+import json
+from datetime import datetime
+from app.db import db_connect
+from app.services.user_directory import CursorInvalidoError
+
+# Tamaño de página de la cola de tickets del agente
+TICKET_PAGE_SIZE = 50
+TICKET_MAX_PAGE_SIZE = 100
+
+# prioridad se calcula sola a partir del estado (columna generada), así ningún UPDATE
+# de estado (agente, jugador, barrido de mantenimiento) puede dejarla desfasada.
+# El índice sigue exactamente el orden de la cola: prioridad, más nuevos primero.
+COLUMNAS_COLA = """
+    ALTER TABLE Soporte ADD COLUMN IF NOT EXISTS prioridad SMALLINT
+        GENERATED ALWAYS AS (CASE estado WHEN 'Abierto' THEN 1 WHEN 'En Proceso' THEN 2 ELSE 3 END) STORED;
+    CREATE INDEX IF NOT EXISTS idx_soporte_cola ON Soporte (prioridad, fecha_creacion DESC, id_ticket DESC);
+"""
+
+COLUMNAS_TICKET = """
+    s.id_ticket, s.id_jugador, u.nombre AS nombre_jugador, u.apellido AS apellido_jugador,
+    s.asunto, s.estado, s.mensaje, s.fecha_creacion, s.id_agente, s.prioridad,
+    CASE WHEN s.id_agente IS NOT NULL THEN 'Asignado' ELSE 'Sin asignar' END AS estado_asignacion,
+    a.nombre || ' ' || a.apellido AS nombre_agente
+"""
+
+
+def ensure_ticket_queue_columns():
+    """Agrega Soporte.prioridad y el índice de la cola."""
+    conn = None
+    try:
+        conn = db_connect.get_connection()
+        cursor = conn.cursor()
+        cursor.execute(COLUMNAS_COLA)
+        conn.commit()
+        cursor.close()
+    except Exception as e:
+        print(f"Error adding Soporte queue columns: {e}")
+    finally:
+        if conn: conn.close()
+
+
+def codificar_cursor_ticket(prioridad: int, fecha_creacion: datetime, id_ticket: int) -> str:
+    """Cursor opaco con la llave de orden (prioridad, fecha_creacion, id_ticket) de la última fila."""
+    raw = json.dumps([prioridad, fecha_creacion.isoformat(), id_ticket]).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def decodificar_cursor_ticket(cursor: str):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        prioridad, fecha, id_ticket = json.loads(raw.decode("utf-8"))
+        if not isinstance(prioridad, int) or not isinstance(id_ticket, int):
+            raise ValueError
+        return prioridad, datetime.fromisoformat(fecha), id_ticket
+    except Exception:
+        raise CursorInvalidoError("Cursor de paginación inválido")
+
+
+def buscar_tickets(cursor, estado: str = None, asignado: str = None,
+                   limit: int = TICKET_PAGE_SIZE, after: str = None) -> dict:
+    """
+    Una página de la cola de tickets: abiertos, luego en proceso, luego cerrados, y
+    dentro de cada grupo los más nuevos primero. Paginación por llave (keyset).
+
+    Como prioridad va ascendente y la fecha descendente, la continuación se parte en
+    dos ramas que el índice idx_soporte_cola resuelve como rangos: el resto del grupo
+    actual y los grupos siguientes. Cada rama trae a lo más limit + 1 filas.
+    Devuelve {"items": [...], "next_cursor": str | None}.
+    """
+    limit = max(1, min(int(limit or TICKET_PAGE_SIZE), TICKET_MAX_PAGE_SIZE))
+    filtros = []
+    params = []
+    if estado:
+        filtros.append("s.estado = %s")
+        params.append(estado)
+    if asignado == "si":
+        filtros.append("s.id_agente IS NOT NULL")
+    elif asignado == "no":
+        filtros.append("s.id_agente IS NULL")
+
+    def rama(extra):
+        condiciones = " AND ".join(filtros + [extra])
+        return f"""
+            (SELECT {COLUMNAS_TICKET}
+             FROM Soporte s
+             JOIN Usuario u ON u.id_usuario = s.id_jugador
+             LEFT JOIN Usuario a ON a.id_usuario = s.id_agente
+             WHERE {condiciones}
+             ORDER BY s.prioridad, s.fecha_creacion DESC, s.id_ticket DESC
+             LIMIT %s)
+        """
+
+    if after:
+        prioridad, fecha, id_ticket = decodificar_cursor_ticket(after)
+        query = f"""
+            {rama("s.prioridad = %s AND (s.fecha_creacion, s.id_ticket) < (%s, %s)")}
+            UNION ALL
+            {rama("s.prioridad > %s")}
+            ORDER BY prioridad, fecha_creacion DESC, id_ticket DESC
+            LIMIT %s
+        """
+        query_params = (*params, prioridad, fecha, id_ticket, limit + 1,
+                        *params, prioridad, limit + 1, limit + 1)
+    else:
+        query = rama("TRUE")
+        query_params = (*params, limit + 1)
+
+    cursor.execute(query, query_params)
+    filas = cursor.fetchall()
+
+    # Se pide una fila de más para saber si hay otra página sin hacer COUNT(*)
+    next_cursor = None
+    if len(filas) > limit:
+        filas = filas[:limit]
+        ultima = filas[-1]
+        next_cursor = codificar_cursor_ticket(ultima["prioridad"], ultima["fecha_creacion"], ultima["id_ticket"])
+    return {"items": filas, "next_cursor": next_cursor}
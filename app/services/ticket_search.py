@@ -0,0 +1,190 @@
+import base64
+import html
+import json
+from app.db import db_connect
+from app.services.user_directory import CursorInvalidoError
+
+# Tamaño de página de la búsqueda de tickets
+SEARCH_PAGE_SIZE = 20
+SEARCH_MAX_PAGE_SIZE = 50
+
+# Largo máximo del texto buscado
+SEARCH_MAX_QUERY_LENGTH = 200
+
+# Configuración de texto de Postgres por idioma de locales/ (es.json, en.json)
+CONFIG_IDIOMA = {"es": "spanish", "en": "english"}
+
+# Marcas del fragmento resaltado: caracteres de control que no aparecen en el texto
+# de un ticket; se cambian por <mark> después de escapar el HTML
+MARCA_INICIO = "\x02"
+MARCA_FIN = "\x03"
+OPCIONES_FRAGMENTO = f"StartSel={MARCA_INICIO}, StopSel={MARCA_FIN}, MaxWords=25, MinWords=10, MaxFragments=2, FragmentDelimiter=\" … \""
+
+# Columnas de búsqueda generadas (STORED): Postgres las recalcula en cada INSERT y en
+# cada UPDATE del texto, así que el índice GIN se mantiene fila a fila sin triggers
+# ni reindexados. Cada texto se indexa con las dos configuraciones (raíces en español
+# y en inglés); el asunto pesa más (A) que el mensaje (B) y las respuestas (C).
+COLUMNAS_BUSQUEDA = """
+    ALTER TABLE Soporte ADD COLUMN IF NOT EXISTS busqueda tsvector
+        GENERATED ALWAYS AS (
+            setweight(to_tsvector('spanish'::regconfig, asunto), 'A') ||
+            setweight(to_tsvector('english'::regconfig, asunto), 'A') ||
+            setweight(to_tsvector('spanish'::regconfig, mensaje), 'B') ||
+            setweight(to_tsvector('english'::regconfig, mensaje), 'B')
+        ) STORED;
+    CREATE INDEX IF NOT EXISTS idx_soporte_busqueda ON Soporte USING GIN (busqueda);
+
+    ALTER TABLE RespuestaTicket ADD COLUMN IF NOT EXISTS busqueda tsvector
+        GENERATED ALWAYS AS (
+            setweight(to_tsvector('spanish'::regconfig, mensaje), 'C') ||
+            setweight(to_tsvector('english'::regconfig, mensaje), 'C')
+        ) STORED;
+    CREATE INDEX IF NOT EXISTS idx_respuesta_busqueda ON RespuestaTicket USING GIN (busqueda);
+"""
+
+# Las coincidencias salen de los dos índices GIN (ticket y respuestas); cada ticket
+# queda con su mejor coincidencia. Los fragmentos (ts_headline, lo caro) solo se
+# calculan para las filas de la página.
+BUSQUEDA_SQL = """
+    WITH q AS (
+        SELECT {consulta} AS consulta,
+               websearch_to_tsquery('spanish', %(texto)s) AS q_es,
+               websearch_to_tsquery('english', %(texto)s) AS q_en
+    ),
+    coincidencias AS (
+        SELECT s.id_ticket, NULL::int AS id_respuesta, ts_rank(s.busqueda, q.consulta) AS rango
+        FROM Soporte s, q
+        WHERE s.busqueda @@ q.consulta {filtro_estado}
+        UNION ALL
+        SELECT r.id_ticket, r.id_respuesta, ts_rank(r.busqueda, q.consulta) AS rango
+        FROM RespuestaTicket r
+        JOIN Soporte s ON s.id_ticket = r.id_ticket, q
+        WHERE r.busqueda @@ q.consulta {filtro_estado}
+    ),
+    mejores AS (
+        SELECT DISTINCT ON (id_ticket) id_ticket, id_respuesta, rango
+        FROM coincidencias
+        ORDER BY id_ticket, rango DESC, id_respuesta NULLS FIRST
+    ),
+    pagina AS (
+        SELECT * FROM mejores
+        WHERE {filtro_cursor}
+        ORDER BY rango DESC, id_ticket DESC
+        LIMIT %(limite)s
+    )
+    SELECT p.id_ticket, p.id_respuesta, p.rango,
+           s.asunto, s.estado, s.fecha_creacion, s.id_agente,
+           u.nombre AS nombre_jugador, u.apellido AS apellido_jugador,
+           a.nombre || ' ' || a.apellido AS nombre_agente,
+           CASE WHEN p.id_respuesta IS NULL THEN 'ticket' ELSE 'respuesta' END AS coincide_en,
+           CASE
+               WHEN %(es)s AND to_tsvector('spanish', t.texto) @@ q.q_es
+                   THEN ts_headline('spanish', t.texto, q.q_es, %(opciones)s)
+               WHEN %(en)s AND to_tsvector('english', t.texto) @@ q.q_en
+                   THEN ts_headline('english', t.texto, q.q_en, %(opciones)s)
+               ELSE ts_headline(%(config)s::regconfig, t.texto, q.consulta, %(opciones)s)
+           END AS fragmento
+    FROM pagina p
+    JOIN Soporte s ON s.id_ticket = p.id_ticket
+    JOIN Usuario u ON u.id_usuario = s.id_jugador
+    LEFT JOIN Usuario a ON a.id_usuario = s.id_agente
+    LEFT JOIN RespuestaTicket r ON r.id_respuesta = p.id_respuesta
+    CROSS JOIN q
+    CROSS JOIN LATERAL (SELECT COALESCE(r.mensaje, s.asunto || '. ' || s.mensaje) AS texto) t
+    ORDER BY p.rango DESC, p.id_ticket DESC
+"""
+
+
+class BusquedaInvalidaError(ValueError):
+    """Texto de búsqueda vacío o demasiado largo."""
+
+
+def ensure_ticket_search_columns():
+    """Agrega las columnas tsvector de Soporte y RespuestaTicket y sus índices GIN."""
+    conn = None
+    try:
+        conn = db_connect.get_connection()
+        cursor = conn.cursor()
+        cursor.execute(COLUMNAS_BUSQUEDA)
+        conn.commit()
+        cursor.close()
+    except Exception as e:
+        print(f"Error adding ticket search columns: {e}")
+    finally:
+        if conn: conn.close()
+
+
+def codificar_cursor_busqueda(rango: float, id_ticket: int) -> str:
+    """Cursor opaco con la llave de orden (rango, id_ticket) de la última fila."""
+    raw = json.dumps([rango, id_ticket]).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def decodificar_cursor_busqueda(cursor: str):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        rango, id_ticket = json.loads(raw.decode("utf-8"))
+        if not isinstance(rango, (int, float)) or not isinstance(id_ticket, int):
+            raise ValueError
+        return float(rango), id_ticket
+    except Exception:
+        raise CursorInvalidoError("Cursor de paginación inválido")
+
+
+def resaltar(fragmento: str) -> str:
+    """Escapa el HTML del fragmento y cambia las marcas de ts_headline por <mark>."""
+    return html.escape(fragmento or "").replace(MARCA_INICIO, "<mark>").replace(MARCA_FIN, "</mark>")
+
+
+def buscar_texto_tickets(cursor, texto: str, idioma: str = None, estado: str = None,
+                         limit: int = SEARCH_PAGE_SIZE, after: str = None) -> dict:
+    """
+    Una página de tickets cuyo asunto, mensaje o alguna respuesta coincide con `texto`
+    (sintaxis de buscador: "frase exacta", -excluir, or), de más a menos relevante.
+
+    `idioma` ('es' o 'en') limita la búsqueda a esa configuración; sin idioma se busca
+    con las dos. Cada fila trae `fragmento`: el trozo del texto que coincide, con el
+    HTML escapado y los términos entre <mark>. Paginación por llave (rango, id_ticket).
+    Devuelve {"items": [...], "next_cursor": str | None}.
+    """
+    texto = (texto or "").strip()
+    if not texto:
+        raise BusquedaInvalidaError("Escribe qué quieres buscar")
+    if len(texto) > SEARCH_MAX_QUERY_LENGTH:
+        raise BusquedaInvalidaError(f"La búsqueda admite hasta {SEARCH_MAX_QUERY_LENGTH} caracteres")
+    limit = max(1, min(int(limit or SEARCH_PAGE_SIZE), SEARCH_MAX_PAGE_SIZE))
+
+    idiomas = [idioma] if idioma in CONFIG_IDIOMA else list(CONFIG_IDIOMA)
+    params = {
+        "texto": texto, "limite": limit + 1, "opciones": OPCIONES_FRAGMENTO,
+        "es": "es" in idiomas, "en": "en" in idiomas, "config": CONFIG_IDIOMA[idiomas[0]],
+    }
+
+    filtro_estado = ""
+    if estado:
+        filtro_estado = "AND s.estado = %(estado)s"
+        params["estado"] = estado
+
+    filtro_cursor = "TRUE"
+    if after:
+        params["rango"], params["id_ticket"] = decodificar_cursor_busqueda(after)
+        filtro_cursor = "(rango, id_ticket) < (%(rango)s::real, %(id_ticket)s)"
+
+    query = BUSQUEDA_SQL.format(
+        consulta=" || ".join(f"websearch_to_tsquery('{CONFIG_IDIOMA[i]}', %(texto)s)" for i in idiomas),
+        filtro_estado=filtro_estado,
+        filtro_cursor=filtro_cursor,
+    )
+    cursor.execute(query, params)
+    filas = cursor.fetchall()
+
+    # Se pide una fila de más para saber si hay otra página sin hacer COUNT(*)
+    next_cursor = None
+    if len(filas) > limit:
+        filas = filas[:limit]
+        ultima = filas[-1]
+        next_cursor = codificar_cursor_busqueda(ultima["rango"], ultima["id_ticket"])
+    for fila in filas:
+        fila["fragmento"] = resaltar(fila["fragmento"])
+        fila["rango"] = round(float(fila["rango"]), 6)
+    return {"items": filas, "next_cursor": next_cursor}
@@ -0,0 +1,126 @@
+import base64
+import json
+from app.db import db_connect
+
+# Tamaño de página del directorio de usuarios del admin
+DIRECTORY_PAGE_SIZE = 50
+DIRECTORY_MAX_PAGE_SIZE = 100
+
+# Con menos caracteres que esto se busca por prefijo (índices btree); con más, por
+# subcadena (índice de trigramas). Un trigrama necesita al menos 3 caracteres.
+DIRECTORY_MIN_SUBSTRING = 3
+
+
+def _expr_busqueda(alias: str = "") -> str:
+    """
+    Expresión indexada para la búsqueda por subcadena. La consulta debe usar
+    EXACTAMENTE la del índice idx_usuario_busqueda_trgm para que el planner la use.
+    """
+    return (f"lower(coalesce({alias}nombre, '') || ' ' || coalesce({alias}apellido, '') "
+            f"|| ' ' || coalesce({alias}email, ''))")
+
+
+class CursorInvalidoError(ValueError):
+    """El cursor de paginación no es válido (manipulado o de otra versión)."""
+
+
+def ensure_directory_indexes():
+    """
+    Índices del directorio de usuarios:
+    - (id_rol, nombre, id_usuario): recorre una página en orden sin ordenar toda la tabla.
+    - lower(nombre/apellido/email) text_pattern_ops: búsqueda por prefijo (LIKE 'abc%').
+    - GIN de trigramas sobre nombre + apellido + email: búsqueda por subcadena (LIKE '%abc%').
+    """
+    conn = None
+    try:
+        conn = db_connect.get_connection()
+        cursor = conn.cursor()
+        cursor.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+        cursor.execute(f"""
+            CREATE INDEX IF NOT EXISTS idx_usuario_rol_nombre ON Usuario (id_rol, nombre, id_usuario);
+            CREATE INDEX IF NOT EXISTS idx_usuario_nombre_prefijo ON Usuario (lower(nombre) text_pattern_ops);
+            CREATE INDEX IF NOT EXISTS idx_usuario_apellido_prefijo ON Usuario (lower(apellido) text_pattern_ops);
+            CREATE INDEX IF NOT EXISTS idx_usuario_email_prefijo ON Usuario (lower(email) text_pattern_ops);
+            CREATE INDEX IF NOT EXISTS idx_usuario_busqueda_trgm ON Usuario
+                USING GIN ({_expr_busqueda()} gin_trgm_ops);
+        """)
+        conn.commit()
+        cursor.close()
+    except Exception as e:
+        print(f"Error creating Usuario directory indexes: {e}")
+    finally:
+        if conn: conn.close()
+
+
+def codificar_cursor(nombre: str, id_usuario: int) -> str:
+    """Cursor opaco con la llave de orden (nombre, id_usuario) de la última fila."""
+    raw = json.dumps([nombre, id_usuario], ensure_ascii=False).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def decodificar_cursor(cursor: str):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        nombre, id_usuario = json.loads(raw.decode("utf-8"))
+        if not isinstance(nombre, str) or not isinstance(id_usuario, int):
+            raise ValueError
+        return nombre, id_usuario
+    except Exception:
+        raise CursorInvalidoError("Cursor de paginación inválido")
+
+
+def _patron_like(texto: str) -> str:
+    """Escapa los comodines de LIKE para buscar el texto literal."""
+    return texto.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+def buscar_usuarios(cursor, roles: tuple, q: str = None, limit: int = DIRECTORY_PAGE_SIZE, after: str = None) -> dict:
+    """
+    Una página del directorio de usuarios con los roles dados, ordenada por
+    (nombre, id_usuario) con paginación por llave (keyset): el costo no crece con
+    el número de página, a diferencia de OFFSET.
+
+    q filtra por nombre, apellido o email: prefijo si es corto, subcadena si no.
+    Devuelve {"items": [...], "next_cursor": str | None}.
+    """
+    limit = max(1, min(int(limit or DIRECTORY_PAGE_SIZE), DIRECTORY_MAX_PAGE_SIZE))
+    condiciones = ["u.id_rol IN %s"]
+    params = [tuple(roles)]
+
+    termino = (q or "").strip().lower()
+    if termino:
+        patron = _patron_like(termino)
+        if len(termino) < DIRECTORY_MIN_SUBSTRING:
+            condiciones.append(
+                "(lower(u.nombre) LIKE %s OR lower(u.apellido) LIKE %s OR lower(u.email) LIKE %s)"
+            )
+            params += [patron + "%"] * 3
+        else:
+            condiciones.append(f"{_expr_busqueda('u.')} LIKE %s")
+            params.append("%" + patron + "%")
+
+    if after:
+        nombre, id_usuario = decodificar_cursor(after)
+        condiciones.append("(u.nombre, u.id_usuario) > (%s, %s)")
+        params += [nombre, id_usuario]
+
+    cursor.execute(
+        f"""
+        SELECT u.id_usuario, u.nombre, u.apellido, u.email, u.activo, r.nombre as rol
+        FROM Usuario u
+        JOIN Rol r ON u.id_rol = r.id_rol
+        WHERE {' AND '.join(condiciones)}
+        ORDER BY u.nombre, u.id_usuario
+        LIMIT %s
+        """,
+        (*params, limit + 1)
+    )
+    filas = cursor.fetchall()
+
+    # Se pide una fila de más para saber si hay otra página sin hacer COUNT(*)
+    next_cursor = None
+    if len(filas) > limit:
+        filas = filas[:limit]
+        ultima = filas[-1]
+        next_cursor = codificar_cursor(ultima["nombre"], ultima["id_usuario"])
+    return {"items": filas, "next_cursor": next_cursor}
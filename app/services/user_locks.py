@@ -0,0 +1,306 @@
+import asyncio
+import time
+from contextlib import asynccontextmanager
+from fastapi import HTTPException, status
+from app.db import db_connect
+
+# Primer entero de la pareja (clave1, clave2) de los advisory locks de Postgres.
+# Separa estos locks de cualquier otro advisory lock que use la aplicación.
+USER_LOCK_NAMESPACE = 7301
+
+# Tiempo máximo que una operación espera su turno antes de rendirse
+USER_LOCK_TIMEOUT_SECONDS = 10.0
+
+# Espera entre reintentos de pg_try_advisory_lock cuando otro worker tiene el lock
+_DB_RETRY_SLEEP = 0.005
+_DB_RETRY_SLEEP_MAX = 0.1
+
+
+class UserBusyError(HTTPException):
+    """La operación no consiguió el lock del usuario dentro del timeout."""
+
+    def __init__(self):
+        super().__init__(
+            status_code=status.HTTP_409_CONFLICT,
+            detail="Hay otra operación en curso para este usuario. Intenta de nuevo."
+        )
+
+
+class UserOperationCoordinator:
+    """
+    Serializa las operaciones que modifican el saldo de un mismo usuario.
+
+    Dos niveles:
+    - asyncio.Lock por usuario dentro del proceso (cola justa, sin tocar la BD).
+    - Advisory lock de Postgres para excluir a los demás workers de gunicorn.
+
+    Si se pasa `conn`, el advisory lock es de transacción (pg_try_advisory_xact_lock)
+    y se libera con el commit/rollback del llamador. Si no, se abre una conexión
+    dedicada con lock de sesión que se libera al salir del bloque.
+    """
+
+    def __init__(self, namespace: int = USER_LOCK_NAMESPACE, timeout: float = USER_LOCK_TIMEOUT_SECONDS):
+        self.namespace = namespace
+        self.timeout = timeout
+        # {id_usuario: [asyncio.Lock, usuarios_esperando_o_dentro]}
+        self._locks = {}
+        self._metrics = {
+            "acquired": 0,
+            "local_contended": 0,
+            "db_contended": 0,
+            "timeouts": 0,
+            "wait_total_ms": 0.0,
+            "wait_max_ms": 0.0,
+        }
+
+    def _enter_local(self, user_id: int):
+        entry = self._locks.get(user_id)
+        if entry is None:
+            entry = self._locks[user_id] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        return entry
+
+    def _leave_local(self, user_id: int, entry):
+        entry[1] -= 1
+        if entry[1] == 0 and self._locks.get(user_id) is entry:
+            del self._locks[user_id]
+
+    async def _acquire_db(self, cursor, user_id: int, deadline: float, xact: bool) -> bool:
+        func = "pg_try_advisory_xact_lock" if xact else "pg_try_advisory_lock"
+        sleep = _DB_RETRY_SLEEP
+        contended = False
+        while True:
+            cursor.execute(f"SELECT {func}(%s, %s)", (self.namespace, user_id))
+            if cursor.fetchone()[0]:
+                if contended:
+                    self._metrics["db_contended"] += 1
+                return True
+            contended = True
+            if time.monotonic() >= deadline:
+                return False
+            # Dormimos sin bloquear el event loop mientras el otro worker termina
+            await asyncio.sleep(sleep)
+            sleep = min(sleep * 2, _DB_RETRY_SLEEP_MAX)
+
+    @asynccontextmanager
+    async def hold(self, user_id, conn=None):
+        user_id = int(user_id)
+        started = time.monotonic()
+        deadline = started + self.timeout
+        entry = self._enter_local(user_id)
+        lock = entry[0]
+        lock_conn = None
+        try:
+            if entry[1] > 1:
+                # Otra operación del mismo usuario ya está dentro o esperando
+                self._metrics["local_contended"] += 1
+            try:
+                await asyncio.wait_for(lock.acquire(), timeout=self.timeout)
+            except asyncio.TimeoutError:
+                self._metrics["timeouts"] += 1
+                raise UserBusyError()
+
+            try:
+                if conn is not None:
+                    cursor = conn.cursor()
+                    acquired = await self._acquire_db(cursor, user_id, deadline, xact=True)
+                    cursor.close()
+                else:
+                    lock_conn = db_connect.get_connection()
+                    if lock_conn is None:
+                        raise HTTPException(status_code=500, detail="Error de conexión")
+                    lock_conn.autocommit = True
+                    cursor = lock_conn.cursor()
+                    acquired = await self._acquire_db(cursor, user_id, deadline, xact=False)
+                    cursor.close()
+                if not acquired:
+                    self._metrics["timeouts"] += 1
+                    raise UserBusyError()
+
+                waited_ms = (time.monotonic() - started) * 1000
+                self._metrics["acquired"] += 1
+                self._metrics["wait_total_ms"] += waited_ms
+                self._metrics["wait_max_ms"] = max(self._metrics["wait_max_ms"], waited_ms)
+
+                yield
+            finally:
+                if lock_conn is not None:
+                    try:
+                        cursor = lock_conn.cursor()
+                        cursor.execute("SELECT pg_advisory_unlock(%s, %s)", (self.namespace, user_id))
+                        cursor.close()
+                    except Exception as e:
+                        print(f"⚠️ Lock de usuario {user_id}: error al liberar advisory lock: {e}")
+                    finally:
+                        lock_conn.close()
+                lock.release()
+        finally:
+            self._leave_local(user_id, entry)
+
+    def stats(self) -> dict:
+        acquired = self._metrics["acquired"]
+        return {
+            **self._metrics,
+            "wait_avg_ms": round(self._metrics["wait_total_ms"] / acquired, 3) if acquired else 0.0,
+            "users_in_flight": len(self._locks),
+        }
+
+
+user_ops = UserOperationCoordinator()
+
+
+# ======================================================================
+#  Prueba de estrés: python -m app.services.user_locks [operaciones] [workers]
+#
+#  Un solo usuario recibe a la vez giros de slot, manos de blackjack y
+#  depósitos/retiros de la billetera, repartidos entre varios "workers" (un
+#  coordinador cada uno). Slot y billetera leen el saldo, validan, esperan la BD
+#  y escriben. El blackjack usa los mismos _cobrar/_pagar que
+#  api/blackjack_endpoints.py (UPDATE relativo condicionado): cobra al repartir,
+#  a veces dobla (segundo cobro) y paga al plantarse, en peticiones separadas.
+#  Los advisory locks de Postgres y el UPDATE de Saldo se simulan en memoria.
+#  Con lock, el saldo final debe ser el inicial más la suma de lo aceptado y
+#  nunca quedar negativo; sin lock se muestra lo que se pierde.
+# ======================================================================
+class _BDSimulada:
+    def __init__(self, saldo: float):
+        self.saldo = saldo
+        self.minimo = saldo
+        self.advisory = set()
+
+    def conexion(self):
+        return _ConexionSimulada(self)
+
+
+class _ConexionSimulada:
+    def __init__(self, bd):
+        self.bd = bd
+        self.autocommit = False
+        self._fila = None
+
+    def cursor(self):
+        return self
+
+    def execute(self, query, params=()):
+        clave = tuple(params)
+        if "pg_try_advisory" in query:
+            libre = clave not in self.bd.advisory
+            self.bd.advisory.add(clave)
+            self._fila = (libre,)
+        elif "pg_advisory_unlock" in query:
+            self.bd.advisory.discard(clave)
+            self._fila = (True,)
+        elif "UPDATE Saldo SET saldo_actual = saldo_actual +" in query:
+            # UPDATE relativo con "WHERE saldo_actual >= minimo": atómico, como en Postgres
+            delta, _, minimo = (float(x) for x in params)
+            self._fila = None
+            if self.bd.saldo >= minimo:
+                self.bd.saldo += delta
+                self.bd.minimo = min(self.bd.minimo, self.bd.saldo)
+                self._fila = (self.bd.saldo,)
+
+    def fetchone(self):
+        return self._fila
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        pass
+
+    def close(self):
+        pass
+
+
+async def _prueba_estres(operaciones: int, workers: int, con_lock: bool = True):
+    import random
+    from api.blackjack_endpoints import _cobrar, _pagar
+
+    rnd = random.Random(28)
+    saldo_inicial = 1000.0
+    bd = _BDSimulada(saldo_inicial)
+    db_connect.get_connection = bd.conexion
+    coordinadores = [UserOperationCoordinator(timeout=60) for _ in range(workers)]
+    id_usuario = 42
+    aceptado = {"total": 0.0, "rechazadas": 0}
+
+    @asynccontextmanager
+    async def sin_lock():
+        yield
+
+    def turno():
+        # Cada petición cae en un worker al azar (como detrás del balanceador)
+        return rnd.choice(coordinadores).hold(id_usuario) if con_lock else sin_lock()
+
+    async def mover(delta: float, exige_saldo: float = 0.0) -> bool:
+        """Lee, valida y escribe el saldo con una ida y vuelta a la BD en medio."""
+        saldo = bd.saldo
+        await asyncio.sleep(rnd.uniform(0, 0.002))
+        if saldo < exige_saldo:
+            aceptado["rechazadas"] += 1
+            return False
+        bd.saldo = saldo + delta
+        bd.minimo = min(bd.minimo, bd.saldo)
+        aceptado["total"] += delta
+        return True
+
+    async def slot():
+        apuesta = rnd.choice([5, 10, 25])
+        premio = apuesta * rnd.choice([0, 0, 0, 1, 2, 5])
+        async with turno():
+            await mover(premio - apuesta, exige_saldo=apuesta)
+
+    async def blackjack():
+        g = {"bet": rnd.choice([10, 20, 50]), "bank": 0}
+        async with turno():  # /deal
+            if not _cobrar(g, id_usuario, g["bet"]):
+                aceptado["rechazadas"] += 1
+                return
+            aceptado["total"] -= g["bet"]
+        await asyncio.sleep(rnd.uniform(0, 0.005))  # El jugador piensa
+        if rnd.random() < 0.3:
+            async with turno():  # /double
+                if _cobrar(g, id_usuario, g["bet"]):
+                    aceptado["total"] -= g["bet"]
+                    g["bet"] *= 2
+                else:
+                    aceptado["rechazadas"] += 1
+            await asyncio.sleep(rnd.uniform(0, 0.005))
+        async with turno():  # /stand: apuesta devuelta + ganancia, o nada
+            pago = g["bet"] * rnd.choice([0, 0, 1, 2, 2.5])
+            _pagar(g, id_usuario, pago)
+            aceptado["total"] += pago
+
+    async def billetera():
+        monto = rnd.choice([20, 50, 100])
+        async with turno():
+            if rnd.random() < 0.5:
+                await mover(monto)
+            else:
+                await mover(-monto, exige_saldo=monto)
+
+    tareas = [rnd.choice([slot, slot, blackjack, billetera])() for _ in range(operaciones)]
+    t0 = time.perf_counter()
+    await asyncio.gather(*tareas)
+    duracion = time.perf_counter() - t0
+
+    esperado = saldo_inicial + aceptado["total"]
+    ok = abs(bd.saldo - esperado) < 1e-6 and bd.minimo >= 0
+    print(f"{'Con' if con_lock else 'Sin'} lock | operaciones: {operaciones} | workers: {workers} | {duracion:.2f}s")
+    print(f"  Saldo final: {bd.saldo:.2f} | esperado: {esperado:.2f} | mínimo alcanzado: {bd.minimo:.2f} "
+          f"| rechazadas por saldo: {aceptado['rechazadas']}")
+    if con_lock:
+        s = [c.stats() for c in coordinadores]
+        print(f"  Locks: {sum(x['acquired'] for x in s)} | contención local: {sum(x['local_contended'] for x in s)} "
+              f"| contención entre workers: {sum(x['db_contended'] for x in s)} | timeouts: {sum(x['timeouts'] for x in s)}")
+    print("  ✅ El saldo cuadra" if ok else "  🚨 El saldo NO cuadra")
+    return ok
+
+
+if __name__ == "__main__":
+    import sys
+    total = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    n_workers = int(sys.argv[2]) if len(sys.argv) > 2 else 4
+    cuadra = asyncio.run(_prueba_estres(total, n_workers, con_lock=True))
+    asyncio.run(_prueba_estres(total, n_workers, con_lock=False))
+    sys.exit(0 if cuadra else 1)
@@ -0,0 +1,362 @@
+import asyncio
+import json
+import threading
+import time
+from psycopg2.extras import RealDictCursor
+from app.db import db_connect
+
+# Filas por lote. Cada lote es una transacción corta: pocos locks y poco WAL de golpe.
+PURGE_BATCH_SIZE = 2000
+
+# Pausa entre lotes para no acaparar la BD ni el worker de hilos
+PURGE_BATCH_PAUSE_SECONDS = 0.05
+
+# Cada cuánto se revisan trabajos pendientes (p. ej. los que dejó otro worker al caer)
+PURGE_POLL_SECONDS = 60
+
+# Si un lote espera más que esto por un lock (usuario jugando en ese momento), se
+# aborta y se reintenta en la siguiente pasada en lugar de bloquear a los demás.
+PURGE_LOCK_TIMEOUT = "2s"
+
+# Espacio de pg_try_advisory_lock(clase, id_usuario) para que dos workers no procesen
+# el mismo borrado a la vez.
+PURGE_LOCK_CLASS = 3901
+
+# Pasos en orden de dependencia: (nombre, DELETE de un lote). Cada DELETE borra como
+# mucho PURGE_BATCH_SIZE filas por llave primaria y se repite hasta que no borra nada,
+# así que todos los pasos se pueden reanudar desde cero sin problema.
+PASOS_BORRADO = [
+    ("auditoria", """
+        DELETE FROM Auditoria WHERE id_auditoria IN (
+            SELECT id_auditoria FROM Auditoria WHERE id_usuario = %(id)s LIMIT %(lote)s)
+    """),
+    ("respuestas_ticket", """
+        DELETE FROM RespuestaTicket WHERE id_respuesta IN (
+            SELECT id_respuesta FROM RespuestaTicket
+            WHERE id_usuario = %(id)s
+               OR id_ticket IN (SELECT id_ticket FROM Soporte WHERE id_jugador = %(id)s OR id_agente = %(id)s)
+            LIMIT %(lote)s)
+    """),
+    ("tickets", """
+        DELETE FROM Soporte WHERE id_ticket IN (
+            SELECT id_ticket FROM Soporte WHERE id_jugador = %(id)s OR id_agente = %(id)s LIMIT %(lote)s)
+    """),
+    ("transacciones", """
+        DELETE FROM Transaccion WHERE id_transaccion IN (
+            SELECT id_transaccion FROM Transaccion WHERE id_usuario = %(id)s LIMIT %(lote)s)
+    """),
+    # Las apuestas se borran antes que sus sesiones para que el CASCADE no borre
+    # millones de filas en un solo statement.
+    ("apuestas", """
+        DELETE FROM Apuesta WHERE id_apuesta IN (
+            SELECT a.id_apuesta FROM Apuesta a
+            JOIN Sesion_Juego s ON s.id_sesion_juego = a.id_sesion_juego
+            WHERE s.id_usuario = %(id)s LIMIT %(lote)s)
+    """),
+    ("sesiones_juego", """
+        DELETE FROM Sesion_Juego WHERE id_sesion_juego IN (
+            SELECT id_sesion_juego FROM Sesion_Juego WHERE id_usuario = %(id)s LIMIT %(lote)s)
+    """),
+    ("metodos_pago", "DELETE FROM Usuario_Metodo_Pago WHERE id_usuario = %(id)s"),
+    ("saldo", "DELETE FROM Saldo WHERE id_usuario = %(id)s"),
+    ("bonos", "DELETE FROM Usuario_Bono WHERE id_usuario = %(id)s"),
+    ("mensajes_chat", """
+        DELETE FROM Mensaje_Chat WHERE id_mensaje IN (
+            SELECT id_mensaje FROM Mensaje_Chat
+            WHERE id_usuario = %(id)s
+               OR id_chat IN (SELECT id_chat FROM Chat WHERE id_jugador = %(id)s OR id_agente = %(id)s)
+            LIMIT %(lote)s)
+    """),
+    ("chats", """
+        DELETE FROM Chat WHERE id_chat IN (
+            SELECT id_chat FROM Chat WHERE id_jugador = %(id)s OR id_agente = %(id)s LIMIT %(lote)s)
+    """),
+    ("usuario", "DELETE FROM Usuario WHERE id_usuario = %(id)s"),
+]
+
+
+def ensure_purge_table():
+    """
+    Crea la tabla Borrado_Usuario (estado y avance de cada borrado) y los índices
+    por id_usuario que necesitan los lotes para no recorrer tablas completas.
+    """
+    conn = None
+    try:
+        conn = db_connect.get_connection()
+        cursor = conn.cursor()
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS Borrado_Usuario (
+                id_usuario INTEGER PRIMARY KEY,
+                estado VARCHAR(20) NOT NULL DEFAULT 'Pendiente'
+                    CHECK (estado IN ('Pendiente', 'En curso', 'Completado', 'Error')),
+                paso VARCHAR(30),
+                filas_borradas BIGINT NOT NULL DEFAULT 0,
+                detalle JSONB NOT NULL DEFAULT '{}'::jsonb,
+                error TEXT,
+                solicitado_por INTEGER,
+                fecha_solicitud TIMESTAMP WITHOUT TIME ZONE NOT NULL DEFAULT NOW(),
+                fecha_actualizacion TIMESTAMP WITHOUT TIME ZONE NOT NULL DEFAULT NOW(),
+                fecha_fin TIMESTAMP WITHOUT TIME ZONE
+            );
+
+            CREATE INDEX IF NOT EXISTS idx_borrado_usuario_pendiente ON Borrado_Usuario (fecha_solicitud)
+                WHERE estado IN ('Pendiente', 'En curso');
+            CREATE INDEX IF NOT EXISTS idx_auditoria_usuario ON Auditoria (id_usuario);
+            CREATE INDEX IF NOT EXISTS idx_respuesta_ticket_usuario ON RespuestaTicket (id_usuario);
+            CREATE INDEX IF NOT EXISTS idx_mensaje_chat_usuario ON Mensaje_Chat (id_usuario);
+        """)
+        conn.commit()
+        cursor.close()
+    except Exception as e:
+        print(f"Error creating Borrado_Usuario table: {e}")
+    finally:
+        if conn: conn.close()
+
+
+class UserPurger:
+    """
+    Borrado de usuarios en segundo plano.
+
+    La petición solo desactiva al usuario y registra el trabajo en Borrado_Usuario;
+    una tarea de fondo borra sus datos por lotes, guardando el avance en la misma
+    transacción de cada lote. Si el proceso se reinicia, el trabajo sigue desde el
+    paso guardado.
+    """
+
+    def __init__(self, batch_size: int = PURGE_BATCH_SIZE):
+        self.batch_size = batch_size
+        self._task = None
+        self._loop = None
+        self._wake = None
+        self._stopping = threading.Event()
+        self._lock = threading.Lock()
+        self._metrics = {"jobs_completed": 0, "jobs_failed": 0, "batches": 0, "rows_deleted": 0, "lock_timeouts": 0}
+
+    # ------------------------------------------------------------------
+    #  Solicitud (desde el endpoint)
+    # ------------------------------------------------------------------
+    def request(self, id_usuario: int, solicitado_por: int = None) -> dict:
+        """
+        Desactiva al usuario y encola su borrado. Devuelve el estado del trabajo o
+        None si el usuario no existe. Solicitar de nuevo un borrado fallido lo repite
+        desde el primer paso (los pasos son idempotentes).
+        """
+        conn = db_connect.get_connection()
+        if conn is None:
+            raise RuntimeError("Error de conexión")
+        try:
+            cursor = conn.cursor(cursor_factory=RealDictCursor)
+            cursor.execute("UPDATE Usuario SET activo = false WHERE id_usuario = %s", (id_usuario,))
+            if cursor.rowcount == 0:
+                conn.rollback()
+                cursor.close()
+                return None
+            cursor.execute(
+                """
+                INSERT INTO Borrado_Usuario (id_usuario, solicitado_por) VALUES (%s, %s)
+                ON CONFLICT (id_usuario) DO UPDATE
+                    SET estado = 'Pendiente', paso = NULL, error = NULL, fecha_actualizacion = NOW()
+                    WHERE Borrado_Usuario.estado = 'Error'
+                """,
+                (id_usuario, solicitado_por)
+            )
+            conn.commit()
+            cursor.close()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
+        self.wake()
+        return self.status(id_usuario)
+
+    def status(self, id_usuario: int) -> dict:
+        conn = db_connect.get_connection()
+        if conn is None:
+            raise RuntimeError("Error de conexión")
+        try:
+            cursor = conn.cursor(cursor_factory=RealDictCursor)
+            cursor.execute(
+                """
+                SELECT id_usuario, estado, paso, filas_borradas, detalle, error,
+                       fecha_solicitud, fecha_actualizacion, fecha_fin
+                FROM Borrado_Usuario WHERE id_usuario = %s
+                """,
+                (id_usuario,)
+            )
+            job = cursor.fetchone()
+            cursor.close()
+        finally:
+            conn.close()
+        if job is None:
+            return None
+        job = dict(job)
+        pasos = [nombre for nombre, _ in PASOS_BORRADO]
+        job["paso_actual"] = pasos.index(job["paso"]) + 1 if job["paso"] in pasos else 0
+        job["total_pasos"] = len(pasos)
+        return job
+
+    def wake(self):
+        """Despierta a la tarea de fondo (si corre en este worker)."""
+        if self._wake is not None:
+            try:
+                self._loop.call_soon_threadsafe(self._wake.set)
+            except RuntimeError:
+                pass
+
+    # ------------------------------------------------------------------
+    #  Ejecución por lotes
+    # ------------------------------------------------------------------
+    def process_pending(self):
+        """Procesa todos los trabajos pendientes o interrumpidos (en un hilo)."""
+        conn = None
+        try:
+            conn = db_connect.get_connection()
+            if conn is None:
+                return
+            cursor = conn.cursor()
+            cursor.execute(
+                """
+                SELECT id_usuario FROM Borrado_Usuario
+                WHERE estado IN ('Pendiente', 'En curso')
+                ORDER BY fecha_solicitud
+                """
+            )
+            pendientes = [row[0] for row in cursor.fetchall()]
+            cursor.close()
+        except Exception as e:
+            print(f"⚠️ Borrado de usuarios: no se pudieron leer trabajos pendientes ({e})")
+            return
+        finally:
+            if conn: conn.close()
+
+        for id_usuario in pendientes:
+            if self._stopping.is_set():
+                return
+            self.run_job(id_usuario)
+
+    def run_job(self, id_usuario: int):
+        """
+        Borra los datos de un usuario paso por paso. El advisory lock (de sesión, sobrevive
+        a los commits de cada lote) evita que otro worker procese el mismo trabajo.
+        """
+        conn = db_connect.get_connection()
+        if conn is None:
+            return
+        try:
+            cursor = conn.cursor()
+            cursor.execute("SELECT pg_try_advisory_lock(%s, %s)", (PURGE_LOCK_CLASS, id_usuario))
+            if not cursor.fetchone()[0]:
+                conn.rollback()
+                return
+            try:
+                self._run_steps(conn, cursor, id_usuario)
+            finally:
+                conn.rollback()
+                cursor.execute("SELECT pg_advisory_unlock(%s, %s)", (PURGE_LOCK_CLASS, id_usuario))
+                conn.commit()
+            cursor.close()
+        except Exception as e:
+            print(f"🚨 Borrado de usuarios: error en el usuario {id_usuario}: {e}")
+        finally:
+            conn.close()
+
+    def _run_steps(self, conn, cursor, id_usuario: int):
+        cursor.execute(
+            "SELECT estado, paso, detalle FROM Borrado_Usuario WHERE id_usuario = %s",
+            (id_usuario,)
+        )
+        row = cursor.fetchone()
+        conn.commit()
+        if row is None or row[0] not in ("Pendiente", "En curso"):
+            return
+        _, paso_guardado, detalle = row
+        detalle = dict(detalle or {})
+        pasos = [nombre for nombre, _ in PASOS_BORRADO]
+        inicio = pasos.index(paso_guardado) if paso_guardado in pasos else 0
+        print(f"🔹 Borrado de usuarios: procesando usuario {id_usuario} desde el paso '{pasos[inicio]}'")
+
+        for nombre, sql in PASOS_BORRADO[inicio:]:
+            while True:
+                if self._stopping.is_set():
+                    return
+                try:
+                    cursor.execute(f"SET LOCAL lock_timeout = '{PURGE_LOCK_TIMEOUT}'")
+                    cursor.execute(sql, {"id": id_usuario, "lote": self.batch_size})
+                    borradas = cursor.rowcount
+                    detalle[nombre] = detalle.get(nombre, 0) + borradas
+                    terminado = nombre == "usuario"
+                    cursor.execute(
+                        """
+                        UPDATE Borrado_Usuario
+                        SET estado = %s, paso = %s, filas_borradas = filas_borradas + %s, detalle = %s,
+                            error = NULL, fecha_actualizacion = NOW(),
+                            fecha_fin = CASE WHEN %s THEN NOW() ELSE NULL END
+                        WHERE id_usuario = %s
+                        """,
+                        ("Completado" if terminado else "En curso", nombre, borradas,
+                         json.dumps(detalle), terminado, id_usuario)
+                    )
+                    conn.commit()
+                except Exception as e:
+                    conn.rollback()
+                    if getattr(e, "pgcode", None) == "55P03":  # lock_not_available
+                        # Se queda 'En curso' y se retoma en la siguiente pasada
+                        self._metrics["lock_timeouts"] += 1
+                        print(f"⚠️ Borrado de usuarios: lock ocupado en '{nombre}' (usuario {id_usuario}), se reintentará")
+                        return
+                    cursor.execute(
+                        """
+                        UPDATE Borrado_Usuario SET estado = 'Error', paso = %s, error = %s, fecha_actualizacion = NOW()
+                        WHERE id_usuario = %s
+                        """,
+                        (nombre, str(e), id_usuario)
+                    )
+                    conn.commit()
+                    self._metrics["jobs_failed"] += 1
+                    print(f"🚨 Borrado de usuarios: falló '{nombre}' para el usuario {id_usuario}: {e}")
+                    return
+
+                with self._lock:
+                    self._metrics["batches"] += 1
+                    self._metrics["rows_deleted"] += borradas
+                if terminado:
+                    self._metrics["jobs_completed"] += 1
+                    print(f"✅ Borrado de usuarios: usuario {id_usuario} eliminado ({detalle})")
+                    return
+                if borradas < self.batch_size:
+                    break
+                time.sleep(PURGE_BATCH_PAUSE_SECONDS)
+
+    # ------------------------------------------------------------------
+    #  Tarea de fondo
+    # ------------------------------------------------------------------
+    async def run_worker(self, interval: float = PURGE_POLL_SECONDS):
+        while True:
+            await asyncio.to_thread(self.process_pending)
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+
+    def start(self):
+        if self._task is None:
+            self._stopping.clear()
+            self._loop = asyncio.get_running_loop()
+            self._wake = asyncio.Event()
+            self._task = self._loop.create_task(self.run_worker())
+
+    async def stop(self):
+        # El lote en curso termina (o se revierte); el trabajo se reanuda al reiniciar
+        self._stopping.set()
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {**self._metrics, "batch_size": self.batch_size, "running": self._task is not None}
+
+
+user_purger = UserPurger()
@@ -0,0 +1,200 @@
+import asyncio
+import decimal
+import threading
+import time
+import uuid
+from app.db import db_connect
+from app.services.game_catalog import catalog as game_catalog
+
+# Cada cuánto se vuelcan a la BD las apuestas acumuladas en memoria
+WAGERING_FLUSH_SECONDS = 5.0
+
+# Los lotes ya aplicados se guardan este tiempo para reconocer reintentos
+WAGERING_LOTE_RETENTION = "1 day"
+
+COLUMNAS_ROLLOVER = """
+    ALTER TABLE Usuario_Bono ADD COLUMN IF NOT EXISTS apostado NUMERIC(14, 2) NOT NULL DEFAULT 0;
+    CREATE TABLE IF NOT EXISTS Rollover_Lote (
+        id_lote UUID PRIMARY KEY,
+        fecha TIMESTAMP WITHOUT TIME ZONE NOT NULL DEFAULT NOW()
+    );
+"""
+
+# Reparte cada (usuario, juego, monto) del lote entre los bonos activos del usuario que
+# cuentan para ese juego (id_juego NULL = todos) y avanza apostado/progreso en un solo
+# UPDATE. Los bonos sin requisito (valor o requisito_apuesta en 0) no se siguen.
+# progreso es NUMERIC(3, 2): se trunca para no mostrar 1.00 antes de completar.
+FLUSH_SQL = """
+    WITH lote AS (
+        SELECT * FROM unnest(%s::int[], %s::int[], %s::numeric[]) AS d(id_usuario, id_juego, monto)
+    ),
+    suma AS (
+        SELECT ub.id_usuario, ub.id_bono, SUM(lote.monto) AS monto, b.valor * b.requisito_apuesta AS requisito
+        FROM lote
+        JOIN Usuario_Bono ub ON ub.id_usuario = lote.id_usuario AND ub.estado = 'Activo'
+        JOIN Bono b ON b.id_bono = ub.id_bono
+        WHERE b.valor * b.requisito_apuesta > 0
+          AND (b.id_juego IS NULL OR b.id_juego = lote.id_juego)
+        GROUP BY ub.id_usuario, ub.id_bono, b.valor, b.requisito_apuesta
+    )
+    UPDATE Usuario_Bono ub
+    SET apostado = ub.apostado + suma.monto,
+        progreso = LEAST(FLOOR((ub.apostado + suma.monto) / suma.requisito * 100) / 100, 1),
+        estado = CASE WHEN ub.apostado + suma.monto >= suma.requisito THEN 'Usado' ELSE ub.estado END
+    FROM suma
+    WHERE ub.id_usuario = suma.id_usuario AND ub.id_bono = suma.id_bono AND ub.estado = 'Activo'
+    RETURNING ub.estado
+"""
+
+
+def ensure_wagering_columns():
+    """Agrega Usuario_Bono.apostado y la tabla de lotes ya aplicados (Rollover_Lote)."""
+    conn = None
+    try:
+        conn = db_connect.get_connection()
+        cursor = conn.cursor()
+        cursor.execute(COLUMNAS_ROLLOVER)
+        conn.commit()
+        cursor.close()
+    except Exception as e:
+        print(f"Error adding Usuario_Bono wagering columns: {e}")
+    finally:
+        if conn: conn.close()
+
+
+class WageringTracker:
+    """
+    Rollover de bonos: cuánto ha apostado cada jugador para liberar sus bonos activos.
+
+    Las liquidaciones (tragamonedas, ruleta, blackjack) solo suman la apuesta a un
+    buffer en memoria por (usuario, juego). Una tarea de fondo vuelca el buffer en
+    lotes: un UPDATE para todos los bonos afectados, que avanza apostado/progreso y
+    marca 'Usado' los que alcanzan su requisito.
+
+    Cada lote tiene un id que se registra en Rollover_Lote dentro de la misma
+    transacción. Si un volcado falla (aunque el commit haya llegado a la BD), se
+    reintenta el MISMO lote y el id repetido hace que no se aplique dos veces. Lo que
+    queda en memoria se vuelca también al apagar; una caída dura pierde a lo más lo
+    apostado en el último intervalo.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._buffer = {}
+        # (id_lote, {(id_usuario, slug): monto}) en espera de confirmarse
+        self._pendiente = None
+        self._flush_lock = threading.Lock()
+        self._task = None
+        self._metrics = {
+            "bets": 0, "flushes": 0, "flush_errors": 0, "retried_batches": 0,
+            "rows_updated": 0, "completed": 0, "last_flush_ms": 0.0,
+        }
+
+    # ------------------------------------------------------------------
+    #  Apuestas (por liquidación)
+    # ------------------------------------------------------------------
+    def record_bet(self, id_usuario: int, juego: str, monto):
+        """Suma la apuesta liquidada al buffer local. No toca la BD."""
+        if not monto or monto <= 0:
+            return
+        key = (int(id_usuario), juego)
+        amount = decimal.Decimal(str(monto))
+        with self._lock:
+            self._buffer[key] = self._buffer.get(key, 0) + amount
+            self._metrics["bets"] += 1
+
+    def pending(self) -> int:
+        with self._lock:
+            return len(self._buffer) + (len(self._pendiente[1]) if self._pendiente else 0)
+
+    # ------------------------------------------------------------------
+    #  Volcado
+    # ------------------------------------------------------------------
+    def _next_batch(self):
+        """El lote pendiente de un volcado fallido o, si no hay, el buffer actual."""
+        with self._lock:
+            if self._pendiente is None and self._buffer:
+                self._pendiente = (str(uuid.uuid4()), self._buffer)
+                self._buffer = {}
+            return self._pendiente
+
+    def _write_batch(self, cursor, id_lote: str, montos: dict):
+        cursor.execute(
+            "INSERT INTO Rollover_Lote (id_lote) VALUES (%s::uuid) ON CONFLICT (id_lote) DO NOTHING",
+            (id_lote,)
+        )
+        if cursor.rowcount == 0:
+            # Un intento anterior ya hizo commit de este lote
+            self._metrics["retried_batches"] += 1
+            return []
+
+        usuarios, juegos, cantidades = [], [], []
+        for (id_usuario, slug), monto in sorted(montos.items(), key=lambda kv: (kv[0][0], kv[0][1] or "")):
+            game = game_catalog.get_by_slug(slug)
+            usuarios.append(id_usuario)
+            juegos.append(game["id_juego"] if game else None)
+            cantidades.append(monto)
+        cursor.execute(FLUSH_SQL, (usuarios, juegos, cantidades))
+        return [row[0] for row in cursor.fetchall()]
+
+    def flush(self):
+        """Aplica el lote pendiente. Se llama desde el hilo del flusher (y al apagar)."""
+        with self._flush_lock:
+            batch = self._next_batch()
+            if batch is None:
+                return
+            id_lote, montos = batch
+            t0 = time.perf_counter()
+            conn = None
+            try:
+                conn = db_connect.get_connection()
+                if conn is None:
+                    raise RuntimeError("Error de conexión")
+                cursor = conn.cursor()
+                estados = self._write_batch(cursor, id_lote, montos)
+                cursor.execute(
+                    f"DELETE FROM Rollover_Lote WHERE fecha < NOW() - INTERVAL '{WAGERING_LOTE_RETENTION}'"
+                )
+                conn.commit()
+                cursor.close()
+            except Exception as e:
+                if conn: conn.rollback()
+                # El lote se queda en _pendiente y se reintenta con el mismo id
+                self._metrics["flush_errors"] += 1
+                print(f"⚠️ Rollover: error al volcar {len(montos)} apuestas acumuladas ({e}), se reintentará")
+                return
+            finally:
+                if conn: conn.close()
+
+            with self._lock:
+                self._pendiente = None
+            completados = sum(1 for estado in estados if estado == "Usado")
+            self._metrics["flushes"] += 1
+            self._metrics["rows_updated"] += len(estados)
+            self._metrics["completed"] += completados
+            self._metrics["last_flush_ms"] = round((time.perf_counter() - t0) * 1000, 1)
+            if completados:
+                print(f"✅ Rollover: {completados} bonos alcanzaron su requisito de apuesta")
+
+    async def run_flusher(self, interval: float = WAGERING_FLUSH_SECONDS):
+        while True:
+            await asyncio.sleep(interval)
+            await asyncio.to_thread(self.flush)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self.run_flusher())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        # Un reintento por si el lote fallido es anterior a lo que queda en el buffer
+        await asyncio.to_thread(self.flush)
+        await asyncio.to_thread(self.flush)
+
+    def stats(self) -> dict:
+        return {**self._metrics, "pending_keys": self.pending()}
+
+
+wagering = WageringTracker()
@@ -1,6 +1,8 @@
 
 from datetime import datetime, date
 import decimal
+import os
+from fastapi.responses import JSONResponse, Response
 
 def serialize_data(data):
     """
@@ -19,3 +21,36 @@ def serialize_data(data):
     if isinstance(data, decimal.Decimal):
         return float(data)
     return data
+
+
+def etag_response(request, content: dict, etag: str, max_age: int = 0):
+    """
+    Devuelve un JSONResponse con cabecera ETag, o un 304 vacío si el cliente
+    ya tiene esa versión (If-None-Match).
+    """
+    headers = {"ETag": etag, "Cache-Control": f"private, max-age={max_age}, must-revalidate"}
+    if_none_match = request.headers.get("if-none-match", "")
+    if etag in [tag.strip() for tag in if_none_match.split(",")] or if_none_match.strip() == "*":
+        return Response(status_code=304, headers=headers)
+    return JSONResponse(content, headers=headers)
+
+
+# Proxies de confianza delante de la app (Render: 1). Cada uno agrega al final de
+# X-Forwarded-For la IP que le habló; lo que está a su izquierda lo manda el
+# cliente y no vale para bloquear ni limitar. 0 = sin proxy, solo el socket.
+TRUSTED_PROXY_HOPS = int(os.getenv("TRUSTED_PROXY_HOPS", "1"))
+
+
+def client_ip(request) -> str:
+    """
+    IP del cliente. Detrás de TRUSTED_PROXY_HOPS proxies es la entrada de
+    X-Forwarded-For que agregó el proxy más externo (la N-ésima desde la derecha),
+    no la primera: esa la puede inventar el cliente. Sin cabecera, la del socket.
+    """
+    socket_ip = request.client.host if request.client else "desconocida"
+    if TRUSTED_PROXY_HOPS <= 0:
+        return socket_ip
+    saltos = [h.strip() for h in request.headers.get("x-forwarded-for", "").split(",") if h.strip()]
+    if not saltos:
+        return socket_ip
+    return saltos[-min(TRUSTED_PROXY_HOPS, len(saltos))]
@@ -0,0 +1,74 @@
+"""
+Calibración de Argon2id para la máquina donde corre el backend.
+
+Mide el tiempo de verify() para combinaciones de memory_cost / time_cost y recomienda
+la más costosa (más resistente) que cumple la latencia objetivo por login.
+
+Uso (en la misma instancia/plan de Render que producción):
+    python calibrate_argon2.py --target-ms 250
+    python calibrate_argon2.py --target-ms 150 --max-memory-mb 128 --parallelism 2
+
+El resultado se aplica con las variables ARGON2_TIME_COST, ARGON2_MEMORY_COST y
+ARGON2_PARALLELISM. Los usuarios se rehashean solos en su siguiente login.
+"""
+import argparse
+import statistics
+import time
+from passlib.hash import argon2
+
+
+def measure(time_cost: int, memory_kib: int, parallelism: int, samples: int) -> float:
+    """Mediana en ms de verify() con esos parámetros."""
+    handler = argon2.using(rounds=time_cost, memory_cost=memory_kib, parallelism=parallelism)
+    password = "calibracion-Argon2!"
+    stored = handler.hash(password)
+    times = []
+    for _ in range(samples):
+        t0 = time.perf_counter()
+        handler.verify(password, stored)
+        times.append((time.perf_counter() - t0) * 1000)
+    return statistics.median(times)
+
+
+def calibrate(target_ms: float, max_memory_mb: int, max_time_cost: int, parallelism: int, samples: int):
+    memory_options = []
+    memory_mb = 16
+    while memory_mb <= max_memory_mb:
+        memory_options.append(memory_mb * 1024)
+        memory_mb *= 2
+
+    results = []
+    print(f"{'memoria':>10} {'t_cost':>7} {'p':>3} {'verify (ms)':>12}")
+    for memory_kib in memory_options:
+        for time_cost in range(1, max_time_cost + 1):
+            ms = measure(time_cost, memory_kib, parallelism, samples)
+            ok = ms <= target_ms
+            results.append((memory_kib, time_cost, ms, ok))
+            print(f"{memory_kib // 1024:>7} MB {time_cost:>7} {parallelism:>3} {ms:>12.1f} {'✅' if ok else ''}")
+            # Subir time_cost solo hace más lento; no tiene caso seguir con esta memoria
+            if not ok:
+                break
+
+    candidates = [r for r in results if r[3]]
+    if not candidates:
+        print(f"\n❌ Ninguna combinación cumple {target_ms} ms; sube el objetivo o usa menos memoria.")
+        return None
+
+    # Costo relativo para un atacante ~ memoria x pasadas. Se prefiere más memoria a
+    # más pasadas con el mismo costo (Argon2id resiste mejor GPUs con memoria alta).
+    memory_kib, time_cost, ms, _ = max(candidates, key=lambda r: (r[0] * r[1], r[0]))
+    print(f"\n✅ Recomendado para {target_ms} ms: memory_cost={memory_kib} KiB "
+          f"({memory_kib // 1024} MB), time_cost={time_cost}, parallelism={parallelism} -> {ms:.1f} ms")
+    print(f"   ARGON2_MEMORY_COST={memory_kib} ARGON2_TIME_COST={time_cost} ARGON2_PARALLELISM={parallelism}")
+    return memory_kib, time_cost, parallelism
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Calibra los parámetros de Argon2id para una latencia objetivo.")
+    parser.add_argument("--target-ms", type=float, default=250, help="Latencia máxima de verify() por login")
+    parser.add_argument("--max-memory-mb", type=int, default=256, help="Memoria máxima por hash")
+    parser.add_argument("--max-time-cost", type=int, default=6, help="Pasadas máximas")
+    parser.add_argument("--parallelism", type=int, default=4, help="Hilos por hash (lanes)")
+    parser.add_argument("--samples", type=int, default=5, help="Mediciones por combinación")
+    args = parser.parse_args()
+    calibrate(args.target_ms, args.max_memory_mb, args.max_time_cost, args.parallelism, args.samples)
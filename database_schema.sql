@@ -263,3 +263,469 @@ CREATE TABLE IF NOT EXISTS RespuestaTicket (
 CREATE INDEX idx_respuesta_ticket ON RespuestaTicket (id_ticket);
 CREATE INDEX idx_respuesta_fecha ON RespuestaTicket (id_ticket, fecha_respuesta);
 
+-- ===================================================================
+-- 17. TABLA LIMITE_APUESTA_USUARIO
+-- Overrides de apuesta mínima/máxima por usuario (VIP, juego responsable).
+-- id_juego NULL = el límite aplica a todos los juegos.
+-- ===================================================================
+CREATE TABLE IF NOT EXISTS Limite_Apuesta_Usuario (
+    id_limite SERIAL PRIMARY KEY,
+    id_usuario INTEGER NOT NULL REFERENCES Usuario(id_usuario) ON DELETE CASCADE,
+    id_juego INTEGER REFERENCES Juego(id_juego) ON DELETE CASCADE,
+    min_apuesta NUMERIC(8, 2),
+    max_apuesta NUMERIC(8, 2),
+    motivo VARCHAR(50),
+    fecha_actualizacion TIMESTAMP WITHOUT TIME ZONE NOT NULL DEFAULT NOW()
+);
+
+CREATE UNIQUE INDEX IF NOT EXISTS idx_limite_usuario_juego ON Limite_Apuesta_Usuario (id_usuario, COALESCE(id_juego, 0));
+
+-- ===================================================================
+-- 18. TABLAS JACKPOT Y JACKPOT_CONTRIBUCION
+-- Jackpot progresivo. Las contribuciones se reparten en N filas (shards)
+-- para no convertir una sola fila en un punto caliente.
+-- ===================================================================
+CREATE TABLE IF NOT EXISTS Jackpot (
+    id_jackpot SERIAL PRIMARY KEY,
+    semilla NUMERIC(12, 2) NOT NULL,
+    estado VARCHAR(20) NOT NULL DEFAULT 'Activo' CHECK (estado IN ('Activo', 'Ganado')),
+    fecha_inicio TIMESTAMP WITHOUT TIME ZONE NOT NULL DEFAULT NOW(),
+    id_ganador INTEGER REFERENCES Usuario(id_usuario) ON DELETE SET NULL,
+    monto_ganado NUMERIC(12, 2),
+    fecha_ganado TIMESTAMP WITHOUT TIME ZONE
+);
+
+-- Solo puede haber un jackpot activo a la vez
+CREATE UNIQUE INDEX IF NOT EXISTS idx_jackpot_unico_activo ON Jackpot (estado) WHERE estado = 'Activo';
+
+CREATE TABLE IF NOT EXISTS Jackpot_Contribucion (
+    id_jackpot INTEGER NOT NULL REFERENCES Jackpot(id_jackpot) ON DELETE CASCADE,
+    shard SMALLINT NOT NULL,
+    monto NUMERIC(14, 4) NOT NULL DEFAULT 0,
+    PRIMARY KEY (id_jackpot, shard)
+);
+
+-- ===================================================================
+-- 19. TABLA LEADERBOARD_SNAPSHOT
+-- Copia periódica de los rankings en memoria (top-K por periodo y juego)
+-- para reconstruirlos rápido al reiniciar.
+-- ===================================================================
+CREATE TABLE IF NOT EXISTS Leaderboard_Snapshot (
+    periodo VARCHAR(10) NOT NULL,
+    bucket VARCHAR(10) NOT NULL,
+    juego VARCHAR(50) NOT NULL,
+    datos JSONB NOT NULL,
+    fecha_actualizacion TIMESTAMP WITHOUT TIME ZONE NOT NULL DEFAULT NOW(),
+    PRIMARY KEY (periodo, bucket, juego)
+);
+
+-- ===================================================================
+-- 20. TABLA SESION_REVOCADA
+-- Lista de revocación de los tokens de sesión firmados.
+-- jti = token concreto (logout); revocado_desde = todas las sesiones del
+-- usuario emitidas antes de ese momento (desactivación, cambio de rol).
+-- ===================================================================
+CREATE TABLE IF NOT EXISTS Sesion_Revocada (
+    id_revocacion SERIAL PRIMARY KEY,
+    jti VARCHAR(32) UNIQUE,
+    id_usuario INTEGER NOT NULL,
+    revocado_desde TIMESTAMP WITHOUT TIME ZONE,
+    expira TIMESTAMP WITHOUT TIME ZONE NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS idx_sesion_revocada_expira ON Sesion_Revocada (expira);
+
+-- ===================================================================
+-- 21. TABLA LIMITE_TASA
+-- Contadores del rate limit de login/registro/reseteo cuando se usa el
+-- backend compartido (RATE_LIMIT_BACKEND=postgres). UNLOGGED: son datos
+-- efímeros y no necesitan WAL.
+-- ===================================================================
+CREATE UNLOGGED TABLE IF NOT EXISTS Limite_Tasa (
+    clave VARCHAR(200) NOT NULL,
+    ventana BIGINT NOT NULL,
+    conteo INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (clave, ventana)
+);
+
+-- ===================================================================
+-- 22. ÍNDICE ÚNICO DE CURP
+-- El registro detecta CURP duplicada con este índice (email ya es UNIQUE).
+-- Parcial: administradores y auditores no tienen CURP.
+-- ===================================================================
+CREATE UNIQUE INDEX IF NOT EXISTS idx_usuario_curp_unico
+    ON Usuario (curp) WHERE curp IS NOT NULL AND curp <> '';
+
+-- ===================================================================
+-- 23. TABLA CONTADOR_ADMIN Y TRIGGERS
+-- Totales del dashboard del admin (jugadores, activos, depósitos y retiros
+-- completados) mantenidos por triggers. Cada contador se reparte en 8 filas
+-- (shards) para no serializar las escrituras concurrentes.
+-- El backend siembra los contadores al crear los triggers
+-- (app/services/admin_stats.py).
+-- ===================================================================
+CREATE TABLE IF NOT EXISTS Contador_Admin (
+    clave VARCHAR(30) NOT NULL,
+    shard SMALLINT NOT NULL,
+    valor NUMERIC(16, 2) NOT NULL DEFAULT 0,
+    PRIMARY KEY (clave, shard)
+);
+
+CREATE OR REPLACE FUNCTION fn_sumar_contador_admin(p_clave TEXT, p_delta NUMERIC) RETURNS void AS $$
+BEGIN
+    IF p_delta <> 0 THEN
+        INSERT INTO Contador_Admin (clave, shard, valor)
+        VALUES (p_clave, floor(random() * 8)::smallint, p_delta)
+        ON CONFLICT (clave, shard) DO UPDATE SET valor = Contador_Admin.valor + EXCLUDED.valor;
+    END IF;
+END $$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION trg_contador_admin_usuario() RETURNS trigger AS $$
+DECLARE
+    d_total INTEGER := 0;
+    d_activos INTEGER := 0;
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') AND OLD.id_rol = 1 THEN
+        d_total := d_total - 1;
+        IF OLD.activo THEN d_activos := d_activos - 1; END IF;
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') AND NEW.id_rol = 1 THEN
+        d_total := d_total + 1;
+        IF NEW.activo THEN d_activos := d_activos + 1; END IF;
+    END IF;
+    PERFORM fn_sumar_contador_admin('jugadores', d_total);
+    PERFORM fn_sumar_contador_admin('jugadores_activos', d_activos);
+    RETURN NULL;
+END $$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION trg_contador_admin_transaccion() RETURNS trigger AS $$
+DECLARE
+    d_depositos NUMERIC := 0;
+    d_retiros NUMERIC := 0;
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') AND OLD.estado = 'Completada' THEN
+        IF OLD.tipo_transaccion = 'Depósito' THEN d_depositos := d_depositos - OLD.monto; END IF;
+        IF OLD.tipo_transaccion = 'Retiro' THEN d_retiros := d_retiros - OLD.monto; END IF;
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') AND NEW.estado = 'Completada' THEN
+        IF NEW.tipo_transaccion = 'Depósito' THEN d_depositos := d_depositos + NEW.monto; END IF;
+        IF NEW.tipo_transaccion = 'Retiro' THEN d_retiros := d_retiros + NEW.monto; END IF;
+    END IF;
+    PERFORM fn_sumar_contador_admin('depositos', d_depositos);
+    PERFORM fn_sumar_contador_admin('retiros', d_retiros);
+    RETURN NULL;
+END $$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS contador_admin_usuario ON Usuario;
+CREATE TRIGGER contador_admin_usuario
+    AFTER INSERT OR DELETE OR UPDATE OF id_rol, activo ON Usuario
+    FOR EACH ROW EXECUTE FUNCTION trg_contador_admin_usuario();
+
+DROP TRIGGER IF EXISTS contador_admin_transaccion ON Transaccion;
+CREATE TRIGGER contador_admin_transaccion
+    AFTER INSERT OR DELETE OR UPDATE OF tipo_transaccion, monto, estado ON Transaccion
+    FOR EACH ROW EXECUTE FUNCTION trg_contador_admin_transaccion();
+
+-- ===================================================================
+-- 24. ÍNDICES DEL DIRECTORIO DE USUARIOS (admin)
+-- Paginación por llave (id_rol, nombre, id_usuario), búsqueda por prefijo
+-- (text_pattern_ops) y por subcadena (trigramas) en nombre, apellido y email.
+-- La expresión del índice GIN debe coincidir con app/services/user_directory.py.
+-- ===================================================================
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
+CREATE INDEX IF NOT EXISTS idx_usuario_rol_nombre ON Usuario (id_rol, nombre, id_usuario);
+CREATE INDEX IF NOT EXISTS idx_usuario_nombre_prefijo ON Usuario (lower(nombre) text_pattern_ops);
+CREATE INDEX IF NOT EXISTS idx_usuario_apellido_prefijo ON Usuario (lower(apellido) text_pattern_ops);
+CREATE INDEX IF NOT EXISTS idx_usuario_email_prefijo ON Usuario (lower(email) text_pattern_ops);
+CREATE INDEX IF NOT EXISTS idx_usuario_busqueda_trgm ON Usuario
+    USING GIN (lower(coalesce(nombre, '') || ' ' || coalesce(apellido, '') || ' ' || coalesce(email, '')) gin_trgm_ops);
+
+-- ===================================================================
+-- 25. TABLA BORRADO_USUARIO
+-- Trabajos de borrado de usuarios en segundo plano: el endpoint desactiva
+-- al usuario y el backend borra sus datos por lotes, guardando aquí el paso
+-- y las filas borradas para reanudar tras un reinicio.
+-- Sin FK a Usuario: el registro sobrevive al borrado como constancia.
+-- ===================================================================
+CREATE TABLE IF NOT EXISTS Borrado_Usuario (
+    id_usuario INTEGER PRIMARY KEY,
+    estado VARCHAR(20) NOT NULL DEFAULT 'Pendiente'
+        CHECK (estado IN ('Pendiente', 'En curso', 'Completado', 'Error')),
+    paso VARCHAR(30),
+    filas_borradas BIGINT NOT NULL DEFAULT 0,
+    detalle JSONB NOT NULL DEFAULT '{}'::jsonb,
+    error TEXT,
+    solicitado_por INTEGER,
+    fecha_solicitud TIMESTAMP WITHOUT TIME ZONE NOT NULL DEFAULT NOW(),
+    fecha_actualizacion TIMESTAMP WITHOUT TIME ZONE NOT NULL DEFAULT NOW(),
+    fecha_fin TIMESTAMP WITHOUT TIME ZONE
+);
+
+CREATE INDEX IF NOT EXISTS idx_borrado_usuario_pendiente ON Borrado_Usuario (fecha_solicitud)
+    WHERE estado IN ('Pendiente', 'En curso');
+
+-- Índices por id_usuario que usan los lotes del borrado
+CREATE INDEX IF NOT EXISTS idx_auditoria_usuario ON Auditoria (id_usuario);
+CREATE INDEX IF NOT EXISTS idx_respuesta_ticket_usuario ON RespuestaTicket (id_usuario);
+CREATE INDEX IF NOT EXISTS idx_mensaje_chat_usuario ON Mensaje_Chat (id_usuario);
+
+-- ===================================================================
+-- 26. TABLAS BLOQUEOIP Y LISTABLANCAIP
+-- IPs o rangos CIDR (IPv4/IPv6) bloqueados y permitidos. El backend los
+-- carga en memoria (app/services/ip_filter.py) y los aplica en cada
+-- petición; en el mismo prefijo gana la lista blanca.
+-- ===================================================================
+CREATE TABLE IF NOT EXISTS BloqueoIP (
+    id_bloqueo SERIAL PRIMARY KEY,
+    ip_address VARCHAR(50) UNIQUE NOT NULL,
+    razon TEXT,
+    fecha_bloqueo TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    activo BOOLEAN DEFAULT TRUE
+);
+
+CREATE TABLE IF NOT EXISTS ListaBlancaIP (
+    id_lista SERIAL PRIMARY KEY,
+    ip_address VARCHAR(50) UNIQUE NOT NULL,
+    descripcion TEXT,
+    fecha_alta TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    activo BOOLEAN DEFAULT TRUE
+);
+
+-- ===================================================================
+-- 27. COLUMNAS DE VALOR Y SEGMENTACIÓN DE BONO
+-- valor / requisito_apuesta (x veces el valor) y reglas opcionales que
+-- evalúa el motor de elegibilidad en memoria (app/services/bonus_engine.py):
+-- solo jugadores nuevos, depósito mínimo y bono de un juego específico.
+-- NULL = sin restricción; las reglas se combinan con AND.
+-- ===================================================================
+ALTER TABLE Bono ADD COLUMN IF NOT EXISTS valor NUMERIC(10, 2) NOT NULL DEFAULT 0;
+ALTER TABLE Bono ADD COLUMN IF NOT EXISTS requisito_apuesta NUMERIC(10, 2) NOT NULL DEFAULT 0;
+ALTER TABLE Bono ADD COLUMN IF NOT EXISTS solo_nuevos_dias INTEGER;
+ALTER TABLE Bono ADD COLUMN IF NOT EXISTS deposito_minimo NUMERIC(10, 2);
+ALTER TABLE Bono ADD COLUMN IF NOT EXISTS id_juego INTEGER REFERENCES Juego(id_juego) ON DELETE SET NULL;
+
+-- ===================================================================
+-- 28. ROLLOVER DE BONOS
+-- Usuario_Bono.apostado acumula lo apostado desde que se reclamó el bono.
+-- El backend suma las apuestas en memoria y las vuelca en lotes
+-- (app/services/wagering.py); al llegar a valor * requisito_apuesta el
+-- bono pasa a 'Usado'. Rollover_Lote guarda los lotes ya aplicados para
+-- que un reintento no los cuente dos veces.
+-- ===================================================================
+ALTER TABLE Usuario_Bono ADD COLUMN IF NOT EXISTS apostado NUMERIC(14, 2) NOT NULL DEFAULT 0;
+
+CREATE TABLE IF NOT EXISTS Rollover_Lote (
+    id_lote UUID PRIMARY KEY,
+    fecha TIMESTAMP WITHOUT TIME ZONE NOT NULL DEFAULT NOW()
+);
+
+-- ===================================================================
+-- 29. ÍNDICES DEL BARRIDO DE MANTENIMIENTO
+-- app/services/maintenance.py vence bonos (Usuario_Bono -> 'Expirado'),
+-- marca 'Fallida' los retiros pendientes por más de 30 días (devolviendo
+-- el saldo) y cierra tickets sin actividad. Índices parciales con los
+-- mismos predicados de sus lotes: solo contienen las filas vivas.
+-- ===================================================================
+CREATE INDEX IF NOT EXISTS idx_usuario_bono_activo ON Usuario_Bono (id_bono) WHERE estado = 'Activo';
+CREATE INDEX IF NOT EXISTS idx_bono_expiracion ON Bono (fecha_expiracion) WHERE fecha_expiracion IS NOT NULL;
+CREATE INDEX IF NOT EXISTS idx_transaccion_retiro_pendiente ON Transaccion (fecha_transaccion)
+    WHERE tipo_transaccion = 'Retiro' AND estado = 'Pendiente';
+CREATE INDEX IF NOT EXISTS idx_soporte_abierto_fecha ON Soporte (fecha_creacion)
+    WHERE estado IN ('Abierto', 'En Proceso');
+
+-- ===================================================================
+-- 30. COLA DE TICKETS DEL AGENTE
+-- prioridad se deriva del estado (1 Abierto, 2 En Proceso, 3 Cerrado) y
+-- el índice sigue el orden de la cola, paginada por llave
+-- (app/services/ticket_queue.py).
+-- ===================================================================
+ALTER TABLE Soporte ADD COLUMN IF NOT EXISTS prioridad SMALLINT
+    GENERATED ALWAYS AS (CASE estado WHEN 'Abierto' THEN 1 WHEN 'En Proceso' THEN 2 ELSE 3 END) STORED;
+CREATE INDEX IF NOT EXISTS idx_soporte_cola ON Soporte (prioridad, fecha_creacion DESC, id_ticket DESC);
+
+-- ===================================================================
+-- 31. EVENTOS EN VIVO DE TICKETS (LISTEN/NOTIFY)
+-- Los triggers publican en el canal 'casino_eventos' cada ticket creado,
+-- asignado, respondido, cerrado o reabierto (solo ids y estado). Cada
+-- worker escucha el canal (app/services/event_hub.py) y lo reenvía por
+-- SSE (/api/eventos) a las páginas del jugador y del agente.
+-- ===================================================================
+CREATE OR REPLACE FUNCTION trg_evento_soporte() RETURNS trigger AS $$
+DECLARE
+    tipo TEXT;
+    agente_anterior INTEGER;
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        tipo := 'ticket_creado';
+    ELSE
+        IF NEW.estado IS NOT DISTINCT FROM OLD.estado AND NEW.id_agente IS NOT DISTINCT FROM OLD.id_agente THEN
+            RETURN NULL;
+        END IF;
+        agente_anterior := OLD.id_agente;
+        tipo := CASE
+            WHEN NEW.estado = 'Cerrado' AND OLD.estado <> 'Cerrado' THEN 'ticket_cerrado'
+            WHEN OLD.estado = 'Cerrado' AND NEW.estado <> 'Cerrado' THEN 'ticket_reabierto'
+            WHEN NEW.id_agente IS DISTINCT FROM OLD.id_agente THEN 'ticket_asignado'
+            ELSE 'ticket_actualizado' END;
+    END IF;
+    PERFORM pg_notify('casino_eventos', json_build_object(
+        'tipo', tipo, 'id_ticket', NEW.id_ticket, 'id_jugador', NEW.id_jugador,
+        'id_agente', NEW.id_agente, 'id_agente_anterior', agente_anterior, 'estado', NEW.estado)::text);
+    RETURN NULL;
+END $$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION trg_evento_respuesta_ticket() RETURNS trigger AS $$
+DECLARE
+    t RECORD;
+BEGIN
+    SELECT id_jugador, id_agente, estado INTO t FROM Soporte WHERE id_ticket = NEW.id_ticket;
+    PERFORM pg_notify('casino_eventos', json_build_object(
+        'tipo', 'ticket_respondido', 'id_ticket', NEW.id_ticket, 'id_jugador', t.id_jugador,
+        'id_agente', t.id_agente, 'estado', t.estado, 'es_agente', NEW.es_agente)::text);
+    RETURN NULL;
+END $$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS evento_soporte ON Soporte;
+CREATE TRIGGER evento_soporte
+    AFTER INSERT OR UPDATE OF estado, id_agente ON Soporte
+    FOR EACH ROW EXECUTE FUNCTION trg_evento_soporte();
+
+DROP TRIGGER IF EXISTS evento_respuesta_ticket ON RespuestaTicket;
+CREATE TRIGGER evento_respuesta_ticket
+    AFTER INSERT ON RespuestaTicket
+    FOR EACH ROW EXECUTE FUNCTION trg_evento_respuesta_ticket();
+
+-- ===================================================================
+-- 32. CHAT EN VIVO (WEBSOCKET)
+-- uuid lo genera el cliente por mensaje: los reenvíos (ack perdido,
+-- reconexión) chocan con el índice único y no se duplican. Los mensajes
+-- se guardan por lotes y llegan a los demás workers por NOTIFY; el
+-- trigger de Chat avisa cuando un chat se crea, se toma o se cierra
+-- (app/services/live_chat.py, app/services/event_hub.py).
+-- ===================================================================
+ALTER TABLE Mensaje_Chat ADD COLUMN IF NOT EXISTS uuid UUID;
+CREATE UNIQUE INDEX IF NOT EXISTS idx_mensaje_chat_uuid ON Mensaje_Chat (uuid);
+CREATE INDEX IF NOT EXISTS idx_chat_esperando ON Chat (fecha_inicio) WHERE estado = 'Esperando';
+
+CREATE OR REPLACE FUNCTION trg_evento_chat() RETURNS trigger AS $$
+DECLARE
+    tipo TEXT;
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        tipo := 'chat_creado';
+    ELSIF NEW.estado IS NOT DISTINCT FROM OLD.estado AND NEW.id_agente IS NOT DISTINCT FROM OLD.id_agente THEN
+        RETURN NULL;
+    ELSIF NEW.estado = 'Cerrado' THEN
+        tipo := 'chat_cerrado';
+    ELSE
+        tipo := 'chat_tomado';
+    END IF;
+    PERFORM pg_notify('casino_eventos', json_build_object(
+        'tipo', tipo, 'id_chat', NEW.id_chat, 'id_jugador', NEW.id_jugador,
+        'id_agente', NEW.id_agente, 'estado', NEW.estado)::text);
+    RETURN NULL;
+END $$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS evento_chat ON Chat;
+CREATE TRIGGER evento_chat
+    AFTER INSERT OR UPDATE OF estado, id_agente ON Chat
+    FOR EACH ROW EXECUTE FUNCTION trg_evento_chat();
+
+-- ===================================================================
+-- 33. TABLA CONTADOR_AGENTE Y TRIGGER
+-- Cifras del dashboard del agente mantenidas por un trigger de Soporte:
+-- tickets pendientes (id_agente 0), asignados por agente y cerrados por
+-- agente y día. Cada contador se reparte en 4 filas (shards). El backend
+-- siembra los contadores al crear el trigger y el barrido de
+-- mantenimiento borra los días viejos (app/services/agent_stats.py).
+-- ===================================================================
+CREATE TABLE IF NOT EXISTS Contador_Agente (
+    clave VARCHAR(20) NOT NULL,
+    id_agente INTEGER NOT NULL,
+    -- 'infinity' en los contadores que no son por día
+    dia DATE NOT NULL,
+    shard SMALLINT NOT NULL,
+    valor INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (clave, id_agente, dia, shard)
+);
+
+-- Respaldo del dashboard: "cerrados hoy" como rango sobre fecha_cierre
+CREATE INDEX IF NOT EXISTS idx_soporte_cerrado_fecha ON Soporte (fecha_cierre) WHERE estado = 'Cerrado';
+
+CREATE OR REPLACE FUNCTION fn_sumar_contador_agente(p_clave TEXT, p_agente INTEGER, p_dia DATE, p_delta INTEGER)
+RETURNS void AS $$
+BEGIN
+    IF p_delta <> 0 THEN
+        INSERT INTO Contador_Agente (clave, id_agente, dia, shard, valor)
+        VALUES (p_clave, p_agente, p_dia, floor(random() * 4)::smallint, p_delta)
+        ON CONFLICT (clave, id_agente, dia, shard) DO UPDATE SET valor = Contador_Agente.valor + EXCLUDED.valor;
+    END IF;
+END $$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION trg_contador_agente_soporte() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        IF OLD.estado = 'Abierto' AND OLD.id_agente IS NULL THEN
+            PERFORM fn_sumar_contador_agente('pendientes', 0, 'infinity', -1);
+        END IF;
+        IF OLD.id_agente IS NOT NULL AND OLD.estado <> 'Cerrado' THEN
+            PERFORM fn_sumar_contador_agente('asignados', OLD.id_agente, 'infinity', -1);
+        END IF;
+        IF OLD.id_agente IS NOT NULL AND OLD.estado = 'Cerrado' AND OLD.fecha_cierre IS NOT NULL THEN
+            PERFORM fn_sumar_contador_agente('cerrados', OLD.id_agente, OLD.fecha_cierre::date, -1);
+        END IF;
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        IF NEW.estado = 'Abierto' AND NEW.id_agente IS NULL THEN
+            PERFORM fn_sumar_contador_agente('pendientes', 0, 'infinity', 1);
+        END IF;
+        IF NEW.id_agente IS NOT NULL AND NEW.estado <> 'Cerrado' THEN
+            PERFORM fn_sumar_contador_agente('asignados', NEW.id_agente, 'infinity', 1);
+        END IF;
+        IF NEW.id_agente IS NOT NULL AND NEW.estado = 'Cerrado' AND NEW.fecha_cierre IS NOT NULL THEN
+            PERFORM fn_sumar_contador_agente('cerrados', NEW.id_agente, NEW.fecha_cierre::date, 1);
+        END IF;
+    END IF;
+    RETURN NULL;
+END $$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS contador_agente_soporte ON Soporte;
+CREATE TRIGGER contador_agente_soporte
+    AFTER INSERT OR DELETE OR UPDATE OF estado, id_agente, fecha_cierre ON Soporte
+    FOR EACH ROW EXECUTE FUNCTION trg_contador_agente_soporte();
+
+-- ===================================================================
+-- 34. TABLA AGENTE_DISPONIBLE
+-- Última señal de cada agente con una página abierta (stream SSE). El
+-- asignador automático reparte los tickets 'Abierto' sin agente entre los
+-- agentes con señal reciente, el de menos carga primero
+-- (app/services/ticket_assigner.py).
+-- ===================================================================
+CREATE TABLE IF NOT EXISTS Agente_Disponible (
+    id_agente INTEGER PRIMARY KEY REFERENCES Usuario(id_usuario) ON DELETE CASCADE,
+    ultima_senal TIMESTAMP WITHOUT TIME ZONE NOT NULL DEFAULT NOW()
+);
+
+-- ===================================================================
+-- 35. BÚSQUEDA DE TEXTO EN TICKETS
+-- Columnas tsvector generadas (se recalculan en cada INSERT/UPDATE del
+-- texto) con las configuraciones 'spanish' e 'english' de locales/, e
+-- índices GIN. La búsqueda del agente (/api/agente/tickets/buscar) ordena
+-- por ts_rank y resalta con ts_headline (app/services/ticket_search.py).
+-- ===================================================================
+ALTER TABLE Soporte ADD COLUMN IF NOT EXISTS busqueda tsvector
+    GENERATED ALWAYS AS (
+        setweight(to_tsvector('spanish'::regconfig, asunto), 'A') ||
+        setweight(to_tsvector('english'::regconfig, asunto), 'A') ||
+        setweight(to_tsvector('spanish'::regconfig, mensaje), 'B') ||
+        setweight(to_tsvector('english'::regconfig, mensaje), 'B')
+    ) STORED;
+CREATE INDEX IF NOT EXISTS idx_soporte_busqueda ON Soporte USING GIN (busqueda);
+
+ALTER TABLE RespuestaTicket ADD COLUMN IF NOT EXISTS busqueda tsvector
+    GENERATED ALWAYS AS (
+        setweight(to_tsvector('spanish'::regconfig, mensaje), 'C') ||
+        setweight(to_tsvector('english'::regconfig, mensaje), 'C')
+    ) STORED;
+CREATE INDEX IF NOT EXISTS idx_respuesta_busqueda ON RespuestaTicket USING GIN (busqueda);
@@ -11,6 +11,19 @@ from pydantic import BaseModel
 from typing import Dict, Any, List
 import datetime # <-- ¡AÑADIMOS ESTE IMPORT!
 from api.i18n import load_translations, trans # <-- Importar i18n
+from app.services.game_catalog import catalog as game_catalog
+from app.services.jackpot import jackpot
+from app.services.wagering import wagering
+from app.services.leaderboard import leaderboard
+from app.services.password_hasher import password_hasher
+from app.services.user_purge import user_purger
+from app.services.ip_filter import ip_filter
+from app.services.maintenance import maintenance
+from app.services.event_hub import event_hub
+from app.services.live_chat import live_chat
+from app.services.ticket_assigner import ticket_assigner
+from app.middleware.ip_filter import IPFilterMiddleware
+from app.services.session_tokens import sessions
 
 # =========================
 #  APP & STATIC / TEMPLATES
@@ -29,6 +42,10 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Bloqueo de IPs (BloqueoIP / ListaBlancaIP) antes que cualquier otra cosa.
+# Se agrega después de CORS para quedar como el middleware más externo.
+app.add_middleware(IPFilterMiddleware)
+
 # --- MARCA DE VERSIÓN PARA DESPLIEGUE ---
 print("✅✅✅ INICIANDO APLICACIÓN - VERSIÓN MÁS RECIENTE ✅✅✅")
 
@@ -40,6 +57,33 @@ app.mount("/static", StaticFiles(directory="static"), name="static")
 app.mount("/juegos", StaticFiles(directory="juegos"), name="juegos") # <-- Montar juegos locales
 templates = Jinja2Templates(directory="templates")
 
+# --- TAREAS EN SEGUNDO PLANO ---
+@app.on_event("startup")
+async def start_background_tasks():
+    jackpot.start() # Volcado periódico de contribuciones al jackpot
+    wagering.start() # Volcado periódico del rollover de bonos
+    await leaderboard.start() # Reconstruye el ranking desde el último snapshot
+    password_hasher.start() # Procesos de Argon2 listos antes del primer login
+    user_purger.start() # Borrados de usuarios pendientes o interrumpidos
+    await ip_filter.start() # Listas de IPs bloqueadas/permitidas en memoria
+    maintenance.start() # Barrido periódico de bonos vencidos, retiros y tickets (un solo líder)
+    event_hub.start() # LISTEN de cambios de tickets para las páginas en vivo (SSE)
+    live_chat.start() # Guardado por lotes de los mensajes del chat en vivo (WebSocket)
+    ticket_assigner.start() # Reparto de tickets nuevos al agente disponible con menos carga
+
+@app.on_event("shutdown")
+async def stop_background_tasks():
+    await jackpot.stop() # Último volcado para no perder contribuciones
+    await wagering.stop() # Ídem con las apuestas del rollover
+    await leaderboard.stop()
+    password_hasher.stop()
+    await user_purger.stop()
+    await ip_filter.stop()
+    await maintenance.stop()
+    await live_chat.stop() # Guarda los mensajes pendientes antes de cerrar los sockets
+    await ticket_assigner.stop()
+    event_hub.stop()
+
 # --- i18n SETUP ---
 load_translations("locales")
 templates.env.globals["trans"] = trans
@@ -85,9 +129,12 @@ from api.bonos import router as bonos_router
 from api.game_endpoints import router as game_router # <-- Nuevo Router de Juegos
 from api.blackjack_endpoints import router as blackjack_router # <-- Router de Blackjack
 from api.auditor import router as auditor_router # <-- Router de Auditor
+from api.eventos import router as eventos_router # <-- Eventos en vivo (SSE)
+from api.chat import router as chat_router # <-- Chat en vivo (WebSocket)
 
 
 from app.middleware.auth_agente import verificar_rol_agente_redirect
+from app.middleware.auth_roles import requiere_rol_redirect, ROL_ADMINISTRADOR, ROL_AUDITOR
 
 # =========================
 #  RUTAS DE LÓGICA / API
@@ -103,6 +150,8 @@ app.include_router(bonos_router)
 app.include_router(game_router)
 app.include_router(blackjack_router)
 app.include_router(auditor_router)
+app.include_router(eventos_router)
+app.include_router(chat_router)
 
 # =========================
 #  PÚBLICO / AUTH
@@ -166,19 +215,18 @@ async def set_language(request: Request):
 
 @app.get("/play/{game_id}", response_class=HTMLResponse)
 async def play_game(request: Request, game_id: str):
-    # 1. Obtener User ID de la cookie
-    user_id = request.cookies.get("userId")
+    # 1. Obtener User ID de la cookie de sesión firmada
+    user_id = sessions.user_id(request)
     if not user_id:
         return RedirectResponse(url="/login")
 
-    # 2. Mapeo de juegos LOCALES
-    games_map = {
-        "tragamonedas": {"url": "/juegos/tragamonedas-web/index.html", "name": "Tragamonedas"},
-        "ruleta": {"url": "/juegos/ruleta-web/index.html", "name": "Ruleta"},
-        "blackjack": {"url": "/juegos/blackjack-web/index.html", "name": "Blackjack"},
-    }
-    game = games_map.get(game_id)
-    if not game:
+    # 2. Buscar el juego en el catálogo (tabla Juego, cacheada en memoria)
+    try:
+        game = game_catalog.get_by_slug(game_id)
+    except Exception as e:
+        print(f"🚨 ERROR (Play): catálogo de juegos no disponible: {e}")
+        game = None
+    if not game or not game["activo"] or not game["url"]:
         return RedirectResponse(url="/games")
     
     # 3. Construir URL con el ID y la URL del Backend
@@ -191,7 +239,7 @@ async def play_game(request: Request, game_id: str):
         
     final_url = f"{game['url']}?user_id={user_id}&api_url={base_url}"
     
-    return render("play_game.html", request, {"game_url": final_url, "game_name": game["name"]})
+    return render("play_game.html", request, {"game_url": final_url, "game_name": game["nombre"]})
 
 
 
@@ -201,7 +249,7 @@ async def play_game(request: Request, game_id: str):
 @app.get("/api/saldo")
 async def api_get_balance_cookie(request: Request):
     """Endpoint para obtener saldo vía cookie (para juegos locales)."""
-    user_id = request.cookies.get("userId")
+    user_id = sessions.user_id(request)
     if not user_id:
         return JSONResponse({"error": "No autenticado"}, status_code=401)
     
@@ -263,6 +311,10 @@ async def support_chat_new(request: Request):
 async def support_chat_history(request: Request):
     return render("support-chat-historial.html", request)
 
+@app.get("/support/chat/{id_chat}", response_class=HTMLResponse)
+async def support_chat_room(request: Request, id_chat: int):
+    return render("support-chat-sala.html", request)
+
 # Tickets
 @app.get("/support/tickets/active", response_class=HTMLResponse)
 async def tickets_activo(request: Request):
@@ -385,56 +437,92 @@ async def cartera_balance(request: Request):
 # =========================
 @app.get("/admin", response_class=HTMLResponse)
 async def admin_menu(request: Request):
+    redirect = requiere_rol_redirect(request, ROL_ADMINISTRADOR)
+    if redirect:
+        return redirect
     return render("admin.html", request)
 
 # Información general (dashboard)
 @app.get("/admin/info-general", response_class=HTMLResponse)
 async def admin_info_general(request: Request):
+    redirect = requiere_rol_redirect(request, ROL_ADMINISTRADOR)
+    if redirect:
+        return redirect
     return render("admin-info-general.html", request)
 
 # Gestión de usuarios (menú)
 @app.get("/admin/gestion-usuarios", response_class=HTMLResponse)
 async def admin_gestion_usuarios(request: Request):
+    redirect = requiere_rol_redirect(request, ROL_ADMINISTRADOR)
+    if redirect:
+        return redirect
     return render("admin-gestion-usuarios.html", request)
 
 # Listado y perfiles
 @app.get("/admin/usuarios", response_class=HTMLResponse)
 async def admin_usuarios(request: Request):
+    redirect = requiere_rol_redirect(request, ROL_ADMINISTRADOR)
+    if redirect:
+        return redirect
     return render("admin-usuarios.html", request)
 
 @app.get("/admin/administradores", response_class=HTMLResponse)
 async def admin_administradores(request: Request):
+    redirect = requiere_rol_redirect(request, ROL_ADMINISTRADOR)
+    if redirect:
+        return redirect
     return render("admin-administradores.html", request)
 
 @app.get("/admin/usuarios/perfil", response_class=HTMLResponse)
 async def admin_usuario_perfil(request: Request):
+    redirect = requiere_rol_redirect(request, ROL_ADMINISTRADOR)
+    if redirect:
+        return redirect
     return render("admin-usuario-perfil.html", request)
 
 @app.get("/admin/administradores/perfil", response_class=HTMLResponse)
 async def admin_administrador_perfil(request: Request):
+    redirect = requiere_rol_redirect(request, ROL_ADMINISTRADOR)
+    if redirect:
+        return redirect
     return render("admin-administrador-perfil.html", request)
 
 # Gestión de juegos
 @app.get("/admin/juegos", response_class=HTMLResponse)
 async def admin_juegos(request: Request):
+    redirect = requiere_rol_redirect(request, ROL_ADMINISTRADOR)
+    if redirect:
+        return redirect
     return render("admin-juegos.html", request)
 
 # Configuración del sistema
 @app.get("/admin/configuracion", response_class=HTMLResponse)
 async def admin_configuracion(request: Request):
+    redirect = requiere_rol_redirect(request, ROL_ADMINISTRADOR)
+    if redirect:
+        return redirect
     return render("admin-configuracion.html", request)
 
 @app.get("/admin/configuracion/bloquear-ip", response_class=HTMLResponse)
 async def admin_bloquear_ip(request: Request):
+    redirect = requiere_rol_redirect(request, ROL_ADMINISTRADOR)
+    if redirect:
+        return redirect
     return render("admin-configuracion-bloquear-ip.html", request)
 
 @app.get("/admin/configuracion/lista-blanca", response_class=HTMLResponse)
 async def admin_lista_blanca(request: Request):
+    redirect = requiere_rol_redirect(request, ROL_ADMINISTRADOR)
+    if redirect:
+        return redirect
     return render("admin-configuracion-lista-blanca.html", request)
 
 # Promociones
 @app.get("/admin/promociones", response_class=HTMLResponse)
 async def admin_promociones(request: Request):
+    redirect = requiere_rol_redirect(request, ROL_ADMINISTRADOR)
+    if redirect:
+        return redirect
     return render("admin-promociones.html", request)
 
 # =========================
@@ -442,14 +530,23 @@ async def admin_promociones(request: Request):
 # =========================
 @app.get("/auditor", response_class=HTMLResponse)
 async def auditor_menu(request: Request):
+    redirect = requiere_rol_redirect(request, ROL_AUDITOR)
+    if redirect:
+        return redirect
     return render("auditor.html", request)
 
 @app.get("/auditor/realizar", response_class=HTMLResponse)
 async def auditor_realizar(request: Request):
+    redirect = requiere_rol_redirect(request, ROL_AUDITOR)
+    if redirect:
+        return redirect
     return render("auditor-realizar.html", request)
 
 @app.get("/auditor/historial", response_class=HTMLResponse)
 async def auditor_historial(request: Request):
+    redirect = requiere_rol_redirect(request, ROL_AUDITOR)
+    if redirect:
+        return redirect
     return render("auditor-historial.html", request)
 
 # =========================
@@ -521,19 +618,31 @@ async def agente_chat_activo(request: Request, id_chat: int):
 @app.get("/auditor", response_class=HTMLResponse)
 async def auditor_panel(request: Request):
     """Panel principal del auditor"""
+    redirect = requiere_rol_redirect(request, ROL_AUDITOR)
+    if redirect:
+        return redirect
     return render("auditor.html", request)
 
 @app.get("/auditor/realizar", response_class=HTMLResponse)
 async def auditor_realizar(request: Request):
     """Formulario para realizar nueva auditoría"""
+    redirect = requiere_rol_redirect(request, ROL_AUDITOR)
+    if redirect:
+        return redirect
     return render("auditor-realizar.html", request)
 
 @app.get("/auditor/historial", response_class=HTMLResponse)
 async def auditor_historial_page(request: Request):
     """Página de historial de auditorías"""
+    redirect = requiere_rol_redirect(request, ROL_AUDITOR)
+    if redirect:
+        return redirect
     return render("auditor-historial.html", request)
 
 @app.get("/auditor/ver_pdf/{id_auditoria}", response_class=HTMLResponse)
 async def auditor_ver_pdf(request: Request, id_auditoria: int):
     """Visor de PDF de auditoría"""
+    redirect = requiere_rol_redirect(request, ROL_AUDITOR)
+    if redirect:
+        return redirect
     return render("auditor-ver-pdf.html", request, {"id_auditoria": id_auditoria})
\ No newline at end of file
@@ -0,0 +1,136 @@
+// ========== CHAT EN VIVO (WebSocket) - ROYAL CRUMBS ==========
+// Cliente del socket /api/chat/ws/{idChat} (ver app/services/live_chat.py).
+//
+// - Cada mensaje lleva un uuid generado aquí. Queda en la bandeja de salida
+//   (sessionStorage) hasta que el servidor confirma que lo guardó ('ack'); al
+//   reconectar se reenvía lo pendiente y el uuid evita duplicados.
+// - Al reconectar se pide la puesta al día desde la fecha del último mensaje
+//   visto; lo repetido se descarta por uuid.
+//
+// Uso: const chat = conectarChat(idChat, { onMensajes, onInfo, onEstado, onError, onConexion });
+//      chat.enviar('hola');
+
+function conectarChat(idChat, callbacks = {}) {
+    const claveSalida = `chat_salida_${idChat}`;
+    const mensajes = new Map();
+    let salida = [];
+    let ultimaFecha = null;
+    let ws = null;
+    let intentos = 0;
+    let cerradoFinal = false;
+
+    try { salida = JSON.parse(sessionStorage.getItem(claveSalida)) || []; } catch (e) { salida = []; }
+
+    function guardarSalida() {
+        sessionStorage.setItem(claveSalida, JSON.stringify(salida));
+    }
+
+    function nuevoUuid() {
+        if (window.crypto && crypto.randomUUID) return crypto.randomUUID();
+        return 'xxxxxxxx-xxxx-4xxx-yxxx-xxxxxxxxxxxx'.replace(/[xy]/g, c => {
+            const r = Math.random() * 16 | 0;
+            return (c === 'x' ? r : (r & 0x3 | 0x8)).toString(16);
+        });
+    }
+
+    function notificar() {
+        const lista = Array.from(mensajes.values())
+            .sort((a, b) => a.fecha_mensaje < b.fecha_mensaje ? -1 : a.fecha_mensaje > b.fecha_mensaje ? 1 : 0);
+        if (callbacks.onMensajes) callbacks.onMensajes(lista, salida.map(m => m.uuid));
+    }
+
+    function agregar(msg) {
+        if (!ultimaFecha || msg.fecha_mensaje > ultimaFecha) ultimaFecha = msg.fecha_mensaje;
+        if (mensajes.has(msg.uuid)) return false;
+        mensajes.set(msg.uuid, msg);
+        return true;
+    }
+
+    function mandar(pendiente) {
+        if (ws && ws.readyState === WebSocket.OPEN) {
+            ws.send(JSON.stringify({ tipo: 'mensaje', uuid: pendiente.uuid, texto: pendiente.texto }));
+            pendiente.enviado = Date.now();
+        }
+    }
+
+    function abrir() {
+        const protocolo = location.protocol === 'https:' ? 'wss' : 'ws';
+        const desde = ultimaFecha ? `?desde=${encodeURIComponent(ultimaFecha)}` : '';
+        ws = new WebSocket(`${protocolo}://${location.host}/api/chat/ws/${idChat}${desde}`);
+
+        ws.onopen = () => {
+            intentos = 0;
+            if (callbacks.onConexion) callbacks.onConexion(true);
+        };
+
+        ws.onmessage = (e) => {
+            let data;
+            try { data = JSON.parse(e.data); } catch (err) { return; }
+
+            if (data.tipo === 'historial') {
+                data.mensajes.forEach(agregar);
+                if (callbacks.onInfo) callbacks.onInfo(data.chat);
+                // Lo que no se confirmó antes de cortarse se reenvía
+                salida.forEach(mandar);
+                notificar();
+            } else if (data.tipo === 'mensaje') {
+                if (agregar(data)) notificar();
+            } else if (data.tipo === 'ack') {
+                salida = salida.filter(m => m.uuid !== data.uuid);
+                guardarSalida();
+                const msg = mensajes.get(data.uuid);
+                if (msg && data.fecha_mensaje) msg.fecha_mensaje = data.fecha_mensaje;
+                notificar();
+            } else if (data.tipo === 'estado') {
+                if (callbacks.onEstado) callbacks.onEstado(data);
+            } else if (data.tipo === 'error') {
+                if (data.definitivo && data.uuid) {
+                    salida = salida.filter(m => m.uuid !== data.uuid);
+                    mensajes.delete(data.uuid);
+                    guardarSalida();
+                    notificar();
+                }
+                if (callbacks.onError) callbacks.onError(data.error, false);
+            }
+        };
+
+        ws.onclose = (e) => {
+            if (callbacks.onConexion) callbacks.onConexion(false);
+            // 4401/4403/4404: sin sesión, sin permiso o chat inexistente -> no reintentar
+            if (cerradoFinal || (e.code >= 4400 && e.code < 4500)) {
+                if (!cerradoFinal && callbacks.onError) callbacks.onError(e.reason || 'No se pudo abrir el chat', true);
+                return;
+            }
+            // Reintento con espera creciente y algo de azar (que no reconecten todos a la vez)
+            const espera = Math.min(30000, 1000 * Math.pow(2, intentos++)) + Math.random() * 1000;
+            setTimeout(abrir, espera);
+        };
+    }
+
+    // Si un ack se pierde sin que se caiga el socket, se reenvía a los 10 s
+    setInterval(() => {
+        const limite = Date.now() - 10000;
+        salida.filter(m => !m.enviado || m.enviado < limite).forEach(mandar);
+    }, 5000);
+
+    abrir();
+
+    return {
+        enviar(texto) {
+            const pendiente = { uuid: nuevoUuid(), texto: texto };
+            salida.push(pendiente);
+            guardarSalida();
+            mandar(pendiente);
+        },
+        cerrar() {
+            cerradoFinal = true;
+            if (ws) ws.close();
+        }
+    };
+}
+
+function escaparHtml(texto) {
+    const div = document.createElement('div');
+    div.textContent = texto;
+    return div.innerHTML;
+}
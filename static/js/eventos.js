@@ -0,0 +1,53 @@
+// ========== EVENTOS EN VIVO (SSE) - ROYAL CRUMBS ==========
+// Reemplaza el polling con setInterval: la página recarga sus datos solo cuando
+// el servidor avisa de un cambio que le interesa (ver /api/eventos).
+//
+// Uso: escucharEventos(['ticket_creado', 'ticket_cerrado'], cargarTickets,
+//                      { filtro: (evento) => evento.id_ticket === idTicket });
+
+const EVENTOS_TICKET = ['ticket_creado', 'ticket_asignado', 'ticket_respondido',
+                        'ticket_cerrado', 'ticket_reabierto', 'ticket_actualizado'];
+
+function escucharEventos(tipos, recargar, opciones = {}) {
+    const filtro = opciones.filtro || (() => true);
+    // Sin stream (navegador viejo o proxy que lo corta) se vuelve a un polling lento
+    const respaldoMs = opciones.respaldoMs || 60000;
+    let pendiente = null;
+
+    // Varios eventos seguidos (p. ej. el barrido cerrando tickets) = una sola recarga
+    function programarRecarga() {
+        if (pendiente) return;
+        pendiente = setTimeout(() => { pendiente = null; recargar(); }, 300);
+    }
+
+    if (!window.EventSource) {
+        setInterval(recargar, respaldoMs);
+        return null;
+    }
+
+    const fuente = new EventSource('/api/eventos');
+    let caido = false;
+
+    fuente.onmessage = (e) => {
+        let evento;
+        try { evento = JSON.parse(e.data); } catch (err) { return; }
+        if (evento.tipo === 'resync' || (tipos.includes(evento.tipo) && filtro(evento))) {
+            programarRecarga();
+        }
+    };
+
+    // El navegador reconecta solo; al volver se recarga por si se perdió algún evento
+    fuente.onerror = () => { caido = true; };
+    fuente.onopen = () => {
+        if (caido) {
+            caido = false;
+            programarRecarga();
+        }
+    };
+
+    setInterval(() => {
+        if (fuente.readyState !== EventSource.OPEN) recargar();
+    }, respaldoMs);
+
+    return fuente;
+}